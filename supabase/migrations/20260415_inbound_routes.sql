@@ -0,0 +1,40 @@
+-- Inbound routing: which tenant owns each business number we receive messages on.
+-- The Python webhook keeps this table in memory (tools/inbound_routing.py) so an
+-- inbound message is attributed without scanning every tenant's leads.
+--   whatsapp: business_number = Meta phone_number_id (value.metadata.phone_number_id)
+--   sms:      business_number = Twilio "To" number, digits only (e.g. 15551234567)
+-- Numbers shared by several tenants are simply not listed; those messages fall
+-- back to the cross-tenant lead lookup.
+
+CREATE TABLE IF NOT EXISTS inbound_routes (
+  id uuid PRIMARY KEY DEFAULT uuid_generate_v4(),
+  user_id uuid NOT NULL REFERENCES auth.users(id) ON DELETE CASCADE,
+  channel text NOT NULL CHECK (channel IN ('whatsapp', 'sms')),
+  business_number text NOT NULL,
+  active boolean NOT NULL DEFAULT true,
+  created_at timestamptz DEFAULT now(),
+  updated_at timestamptz DEFAULT now(),
+  UNIQUE (channel, business_number)
+);
+
+CREATE INDEX IF NOT EXISTS idx_inbound_routes_user ON inbound_routes (user_id);
+-- Delta refresh: rows changed since the last sync
+CREATE INDEX IF NOT EXISTS idx_inbound_routes_updated_at ON inbound_routes (updated_at);
+
+ALTER TABLE inbound_routes ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users manage their own inbound routes"
+  ON inbound_routes FOR ALL
+  USING (auth.uid() = user_id)
+  WITH CHECK (auth.uid() = user_id);
+
+CREATE OR REPLACE FUNCTION update_inbound_routes_updated_at()
+RETURNS TRIGGER AS $$
+BEGIN NEW.updated_at = now(); RETURN NEW; END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS inbound_routes_updated_at ON inbound_routes;
+CREATE TRIGGER inbound_routes_updated_at
+  BEFORE UPDATE ON inbound_routes
+  FOR EACH ROW EXECUTE FUNCTION update_inbound_routes_updated_at();
+
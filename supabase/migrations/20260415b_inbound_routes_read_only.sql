@@ -0,0 +1,15 @@
+-- Corrective migration: the FOR ALL policy on inbound_routes let any tenant
+-- insert a route for a number nobody had claimed yet (including the shared
+-- platform number), which would redirect other tenants' inbound messages to
+-- them. Routes are provisioned by the platform only: tenants may read their
+-- own rows, and writes go through service_role (which bypasses RLS).
+
+DROP POLICY IF EXISTS "Users manage their own inbound routes" ON inbound_routes;
+DROP POLICY IF EXISTS "Users view their own inbound routes" ON inbound_routes;
+
+CREATE POLICY "Users view their own inbound routes"
+  ON inbound_routes FOR SELECT
+  USING (auth.uid() = user_id);
+
+-- Belt and braces: no table-level write grants for client roles either
+REVOKE INSERT, UPDATE, DELETE ON inbound_routes FROM anon, authenticated;
@@ -0,0 +1,57 @@
+-- Per-lead count of pending follow-ups, kept by a trigger on follow_ups.
+-- Every inbound reply and STOP cancels the lead's pending follow-ups; most
+-- leads have none, so the webhook reads this column off the lead row it
+-- already fetched and skips the UPDATE when it is 0.
+-- Maintained in the database so follow-ups created or cancelled by any
+-- writer (webhook, Next.js app, cron) keep it correct.
+
+ALTER TABLE leads ADD COLUMN IF NOT EXISTS pending_follow_ups INTEGER NOT NULL DEFAULT 0;
+
+CREATE OR REPLACE FUNCTION sync_lead_pending_follow_ups()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.status = 'pending' AND OLD.lead_id IS NOT NULL THEN
+    UPDATE leads SET pending_follow_ups = GREATEST(pending_follow_ups - 1, 0) WHERE id = OLD.lead_id;
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.status = 'pending' AND NEW.lead_id IS NOT NULL THEN
+    UPDATE leads SET pending_follow_ups = pending_follow_ups + 1 WHERE id = NEW.lead_id;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS follow_ups_pending_count ON follow_ups;
+CREATE TRIGGER follow_ups_pending_count
+  AFTER INSERT OR UPDATE OF status, lead_id OR DELETE ON follow_ups
+  FOR EACH ROW EXECUTE FUNCTION sync_lead_pending_follow_ups();
+
+-- The count is bookkeeping, not an edit to the lead: leave updated_at alone
+-- (find_lead_by_phone orders duplicate leads by it)
+CREATE OR REPLACE FUNCTION update_leads_updated_at()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF (to_jsonb(NEW) - 'pending_follow_ups' - 'updated_at') = (to_jsonb(OLD) - 'pending_follow_ups' - 'updated_at') THEN
+    RETURN NEW;
+  END IF;
+  NEW.updated_at = NOW();
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS update_leads_updated_at ON leads;
+CREATE TRIGGER update_leads_updated_at
+  BEFORE UPDATE ON leads
+  FOR EACH ROW EXECUTE FUNCTION update_leads_updated_at();
+
+-- Backfill
+UPDATE leads l
+SET pending_follow_ups = c.pending
+FROM (
+  SELECT lead_id, COUNT(*) AS pending
+  FROM follow_ups
+  WHERE status = 'pending' AND lead_id IS NOT NULL
+  GROUP BY lead_id
+) c
+WHERE l.id = c.lead_id;
+
+COMMENT ON COLUMN leads.pending_follow_ups IS 'Pending follow_ups rows for this lead (maintained by trigger follow_ups_pending_count)';
@@ -0,0 +1,21 @@
+-- Typed follow-ups with a deterministic dedup key.
+-- The webhook used to dedup before every insert with a select, two of them
+-- unindexed LIKE scans over message_text. With (user_id, dedup_key) unique
+-- among pending rows, creating a follow-up is a single insert: a duplicate
+-- is rejected by the index and treated as "already scheduled".
+--
+-- kind: 'follow_up' (generic), 'auto_follow_up' (AI "check back in N days"),
+--       'meeting_reminder' (day-before confirmation), 'valuation_task' (CMA request).
+--       NULL for rows created before this migration or by writers that don't set it.
+
+ALTER TABLE follow_ups
+  ADD COLUMN IF NOT EXISTS kind text,
+  ADD COLUMN IF NOT EXISTS dedup_key text;
+
+-- Only pending rows hold a key: once sent or cancelled, the same follow-up can be scheduled again
+CREATE UNIQUE INDEX IF NOT EXISTS idx_follow_ups_pending_dedup
+  ON follow_ups (user_id, dedup_key)
+  WHERE status = 'pending' AND dedup_key IS NOT NULL;
+
+COMMENT ON COLUMN follow_ups.kind IS 'follow_up | auto_follow_up | meeting_reminder | valuation_task';
+COMMENT ON COLUMN follow_ups.dedup_key IS 'Deterministic key; unique per user among pending follow-ups';
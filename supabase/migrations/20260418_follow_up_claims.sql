@@ -0,0 +1,105 @@
+-- Claim leases for follow-up dispatch workers (tools/followup_dispatcher.py).
+-- Workers claim due rows with FOR UPDATE SKIP LOCKED, so several processes
+-- can drain follow_ups concurrently without picking the same row, and write
+-- results back in one statement per batch. A claim is a lease: a worker that
+-- dies mid-batch leaves rows in 'sending' only until claim_expires_at.
+
+ALTER TABLE follow_ups
+  ADD COLUMN IF NOT EXISTS claimed_by text,
+  ADD COLUMN IF NOT EXISTS claim_expires_at timestamptz;
+
+CREATE INDEX IF NOT EXISTS idx_follow_ups_claim_expiry
+  ON follow_ups (claim_expires_at)
+  WHERE status = 'sending';
+
+-- Claim up to p_limit due, approved follow-ups for leads reachable on one of p_channels.
+-- Returns each claimed row with the lead and agent fields the sender needs.
+CREATE OR REPLACE FUNCTION claim_due_follow_ups(
+  p_worker text,
+  p_limit int DEFAULT 100,
+  p_lease_seconds int DEFAULT 300,
+  p_channels text[] DEFAULT ARRAY['whatsapp', 'sms']
+)
+RETURNS TABLE (
+  id uuid,
+  user_id uuid,
+  lead_id uuid,
+  message_text text,
+  scheduled_at timestamptz,
+  kind text,
+  channel text,
+  lead_phone text,
+  lead_name text,
+  agent_name text,
+  claim_expires_at timestamptz
+) AS $$
+#variable_conflict use_column
+BEGIN
+  -- Expired leases: the worker died or stalled; make the rows claimable again
+  UPDATE follow_ups f
+  SET status = 'pending', claimed_by = NULL, claim_expires_at = NULL
+  WHERE f.status = 'sending' AND f.claim_expires_at < now();
+
+  -- Approval window passed without a decision
+  UPDATE follow_ups f
+  SET approval_status = 'auto_approved'
+  WHERE f.approval_status = 'pending' AND f.approval_deadline <= now();
+
+  RETURN QUERY
+  WITH due AS (
+    SELECT f.id, CASE WHEN COALESCE(l.contact_preference, 'whatsapp') = 'call'
+                      THEN 'whatsapp' ELSE COALESCE(l.contact_preference, 'whatsapp') END AS channel
+    FROM follow_ups f
+    JOIN leads l ON l.id = f.lead_id
+    WHERE f.status = 'pending'
+      AND f.scheduled_at <= now()
+      AND f.approval_status IN ('auto_approved', 'approved')
+      AND (f.quiet_hours_deferred_to IS NULL OR f.quiet_hours_deferred_to <= now())
+      AND l.phone IS NOT NULL
+      AND (CASE WHEN COALESCE(l.contact_preference, 'whatsapp') = 'call'
+                THEN 'whatsapp' ELSE COALESCE(l.contact_preference, 'whatsapp') END) = ANY (p_channels)
+    ORDER BY f.scheduled_at
+    LIMIT p_limit
+    FOR UPDATE OF f SKIP LOCKED
+  ),
+  claimed AS (
+    UPDATE follow_ups f
+    SET status = 'sending',
+        claimed_by = p_worker,
+        claim_expires_at = now() + make_interval(secs => p_lease_seconds)
+    FROM due
+    WHERE f.id = due.id
+    RETURNING f.id, f.user_id, f.lead_id, f.message_text, f.scheduled_at, f.kind, due.channel, f.claim_expires_at
+  )
+  SELECT c.id, c.user_id, c.lead_id, c.message_text, c.scheduled_at, c.kind, c.channel,
+         l.phone, l.owner_name, p.full_name, c.claim_expires_at
+  FROM claimed c
+  JOIN leads l ON l.id = c.lead_id
+  LEFT JOIN profiles p ON p.id = c.user_id
+  ORDER BY c.scheduled_at;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Write a batch of dispatch results: [{id, status, sent_at, error_message}, ...].
+-- Only rows this worker still holds are updated, so a late write after the
+-- lease expired (and another worker re-claimed the row) is a no-op.
+CREATE OR REPLACE FUNCTION complete_follow_ups(p_worker text, p_results jsonb)
+RETURNS int AS $$
+DECLARE
+  updated int;
+BEGIN
+  UPDATE follow_ups f
+  SET status = r.status,
+      sent_at = r.sent_at,
+      error_message = r.error_message,
+      claimed_by = NULL,
+      claim_expires_at = NULL
+  FROM jsonb_to_recordset(p_results) AS r(id uuid, status text, sent_at timestamptz, error_message text)
+  WHERE f.id = r.id AND f.claimed_by = p_worker AND f.status = 'sending';
+  GET DIAGNOSTICS updated = ROW_COUNT;
+  RETURN updated;
+END;
+$$ LANGUAGE plpgsql;
+
+COMMENT ON COLUMN follow_ups.claimed_by IS 'Dispatch worker holding this row while status = sending';
+COMMENT ON COLUMN follow_ups.claim_expires_at IS 'Lease end; expired claims return to pending on the next claim';
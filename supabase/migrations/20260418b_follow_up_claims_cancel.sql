@@ -0,0 +1,37 @@
+-- Corrective migration: a claimed follow-up sits in 'sending' for up to the
+-- lease, but leads.pending_follow_ups only counted 'pending' rows. A claim
+-- dropped the count to 0, so a reply or STOP during the claim skipped the
+-- cancel (has_pending_follow_ups) and the lead still got the message.
+-- Count 'sending' as outstanding too: a claim, an expired lease returning a
+-- row to pending, and a dispatch result now move the count only when a row
+-- leaves or enters the outstanding set. The cancel (cancel_follow_ups_for_leads)
+-- now covers 'sending' rows, and the dispatcher re-checks its claim just
+-- before each send; complete_follow_ups is already fenced on
+-- status = 'sending', so it never overwrites a cancellation.
+
+CREATE OR REPLACE FUNCTION sync_lead_pending_follow_ups()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.status IN ('pending', 'sending') AND OLD.lead_id IS NOT NULL THEN
+    UPDATE leads SET pending_follow_ups = GREATEST(pending_follow_ups - 1, 0) WHERE id = OLD.lead_id;
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.status IN ('pending', 'sending') AND NEW.lead_id IS NOT NULL THEN
+    UPDATE leads SET pending_follow_ups = pending_follow_ups + 1 WHERE id = NEW.lead_id;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Recount with the new definition
+UPDATE leads l
+SET pending_follow_ups = COALESCE(c.outstanding, 0)
+FROM (
+  SELECT l2.id, COUNT(f.id) AS outstanding
+  FROM leads l2
+  LEFT JOIN follow_ups f ON f.lead_id = l2.id AND f.status IN ('pending', 'sending')
+  WHERE l2.pending_follow_ups <> 0 OR f.id IS NOT NULL
+  GROUP BY l2.id
+) c
+WHERE l.id = c.id AND l.pending_follow_ups IS DISTINCT FROM COALESCE(c.outstanding, 0);
+
+COMMENT ON COLUMN leads.pending_follow_ups IS 'Pending or claimed (sending) follow_ups rows for this lead (maintained by trigger follow_ups_pending_count)';
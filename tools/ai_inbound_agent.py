@@ -5,83 +5,130 @@ AI analysis engine for inbound WhatsApp/SMS messages.
 
 - analyze_with_ai(): classifies intent, generates reply, extracts lead info
 - is_stop_message(): detects unsubscribe keywords
+- EarlyReplyDispatcher: lets a handler start the DNC/quota checks and the send
+  as soon as the streamed reply is final, while the model is still writing
+  qualification/meeting/agent_brief
 - Used by webhook_app.py for production message handling
 
 Env vars:
 - OPENAI_API_KEY (for AI analysis)
 - AGENT_NAME, AGENT_BROKERAGE (agent context)
+- MESSAGE_BUDGET_SECONDS (end-to-end reply budget, see deadline.py)
+- AI_STREAMING (1/0, default 1 — stream completions when a handler passes on_reply_ready)
 """
 
 import os
-import json
+import logging
 import datetime as dt
-from typing import Optional
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
 
 from flask import Flask, jsonify
-from openai import OpenAI
+
+from tools.analysis_schema import validate_analysis
+from tools.circuit_breaker import CircuitOpenError
+from tools.deadline import Deadline, DeadlineExceeded, hedged_call
+from tools.reply_rules import rules_for_config
+from tools.stop_matcher import is_stop
+from tools.stream_json import IncrementalJSONParser, repair_json
+from tools import llm_gateway
+
+logger = logging.getLogger(__name__)
 
 # ---------- CONFIG ----------
 AGENT_NAME = os.getenv("AGENT_NAME", "Your Agent")
 AGENT_BROKERAGE = os.getenv("AGENT_BROKERAGE", "Estate AI")
 AI_MODEL = os.getenv("AI_MODEL", "gpt-4o")  # gpt-4o for quality, gpt-4o-mini for cost
+AI_STREAMING = os.getenv("AI_STREAMING", "1") == "1"
 
-# ---------- OPENAI CLIENT ----------
-client = OpenAI()  # uses OPENAI_API_KEY env variable
+# Sent when the model can't answer inside the message budget — safe for any intent
+SAFE_ACK_REPLY = "Thanks for your message! I'll review it and follow up with you shortly."
 
 # ---------- FLASK APP ----------
 app = Flask(__name__)
 
 
+def is_stop_message(text: str) -> bool:
+    """
+    Broad STOP detection (exact keywords + opt-out phrases, EN/AR/ES).
+    Required for TCPA compliance. See stop_matcher.py for normalisation rules.
+    """
+    return is_stop(text)
+
+
+def _fallback_result(notes: str) -> dict:
+    """Result shape returned when no model output is available in time."""
+    return {
+        "intent": "other",
+        "reply": SAFE_ACK_REPLY,
+        "schedule_follow_up_days": None,
+        "notes": notes,
+        "qualification": {},
+        "agent_brief": None,
+        "fallback": True,
+    }
 
 
-import re
-
-# STOP keywords (exact match) — English + Arabic + Spanish
-_STOP_KEYWORDS = {
-    "stop", "unsubscribe", "cancel", "end", "quit", "stop all",
-    "opt out", "optout", "opt-out", "remove me", "remove", "leave me alone",
-    "do not contact", "don't contact", "no more", "stop texting",
-    "stop messaging", "take me off", "off the list", "off your list",
-    # Arabic
-    "توقف", "الغاء", "إلغاء", "الغاء الاشتراك", "إلغاء الاشتراك",
-    "لا تراسلني", "أوقف", "وقف", "كفاية",
-    # Spanish
-    "parar", "cancelar", "detener", "no más", "basta",
-}
+# Intents whose handler branch sends its own message — never dispatched early
+_NO_EARLY_SEND_INTENTS = ("stop", "escalate")
 
-# STOP patterns (regex)
-_STOP_PATTERNS = re.compile(
-    r'\b(stop\s*(texting|messaging|contacting|calling|emailing)\s*me'
-    r'|remove\s*me\s*(from|off)'
-    r'|take\s*me\s*off'
-    r'|don\'?t\s*(text|message|contact|call|email)\s*me'
-    r'|leave\s*me\s*alone'
-    r'|no\s*more\s*(texts?|messages?|emails?|calls?)'
-    r'|i\s*don\'?t\s*want\s*(any\s*more|to\s*(hear|receive))'
-    r'|please\s*stop'
-    r')\b',
-    re.IGNORECASE,
-)
+_early_send_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="early-send")
 
 
-def is_stop_message(text: str) -> bool:
+class EarlyReplyDispatcher:
     """
-    Broad STOP detection using exact keywords + regex patterns.
-    Required for TCPA compliance.
+    Pass as analyze_with_ai(on_reply_ready=...). When the streamed intent and
+    reply are final, send_fn(reply_text) runs on a worker thread while the
+    model finishes the rest of the JSON. Afterwards, if `started`, the handler
+    takes send_fn's return value from result() instead of sending again.
     """
-    if not text:
-        return False
-    normalized = text.strip().lower()
-
-    # Exact keyword match
-    if normalized in _STOP_KEYWORDS:
-        return True
-
-    # Regex pattern match (catches "stop texting me you idiot", etc.)
-    if _STOP_PATTERNS.search(normalized):
-        return True
 
-    return False
+    def __init__(self, send_fn: Callable[[str], object]):
+        self._send_fn = send_fn
+        self._future: Optional[Future] = None
+
+    @property
+    def started(self) -> bool:
+        return self._future is not None
+
+    def __call__(self, early: dict) -> None:
+        if early["intent"] in _NO_EARLY_SEND_INTENTS:
+            return
+        self._future = _early_send_pool.submit(self._send_fn, early["reply"])
+
+    def result(self, timeout: Optional[float] = None):
+        return self._future.result(timeout=timeout)
+
+
+class _StreamedReply:
+    """Fires on_reply_ready once, from whichever hedged attempt finishes intent+reply first."""
+
+    def __init__(self, on_reply_ready: Callable[[dict], None], rules, conversation_history):
+        self._on_reply_ready = on_reply_ready
+        self._rules = rules
+        self._history = conversation_history
+        self._lock = threading.Lock()
+        self.emitted: Optional[dict] = None
+        self.parser: Optional[IncrementalJSONParser] = None
+
+    def offer(self, parser: IncrementalJSONParser) -> None:
+        if self.emitted is not None or "intent" not in parser.fields or "reply" not in parser.fields:
+            return
+        with self._lock:
+            if self.emitted is not None:
+                return
+            head, _ = validate_analysis(
+                {"intent": parser.fields["intent"], "reply": parser.fields["reply"]},
+                default_reply=SAFE_ACK_REPLY,
+            )
+            reply, fired = self._rules.apply(head["reply"], self._history)
+            self.emitted = {"intent": head["intent"], "reply": reply, "post_processing_rules": fired}
+            self.parser = parser
+        try:
+            self._on_reply_ready(dict(self.emitted))
+        except Exception as e:
+            logger.error(f"[Stream] on_reply_ready failed: {e}")
 
 
 def analyze_with_ai(
@@ -94,6 +141,10 @@ def analyze_with_ai(
     agent_brokerage: Optional[str] = None,
     ai_config: Optional[dict] = None,
     campaign_context: Optional[str] = None,
+    deadline: Optional[Deadline] = None,
+    priority: Optional[int] = None,
+    on_reply_ready: Optional[Callable[[dict], None]] = None,
+    model: Optional[str] = None,
 ) -> dict:
     """
     Call OpenAI to classify intent and generate a reply.
@@ -101,6 +152,21 @@ def analyze_with_ai(
 
     Resolution order for agent identity: param → env var → module default.
 
+    The OpenAI call is hedged and bounded by `deadline` (a fresh per-message
+    budget if not given). When the budget runs out the lead gets
+    SAFE_ACK_REPLY instead of waiting on a stuck completion; the same
+    happens immediately while the OpenAI circuit breaker is open.
+
+    Requests go through llm_gateway; `priority` defaults to a guess from the
+    message text (escalation/booking turns jump the queue). `model` overrides
+    AI_MODEL (load shedding passes a cheaper one).
+
+    With `on_reply_ready` (and AI_STREAMING on) the completion is streamed and
+    parsed incrementally; the callback gets {"intent", "reply",
+    "post_processing_rules"} as soon as both fields are complete, and the
+    returned result always carries that same intent and reply. Malformed or
+    truncated JSON is repaired field by field rather than discarded.
+
     Returns a dict like:
     {
         "intent": "interested",
@@ -460,99 +526,68 @@ MEETING RULES:
 
     messages.append({"role": "user", "content": user_content})
 
-    response = client.chat.completions.create(
-        model=AI_MODEL,
-        temperature=0.3,
-        messages=messages,
-        response_format={"type": "json_object"},
-        timeout=30,
-    )
+    deadline = deadline or Deadline()
+    if priority is None:
+        priority = llm_gateway.priority_for_inbound(owner_message, lead_details)
 
-    raw = response.choices[0].message.content.strip()
+    rules = rules_for_config(ai_config)
+    streamed = (
+        _StreamedReply(on_reply_ready, rules, conversation_history)
+        if on_reply_ready and AI_STREAMING else None
+    )
 
-    # Strip markdown code fences if present (shouldn't happen with json_object format)
-    if raw.startswith("```"):
-        raw = raw.split("\n", 1)[1] if "\n" in raw else raw[3:]
-    if raw.endswith("```"):
-        raw = raw[:-3]
-    raw = raw.strip()
+    def _create(timeout: float) -> str:
+        request = dict(
+            model=model or AI_MODEL,
+            temperature=0.3,
+            priority=priority,
+            timeout=min(timeout, 30),
+            response_format={"type": "json_object"},
+        )
+        if streamed is None:
+            return llm_gateway.chat(messages, **request).choices[0].message.content
+        parser = IncrementalJSONParser()
+        for delta in llm_gateway.chat_stream(messages, **request):
+            parser.feed(delta)
+            streamed.offer(parser)
+        return parser.text
 
     try:
-        data = json.loads(raw)
-    except json.JSONDecodeError:
-        import logging as _log
-        _log.getLogger(__name__).error(f"JSON parse failed despite response_format. Raw: {raw[:300]}")
-        data = {
-            "intent": "other",
-            "reply": (
-                "Thanks for your message! I'll review it and follow up with a more "
-                "detailed response shortly."
-            ),
-            "schedule_follow_up_days": None,
-            "notes": f"JSON parse failed. Raw content: {raw[:200]}",
-        }
-
-    # Safety checks
-    if "reply" not in data or not data["reply"]:
-        data["reply"] = (
-            "Thanks for your message! I'll review it and follow up with you shortly."
-        )
-    if "intent" not in data:
-        data["intent"] = "other"
-    if "schedule_follow_up_days" not in data:
-        data["schedule_follow_up_days"] = None
-    if "notes" not in data:
-        data["notes"] = ""
-    if "qualification" not in data:
-        data["qualification"] = {}
-    if "agent_brief" not in data:
-        data["agent_brief"] = None
-
-    # Post-processing: fix common GPT-4o bad habits the prompt can't fully prevent
-    import re
-    reply = data["reply"]
-
-    # Strip name from "Got it, [Name]" openers — GPT-4o ignores the ban
-    reply = re.sub(r'^(Got it|Perfect|Great|Sounds good),?\s+[A-Z][a-z]+[.!]?\s*', r'\1. ', reply)
-
-    # De-duplicate openers — don't start 2+ replies in a row with the same word
-    recent_outbound = [
-        m.get("body", "") for m in (conversation_history or [])
-        if m.get("direction") == "outbound"
-    ][-3:]  # last 3 agent replies
-    recent_openers = [msg.split()[0].rstrip(".,!").lower() for msg in recent_outbound if msg.strip()]
-    current_opener = reply.split()[0].rstrip(".,!").lower() if reply.strip() else ""
-
-    if current_opener and recent_openers.count(current_opener) >= 1:
-        # This opener was already used recently — swap it
-        alternatives = {
-            "got": ["Right —", "Makes sense.", "Okay,"],
-            "great": ["Nice.", "Love it —", "Perfect."],
-            "perfect": ["Great.", "Sounds good.", "Nice —"],
-            "sounds": ["Right.", "Makes sense.", "Perfect."],
-            "right": ["Got it.", "Makes sense.", "So,"],
-            "makes": ["Right.", "Got it.", "Okay,"],
-            "nice": ["Great.", "Love it.", "Perfect."],
-        }
-        swaps = alternatives.get(current_opener, ["So,", "Right —", "Okay,"])
-        # Pick the first alternative not recently used
-        for swap in swaps:
-            swap_opener = swap.split()[0].rstrip(".,!—").lower()
-            if swap_opener not in recent_openers:
-                # Replace the opener phrase (e.g., "Got it." or "Great,")
-                reply = re.sub(r'^(Got it|Perfect|Great|Sounds good|Right|Makes sense|Nice|Okay)[.,!—\s]*', swap + " ", reply, count=1)
-                break
-
-    # Strip conversation killers that slip through
-    killer_patterns = [
-        r"[.!]\s*Let me know if there'?s anything( else)?( you need| I can help with)?[.!]?\s*$",
-        r"[.!]\s*If there'?s anything( specific)? you need( from me)?,?\s*(just )?let me know[.!]?\s*$",
-        r"[.!]\s*Don'?t hesitate to reach out[.!]?\s*$",
-    ]
-    for pattern in killer_patterns:
-        reply = re.sub(pattern, '.', reply, flags=re.IGNORECASE)
-
-    data["reply"] = reply.strip()
+        raw = hedged_call(_create, deadline, name="openai", gated=True)
+    except Exception as e:
+        if streamed is not None and streamed.emitted is not None:
+            # The reply is already on its way — keep whatever else the model got out
+            logger.warning(f"[Stream] Completion for {from_number} cut off after reply was dispatched: {e}")
+            data = streamed.parser.partial()
+            data.update(streamed.emitted)
+            data, repairs = validate_analysis(data, default_reply=SAFE_ACK_REPLY)
+            data["notes"] = (data["notes"] + " [completion cut off after reply]").strip()
+            data["schema_repairs"] = repairs
+            data["streamed_early"] = True
+            return data
+        if isinstance(e, DeadlineExceeded):
+            logger.warning(f"[Deadline] analyze_with_ai for {from_number} fell back to safe ack: {e}")
+            return _fallback_result(f"Deadline exceeded after {deadline.elapsed():.1f}s — sent safe acknowledgement")
+        if isinstance(e, CircuitOpenError):
+            logger.warning(f"[Breaker] analyze_with_ai for {from_number} fell back to safe ack: {e}")
+            return _fallback_result("OpenAI circuit open — sent safe acknowledgement")
+        raise
+
+    data, repaired = repair_json(raw or "")
+    if repaired:
+        logger.error(f"JSON parse failed despite response_format — repaired {sorted(data)}. Raw: {(raw or '')[:300]}")
+    data, repairs = validate_analysis(data, default_reply=SAFE_ACK_REPLY)
+    if repaired:
+        data["notes"] = (data["notes"] + f" [repaired malformed JSON: {(raw or '')[:200]}]").strip()
+    data["schema_repairs"] = repairs
+
+    if streamed is not None and streamed.emitted is not None:
+        # Whatever attempt won, the result must match what was dispatched
+        data.update(streamed.emitted)
+        data["streamed_early"] = True
+    else:
+        # Post-processing: fix common GPT-4o bad habits the prompt can't fully prevent
+        data["reply"], data["post_processing_rules"] = rules.apply(data["reply"], conversation_history)
 
     return data
 
@@ -6,10 +6,16 @@ Owner: marketing-ops agent
 import csv
 import json
 import argparse
-from openai import OpenAI
+import os
+import sys
 
-# Uses your OPENAI_API_KEY environment variable
-client = OpenAI()
+# Run as a script from anywhere: make the tools.* package importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.llm_gateway import PRIORITY_BATCH, chat  # noqa: E402
+
+# Bulk jobs can wait behind live replies in the LLM gateway queue
+LLM_BATCH_TIMEOUT = 300
 
 
 def build_prompt(base_script: str, agent_name: str, brokerage: str, lead: dict) -> str:
@@ -85,14 +91,16 @@ def generate_messages_for_lead(
 ) -> dict:
     prompt = build_prompt(base_script, agent_name, brokerage, lead)
 
-    response = client.chat.completions.create(
-        model=model,
-        response_format={"type": "json_object"},
-        messages=[
+    response = chat(
+        [
             {"role": "system", "content": "You are a helpful real estate ISA assistant."},
             {"role": "user", "content": prompt},
         ],
+        model=model,
         temperature=temperature,
+        priority=PRIORITY_BATCH,
+        timeout=LLM_BATCH_TIMEOUT,
+        response_format={"type": "json_object"},
     )
 
     content = response.choices[0].message.content
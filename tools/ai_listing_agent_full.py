@@ -2,21 +2,40 @@
 LEGACY: Extended CLI outreach agent with SMTP email + multi-template support.
 Replaced by campaign-templates.ts + /api/campaigns/send route + Resend email.
 Owner: marketing-ops agent
+
+Leads stream through two bounded, concurrent stages (--gen-workers for
+generation, --send-workers for SMS/email) with output and log rows written
+in input order; a slow stage pauses the ones before it.
+
+--batch generates all outreach through the OpenAI Batch API (llm_batch.py)
+and merges it back by lead key before writing and sending.
+
+Generated copy is cached by prompt (outreach_cache.py), so re-running a
+campaign only pays for leads whose prompt changed; --refresh regenerates
+everything, --cache-only never calls OpenAI.
 """
 import csv
+import itertools
 import json
 import argparse
 import os
+import sys
 from datetime import datetime, timezone
 from typing import Optional, Dict
 
-from openai import OpenAI
-import smtplib
 from email.mime.text import MIMEText
 
-# ---------- OpenAI client ----------
-# Uses your OPENAI_API_KEY environment variable
-client = OpenAI()
+# Run as a script from anywhere: make the tools.* package importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.llm_batch import LLM_BATCH_POLL_SECONDS, custom_ids, get_backend, request_line, run_batch  # noqa: E402
+from tools.lead_batch import run_concurrent  # noqa: E402
+from tools.llm_gateway import LLM_MAX_CONCURRENCY, PRIORITY_BATCH, chat  # noqa: E402
+from tools.outreach_cache import CacheMiss, OutreachCache  # noqa: E402
+from tools.smtp_pool import get_pool  # noqa: E402
+
+# Bulk jobs can wait behind live replies in the LLM gateway queue
+LLM_BATCH_TIMEOUT = 300
 
 
 # ---------- Utility: load templates ----------
@@ -97,7 +116,7 @@ def send_sms(to_number: str,
 
 def send_email(to_email: str, subject: str, body: str) -> str:
     """
-    Send an email using basic SMTP.
+    Send an email over a pooled SMTP session.
 
     Environment variables:
       EMAIL_HOST        (default smtp.gmail.com)
@@ -105,6 +124,8 @@ def send_email(to_email: str, subject: str, body: str) -> str:
       EMAIL_USER        (your email address / username)
       EMAIL_PASSWORD    (password or app password)
       EMAIL_FROM_NAME   (optional, display name)
+      EMAIL_STARTTLS, EMAIL_POOL_SIZE, EMAIL_MAX_PER_CONNECTION,
+      EMAIL_RATE_PER_MINUTE (pool settings, see smtp_pool.py)
 
     Returns status string.
     """
@@ -126,10 +147,8 @@ def send_email(to_email: str, subject: str, body: str) -> str:
     msg["To"] = to_email
 
     try:
-        with smtplib.SMTP(host, port) as server:
-            server.starttls()
-            server.login(user, password)
-            server.send_message(msg)
+        # Reuses an authenticated session across leads (see smtp_pool.py)
+        get_pool(host, port, user, password).send(msg)
         return "sent"
     except Exception as e:
         return f"error: {e}"
@@ -203,6 +222,39 @@ Return your answer as a single JSON object with EXACTLY these keys:
     return prompt
 
 
+OUTREACH_KEYS = [
+    "sms_text",
+    "email_subject",
+    "email_body",
+    "call_opener",
+    "voicemail_script",
+]
+
+OUTREACH_RESPONSE_FORMAT = {"type": "json_object"}  # cleaner JSON handling
+
+
+def outreach_messages(base_script: str, agent_name: str, brokerage: str, lead: dict) -> list:
+    prompt = build_prompt(base_script, agent_name, brokerage, lead)
+    return [
+        {"role": "system", "content": "You are a helpful real estate ISA assistant."},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def parse_outreach(content: str) -> dict:
+    try:
+        data = json.loads(content)
+    except json.JSONDecodeError:
+        # fallback: wrap content as plain text if JSON fails
+        data = {"sms_text": content}
+
+    # Ensure all expected keys exist
+    for key in OUTREACH_KEYS:
+        data.setdefault(key, "")
+
+    return data
+
+
 def generate_messages_for_lead(
     base_script: str,
     agent_name: str,
@@ -210,38 +262,79 @@ def generate_messages_for_lead(
     lead: dict,
     model: str = "gpt-4.1-mini",
     temperature: float = 0.4,
+    cache: Optional[OutreachCache] = None,
 ) -> dict:
-    prompt = build_prompt(base_script, agent_name, brokerage, lead)
-
-    response = client.chat.completions.create(
+    messages = outreach_messages(base_script, agent_name, brokerage, lead)
+    key = None
+    if cache is not None:
+        key = cache.key(model, temperature, messages, response_format=OUTREACH_RESPONSE_FORMAT)
+        cached = cache.lookup(key)
+        if cached is not None:
+            return parse_outreach(cached)
+
+    response = chat(
+        messages,
         model=model,
-        response_format={"type": "json_object"},  # cleaner JSON handling
-        messages=[
-            {"role": "system", "content": "You are a helpful real estate ISA assistant."},
-            {"role": "user", "content": prompt},
-        ],
         temperature=temperature,
+        priority=PRIORITY_BATCH,
+        timeout=LLM_BATCH_TIMEOUT,
+        use_cache=cache is None,  # the outreach cache already covers this call
+        response_format=OUTREACH_RESPONSE_FORMAT,
     )
 
     content = response.choices[0].message.content
+    if cache is not None:
+        cache.store(key, content, model)
+    return parse_outreach(content)
 
-    try:
-        data = json.loads(content)
-    except json.JSONDecodeError:
-        # fallback: wrap content as plain text if JSON fails
-        data = {"sms_text": content}
-
-    # Ensure all expected keys exist
-    for key in [
-        "sms_text",
-        "email_subject",
-        "email_body",
-        "call_opener",
-        "voicemail_script",
-    ]:
-        data.setdefault(key, "")
 
-    return data
+def batch_generate_messages(
+    leads: list,
+    templates: Dict[str, str],
+    template_column: str,
+    agent_name: str,
+    brokerage: str,
+    model: str,
+    temperature: float,
+    work_dir: str,
+    backend: str = "openai",
+    poll_interval: float = LLM_BATCH_POLL_SECONDS,
+    cache: Optional[OutreachCache] = None,
+) -> list:
+    """
+    Generate outreach for every lead as one Batch API job. Returns one entry
+    per lead, in order: the parsed messages dict, or the Exception for a
+    request that failed. Leads with cached copy are left out of the batch.
+    """
+    ids = custom_ids(leads)
+    found = {}
+    keys = {}
+    lines = []
+    for cid, lead in zip(ids, leads):
+        _, template_text = choose_template_for_lead(templates, lead, template_column)
+        messages = outreach_messages(template_text, agent_name, brokerage, lead)
+        if cache is not None:
+            keys[cid] = cache.key(model, temperature, messages, response_format=OUTREACH_RESPONSE_FORMAT)
+            try:
+                cached = cache.lookup(keys[cid])
+            except CacheMiss as e:
+                found[cid] = e
+                continue
+            if cached is not None:
+                found[cid] = cached
+                continue
+        lines.append(request_line(cid, messages, model, temperature, response_format=OUTREACH_RESPONSE_FORMAT))
+
+    if lines:
+        results = run_batch(lines, get_backend(backend, work_dir), work_dir, poll_interval=poll_interval)
+        for cid, result in results.items():
+            if cache is not None and not isinstance(result, Exception):
+                cache.store(keys[cid], result, model)
+        found.update(results)
+    return [
+        found[cid] if isinstance(found[cid], Exception) else parse_outreach(found[cid])
+        for cid in ids
+    ]
 
 
 # ---------- Main CSV processing + logging ----------
@@ -260,30 +353,82 @@ def process_csv(
     template_column: str,
     model: str = "gpt-4.1-mini",
     temperature: float = 0.4,
+    batch: bool = False,
+    batch_backend: str = "openai",
+    poll_interval: float = LLM_BATCH_POLL_SECONDS,
+    gen_workers: int = LLM_MAX_CONCURRENCY,
+    send_workers: int = 4,
+    max_pending: Optional[int] = None,
+    cache_mode: str = "use",
 ) -> None:
+    """
+    Streaming pipeline: leads are read lazily and flow through two bounded
+    stages, generation (gen_workers at once) and delivery (send_workers).
+    Each stage holds at most max_pending leads (default 2 x its workers);
+    when delivery falls behind, generation and reading pause. Output rows and
+    log rows are written in input order as soon as each lead clears a stage.
+
+    Generated copy is cached on disk (outreach_cache.py); cache_mode is
+    "use", "refresh" or "cache_only".
+    """
     # Load templates (default + optional multi-templates)
     templates = load_templates(base_script_path, template_dir)
+    cache = OutreachCache(cache_mode)
 
-    # Read leads
     with open(input_csv, newline="", encoding="utf-8") as f_in:
         reader = csv.DictReader(f_in)
-        leads = list(reader)
         original_fieldnames = reader.fieldnames or []
         fieldnames = [fn for fn in original_fieldnames if fn]
+        first = next(reader, None)
+        if first is None:
+            print("No rows found in input CSV.")
+            return
+        leads = itertools.chain([first], reader)
+
+        batch_results = None
+        if batch:
+            # A batch needs every prompt up front
+            leads = list(leads)
+            batch_results = batch_generate_messages(
+                leads, templates, template_column, agent_name, brokerage, model, temperature,
+                work_dir=output_csv + ".batch", backend=batch_backend, poll_interval=poll_interval,
+                cache=cache,
+            )
+
+        _run_pipeline(
+            enumerate(leads),
+            templates=templates,
+            template_column=template_column,
+            batch_results=batch_results,
+            generate=lambda template_text, lead: generate_messages_for_lead(
+                base_script=template_text,
+                agent_name=agent_name,
+                brokerage=brokerage,
+                lead=lead,
+                model=model,
+                temperature=temperature,
+                cache=cache,
+            ),
+            fieldnames=fieldnames,
+            output_csv=output_csv,
+            log_csv=log_csv,
+            send_sms_flag=send_sms_flag,
+            send_email_flag=send_email_flag,
+            test_to_phone=test_to_phone,
+            gen_workers=gen_workers,
+            send_workers=send_workers,
+            max_pending=max_pending,
+        )
+
+    print(cache.summary())
+    print(f"Done! Wrote messages to {output_csv} and log to {log_csv}")
 
-    if not leads:
-        print("No rows found in input CSV.")
-        return
 
+def _run_pipeline(numbered_leads, templates, template_column, batch_results, generate, fieldnames,
+                  output_csv, log_csv, send_sms_flag, send_email_flag, test_to_phone,
+                  gen_workers, send_workers, max_pending):
     # Add AI output columns + template used
-    extra_fields = [
-        "sms_text",
-        "email_subject",
-        "email_body",
-        "call_opener",
-        "voicemail_script",
-        "used_template",
-    ]
+    extra_fields = OUTREACH_KEYS + ["used_template"]
     for col in extra_fields:
         if col not in fieldnames:
             fieldnames.append(col)
@@ -302,6 +447,40 @@ def process_csv(
     ]
     log_file_exists = os.path.exists(log_csv)
 
+    def generate_stage(numbered):
+        """Worker: pick the template and generate (or look up) the copy."""
+        i, lead = numbered
+        template_name, template_text = choose_template_for_lead(templates, lead, template_column)
+        if batch_results is not None:
+            ai_data = batch_results[i]
+            if isinstance(ai_data, Exception):
+                raise ai_data
+        else:
+            ai_data = generate(template_text, lead)
+        return template_name, ai_data
+
+    def deliver_stage(generated):
+        """Worker: send SMS / email for one generated lead."""
+        lead, ai_data, generation_error, _ = generated
+        if generation_error is not None:
+            return "skipped: generation failed", "skipped: generation failed"
+
+        sms_status = "not_sent"
+        email_status = "not_sent"
+        if send_sms_flag:
+            sms_status = send_sms(
+                to_number=(lead.get("phone") or "").strip(),
+                body=ai_data["sms_text"],
+                override_to=test_to_phone,
+            )
+        if send_email_flag:
+            email_status = send_email(
+                to_email=(lead.get("email") or "").strip(),
+                subject=ai_data["email_subject"],
+                body=ai_data["email_body"],
+            )
+        return sms_status, email_status
+
     with open(output_csv, "w", newline="", encoding="utf-8") as f_out, \
          open(log_csv, "a", newline="", encoding="utf-8") as f_log:
 
@@ -312,66 +491,44 @@ def process_csv(
         if not log_file_exists:
             log_writer.writeheader()
 
-        for i, lead in enumerate(leads, start=1):
-            print(f"Processing lead {i}/{len(leads)}: {lead.get('property_address', '')}")
-
-            template_name, template_text = choose_template_for_lead(
-                templates, lead, template_column
-            )
-
-            ai_data = generate_messages_for_lead(
-                base_script=template_text,
-                agent_name=agent_name,
-                brokerage=brokerage,
-                lead=lead,
-                model=model,
-                temperature=temperature,
-            )
-
-            # Write full AI content back out
-            row = dict(lead)
-            row.update(ai_data)
-            row["used_template"] = template_name
-            row = {k: v for k, v in row.items() if k and k in fieldnames}
-            writer.writerow(row)
-
-            # --- sending + automatic logging ---
+        def generated_leads():
+            """Generation stage output, in input order; writes each output row."""
+            for (i, lead), result, error in run_concurrent(
+                    numbered_leads, generate_stage, gen_workers, window=max_pending, ordered=True):
+                print(f"Generated lead {i + 1}: {lead.get('property_address', '')}")
+                if error is not None:
+                    print(f"  Generation failed: {error}")
+                    template_name, ai_data = "", parse_outreach("{}")
+                else:
+                    template_name, ai_data = result
+
+                # Write full AI content back out
+                row = dict(lead)
+                row.update(ai_data)
+                row["used_template"] = template_name
+                row = {k: v for k, v in row.items() if k and k in fieldnames}
+                writer.writerow(row)
+                f_out.flush()
+                yield lead, ai_data, error, template_name
+
+        for (lead, ai_data, error, template_name), statuses, send_error in run_concurrent(
+                generated_leads(), deliver_stage, send_workers, window=max_pending, ordered=True):
+            sms_status, email_status = statuses or (f"error: {send_error}", f"error: {send_error}")
             phone = (lead.get("phone") or "").strip()
-            email = (lead.get("email") or "").strip()
-
-            sms_status = "not_sent"
-            email_status = "not_sent"
-            actual_sms_to = test_to_phone or phone
-
-            if send_sms_flag:
-                sms_status = send_sms(
-                    to_number=phone,
-                    body=ai_data["sms_text"],
-                    override_to=test_to_phone,
-                )
-
-            if send_email_flag:
-                email_status = send_email(
-                    to_email=email,
-                    subject=ai_data["email_subject"],
-                    body=ai_data["email_body"],
-                )
-
             log_writer.writerow(
                 {
                     "timestamp_utc": datetime.now(timezone.utc).isoformat(),
                     "property_address": lead.get("property_address", ""),
                     "owner_name": lead.get("owner_name", ""),
                     "lead_phone": phone,
-                    "actual_sms_to": actual_sms_to,
-                    "email": email,
+                    "actual_sms_to": test_to_phone or phone,
+                    "email": (lead.get("email") or "").strip(),
                     "used_template": template_name,
                     "sms_status": sms_status,
                     "email_status": email_status,
                 }
             )
-
-    print(f"Done! Wrote messages to {output_csv} and log to {log_csv}")
+            f_log.flush()
 
 
 def main():
@@ -410,6 +567,24 @@ def main():
         default="template_name",
         help="CSV column indicating which template to use (default: template_name).",
     )
+    parser.add_argument("--batch", action="store_true",
+                        help="Generate through the OpenAI Batch API (cheaper, not real time)")
+    parser.add_argument("--batch-backend", choices=["openai", "local"], default="openai",
+                        help="Batch backend; 'local' is a file-based stand-in for testing")
+    parser.add_argument("--poll-interval", type=float, default=LLM_BATCH_POLL_SECONDS,
+                        help="Seconds between batch status checks")
+    parser.add_argument("--gen-workers", type=int, default=LLM_MAX_CONCURRENCY,
+                        help="Leads generated at once (default: LLM_MAX_CONCURRENCY)")
+    parser.add_argument("--send-workers", type=int, default=4,
+                        help="Leads being sent (SMS/email) at once (default: 4)")
+    parser.add_argument("--max-pending", type=int,
+                        help="Leads buffered per stage before reading pauses "
+                             "(default: 2 x that stage's workers)")
+    cache_flags = parser.add_mutually_exclusive_group()
+    cache_flags.add_argument("--refresh", action="store_true",
+                             help="Regenerate all copy and overwrite the outreach cache")
+    cache_flags.add_argument("--cache-only", action="store_true",
+                             help="Never call OpenAI; leads without cached copy are skipped")
 
     args = parser.parse_args()
 
@@ -427,6 +602,13 @@ def main():
         template_column=args.template_column,
         model=args.model,
         temperature=args.temperature,
+        batch=args.batch,
+        batch_backend=args.batch_backend,
+        poll_interval=args.poll_interval,
+        gen_workers=args.gen_workers,
+        send_workers=args.send_workers,
+        max_pending=args.max_pending,
+        cache_mode="refresh" if args.refresh else "cache_only" if args.cache_only else "use",
     )
 
 
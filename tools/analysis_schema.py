@@ -0,0 +1,140 @@
+"""
+analysis_schema.py
+
+Schema for the JSON object analyze_with_ai gets back from the model.
+
+validate_analysis() coerces a (possibly partial or repaired) result into the
+shape the WhatsApp/SMS handlers expect — right types, known intent, every key
+present — and lists what it had to fix. Fields are repaired individually, so
+one bad value no longer costs the whole reply.
+"""
+
+from typing import Optional
+
+INTENTS = frozenset({
+    "interested", "not_interested", "maybe_later", "needs_more_info",
+    "wrong_person", "stop", "escalate", "buyer", "other",
+})
+
+_QUALIFICATION_INTS = ("bedrooms", "bathrooms", "units", "sqft")
+_QUALIFICATION_STRS = (
+    "property_address", "property_type", "owner_goal", "timeline",
+    "price_expectation", "meeting_date", "meeting_time",
+)
+_MEETING_BOOLS = ("requested", "ready_to_book")
+_MEETING_STRS = ("title", "date_suggestion", "property_address", "description")
+
+
+def _as_int(value) -> Optional[int]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        digits = value.strip().replace(",", "")
+        try:
+            return int(float(digits))
+        except ValueError:
+            return None
+    return None
+
+
+def _as_bool(value) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ("true", "yes", "1")
+    return bool(value)
+
+
+def _as_str(value) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return None if value.strip().lower() in ("", "null", "none") else value
+    return str(value)
+
+
+def _validate_qualification(value, repairs: list) -> dict:
+    if not isinstance(value, dict):
+        if value is not None:
+            repairs.append("qualification")
+        return {}
+    out = dict(value)
+    for key in _QUALIFICATION_INTS:
+        if key in out and out[key] is not None:
+            coerced = _as_int(out[key])
+            if coerced != out[key]:
+                repairs.append(f"qualification.{key}")
+            out[key] = coerced
+    for key in _QUALIFICATION_STRS:
+        if key in out:
+            out[key] = _as_str(out[key])
+    missing = out.get("missing_fields")
+    if missing is not None and not isinstance(missing, list):
+        repairs.append("qualification.missing_fields")
+        out["missing_fields"] = [missing] if isinstance(missing, str) else []
+    if "qualified" in out and not isinstance(out["qualified"], bool):
+        repairs.append("qualification.qualified")
+        out["qualified"] = _as_bool(out["qualified"])
+    return out
+
+
+def _validate_meeting(value, repairs: list) -> dict:
+    if not isinstance(value, dict):
+        if value is not None:
+            repairs.append("meeting")
+        return {}
+    out = dict(value)
+    for key in _MEETING_BOOLS:
+        if key in out and not isinstance(out[key], bool):
+            repairs.append(f"meeting.{key}")
+            out[key] = _as_bool(out[key])
+    for key in _MEETING_STRS:
+        if key in out:
+            out[key] = _as_str(out[key])
+    return out
+
+
+def validate_analysis(data: dict, default_reply: str) -> tuple[dict, list[str]]:
+    """
+    Coerce a model result in place of dropping it.
+    Returns (clean_result, repaired_field_names).
+    """
+    repairs: list[str] = []
+    out = dict(data) if isinstance(data, dict) else {}
+
+    intent = out.get("intent")
+    if isinstance(intent, str) and intent.strip().lower() in INTENTS:
+        out["intent"] = intent.strip().lower()
+    else:
+        repairs.append("intent")
+        out["intent"] = "other"
+
+    reply = out.get("reply")
+    if not isinstance(reply, str) or not reply.strip():
+        repairs.append("reply")
+        out["reply"] = default_reply
+
+    days = out.get("schedule_follow_up_days")
+    coerced = _as_int(days)
+    if coerced is not None and coerced <= 0:
+        coerced = None
+    if days is not None and coerced != days:
+        repairs.append("schedule_follow_up_days")
+    out["schedule_follow_up_days"] = coerced
+
+    notes = out.get("notes")
+    if not isinstance(notes, str):
+        if notes is not None:
+            repairs.append("notes")
+        out["notes"] = "" if notes is None else str(notes)
+
+    out["qualification"] = _validate_qualification(out.get("qualification"), repairs)
+    out["meeting"] = _validate_meeting(out.get("meeting"), repairs)
+
+    if "valuation_requested" in out and not isinstance(out["valuation_requested"], bool):
+        repairs.append("valuation_requested")
+        out["valuation_requested"] = _as_bool(out["valuation_requested"])
+
+    out["agent_brief"] = _as_str(out.get("agent_brief"))
+
+    return out, repairs
@@ -2,18 +2,51 @@
 LEGACY: CLI tool to generate follow-up CSV schedules from GPT.
 Replaced by /api/followups/build route which uses app/lib/ai/followup-generator.ts.
 Owner: engineering-ops agent
+
+Leads are generated concurrently (--concurrency, default LLM_MAX_CONCURRENCY;
+llm_gateway paces them against the token budget and 429s). Each lead's rows
+are appended to the output as soon as they're ready and checkpointed in
+<output>.checkpoint.jsonl, so re-running the same command after a crash or a
+failed lead only generates what's missing (--restart starts over). The
+checkpoint is tied to the leads file's contents and deleted once every lead
+has succeeded.
+
+--batch sends every prompt as one OpenAI Batch API job instead (see
+llm_batch.py); results are merged by lead key into the same checkpointed
+output, and re-running resumes the submitted batch.
 """
 import csv
 import json
 from datetime import date, timedelta
 import argparse
 import os
-from openai import OpenAI
+import sys
+
+# Run as a script from anywhere: make the tools.* package importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-client = OpenAI()  # uses OPENAI_API_KEY
+from tools.circuit_breaker import CircuitOpenError  # noqa: E402
+from tools.lead_batch import Progress, ResumableCsvWriter, run_concurrent  # noqa: E402
+from tools.llm_batch import LLM_BATCH_POLL_SECONDS, custom_ids, get_backend, request_line, run_batch  # noqa: E402
+from tools.llm_gateway import LLM_MAX_CONCURRENCY, PRIORITY_FOLLOWUP, chat, gateway_stats  # noqa: E402
+
+# Follow-up generation is the lowest-priority LLM traffic; let it queue
+LLM_BATCH_TIMEOUT = 300
+
+FOLLOWUP_TEMPERATURE = 0.4
 
 FOLLOWUP_OFFSETS = [1, 3, 7, 14, 30]
 
+FIELDNAMES = [
+    "owner_name",
+    "property_address",
+    "phone",
+    "day_offset",
+    "send_date",
+    "message_text",
+    "status",
+]
+
 
 def build_prompt(lead, first_sms, email_for_contact=None):
     name = (lead.get("owner_name") or "").strip() or "there"
@@ -56,18 +89,15 @@ Each value is the SMS text for that day.
     return prompt
 
 
-def generate_followups_for_lead(lead, first_sms, email_for_contact=None, model="gpt-4.1-mini"):
+def followup_messages(lead, first_sms, email_for_contact=None):
     prompt = build_prompt(lead, first_sms, email_for_contact=email_for_contact)
-    resp = client.chat.completions.create(
-        model=model,
-        response_format={"type": "json_object"},
-        messages=[
-            {"role": "system", "content": "You are a helpful real estate ISA assistant."},
-            {"role": "user", "content": prompt},
-        ],
-        temperature=0.4,
-    )
-    content = resp.choices[0].message.content
+    return [
+        {"role": "system", "content": "You are a helpful real estate ISA assistant."},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def parse_followups(content):
     data = json.loads(content)
 
     for k in ["day1", "day3", "day7", "day14", "day30"]:
@@ -76,6 +106,77 @@ def generate_followups_for_lead(lead, first_sms, email_for_contact=None, model="
     return data
 
 
+def generate_followups_for_lead(lead, first_sms, email_for_contact=None, model="gpt-4.1-mini"):
+    resp = chat(
+        followup_messages(lead, first_sms, email_for_contact=email_for_contact),
+        model=model,
+        temperature=FOLLOWUP_TEMPERATURE,
+        priority=PRIORITY_FOLLOWUP,
+        timeout=LLM_BATCH_TIMEOUT,
+        response_format={"type": "json_object"},
+    )
+    return parse_followups(resp.choices[0].message.content)
+
+
+def batch_generate(items, args):
+    """
+    Batch API path: takes (key, lead) items and yields (item, followups,
+    error) like run_concurrent(), once the whole batch has completed.
+    """
+    ids = [key for key, _ in items]
+    leads = [lead for _, lead in items]
+    lines = [
+        request_line(
+            cid,
+            followup_messages(lead, lead.get(args.first_sms_column, ""), email_for_contact=args.contact_email),
+            args.model,
+            FOLLOWUP_TEMPERATURE,
+            response_format={"type": "json_object"},
+        )
+        for cid, lead in zip(ids, leads)
+    ]
+    work_dir = args.output_csv + ".batch"
+    results = run_batch(lines, get_backend(args.batch_backend, work_dir), work_dir, poll_interval=args.poll_interval)
+    for item in items:
+        result = results[item[0]]
+        if isinstance(result, Exception):
+            yield item, None, result
+            continue
+        try:
+            yield item, parse_followups(result), None
+        except json.JSONDecodeError as e:
+            yield item, None, e
+
+
+def followup_rows(lead, followups, today):
+    """CSV rows for one lead's generated follow-ups (empty messages dropped)."""
+    mapping = {
+        1: "day1",
+        3: "day3",
+        7: "day7",
+        14: "day14",
+        30: "day30",
+    }
+    rows = []
+    for offset in FOLLOWUP_OFFSETS:
+        msg = followups.get(mapping[offset], "").strip()
+        if not msg:
+            continue
+        send_date = today + timedelta(days=offset)
+        rows.append(
+            {
+                "owner_name": lead.get("owner_name", ""),
+                "property_address": lead.get("property_address", ""),
+                "phone": lead.get("phone", ""),
+                "day_offset": offset,
+                "send_date": send_date.isoformat(),
+                "message_text": msg,
+                "status": "pending",
+            }
+        )
+    return rows
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Build follow-up schedule CSV from leads + first SMS."
@@ -102,66 +203,102 @@ def main():
         "--contact-email",
         help="Optional email to reference in follow-ups (e.g., agent's email).",
     )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=LLM_MAX_CONCURRENCY,
+        help="Leads generated at once (default: LLM_MAX_CONCURRENCY).",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="Ignore the checkpoint and regenerate every lead.",
+    )
+    parser.add_argument(
+        "--report-every",
+        type=float,
+        default=10.0,
+        help="Seconds between progress lines.",
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Generate through the OpenAI Batch API (cheaper, not real time).",
+    )
+    parser.add_argument(
+        "--batch-backend",
+        choices=["openai", "local"],
+        default="openai",
+        help="Batch backend; 'local' is a file-based stand-in for testing.",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=LLM_BATCH_POLL_SECONDS,
+        help="Seconds between batch status checks.",
+    )
     args = parser.parse_args()
 
     today = date.today()
 
-    with open(args.leads_csv, newline="", encoding="utf-8") as f_in, \
-         open(args.output_csv, "w", newline="", encoding="utf-8") as f_out:
-
-        reader = csv.DictReader(f_in)
-        fieldnames = [
-            "owner_name",
-            "property_address",
-            "phone",
-            "day_offset",
-            "send_date",
-            "message_text",
-            "status",
-        ]
-        writer = csv.DictWriter(f_out, fieldnames=fieldnames)
-        writer.writeheader()
-
-        leads = list(reader)
-        for i, lead in enumerate(leads, start=1):
-            print(f"Generating follow-ups for lead {i}/{len(leads)}: {lead.get('property_address','')}")
-            first_sms = lead.get(args.first_sms_column, "")
-            if not first_sms.strip():
-                print("  Skipping: no initial sms_text")
-                continue
+    with open(args.leads_csv, newline="", encoding="utf-8") as f_in:
+        leads = list(csv.DictReader(f_in))
 
-            followups = generate_followups_for_lead(
-                lead,
-                first_sms,
-                email_for_contact=args.contact_email,
-                model=args.model,
-            )
-
-            mapping = {
-                1: "day1",
-                3: "day3",
-                7: "day7",
-                14: "day14",
-                30: "day30",
-            }
+    out = ResumableCsvWriter(args.output_csv, FIELDNAMES, restart=args.restart, source=args.leads_csv)
+    if out.stale:
+        print("Checkpoint was written for a different leads file; starting over")
+    # Keyed over the whole file, so a repeated lead keeps its #n across runs
+    todo = []
+    for key, lead in zip(custom_ids(leads), leads):
+        if not lead.get(args.first_sms_column, "").strip():
+            print(f"  Skipping {lead.get('property_address', '')}: no initial sms_text")
+        elif not out.done(key):
+            todo.append((key, lead))
+    if out.resumed:
+        print(f"Resuming: {out.resumed} lead(s) already done, {len(todo)} to go")
+
+    def generate(item):
+        lead = item[1]
+        return generate_followups_for_lead(
+            lead,
+            lead.get(args.first_sms_column, ""),
+            email_for_contact=args.contact_email,
+            model=args.model,
+        )
+
+    def gateway_line():
+        stats = gateway_stats()
+        return f"{stats['rate_limited']} rate-limited, {stats['queue_depth']} queued"
 
-            for offset in FOLLOWUP_OFFSETS:
-                msg = followups.get(mapping[offset], "").strip()
-                if not msg:
-                    continue
-                send_date = today + timedelta(days=offset)
-                writer.writerow(
-                    {
-                        "owner_name": lead.get("owner_name", ""),
-                        "property_address": lead.get("property_address", ""),
-                        "phone": lead.get("phone", ""),
-                        "day_offset": offset,
-                        "send_date": send_date.isoformat(),
-                        "message_text": msg,
-                        "status": "pending",
-                    }
-                )
+    if args.batch:
+        results = batch_generate(todo, args) if todo else iter(())
+    else:
+        results = run_concurrent(todo, generate, args.concurrency)
+
+    progress = Progress(len(todo), every=args.report_every, extra=None if args.batch else gateway_line)
+    clean = False
+    try:
+        for (key, lead), followups, error in results:
+            if error is not None:
+                print(f"  Failed {lead.get('property_address', '')}: {error}")
+                progress.tick(ok=False)
+                if isinstance(error, CircuitOpenError):
+                    # OpenAI is down; stop instead of failing every remaining lead
+                    print("OpenAI circuit is open — stopping. Re-run to resume.")
+                    break
+                continue
+            out.write(key, followup_rows(lead, followups, today))
+            progress.tick()
+        clean = not progress.failed
+    finally:
+        if clean:
+            out.finish()
+        else:
+            out.close()
 
+    print(progress.line())
+    if progress.failed:
+        print(f"{progress.failed} lead(s) failed; re-run the same command to retry them.")
     print(f"Done. Follow-up schedule written to {args.output_csv}")
 
 
@@ -0,0 +1,141 @@
+"""
+circuit_breaker.py
+
+Per-dependency circuit breakers so a degraded OpenAI or Supabase fails fast
+instead of holding every webhook thread for a full timeout.
+
+- closed: calls flow; consecutive failures are counted
+- open: calls are rejected immediately for CB_RESET_SECONDS
+- half_open: one trial call is let through; success closes, failure re-opens
+
+Env vars:
+- CB_FAILURE_THRESHOLD (consecutive failures before opening, default 5)
+- CB_RESET_SECONDS (how long to stay open before a trial call, default 30)
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+CB_FAILURE_THRESHOLD = int(os.getenv("CB_FAILURE_THRESHOLD", "5"))
+CB_RESET_SECONDS = float(os.getenv("CB_RESET_SECONDS", "30"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected because the dependency's breaker is open."""
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = CB_FAILURE_THRESHOLD,
+        reset_seconds: float = CB_RESET_SECONDS,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        self._on_close: list[Callable[[], None]] = []
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_seconds:
+                return HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        """True if a call may go ahead right now."""
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN:
+                if time.monotonic() - self._opened_at < self.reset_seconds:
+                    return False
+                self._state = HALF_OPEN
+                self._trial_in_flight = False
+            # Half-open: exactly one trial call at a time
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            recovered = self._state != CLOSED
+            self._state = CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+            callbacks = list(self._on_close) if recovered else []
+        if recovered:
+            logger.info(f"[Breaker] {self.name} recovered — circuit closed")
+        for cb in callbacks:
+            try:
+                cb()
+            except Exception as e:
+                logger.error(f"[Breaker] {self.name} on-close callback failed: {e}")
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    logger.warning(f"[Breaker] {self.name} opened after {self._failures} failure(s)")
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+
+    def on_close(self, callback: Callable[[], None]) -> None:
+        """Register a callback to run when the breaker recovers (e.g. journal replay)."""
+        self._on_close.append(callback)
+
+    def call(self, fn: Callable, *args, **kwargs):
+        """Run fn through the breaker; raises CircuitOpenError when open."""
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} circuit is open")
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    def snapshot(self) -> dict:
+        state = self.state
+        with self._lock:
+            opened_for: Optional[float] = (
+                round(time.monotonic() - self._opened_at, 1) if self._state != CLOSED else None
+            )
+            return {"state": state, "consecutive_failures": self._failures, "open_for_seconds": opened_for}
+
+
+_BREAKERS: dict[str, CircuitBreaker] = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """Shared breaker for a dependency name ("openai", "supabase", ...)."""
+    with _REGISTRY_LOCK:
+        if name not in _BREAKERS:
+            _BREAKERS[name] = CircuitBreaker(name)
+        return _BREAKERS[name]
+
+
+def breaker_states() -> dict:
+    with _REGISTRY_LOCK:
+        breakers = list(_BREAKERS.values())
+    return {b.name: b.snapshot() for b in breakers}
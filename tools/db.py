@@ -1,13 +1,45 @@
 """
 Supabase database client for Python webhook service
+
+Every query helper runs behind the "supabase" circuit breaker: while it is
+open, reads return their usual failure value immediately (DNC checks stay
+conservative) and writes are deferred to the local journal (db_journal.py),
+which is replayed once Supabase recovers.
+
+Only outages (transport errors, timeouts, 429 and 5xx) count against the
+breaker and get journaled. A request Supabase rejects on its merits (bad
+data, constraint or FK violation) is logged and dropped: retrying it can't
+succeed, and counting it would let one bad row open the breaker for every
+tenant. Only idempotent writes are journaled, since a write that timed out
+may already have been applied.
 """
+import copy
+import functools
 import logging
 import os
+import threading
 from supabase import create_client, Client
 from typing import Optional
 
+from tools import db_journal
+from tools.circuit_breaker import get_breaker
+
+try:
+    import httpx
+    _TRANSPORT_ERRORS = (OSError, httpx.TransportError)
+except ImportError:
+    _TRANSPORT_ERRORS = (OSError,)
+
 logger = logging.getLogger(__name__)
 
+_breaker = get_breaker("supabase")
+_call_state = threading.local()
+_MAX_REPLAY_ATTEMPTS = 3
+# Postgres error classes for a request rejected on its merits: data
+# exceptions, integrity (constraint/FK) violations, undefined column/table;
+# PGRST* are PostgREST's own request errors
+_REJECTED_CODE_PREFIXES = ("22", "23", "42", "PGRST")
+
 
 def get_supabase_client() -> Optional[Client]:
     """
@@ -23,6 +55,100 @@ def get_supabase_client() -> Optional[Client]:
     return create_client(url, key)
 
 
+def _is_outage(error: Exception) -> bool:
+    """True if a retry could succeed: transport errors, timeouts, 429 and 5xx."""
+    if isinstance(error, _TRANSPORT_ERRORS):
+        return True
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    code = str(getattr(error, "code", None) or "")
+    if status is None and len(code) == 3 and code.isdigit():
+        status = code  # postgrest-py relays a non-JSON HTTP error's status as the code
+    if status is not None:
+        return int(status) == 429 or int(status) >= 500
+    if code:
+        return not code.startswith(_REJECTED_CODE_PREFIXES)
+    return False
+
+
+def _note_db_failure(error: Exception) -> None:
+    """Classify the current guarded call's error (called from except blocks)."""
+    if _is_outage(error):
+        _call_state.failed = True
+    else:
+        _call_state.rejected = True
+
+
+def _guarded(fallback=None, journal: bool = False):
+    """
+    Run a query helper through the Supabase breaker.
+
+    fallback is returned without touching the network while the breaker is
+    open. journal=True marks an idempotent write: it is appended to the local
+    journal when skipped or when it fails with an outage, so it can be
+    replayed later. A rejected write is logged and dropped.
+    Nested helpers (e.g. find_lead_by_phone inside get_conversation_history)
+    report into the outermost call instead of the breaker directly.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            depth = getattr(_call_state, "depth", 0)
+            if depth == 0:
+                if not _breaker.allow():
+                    if journal:
+                        db_journal.append(fn.__name__, args, kwargs)
+                    return copy.deepcopy(fallback)
+                _call_state.failed = _call_state.rejected = False
+
+            _call_state.depth = depth + 1
+            try:
+                result = fn(*args, **kwargs)
+            finally:
+                _call_state.depth = depth
+
+            if depth == 0:
+                if _call_state.failed:
+                    _breaker.record_failure()
+                    if journal:
+                        db_journal.append(fn.__name__, args, kwargs)
+                else:
+                    # A rejection is still an answer from a healthy Supabase
+                    _breaker.record_success()
+                    if journal and _call_state.rejected:
+                        logger.warning(f"[DB] {fn.__name__} rejected by Supabase — dropped, not journaled")
+            return result
+        return wrapper
+    return decorator
+
+
+def replay_journal() -> int:
+    """
+    Re-apply journaled writes in order. Returns how many were applied.
+    Entries that keep failing are dropped after _MAX_REPLAY_ATTEMPTS; one
+    Supabase rejects is dropped straight away.
+    """
+    writers = {name: _replay_writer(fn.__wrapped__) for name, fn in _JOURNALED_WRITES.items()}
+    return db_journal.replay(writers, _MAX_REPLAY_ATTEMPTS)
+
+
+def _replay_writer(fn):
+    def run(*args, **kwargs):
+        _call_state.failed = _call_state.rejected = False
+        ok = fn(*args, **kwargs)
+        if not ok and _call_state.rejected and not _call_state.failed:
+            return db_journal.DROPPED
+        return ok
+    return run
+
+
+def _replay_in_background() -> None:
+    threading.Thread(target=replay_journal, name="db-journal-replay", daemon=True).start()
+
+
+_breaker.on_close(_replay_in_background)
+
+
+@_guarded(False)
 def log_inbound_message(
     user_id: str,
     from_number: str,
@@ -51,10 +177,12 @@ def log_inbound_message(
         }).execute()
         return True
     except Exception as e:
+        _note_db_failure(e)
         logger.error(f"Error logging inbound message: {e}")
         return False
 
 
+@_guarded(False)
 def log_outbound_message(
     user_id: str,
     to_number: str,
@@ -86,10 +214,12 @@ def log_outbound_message(
         }).execute()
         return True
     except Exception as e:
+        _note_db_failure(e)
         logger.error(f"Error logging outbound message: {e}")
         return False
 
 
+@_guarded(False, journal=True)
 def add_to_dnc_list(user_id: str, phone: str, reason: str = "STOP keyword") -> bool:
     """
     Add a phone number to the DNC (Do Not Call) list
@@ -108,10 +238,12 @@ def add_to_dnc_list(user_id: str, phone: str, reason: str = "STOP keyword") -> b
         }, on_conflict="user_id,phone").execute()
         return True
     except Exception as e:
+        _note_db_failure(e)
         logger.error(f"Error adding to DNC list: {e}")
         return False
 
 
+@_guarded(False, journal=True)
 def log_activity(
     user_id: str,
     event_type: str,
@@ -136,10 +268,12 @@ def log_activity(
         }).execute()
         return True
     except Exception as e:
+        _note_db_failure(e)
         logger.error(f"Error logging activity: {e}")
         return False
 
 
+@_guarded(None)
 def find_lead_by_phone(user_id: str, phone: str) -> Optional[dict]:
     """
     Find a lead by phone number
@@ -164,10 +298,12 @@ def find_lead_by_phone(user_id: str, phone: str) -> Optional[dict]:
             return result.data[0]
         return None
     except Exception as e:
+        _note_db_failure(e)
         logger.error(f"Error finding lead: {e}")
         return None
 
 
+@_guarded(False, journal=True)
 def update_lead_last_response(lead_id: str) -> bool:
     """
     Update the last_response timestamp on a lead
@@ -188,10 +324,12 @@ def update_lead_last_response(lead_id: str) -> bool:
 
         return True
     except Exception as e:
+        _note_db_failure(e)
         logger.error(f"Error updating lead: {e}")
         return False
 
 
+@_guarded(False)
 def create_meeting(
     user_id: str,
     title: str,
@@ -234,54 +372,173 @@ def create_meeting(
         client.table("meetings").insert(record).execute()
         return True
     except Exception as e:
+        _note_db_failure(e)
         logger.error(f"Error creating meeting: {e}")
         return False
 
 
+def _is_unique_violation(error: Exception) -> bool:
+    """Postgres 23505 as surfaced by postgrest-py (APIError.code) or in the message."""
+    return getattr(error, "code", None) == "23505" or "23505" in str(error)
+
+
+# create_follow_up() results; a failed write returns None
+FOLLOW_UP_CREATED = "created"
+FOLLOW_UP_DUPLICATE = "duplicate"
+
+
+@_guarded(None, journal=True)
 def create_follow_up(
     user_id: str,
     lead_id: str,
     message_text: str,
     scheduled_at: str,
     channel: str = "both",
-) -> bool:
+    kind: str = "follow_up",
+    dedup_key: Optional[str] = None,
+) -> Optional[str]:
     """
     Create a follow-up reminder in the follow_ups table.
-    Deduplicates: skips if a pending follow-up already exists for this lead at this time.
-    Table columns: id, user_id, lead_id, message_text, scheduled_at, status, sent_at, created_at
+    Idempotent: (user_id, dedup_key) is unique among pending follow-ups, so a
+    duplicate insert is rejected by the index — no pre-read. Returns
+    FOLLOW_UP_CREATED for a new row, FOLLOW_UP_DUPLICATE if one was already
+    pending (both truthy), None on failure. dedup_key defaults to kind + lead
+    + scheduled date, so retries of the same turn collapse into one row.
+    Table columns: id, user_id, lead_id, message_text, scheduled_at, status, sent_at, created_at, kind, dedup_key
     """
     client = get_supabase_client()
     if not client:
-        return False
+        return None
 
+    dedup_key = dedup_key or f"{kind}:{lead_id}:{str(scheduled_at)[:10]}"
     try:
-        # Check for existing pending follow-up for same lead + scheduled time
-        existing = (
-            client.table("follow_ups")
-            .select("id")
-            .eq("lead_id", lead_id)
-            .eq("scheduled_at", scheduled_at)
-            .eq("status", "pending")
-            .execute()
-        )
-        if existing.data and len(existing.data) > 0:
-            logger.debug(f"Follow-up already exists for lead {lead_id} at {scheduled_at}, skipping")
-            return True
-
         record = {
             "user_id": user_id,
             "lead_id": lead_id,
             "message_text": message_text,
             "scheduled_at": scheduled_at,
             "status": "pending",
+            "kind": kind,
+            "dedup_key": dedup_key,
         }
         client.table("follow_ups").insert(record).execute()
-        return True
+        return FOLLOW_UP_CREATED
     except Exception as e:
+        if _is_unique_violation(e):
+            logger.debug(f"Follow-up {dedup_key} already pending, skipping")
+            return FOLLOW_UP_DUPLICATE
+        _note_db_failure(e)
         logger.error(f"Error creating follow-up: {e}")
+        return None
+
+
+@_guarded(None)
+def claim_due_follow_ups(worker_id: str, limit: int, lease_seconds: int, channels: list) -> Optional[list]:
+    """
+    Claim due, approved follow-ups (claim_due_follow_ups RPC, FOR UPDATE SKIP LOCKED).
+    Claimed rows move to 'sending' under a lease held by worker_id and come
+    back with the lead phone/name and agent name. Returns None on failure.
+    """
+    client = get_supabase_client()
+    if not client:
+        return None
+
+    try:
+        result = client.rpc("claim_due_follow_ups", {
+            "p_worker": worker_id,
+            "p_limit": limit,
+            "p_lease_seconds": lease_seconds,
+            "p_channels": channels,
+        }).execute()
+        return result.data or []
+    except Exception as e:
+        _note_db_failure(e)
+        logger.error(f"Error claiming follow-ups: {e}")
+        return None
+
+
+@_guarded(None)
+def follow_up_claim_held(follow_up_id: str, worker_id: str) -> Optional[bool]:
+    """
+    Whether worker_id still holds follow_up_id in 'sending' (not cancelled
+    by a reply/STOP or re-claimed since). Returns None on failure.
+    """
+    client = get_supabase_client()
+    if not client:
+        return None
+
+    try:
+        result = client.table("follow_ups").select("id").eq("id", follow_up_id).eq(
+            "claimed_by", worker_id
+        ).eq("status", "sending").limit(1).execute()
+        return bool(result.data)
+    except Exception as e:
+        _note_db_failure(e)
+        logger.error(f"Error checking claim on follow-up {follow_up_id}: {e}")
+        return None
+
+
+@_guarded(False, journal=True)
+def complete_follow_ups(worker_id: str, results: list) -> bool:
+    """
+    Write a batch of dispatch results ({id, status, sent_at, error_message})
+    in one statement. Rows whose lease this worker no longer holds are skipped.
+    """
+    client = get_supabase_client()
+    if not client:
+        return False
+
+    try:
+        client.rpc("complete_follow_ups", {"p_worker": worker_id, "p_results": results}).execute()
+        return True
+    except Exception as e:
+        _note_db_failure(e)
+        logger.error(f"Error completing {len(results)} follow-up(s): {e}")
+        return False
+
+
+@_guarded(False)
+def log_follow_up_sends(messages: list, activities: list) -> bool:
+    """Bulk-insert the messages and activity_logs rows for a dispatched batch."""
+    client = get_supabase_client()
+    if not client:
+        return False
+
+    try:
+        if messages:
+            client.table("messages").insert(messages).execute()
+        if activities:
+            client.table("activity_logs").insert(activities).execute()
+        return True
+    except Exception as e:
+        _note_db_failure(e)
+        logger.error(f"Error logging {len(messages)} follow-up send(s): {e}")
         return False
 
 
+@_guarded(False, journal=True)
+def cancel_follow_ups_for_leads(lead_ids: list) -> bool:
+    """
+    Cancel every pending follow-up for the given leads in one UPDATE
+    (they replied or opted out), including rows a dispatcher has claimed
+    ('sending'): the dispatcher re-checks its claim before sending.
+    """
+    client = get_supabase_client()
+    if not client:
+        return False
+
+    try:
+        client.table("follow_ups").update({"status": "cancelled"}).in_(
+            "lead_id", [str(lead_id) for lead_id in lead_ids]
+        ).in_("status", ["pending", "sending"]).execute()
+        return True
+    except Exception as e:
+        _note_db_failure(e)
+        logger.error(f"Error cancelling follow-ups for {len(lead_ids)} lead(s): {e}")
+        return False
+
+
+@_guarded([])
 def get_conversation_history(user_id: str, phone: str, limit: int = 20) -> list:
     """
     Fetch recent conversation messages for a phone number.
@@ -348,10 +605,12 @@ def get_conversation_history(user_id: str, phone: str, limit: int = 20) -> list:
         merged.sort(key=lambda m: m["created_at"])
         return merged[-limit:]
     except Exception as e:
+        _note_db_failure(e)
         logger.error(f"Error fetching conversation history: {e}")
         return []
 
 
+@_guarded({})
 def get_campaign_names(user_id: str, campaign_ids: list) -> dict:
     """
     Fetch campaign names for a list of campaign IDs.
@@ -370,10 +629,35 @@ def get_campaign_names(user_id: str, campaign_ids: list) -> dict:
         )
         return {c["id"]: c["name"] for c in (result.data or [])}
     except Exception as e:
+        _note_db_failure(e)
         logger.error(f"Error fetching campaign names: {e}")
         return {}
 
 
+def tag_campaign_context(user_id: str, history: list) -> Optional[str]:
+    """
+    Tag history messages with their campaign name (in place) and return the
+    name of the most recent campaign in the conversation, if any.
+    """
+    campaign_ids = list({
+        msg["campaign_id"] for msg in history
+        if msg.get("campaign_id")
+    })
+    if not campaign_ids:
+        return None
+    campaign_names = get_campaign_names(user_id, campaign_ids)
+    for msg in history:
+        cid = msg.get("campaign_id")
+        if cid and cid in campaign_names:
+            msg["campaign_name"] = campaign_names[cid]
+    latest_campaign_msg = next(
+        (m for m in reversed(history) if m.get("campaign_name")),
+        None
+    )
+    return latest_campaign_msg["campaign_name"] if latest_campaign_msg else None
+
+
+@_guarded(None)
 def get_lead_details(user_id: str, phone: str) -> Optional[dict]:
     """
     Get full lead details including property info, budget, etc.
@@ -384,6 +668,7 @@ def get_lead_details(user_id: str, phone: str) -> Optional[dict]:
     return lead
 
 
+@_guarded(True)
 def is_on_dnc_list(user_id: str, phone: str) -> bool:
     """
     Check if a phone number is on the DNC (Do Not Contact) list.
@@ -404,10 +689,12 @@ def is_on_dnc_list(user_id: str, phone: str) -> bool:
 
         return bool(result.data)
     except Exception as e:
+        _note_db_failure(e)
         logger.error(f"Error checking DNC list: {e}")
         return True  # TCPA compliance: block sending when unsure
 
 
+@_guarded(False, journal=True)
 def remove_from_dnc_list(user_id: str, phone: str) -> bool:
     """
     Remove a phone number from the DNC list (re-opt-in).
@@ -427,10 +714,41 @@ def remove_from_dnc_list(user_id: str, phone: str) -> bool:
         ).like("phone", f"%{digits}").execute()
         return True
     except Exception as e:
+        _note_db_failure(e)
         logger.error(f"Error removing from DNC list: {e}")
         return False
 
 
+@_guarded(None)
+def get_dnc_numbers(user_id: str, since: Optional[str] = None, page_size: int = 1000) -> Optional[list]:
+    """
+    All DNC rows (phone, created_at) for a user, oldest first, paged past the
+    PostgREST row cap. With `since` (ISO timestamp), only rows created at or
+    after it. Returns None on failure so callers can block instead of sending.
+    """
+    client = get_supabase_client()
+    if not client:
+        return None
+
+    try:
+        rows = []
+        while True:
+            query = client.table("dnc_list").select("phone, created_at").eq("user_id", user_id)
+            if since:
+                query = query.gte("created_at", since)
+            # id breaks created_at ties (bulk imports share one timestamp) so pages are stable
+            page = (query.order("created_at").order("id")
+                    .range(len(rows), len(rows) + page_size - 1).execute().data or [])
+            rows.extend(page)
+            if len(page) < page_size:
+                return rows
+    except Exception as e:
+        _note_db_failure(e)
+        logger.error(f"Error loading DNC list: {e}")
+        return None
+
+
+@_guarded(None)
 def get_default_user_id() -> Optional[str]:
     """
     DEPRECATED: Returns first user from profiles table. Only valid for single-user setups.
@@ -452,10 +770,12 @@ def get_default_user_id() -> Optional[str]:
             return result.data[0]["id"]
         return None
     except Exception as e:
+        _note_db_failure(e)
         logger.error(f"Error getting default user: {e}")
         return None
 
 
+@_guarded(None)
 def find_user_by_lead_phone(phone: str) -> Optional[dict]:
     """
     Search leads across ALL users (no user_id filter) to find which agent owns this lead.
@@ -481,10 +801,46 @@ def find_user_by_lead_phone(phone: str) -> Optional[dict]:
             return {"user_id": lead.get("user_id"), "lead": lead}
         return None
     except Exception as e:
+        _note_db_failure(e)
         logger.error(f"Error finding user by lead phone: {e}")
         return None
 
 
+@_guarded(None)
+def get_inbound_routes(since: Optional[str] = None, page_size: int = 1000) -> Optional[list]:
+    """
+    Business-number → tenant routes (inbound_routes table), paged past the
+    PostgREST row cap. With `since` (ISO timestamp), only rows updated after
+    it — including deactivated ones, so callers can drop them. Returns None
+    on failure.
+    """
+    client = get_supabase_client()
+    if not client:
+        return None
+
+    try:
+        rows = []
+        while True:
+            query = client.table("inbound_routes").select(
+                "id, channel, business_number, user_id, active, updated_at"
+            )
+            if since:
+                query = query.gt("updated_at", since)
+            else:
+                query = query.eq("active", True)
+            # id breaks updated_at ties so pages neither overlap nor skip rows
+            page = (query.order("updated_at").order("id")
+                    .range(len(rows), len(rows) + page_size - 1).execute().data or [])
+            rows.extend(page)
+            if len(page) < page_size:
+                return rows
+    except Exception as e:
+        _note_db_failure(e)
+        logger.error(f"Error loading inbound routes: {e}")
+        return None
+
+
+@_guarded(None)
 def get_user_profile(user_id: str) -> Optional[dict]:
     """
     Fetch a user's profile (full_name, company, phone, email).
@@ -503,10 +859,12 @@ def get_user_profile(user_id: str) -> Optional[dict]:
             return result.data[0]
         return None
     except Exception as e:
+        _note_db_failure(e)
         logger.error(f"Error getting user profile: {e}")
         return None
 
 
+@_guarded({"available": True, "conflicts": []})
 def check_meeting_availability(
     user_id: str,
     proposed_date: str,
@@ -563,10 +921,12 @@ def check_meeting_availability(
 
         return {"available": len(conflicts) == 0, "conflicts": conflicts}
     except Exception as e:
+        _note_db_failure(e)
         logger.error(f"Error checking meeting availability: {e}")
         return {"available": True, "conflicts": []}
 
 
+@_guarded(None)
 def get_user_ai_config(user_id: str) -> Optional[dict]:
     """
     Fetch a user's AI script configuration from ai_config table.
@@ -585,10 +945,12 @@ def get_user_ai_config(user_id: str) -> Optional[dict]:
             return result.data[0]
         return None
     except Exception as e:
+        _note_db_failure(e)
         logger.error(f"Error getting user AI config: {e}")
         return None
 
 
+@_guarded(False)
 def record_overage(user_id: str, channel: str, period_start: str, count: int = 1) -> bool:
     """
     Record overage usage for a given channel.
@@ -631,10 +993,12 @@ def record_overage(user_id: str, channel: str, period_start: str, count: int = 1
             }).execute()
         return True
     except Exception as e:
+        _note_db_failure(e)
         logger.error(f"Error recording overage: {e}")
         return False
 
 
+@_guarded(None)
 def get_user_plan_slug(user_id: str) -> Optional[str]:
     """
     Get the plan slug for a user. Returns 'starter', 'pro', 'agency', or None.
@@ -658,10 +1022,12 @@ def get_user_plan_slug(user_id: str) -> Optional[str]:
             return plans.get("slug")
         return None
     except Exception as e:
+        _note_db_failure(e)
         logger.error(f"Error getting user plan slug: {e}")
         return None
 
 
+@_guarded({"allowed": True, "remaining": 999, "limit": -1, "current": 0})
 def check_messaging_quota(user_id: str) -> dict:
     """
     Check if a user has remaining messaging quota.
@@ -718,11 +1084,13 @@ def check_messaging_quota(user_id: str) -> dict:
             "period_start": period_iso,
         }
     except Exception as e:
+        _note_db_failure(e)
         logger.error(f"Error checking messaging quota: {e}")
         # On error, allow (don't block inbound responses)
         return {"allowed": True, "remaining": 999, "limit": -1, "current": 0}
 
 
+@_guarded(False, journal=True)
 def update_message_status(external_id: str, status: str, error_message: Optional[str] = None) -> bool:
     """Update a message's delivery status by its WhatsApp external_id (wamid)."""
     client = get_supabase_client()
@@ -738,5 +1106,26 @@ def update_message_status(external_id: str, status: str, error_message: Optional
         logger.info(f"Message status updated: {external_id} -> {status}")
         return True
     except Exception as e:
+        _note_db_failure(e)
         logger.error(f"Error updating message status for {external_id}: {e}")
         return False
+
+
+# Writes safe to apply twice (upserts, keyed inserts, set-to-value updates).
+# Plain inserts (message logs, meetings) and read-then-increment updates
+# (record_overage) are not journaled: a timeout may hide an applied write,
+# and a replay would duplicate rows or double-bill. log_activity stays: a
+# duplicate activity entry is harmless next to losing it.
+_JOURNALED_WRITES = {
+    fn.__name__: fn
+    for fn in (
+        add_to_dnc_list,
+        log_activity,
+        update_lead_last_response,
+        create_follow_up,
+        cancel_follow_ups_for_leads,
+        complete_follow_ups,
+        remove_from_dnc_list,
+        update_message_status,
+    )
+}
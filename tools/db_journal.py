@@ -0,0 +1,130 @@
+"""
+db_journal.py
+
+Local write-ahead journal for Supabase writes that couldn't be applied
+(circuit open or the write itself failed). Entries are JSON lines naming the
+tools.db function and its arguments; db.replay_journal() re-applies them in
+order (via replay()) once the Supabase breaker closes again.
+
+Env vars:
+- DB_JOURNAL_PATH (default tools/logs/db_journal.jsonl)
+"""
+
+import fcntl
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+DB_JOURNAL_PATH = os.getenv(
+    "DB_JOURNAL_PATH",
+    os.path.join(os.path.dirname(__file__), "logs", "db_journal.jsonl"),
+)
+
+# Returned by a replay writer for an entry that can never apply (rejected)
+DROPPED = object()
+
+
+@contextmanager
+def _locked():
+    """
+    Exclusive lock on a sidecar file (<journal>.lock). Locking the journal
+    itself isn't enough: an append blocked on it while drain() renames the
+    file would then write into the renamed inode after it was read.
+    """
+    os.makedirs(os.path.dirname(DB_JOURNAL_PATH), exist_ok=True)
+    with open(DB_JOURNAL_PATH + ".lock", "a") as lock_f:
+        fcntl.flock(lock_f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_f, fcntl.LOCK_UN)
+
+
+def append(fn_name: str, args: tuple, kwargs: dict, attempts: int = 0) -> None:
+    """Durably append one pending write."""
+    entry = {
+        "ts": time.time(),
+        "fn": fn_name,
+        "args": list(args),
+        "kwargs": kwargs,
+        "attempts": attempts,
+    }
+    with _locked(), open(DB_JOURNAL_PATH, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, default=str) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    logger.info(f"[Journal] Deferred {fn_name} until Supabase recovers")
+
+
+def drain() -> list[dict]:
+    """
+    Atomically take every pending entry out of the journal (oldest first).
+    Entries that fail again should be re-appended by the caller.
+    """
+    if not os.path.exists(DB_JOURNAL_PATH):
+        return []
+
+    replay_path = f"{DB_JOURNAL_PATH}.{os.getpid()}.replay"
+    with _locked():
+        if not os.path.exists(DB_JOURNAL_PATH):
+            return []
+        os.replace(DB_JOURNAL_PATH, replay_path)
+
+    entries = []
+    with open(replay_path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                logger.error(f"[Journal] Dropping corrupt entry: {line[:200]}")
+    os.remove(replay_path)
+    return entries
+
+
+def replay(writers: dict[str, Callable[..., bool]], max_attempts: int) -> int:
+    """
+    Drain the journal and call writers[entry["fn"]](*args, **kwargs) for each
+    entry in order. A write that returns falsy is re-appended, and dropped
+    after max_attempts tries; one that returns DROPPED (can never succeed) is
+    dropped at once. Returns how many were applied.
+    """
+    applied = 0
+    for entry in drain():
+        fn = writers.get(entry.get("fn"))
+        if fn is None:
+            logger.error(f"[Journal] Unknown write {entry.get('fn')} — dropping")
+            continue
+        ok = fn(*entry.get("args", []), **entry.get("kwargs", {}))
+        if ok is DROPPED:
+            logger.error(f"[Journal] {entry['fn']} rejected on replay — dropping: {entry}")
+            continue
+        if ok:
+            applied += 1
+            continue
+        attempts = entry.get("attempts", 0) + 1
+        if attempts >= max_attempts:
+            logger.error(f"[Journal] Giving up on {entry['fn']} after {attempts} attempts: {entry}")
+        else:
+            append(entry["fn"], tuple(entry.get("args", [])), entry.get("kwargs", {}), attempts)
+    if applied:
+        logger.info(f"[Journal] Replayed {applied} deferred Supabase write(s)")
+    return applied
+
+
+def pending_count() -> Optional[int]:
+    """Number of journaled writes waiting for replay (None if unreadable)."""
+    if not os.path.exists(DB_JOURNAL_PATH):
+        return 0
+    try:
+        with open(DB_JOURNAL_PATH, encoding="utf-8") as f:
+            return sum(1 for line in f if line.strip())
+    except OSError:
+        return None
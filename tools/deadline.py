@@ -0,0 +1,259 @@
+"""
+deadline.py
+
+Per-message time budgets and hedged calls for slow dependencies.
+
+- Deadline: end-to-end budget that travels with an inbound message
+- LatencyTracker: rolling latency window used to estimate p95
+- hedged_call(): fires a backup request when the first one is slower than p95.
+  With gated=True the clock (hedge timer and latency sample) starts when the
+  call is admitted by its client's queue (llm_gateway calls mark_admitted()),
+  so a backlog never looks like a slow dependency and never doubles itself
+- hedge_stats(): hedge rate + tail-latency improvement, surfaced in /health
+
+Env vars:
+- MESSAGE_BUDGET_SECONDS (per-message end-to-end budget, default 25)
+- HEDGE_MIN_DELAY_SECONDS (never hedge earlier than this, default 2)
+- HEDGE_POOL_SIZE (worker threads shared by all hedged calls, default 16)
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+MESSAGE_BUDGET_SECONDS = float(os.getenv("MESSAGE_BUDGET_SECONDS", "25"))
+HEDGE_MIN_DELAY_SECONDS = float(os.getenv("HEDGE_MIN_DELAY_SECONDS", "2"))
+HEDGE_POOL_SIZE = int(os.getenv("HEDGE_POOL_SIZE", "16"))
+
+# Don't start a backup request with less than this left on the clock —
+# it can't finish in time and only burns tokens.
+_MIN_USEFUL_BUDGET = 1.0
+
+_executor = ThreadPoolExecutor(max_workers=HEDGE_POOL_SIZE, thread_name_prefix="hedge")
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a message's end-to-end budget runs out."""
+
+
+class Deadline:
+    """Absolute point in time by which a message must be answered."""
+
+    def __init__(self, budget_seconds: float = MESSAGE_BUDGET_SECONDS):
+        self.budget = budget_seconds
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + budget_seconds
+
+    def remaining(self) -> float:
+        """Seconds left in the budget (never negative)."""
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def check(self, stage: str = "") -> None:
+        """Raise DeadlineExceeded if the budget is spent."""
+        if self.expired():
+            raise DeadlineExceeded(f"Budget of {self.budget:.1f}s exhausted{' at ' + stage if stage else ''}")
+
+
+class LatencyTracker:
+    """Thread-safe rolling window of call latencies (seconds)."""
+
+    def __init__(self, window: int = 200, default_p95: float = 8.0):
+        self._samples: deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._default_p95 = default_p95
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct: float) -> float:
+        with self._lock:
+            samples = sorted(self._samples)
+        # Too few samples for a meaningful tail — fall back to a fixed guess
+        if len(samples) < 20:
+            return self._default_p95
+        idx = min(int(len(samples) * pct / 100.0), len(samples) - 1)
+        return samples[idx]
+
+    def p95(self) -> float:
+        return self.percentile(95)
+
+
+class HedgeStats:
+    """Counters for hedged calls: how often we hedge and what it buys us."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.deadline_misses = 0
+        self.saved_seconds_total = 0.0
+
+    def incr(self, field: str, amount: float = 1) -> None:
+        with self._lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            calls = self.calls or 1
+            wins = self.hedge_wins or 1
+            return {
+                "calls": self.calls,
+                "hedged": self.hedged,
+                "hedge_rate": round(self.hedged / calls, 4),
+                "hedge_wins": self.hedge_wins,
+                "deadline_misses": self.deadline_misses,
+                "avg_tail_saved_ms": round(self.saved_seconds_total / wins * 1000) if self.hedge_wins else 0,
+            }
+
+
+# One tracker + stats bucket per dependency name (e.g. "openai")
+_TRACKERS: dict[str, LatencyTracker] = {}
+_STATS: dict[str, HedgeStats] = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+def _get_tracker(name: str) -> LatencyTracker:
+    with _REGISTRY_LOCK:
+        if name not in _TRACKERS:
+            _TRACKERS[name] = LatencyTracker()
+            _STATS[name] = HedgeStats()
+        return _TRACKERS[name]
+
+
+def hedge_stats() -> dict:
+    """Snapshot of hedging metrics for every dependency, keyed by name."""
+    with _REGISTRY_LOCK:
+        names = list(_STATS)
+    return {
+        name: {**_STATS[name].snapshot(), "p95_ms": round(_TRACKERS[name].p95() * 1000)}
+        for name in names
+    }
+
+
+_current = threading.local()
+
+
+class _Attempt:
+    """One try inside hedged_call(); started_at moves to admission for gated calls."""
+
+    __slots__ = ("started_at", "admitted")
+
+    def __init__(self, gated: bool):
+        self.started_at = time.monotonic()
+        self.admitted = threading.Event()
+        if not gated:
+            self.admitted.set()
+
+
+def mark_admitted() -> None:
+    """
+    Called by a queueing client (llm_gateway) once a request is admitted: the
+    running hedged attempt's timer starts now. No-op outside hedged_call().
+    """
+    attempt = getattr(_current, "attempt", None)
+    if attempt is not None and not attempt.admitted.is_set():
+        attempt.started_at = time.monotonic()
+        attempt.admitted.set()
+
+
+def _timed(fn: Callable[[float], T], timeout: float, attempt: _Attempt) -> tuple[T, float]:
+    _current.attempt = attempt
+    try:
+        result = fn(timeout)
+    finally:
+        _current.attempt = None
+        attempt.admitted.set()  # never admitted (cache hit, error): release the waiter
+    return result, time.monotonic() - attempt.started_at
+
+
+def hedged_call(
+    fn: Callable[[float], T],
+    deadline: Deadline,
+    name: str = "openai",
+    gated: bool = False,
+) -> T:
+    """
+    Run fn(timeout) under the deadline, hedging once if it's slower than p95.
+
+    fn receives the per-attempt timeout in seconds and should pass it down to
+    the client it calls. The first attempt to succeed wins; a losing attempt
+    is left to finish in the background (its latency still feeds the tracker).
+    gated=True: fn waits in a client-side queue and calls mark_admitted() when
+    it leaves it; the p95 wait starts there, not at submission.
+    Raises DeadlineExceeded if neither attempt finishes within the budget.
+    """
+    tracker = _get_tracker(name)
+    stats = _STATS[name]
+    stats.incr("calls")
+
+    deadline.check(f"{name} call")
+
+    first = _Attempt(gated)
+    primary = _executor.submit(_timed, fn, deadline.remaining(), first)
+    attempts: list[Future] = [primary]
+    hedged = False
+
+    hedge_delay = max(tracker.p95(), HEDGE_MIN_DELAY_SECONDS)
+    # Queue wait isn't the dependency being slow: time the primary from admission
+    first.admitted.wait(deadline.remaining())
+    since_start = time.monotonic() - first.started_at
+    done, _ = wait([primary], timeout=min(max(hedge_delay - since_start, 0.0), deadline.remaining()))
+
+    if not done and deadline.remaining() > _MIN_USEFUL_BUDGET:
+        stats.incr("hedged")
+        hedged = True
+        logger.info(f"[Hedge] {name} slower than p95 ({hedge_delay:.1f}s) — firing backup request")
+        attempts.append(_executor.submit(_timed, fn, deadline.remaining(), _Attempt(gated)))
+
+    last_error: Optional[BaseException] = None
+    pending = set(attempts)
+    while pending:
+        done, pending = wait(pending, timeout=deadline.remaining(), return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for fut in done:
+            if fut.exception() is not None:
+                last_error = fut.exception()
+                continue
+            result, latency = fut.result()
+            tracker.record(latency)
+            if fut is not primary and hedged:
+                stats.incr("hedge_wins")
+                win_latency = time.monotonic() - first.started_at
+                _record_saving_when_done(primary, win_latency, stats, tracker)
+            return result
+
+    if last_error is not None and not pending:
+        raise last_error
+
+    stats.incr("deadline_misses")
+    raise DeadlineExceeded(f"{name} did not answer within {deadline.budget:.1f}s budget")
+
+
+def _record_saving_when_done(primary: Future, win_latency: float, stats: HedgeStats, tracker: LatencyTracker) -> None:
+    """Once the slow primary finishes, credit the time the hedge saved us."""
+
+    def _on_done(fut: Future) -> None:
+        if fut.exception() is not None:
+            return
+        _, primary_latency = fut.result()
+        tracker.record(primary_latency)
+        stats.incr("saved_seconds_total", max(primary_latency - win_latency, 0.0))
+
+    primary.add_done_callback(_on_done)
@@ -0,0 +1,369 @@
+"""
+dnc_cache.py
+
+Per-tenant in-memory DNC membership, so a DNC check is a set lookup instead
+of a LIKE query against dnc_list on every message (and on every lead of a
+bulk send).
+
+- keyed by the last 10 digits of the number, so "+1 555-123-4567" and
+  "5551234567" hit the same entry (the LIKE '%digits' match it replaces)
+- loaded lazily, the first time a tenant is checked, then kept current by
+  write-through (add/remove go through this module) and a delta sync of rows
+  created since the last sync, pulled when a lookup finds the tenant older
+  than DNC_SYNC_SECONDS. The delta window reaches DNC_SYNC_OVERLAP_SECONDS
+  back past the newest created_at seen: created_at is stamped at insert, not
+  commit, so a slow transaction can commit a row older than one already seen
+- deletions made outside this process can't be seen in a delta; a full
+  reload every DNC_FULL_RELOAD_SECONDS picks them up (in the background,
+  the current data keeps serving meanwhile)
+- the load/sync query runs outside the tenant's lock: other lookups answer
+  from the current data meanwhile (only a tenant's first load is waited
+  on), and a number removed while a query is in flight stays removed
+- lists with at least DNC_BLOOM_THRESHOLD numbers are held as a Bloom filter:
+  a false positive blocks a send, never allows one
+
+Conservative like is_on_dnc_list: when a tenant can't be loaded or synced,
+or the number is too short to key safely, the check falls through to the
+direct query, which itself blocks when the database is unreachable.
+
+Env vars:
+- DNC_SYNC_SECONDS (max age before a lookup pulls new rows, default 30)
+- DNC_SYNC_OVERLAP_SECONDS (delta window overlap for late commits, default 120)
+- DNC_FULL_RELOAD_SECONDS (full reload interval, default 3600)
+- DNC_BLOOM_THRESHOLD (list size held as a Bloom filter, default 200000; 0 = never)
+- DNC_BLOOM_ERROR_RATE (Bloom false-positive rate, default 0.001)
+"""
+
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    from tools.db import add_to_dnc_list, get_dnc_numbers, is_on_dnc_list, remove_from_dnc_list
+    SUPABASE_AVAILABLE = True
+except ImportError:
+    SUPABASE_AVAILABLE = False
+
+DNC_SYNC_SECONDS = float(os.getenv("DNC_SYNC_SECONDS", "30"))
+DNC_SYNC_OVERLAP_SECONDS = float(os.getenv("DNC_SYNC_OVERLAP_SECONDS", "120"))
+DNC_FULL_RELOAD_SECONDS = float(os.getenv("DNC_FULL_RELOAD_SECONDS", "3600"))
+DNC_BLOOM_THRESHOLD = int(os.getenv("DNC_BLOOM_THRESHOLD", "200000"))
+DNC_BLOOM_ERROR_RATE = float(os.getenv("DNC_BLOOM_ERROR_RATE", "0.001"))
+
+KEY_DIGITS = 10
+
+
+def dnc_key(phone: str) -> Optional[str]:
+    """Last 10 digits of the number, or None if it has fewer (too ambiguous to key)."""
+    digits = "".join(c for c in (phone or "") if c.isdigit())
+    if len(digits) < KEY_DIGITS:
+        return None
+    return digits[-KEY_DIGITS:]
+
+
+def _delta_since(synced_to: Optional[str]) -> Optional[str]:
+    """Start of the next delta window: the newest created_at seen minus the overlap."""
+    if not synced_to:
+        return synced_to
+    try:
+        start = datetime.fromisoformat(synced_to.replace("Z", "+00:00"))
+    except ValueError:
+        return synced_to
+    return (start - timedelta(seconds=DNC_SYNC_OVERLAP_SECONDS)).isoformat()
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings (double hashing on one blake2b digest)."""
+
+    def __init__(self, capacity: int, error_rate: float = DNC_BLOOM_ERROR_RATE):
+        capacity = max(1, capacity)
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, key: str) -> None:
+        for pos in self._positions(key):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class _TenantDnc:
+    """One tenant's numbers: a set, or a Bloom filter plus the keys removed since it was built."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # One load/sync query per tenant at a time; taken without `lock`, so
+        # lookups and write-through updates don't wait on the database
+        self.sync_lock = threading.Lock()
+        self.members: Optional[set] = None
+        self.bloom: Optional[BloomFilter] = None
+        self.removed: set = set()
+        self.local_adds: dict[str, float] = {}  # write-through adds, replayed over a reload
+        self.local_removes: dict[str, float] = {}  # write-through removes, kept out of an in-flight query's rows
+        self.synced_to: Optional[str] = None    # max created_at seen
+        self.checked_at = 0.0
+        self.loaded_at = 0.0
+        self.reloading = False
+        self.size = 0
+
+    @property
+    def loaded(self) -> bool:
+        return self.members is not None or self.bloom is not None
+
+    def build(self, rows: list, started: float) -> None:
+        """
+        Replace the data with a full load that began at `started` (lock held).
+        Write-through adds from the last reload interval are re-applied: they
+        may have landed after the load's snapshot, or still sit in the journal.
+        """
+        keys = {key for key in (dnc_key(row.get("phone")) for row in rows) if key}
+        keys -= self._removed_since(started)
+        self.local_adds = {k: t for k, t in self.local_adds.items() if t >= started - DNC_FULL_RELOAD_SECONDS}
+        keys.update(self.local_adds)
+        if DNC_BLOOM_THRESHOLD and len(keys) >= DNC_BLOOM_THRESHOLD:
+            self.bloom = BloomFilter(int(len(keys) * 1.25))
+            for key in keys:
+                self.bloom.add(key)
+            self.members = None
+        else:
+            self.members, self.bloom = keys, None
+        self.removed = set()
+        self.size = len(keys)
+        self.synced_to = max((row.get("created_at") or "" for row in rows), default=None) or None
+
+    def apply_delta(self, rows: list, started: float) -> None:
+        """Merge rows from a delta query that began at `started` (lock held)."""
+        # Rows re-read from the overlap are already members; add() skips them
+        removed = self._removed_since(started)
+        for row in rows:
+            key = dnc_key(row.get("phone"))
+            if key and key not in removed:
+                self.add(key)
+            created = row.get("created_at")
+            if created and (self.synced_to is None or created > self.synced_to):
+                self.synced_to = created
+
+    def _removed_since(self, started: float) -> set:
+        """
+        Keys removed after a query began: its rows may predate the delete. Older
+        removes were committed before the query ran, so they're dropped here.
+        """
+        self.local_removes = {k: t for k, t in self.local_removes.items() if t >= started}
+        return set(self.local_removes)
+
+    def add(self, key: str) -> None:
+        if key in self:
+            return
+        self.removed.discard(key)
+        if self.bloom is not None:
+            self.bloom.add(key)
+        elif self.members is not None:
+            self.members.add(key)
+        self.size += 1
+
+    def discard(self, key: str) -> None:
+        if self.bloom is not None:
+            self.removed.add(key)
+        elif self.members is not None:
+            self.members.discard(key)
+
+    def __contains__(self, key: str) -> bool:
+        if key in self.removed:
+            return False
+        if self.bloom is not None:
+            return key in self.bloom
+        return self.members is not None and key in self.members
+
+
+class DncCache:
+    def __init__(self, loader: Callable[..., Optional[list]], fallback: Callable[[str, str], bool]):
+        self._loader = loader
+        self._fallback = fallback
+        self._tenants: dict[str, _TenantDnc] = {}
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.blocked = 0
+        self.fallbacks = 0
+        self.full_loads = 0
+        self.delta_syncs = 0
+        self.sync_failures = 0
+
+    def _tenant(self, user_id: str) -> _TenantDnc:
+        with self._lock:
+            tenant = self._tenants.get(user_id)
+            if tenant is None:
+                tenant = self._tenants[user_id] = _TenantDnc()
+            return tenant
+
+    def _count(self, field: str) -> None:
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def _sync(self, user_id: str, tenant: _TenantDnc) -> bool:
+        """
+        Bring the tenant up to date if it's stale. False if it can't be trusted.
+        While a loaded tenant is already being synced or reloaded, lookups answer
+        from the current data instead of queueing behind the query.
+        """
+        with tenant.lock:
+            loaded = tenant.loaded
+            if loaded:
+                now = time.monotonic()
+                if now - tenant.loaded_at >= DNC_FULL_RELOAD_SECONDS and not tenant.reloading:
+                    tenant.reloading = True
+                    threading.Thread(target=self._reload, args=(user_id, tenant), name="dnc-reload", daemon=True).start()
+                if now - tenant.checked_at < DNC_SYNC_SECONDS:
+                    return True
+        if not tenant.sync_lock.acquire(blocking=not loaded):
+            return True
+        try:
+            return self._fetch(user_id, tenant)
+        finally:
+            tenant.sync_lock.release()
+
+    def _fetch(self, user_id: str, tenant: _TenantDnc) -> bool:
+        """Full load or delta sync (sync_lock held). The query runs outside tenant.lock."""
+        with tenant.lock:
+            started = time.monotonic()
+            if tenant.loaded and started - tenant.checked_at < DNC_SYNC_SECONDS:
+                return True  # another lookup synced it while this one waited
+            full = not tenant.loaded
+            since = None if full else _delta_since(tenant.synced_to)
+        rows = self._loader(user_id) if full else self._loader(user_id, since)
+        if rows is None:
+            self._count("sync_failures")
+            return False
+
+        with tenant.lock:
+            if full:
+                tenant.build(rows, started)
+                tenant.loaded_at = started
+            else:
+                tenant.apply_delta(rows, started)
+            tenant.checked_at = started
+            size, bloom = tenant.size, tenant.bloom is not None
+        if full:
+            self._count("full_loads")
+            logger.info(f"[DNC] Loaded {size} number(s) for user {user_id}{' (bloom)' if bloom else ''}")
+        else:
+            self._count("delta_syncs")
+        return True
+
+    def _reload(self, user_id: str, tenant: _TenantDnc) -> None:
+        """Full reload off the request path; picks up removals made by other processes."""
+        try:
+            with tenant.sync_lock:
+                started = time.monotonic()
+                rows = self._loader(user_id)
+                if rows is None:
+                    self._count("sync_failures")
+                    return
+                with tenant.lock:
+                    tenant.build(rows, started)
+                    tenant.loaded_at = tenant.checked_at = started
+            self._count("full_loads")
+        except Exception as e:
+            logger.error(f"[DNC] Reload failed for user {user_id}: {e}")
+        finally:
+            tenant.reloading = False
+
+    def is_blocked(self, user_id: str, phone: str) -> bool:
+        """True if the number must not be contacted. Same contract as is_on_dnc_list."""
+        key = dnc_key(phone)
+        if not key:
+            self._count("fallbacks")
+            return self._fallback(user_id, phone)
+        tenant = self._tenant(user_id)
+        blocked = None
+        if self._sync(user_id, tenant):
+            with tenant.lock:
+                blocked = key in tenant
+        if blocked is None:
+            self._count("fallbacks")
+            return self._fallback(user_id, phone)
+        with self._lock:
+            self.lookups += 1
+            self.blocked += int(blocked)
+        return blocked
+
+    def blocked_among(self, user_id: str, phones: Iterable[str]) -> set:
+        """The subset of `phones` that must not be contacted (one sync for the whole batch)."""
+        return {phone for phone in phones if self.is_blocked(user_id, phone)}
+
+    def note_added(self, user_id: str, phone: str) -> None:
+        key = dnc_key(phone)
+        if not key:
+            return
+        tenant = self._tenant(user_id)
+        with tenant.lock:
+            tenant.local_adds[key] = time.monotonic()
+            if tenant.loaded:
+                tenant.add(key)
+
+    def note_removed(self, user_id: str, phone: str) -> None:
+        key = dnc_key(phone)
+        if not key:
+            return
+        tenant = self._tenant(user_id)
+        with tenant.lock:
+            tenant.local_adds.pop(key, None)
+            tenant.local_removes[key] = time.monotonic()
+            tenant.discard(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            tenants = list(self._tenants.values())
+            out = {
+                "lookups": self.lookups,
+                "blocked": self.blocked,
+                "fallbacks": self.fallbacks,
+                "full_loads": self.full_loads,
+                "delta_syncs": self.delta_syncs,
+                "sync_failures": self.sync_failures,
+            }
+        out["tenants"] = sum(t.loaded for t in tenants)
+        out["numbers"] = sum(t.size for t in tenants if t.loaded)
+        out["bloom_tenants"] = sum(t.bloom is not None for t in tenants)
+        return out
+
+
+CACHE = DncCache(
+    get_dnc_numbers if SUPABASE_AVAILABLE else (lambda user_id, since=None: None),
+    is_on_dnc_list if SUPABASE_AVAILABLE else (lambda user_id, phone: False),
+)
+
+
+def is_blocked(user_id: str, phone: str) -> bool:
+    return CACHE.is_blocked(user_id, phone)
+
+
+def add(user_id: str, phone: str, reason: str = "STOP keyword") -> bool:
+    """add_to_dnc_list, written through. The cache blocks the number even if the write is journaled."""
+    CACHE.note_added(user_id, phone)
+    return add_to_dnc_list(user_id, phone, reason)
+
+
+def remove(user_id: str, phone: str) -> bool:
+    """remove_from_dnc_list, written through. The cache only unblocks once the delete succeeded."""
+    removed = remove_from_dnc_list(user_id, phone)
+    if removed:
+        CACHE.note_removed(user_id, phone)
+    return removed
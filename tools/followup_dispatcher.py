@@ -0,0 +1,364 @@
+"""
+followup_dispatcher.py
+
+Worker that drains due follow-ups from the follow_ups table and sends them
+over WhatsApp / SMS. Safe to run as several processes: rows are claimed with
+FOR UPDATE SKIP LOCKED (claim_due_follow_ups RPC, migration
+20260418_follow_up_claims.sql), so no two workers ever hold the same row.
+
+- claim: batches of DISPATCH_BATCH_SIZE due rows (status pending, scheduled_at
+  reached, approval_status approved/auto_approved, quiet_hours_deferred_to
+  passed), each under a DISPATCH_LEASE_SECONDS lease. Rows of a worker that
+  dies return to pending when the lease runs out.
+- send: DISPATCH_WORKERS parallel senders over one pooled keep-alive HTTP
+  session. WhatsApp falls back from plain text to the utility template, then
+  the marketing template, like /api/cron/send-followups.
+- checks: tenant DNC (dnc_cache) and, for SMS, the National DNC registry
+  when one is installed (national_dnc) — a listed number is cancelled. Just
+  before sending, the claim itself is re-checked: a reply or STOP cancels
+  claimed rows too, and a withdrawn row is skipped (if the check fails the
+  row is left to the lease rather than sent unchecked)
+- a row whose lease is about to run out is not sent; it goes back to pending
+- results: one complete_follow_ups call per batch (fenced on the claim, so a
+  late write after the lease moved on is a no-op), one bulk insert each for
+  messages and activity_logs, overage recorded once per tenant
+- any error sending one row (not just HTTP errors) marks that row failed; an
+  error in a whole batch is logged and the worker carries on
+
+Delivery is at-least-once. If complete_follow_ups still fails after
+COMPLETE_RETRIES tries within the lease, the sent rows stay in 'sending' and
+go back to pending when the lease lapses, so they are sent again (the failed
+write is journaled, but its replay is a no-op once the claim has moved on).
+The retries cover a blip; a Supabase outage longer than the lease can
+duplicate at most one batch per worker.
+
+Don't point /api/cron/send-followups at the same rows: it claims without locks.
+
+Usage:
+    python tools/followup_dispatcher.py            # run until interrupted
+    python tools/followup_dispatcher.py --once     # drain what's due now, then exit
+
+Env vars:
+- DISPATCH_BATCH_SIZE (rows claimed per batch, default 100)
+- DISPATCH_WORKERS (parallel senders, default 8)
+- DISPATCH_LEASE_SECONDS (claim lease, default 300)
+- DISPATCH_POLL_SECONDS (sleep when nothing is due, default 15)
+- WHATSAPP_ACCESS_TOKEN / WHATSAPP_PHONE_NUMBER_ID / WHATSAPP_TEMPLATE_NAME
+- TWILIO_ACCOUNT_SID / TWILIO_AUTH_TOKEN / TWILIO_PHONE_NUMBER
+"""
+
+import argparse
+import logging
+import os
+import re
+import signal
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from tools import dnc_cache, national_dnc
+
+logger = logging.getLogger(__name__)
+
+try:
+    from tools.db import (
+        check_messaging_quota,
+        claim_due_follow_ups,
+        complete_follow_ups,
+        follow_up_claim_held,
+        log_follow_up_sends,
+        record_overage,
+    )
+    SUPABASE_AVAILABLE = True
+except ImportError:
+    SUPABASE_AVAILABLE = False
+
+DISPATCH_BATCH_SIZE = int(os.getenv("DISPATCH_BATCH_SIZE", "100"))
+DISPATCH_WORKERS = int(os.getenv("DISPATCH_WORKERS", "8"))
+DISPATCH_LEASE_SECONDS = int(os.getenv("DISPATCH_LEASE_SECONDS", "300"))
+DISPATCH_POLL_SECONDS = float(os.getenv("DISPATCH_POLL_SECONDS", "15"))
+
+WHATSAPP_ACCESS_TOKEN = os.getenv("WHATSAPP_ACCESS_TOKEN", "")
+WHATSAPP_PHONE_NUMBER_ID = os.getenv("WHATSAPP_PHONE_NUMBER_ID", "")
+WHATSAPP_TEMPLATE_NAME = os.getenv("WHATSAPP_TEMPLATE_NAME", "realestate_outreach")
+TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID", "")
+TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN", "")
+TWILIO_PHONE_NUMBER = os.getenv("TWILIO_PHONE_NUMBER", "")
+
+CHANNELS = ["whatsapp", "sms"]
+# Tries at writing a batch's results before its rows are left to the lease
+COMPLETE_RETRIES = 3
+
+
+class Transports:
+    """WhatsApp Cloud API + Twilio over one pooled HTTP session shared by the senders."""
+
+    def __init__(self, pool_size: int = DISPATCH_WORKERS):
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=pool_size))
+
+    def _whatsapp_post(self, payload: dict) -> dict:
+        resp = self.session.post(
+            f"https://graph.facebook.com/v21.0/{WHATSAPP_PHONE_NUMBER_ID}/messages",
+            headers={"Authorization": f"Bearer {WHATSAPP_ACCESS_TOKEN}"},
+            json=payload,
+            timeout=10,
+        )
+        if not resp.ok:
+            return {"ok": False, "error": f"{resp.status_code} {resp.text[:200]}"}
+        messages = resp.json().get("messages") or [{}]
+        return {"ok": True, "external_id": messages[0].get("id")}
+
+    def whatsapp(self, to_number: str, body: str, agent_name: str) -> dict:
+        """Plain text (inside the 24h window), then utility template, then marketing template."""
+        if not WHATSAPP_ACCESS_TOKEN or not WHATSAPP_PHONE_NUMBER_ID:
+            return {"ok": True, "demo": True}
+        digits = re.sub(r"\D", "", to_number)
+        to = f"1{digits}" if len(digits) == 10 else digits
+        result = self._whatsapp_post({"messaging_product": "whatsapp", "to": to, "type": "text", "text": {"body": body}})
+        for name, params in (("property_inquiry", [body, agent_name]), (WHATSAPP_TEMPLATE_NAME, [body])):
+            if result["ok"]:
+                break
+            result = self._whatsapp_post({
+                "messaging_product": "whatsapp",
+                "to": to,
+                "type": "template",
+                "template": {
+                    "name": name,
+                    "language": {"code": "en"},
+                    "components": [{"type": "body", "parameters": [{"type": "text", "text": p} for p in params]}],
+                },
+            })
+        return result
+
+    def sms(self, to_number: str, body: str) -> dict:
+        if not TWILIO_ACCOUNT_SID or not TWILIO_AUTH_TOKEN or not TWILIO_PHONE_NUMBER:
+            return {"ok": True, "demo": True}
+        resp = self.session.post(
+            f"https://api.twilio.com/2010-04-01/Accounts/{TWILIO_ACCOUNT_SID}/Messages.json",
+            data={"To": to_number if to_number.startswith("+") else f"+{to_number}",
+                  "From": TWILIO_PHONE_NUMBER, "Body": body},
+            auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN),
+            timeout=10,
+        )
+        if not resp.ok:
+            return {"ok": False, "error": f"{resp.status_code} {resp.text[:200]}"}
+        return {"ok": True, "external_id": resp.json().get("sid")}
+
+
+def _on_national_dnc(phone: str) -> bool:
+    """National registry check for SMS. Without an installed registry this is skipped, as in the Next.js cron."""
+    registry = national_dnc.registry()
+    return registry is not None and phone in registry
+
+
+class Dispatcher:
+    def __init__(
+        self,
+        worker_id: Optional[str] = None,
+        batch_size: int = DISPATCH_BATCH_SIZE,
+        workers: int = DISPATCH_WORKERS,
+        lease_seconds: int = DISPATCH_LEASE_SECONDS,
+        claim: Optional[Callable] = None,
+        complete: Optional[Callable] = None,
+        log_sends: Optional[Callable] = None,
+        claim_held: Optional[Callable] = None,
+        transports: Optional[Transports] = None,
+        is_blocked: Callable[[str, str], bool] = dnc_cache.is_blocked,
+        on_national_dnc: Callable[[str], bool] = _on_national_dnc,
+    ):
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        # Stop sending this long before the lease ends, so a slow send can't outlive the claim
+        self.lease_margin = min(30.0, lease_seconds / 10)
+        self._claim = claim or (claim_due_follow_ups if SUPABASE_AVAILABLE else (lambda *a: None))
+        self._complete = complete or (complete_follow_ups if SUPABASE_AVAILABLE else (lambda *a: False))
+        self._log_sends = log_sends or (log_follow_up_sends if SUPABASE_AVAILABLE else (lambda *a: False))
+        self._claim_held = claim_held or (follow_up_claim_held if SUPABASE_AVAILABLE else (lambda *a: True))
+        self.transports = transports or Transports(workers)
+        self._is_blocked = is_blocked
+        self._on_national_dnc = on_national_dnc
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dispatch")
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.counts = {"batches": 0, "claimed": 0, "sent": 0, "failed": 0, "cancelled": 0, "lease_expired": 0,
+                       "withdrawn": 0, "unrecorded": 0}
+
+    def _send_one(self, row: dict, lease_deadline: float) -> Optional[dict]:
+        """
+        Send one claimed row. Returns its result record, {"status": "withdrawn"}
+        if the row was cancelled since the claim, or None to let the lease lapse.
+        """
+        if time.monotonic() >= lease_deadline:
+            return None
+        phone, channel = row.get("lead_phone") or "", row.get("channel") or "whatsapp"
+        try:
+            if self._is_blocked(row["user_id"], phone) or (channel == "sms" and self._on_national_dnc(phone)):
+                return {"id": row["id"], "status": "cancelled", "sent_at": None, "error_message": "on DNC list"}
+            # A reply or STOP since the claim cancels the row in the table
+            held = self._claim_held(row["id"], self.worker_id)
+            if held is None:
+                return None
+            if not held:
+                return {"id": row["id"], "status": "withdrawn"}
+            if channel == "sms":
+                result = self.transports.sms(phone, row["message_text"])
+            else:
+                result = self.transports.whatsapp(phone, row["message_text"], row.get("agent_name") or "Your Real Estate Agent")
+        except Exception as e:
+            # One bad row must not sink the batch (and leave its sent rows to be re-sent)
+            if not isinstance(e, requests.RequestException):
+                logger.error(f"[Dispatch] Follow-up {row.get('id')} failed: {e!r}")
+            result = {"ok": False, "error": str(e) or type(e).__name__}
+        return {
+            "id": row["id"],
+            "status": "sent" if result.get("ok") else "failed",
+            "sent_at": datetime.now(timezone.utc).isoformat() if result.get("ok") else None,
+            "error_message": result.get("error"),
+            "external_id": result.get("external_id"),
+        }
+
+    def _complete_within_lease(self, results: list, lease_end: float) -> bool:
+        """complete_follow_ups with a few retries, while the claim is still ours."""
+        for attempt in range(1, COMPLETE_RETRIES + 1):
+            if self._complete(self.worker_id, results):
+                return True
+            if attempt == COMPLETE_RETRIES or time.monotonic() + attempt >= lease_end:
+                break
+            time.sleep(attempt)
+        logger.error(f"[Dispatch] {self.worker_id}: could not record {len(results)} result(s); those rows "
+                     f"will be sent again after the lease lapses: {', '.join(str(r['id']) for r in results)}")
+        return False
+
+    def run_batch(self) -> Optional[int]:
+        """Claim, send and record one batch. Returns rows claimed (None if the claim failed)."""
+        claimed_at = time.monotonic()
+        rows = self._claim(self.worker_id, self.batch_size, self.lease_seconds, CHANNELS)
+        if rows is None:
+            return None
+        if not rows:
+            return 0
+        lease_deadline = claimed_at + self.lease_seconds - self.lease_margin
+        outcomes = list(self._pool.map(lambda row: self._send_one(row, lease_deadline), rows))
+
+        results, messages, activities = [], [], []
+        sent_by_tenant: dict[str, dict[str, int]] = {}
+        for row, outcome in zip(rows, outcomes):
+            if outcome is None:
+                self._count("lease_expired")
+                continue
+            if outcome["status"] == "withdrawn":
+                # Nothing to record: the row is no longer ours
+                self._count("withdrawn")
+                continue
+            self._count(outcome["status"])
+            results.append({k: outcome[k] for k in ("id", "status", "sent_at", "error_message")})
+            if outcome["status"] == "cancelled":
+                continue
+            sent = outcome["status"] == "sent"
+            if sent:
+                by_channel = sent_by_tenant.setdefault(row["user_id"], {})
+                by_channel[row["channel"]] = by_channel.get(row["channel"], 0) + 1
+                messages.append({
+                    "user_id": row["user_id"], "lead_id": row["lead_id"], "direction": "outbound",
+                    "channel": row["channel"], "to_number": row["lead_phone"], "body": row["message_text"],
+                    "status": "sent", "external_id": outcome.get("external_id"),
+                })
+            activities.append({
+                "user_id": row["user_id"],
+                "event_type": "follow_up_sent",
+                "description": f"Follow-up {outcome['status']} via {row['channel']}"
+                               + (f": {outcome['error_message']}" if outcome.get("error_message") else ""),
+                "status": "success" if sent else "failed",
+                "metadata": {"follow_up_id": row["id"], "lead_id": row["lead_id"], "channel": row["channel"],
+                             "kind": row.get("kind"), "worker": self.worker_id},
+            })
+
+        if results and not self._complete_within_lease(results, claimed_at + self.lease_seconds):
+            self._count("unrecorded", len(results))
+        if messages or activities:
+            self._log_sends(messages, activities)
+        self._record_overages(sent_by_tenant)
+        self._count("batches")
+        self._count("claimed", len(rows))
+        withdrawn = sum(1 for outcome in outcomes if outcome and outcome["status"] == "withdrawn")
+        logger.info(f"[Dispatch] {self.worker_id}: {len(rows)} claimed, {len(messages)} sent, "
+                    f"{len(results) - len(activities)} cancelled, {withdrawn} withdrawn, "
+                    f"{len(rows) - len(results) - withdrawn} left to lease expiry")
+        return len(rows)
+
+    def _record_overages(self, sent_by_tenant: dict) -> None:
+        """One quota read and at most one overage write per tenant and channel."""
+        if not SUPABASE_AVAILABLE:
+            return
+        for user_id, by_channel in sent_by_tenant.items():
+            quota = check_messaging_quota(user_id)
+            limit = quota.get("limit", 0)
+            if limit <= 0 or not quota.get("period_start"):
+                continue
+            running = quota.get("current", 0)
+            for channel, count in by_channel.items():
+                over = max(0, running + count - limit) - max(0, running - limit)
+                running += count
+                if over:
+                    record_overage(user_id, channel, quota["period_start"], count=over)
+
+    def _count(self, key: str, n: int = 1) -> None:
+        with self._lock:
+            self.counts[key] += n
+
+    def run(self, once: bool = False, poll_seconds: float = DISPATCH_POLL_SECONDS) -> None:
+        """Claim batches back to back while work is due; sleep poll_seconds when idle."""
+        logger.info(f"[Dispatch] Worker {self.worker_id} started")
+        while not self._stop.is_set():
+            try:
+                claimed = self.run_batch()
+            except Exception as e:
+                logger.error(f"[Dispatch] {self.worker_id}: batch failed: {e!r}")
+                claimed = None
+            if claimed is not None and claimed >= self.batch_size:
+                continue
+            if once:
+                break
+            self._stop.wait(poll_seconds)
+        self._pool.shutdown(wait=True)
+        logger.info(f"[Dispatch] Worker {self.worker_id} stopped: {self.stats()}")
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send due follow-ups from the follow_ups table.")
+    parser.add_argument("--once", action="store_true", help="Drain what is due now, then exit")
+    parser.add_argument("--batch-size", type=int, default=DISPATCH_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=DISPATCH_WORKERS, help="Parallel senders")
+    parser.add_argument("--lease-seconds", type=int, default=DISPATCH_LEASE_SECONDS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if not SUPABASE_AVAILABLE:
+        parser.error("Supabase client not installed")
+
+    dispatcher = Dispatcher(batch_size=args.batch_size, workers=args.workers, lease_seconds=args.lease_seconds)
+    signal.signal(signal.SIGTERM, lambda *_: dispatcher.stop())
+    try:
+        dispatcher.run(once=args.once)
+    except KeyboardInterrupt:
+        dispatcher.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,37 +1,66 @@
 """
-LEGACY: CSV-based follow-up scheduler reading from leads_state.csv.
+LEGACY: follow-up scheduler for the CSV lead list (leads_state.csv).
 Replaced by Supabase follow_ups table + /api/cron/send-followups cron.
 Owner: engineering-ops agent
+
+State lives in SQLite (leads_state.sqlite3), indexed on the next follow-up
+time, so a run reads only the leads that are due and each stage transition
+is a one-row UPDATE instead of a rewrite of the whole CSV. leads_state.csv
+is imported on first use and merged in again whenever it changes (or with
+--import): leads are matched by phone, contact details come from the CSV and
+the follow-up progress (stage, last_outbound_at, next due time) stays as the
+store has it. It can be written back with --export.
+
+- run_scheduler(): one pass over everything due now
+- --watch: long-running; keeps the upcoming follow-ups in a min-heap and
+  sleeps until the earliest one is due (re-reading the index at least every
+  --max-sleep seconds to pick up leads added by other processes)
+
+Usage:
+    python tools/followup_scheduler.py [--import] [--export] [--watch] [--max-sleep 300]
 """
+import argparse
 import csv
+import heapq
 import os
+import sqlite3
+import time
+from collections import defaultdict
 from datetime import datetime, timedelta, timezone
 
 LEADS_STATE_FILE = "leads_state.csv"
+LEADS_DB_FILE = "leads_state.sqlite3"
 
+FIELDS = [
+    "phone", "name", "address", "source", "agent_id",
+    "stage", "status", "last_outbound_at", "next_followup_at", "notes",
+]
+# A failed send is retried after this long rather than immediately
+RETRY_SECONDS = 300
+# Upcoming follow-ups held in the heap at once
+HEAP_WINDOW = 1000
 
-def load_leads():
-    leads = []
-    if not os.path.exists(LEADS_STATE_FILE):
-        return leads
 
-    with open(LEADS_STATE_FILE, newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            leads.append(row)
-    return leads
+def load_leads(path=LEADS_STATE_FILE):
+    """Stream leads_state.csv rows (dicts)."""
+    if not os.path.exists(path):
+        return
+    with open(path, newline="", encoding="utf-8") as f:
+        yield from csv.DictReader(f)
 
 
-def save_leads(leads):
-    if not leads:
-        return
-    fieldnames = list(leads[0].keys())
-    with open(LEADS_STATE_FILE, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
+def save_leads(leads, path=LEADS_STATE_FILE):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS, extrasaction="ignore")
         writer.writeheader()
         writer.writerows(leads)
 
 
+def _csv_signature(path):
+    st = os.stat(path)
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
 def parse_iso(dt_str):
     if not dt_str:
         return None
@@ -87,59 +116,224 @@ def send_sms(to_number, body):
     return "demo: whatsapp stub"
 
 
-def run_scheduler():
-    now = datetime.now(timezone.utc)
-    leads = load_leads()
-    updated = False
+class LeadStore:
+    """
+    Lead follow-up state in SQLite. next_due holds the next follow-up as a
+    UTC epoch (NULL = nothing scheduled) and is indexed for active leads.
+    """
 
-    for lead in leads:
-        status = lead.get("status", "active")
-        if status != "active":
-            continue
+    def __init__(self, path=LEADS_DB_FILE):
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS leads (
+                id INTEGER PRIMARY KEY,
+                phone TEXT, name TEXT, address TEXT, source TEXT, agent_id TEXT,
+                stage TEXT, status TEXT, last_outbound_at TEXT, notes TEXT,
+                next_due REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_leads_next_due ON leads (next_due) WHERE status = 'active';
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        """)
 
-        stage = lead.get("stage", "new")
-        next_followup_str = lead.get("next_followup_at", "")
-        next_followup = parse_iso(next_followup_str)
+    def _meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
 
-        # if no follow-up date set and stage is new, schedule the first
-        if next_followup is None and stage == "new":
-            # treat as ready to send the first follow-up
-            next_followup = now
+    def _set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
 
-        if not next_followup or next_followup > now:
-            continue  # not time yet
+    def is_current(self, path=LEADS_STATE_FILE):
+        """True if the CSV hasn't changed since it was last imported or exported."""
+        return self._meta("source_signature") == _csv_signature(path)
 
-        to_number = lead.get("phone")
-        name = lead.get("name", "")
-        address = lead.get("address", "")
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM leads").fetchone()[0]
 
-        text = pick_followup_text(stage, name, address)
-        if not text:
-            continue
+    def import_csv(self, path=LEADS_STATE_FILE, now=None):
+        """
+        Merge leads_state.csv into the store, streamed. A lead already in the
+        store (same phone) gets the CSV's name, address, source, agent, status
+        and notes but keeps its stage, last_outbound_at and next_due. New
+        leads are added (a new lead without a date is due now); leads no
+        longer in the CSV are removed. Returns the number of leads stored.
+        """
+        if not os.path.exists(path):
+            # An empty merge would remove every lead
+            raise FileNotFoundError(path)
+        now_ts = (now or datetime.now(timezone.utc)).timestamp()
+        existing = defaultdict(list)  # phone -> ids, oldest first (duplicates pair up in order)
+        for row in self.conn.execute("SELECT id, phone FROM leads ORDER BY id"):
+            existing[(row["phone"] or "").strip()].append(row["id"])
+        kept = set()
 
-        # send SMS
-        try:
-            send_sms(to_number, text)
-        except Exception as e:
-            print(f"Error sending to {to_number}: {e}")
-            continue
+        with self.conn:
+            for lead in load_leads(path):
+                phone = (lead.get("phone") or "").strip()
+                details = (
+                    lead.get("name", ""), lead.get("address", ""), lead.get("source", ""),
+                    lead.get("agent_id", ""), lead.get("status") or "active", lead.get("notes", ""),
+                )
+                ids = existing.get(phone)
+                if ids:
+                    lead_id = ids.pop(0)
+                    self.conn.execute(
+                        "UPDATE leads SET name = ?, address = ?, source = ?, agent_id = ?, status = ?, notes = ?"
+                        " WHERE id = ?",
+                        (*details, lead_id),
+                    )
+                    kept.add(lead_id)
+                    continue
+                stage = lead.get("stage") or "new"
+                due = parse_iso(lead.get("next_followup_at", ""))
+                cur = self.conn.execute(
+                    "INSERT INTO leads (phone, name, address, source, agent_id, status, notes,"
+                    " stage, last_outbound_at, next_due) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (phone, *details, stage, lead.get("last_outbound_at", ""),
+                     due.timestamp() if due else (now_ts if stage == "new" else None)),
+                )
+                kept.add(cur.lastrowid)
+            removed = [(lead_id,) for ids in existing.values() for lead_id in ids if lead_id not in kept]
+            self.conn.executemany("DELETE FROM leads WHERE id = ?", removed)
+            self._set_meta("source_signature", _csv_signature(path))
+        return self.count()
 
-        # advance stage
-        new_stage, delay_days = next_stage_and_delay(stage)
-        lead["last_outbound_at"] = format_iso(now)
-        lead["stage"] = new_stage or stage
+    def export_csv(self, path=LEADS_STATE_FILE):
+        def rows():
+            for row in self.conn.execute("SELECT * FROM leads ORDER BY id"):
+                lead = dict(row)
+                due = lead.pop("next_due")
+                lead["next_followup_at"] = format_iso(datetime.fromtimestamp(due, timezone.utc)) if due else ""
+                yield lead
+        save_leads(rows(), path)
+        # Our own export isn't an edit: don't merge it back in on the next start
+        with self.conn:
+            self._set_meta("source_signature", _csv_signature(path))
 
-        if delay_days is not None:
-            next_dt = now + timedelta(days=delay_days)
-            lead["next_followup_at"] = format_iso(next_dt)
-        else:
-            lead["next_followup_at"] = ""
+    def due(self, until_ts, limit=HEAP_WINDOW):
+        """Active leads with a follow-up at or before until_ts, earliest first (index range scan)."""
+        return self.conn.execute(
+            "SELECT * FROM leads WHERE status = 'active' AND next_due <= ? ORDER BY next_due LIMIT ?",
+            (until_ts, limit),
+        ).fetchall()
 
-        updated = True
+    def get(self, lead_id):
+        return self.conn.execute("SELECT * FROM leads WHERE id = ?", (lead_id,)).fetchone()
+
+    def update(self, lead_id, **fields):
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self.conn:
+            self.conn.execute(f"UPDATE leads SET {assignments} WHERE id = ?", (*fields.values(), lead_id))
+
+    def close(self):
+        self.conn.close()
+
+
+def process_lead(store, lead, now):
+    """Send the lead's current-stage follow-up and advance it. Returns the next due epoch (or None)."""
+    text = pick_followup_text(lead["stage"], lead["name"] or "", lead["address"])
+    if not text:
+        # Nothing left to send at this stage; stop it coming up as due
+        store.update(lead["id"], next_due=None)
+        return None
+
+    try:
+        send_sms(lead["phone"], text)
+    except Exception as e:
+        print(f"Error sending to {lead['phone']}: {e}")
+        retry_ts = now.timestamp() + RETRY_SECONDS
+        store.update(lead["id"], next_due=retry_ts)
+        return retry_ts
 
-    if updated:
-        save_leads(leads)
+    new_stage, delay_days = next_stage_and_delay(lead["stage"])
+    next_dt = now + timedelta(days=delay_days) if delay_days is not None else None
+    next_ts = next_dt.timestamp() if next_dt else None
+    store.update(lead["id"], stage=new_stage or lead["stage"], last_outbound_at=format_iso(now), next_due=next_ts)
+    return next_ts
+
+
+def open_store(path=LEADS_DB_FILE, csv_path=LEADS_STATE_FILE):
+    """The SQLite store, with leads_state.csv merged in if it changed since the last import/export."""
+    store = LeadStore(path)
+    if os.path.exists(csv_path) and not store.is_current(csv_path):
+        print(f"Merged {csv_path}: {store.import_csv(csv_path)} lead(s)")
+    return store
+
+
+def run_scheduler(store=None, now=None):
+    """Send every follow-up that is due now. Returns how many leads were processed."""
+    own_store = store is None
+    store = store or open_store()
+    now = now or datetime.now(timezone.utc)
+    processed = 0
+    try:
+        while True:
+            batch = store.due(now.timestamp())
+            for lead in batch:
+                process_lead(store, lead, now)
+            processed += len(batch)
+            if len(batch) < HEAP_WINDOW:
+                return processed
+    finally:
+        if own_store:
+            store.close()
+
+
+def run_forever(store, max_sleep=300.0, clock=time.time, sleep=time.sleep, stop=lambda: False):
+    """
+    Long-running mode. The next HEAP_WINDOW follow-ups within max_sleep are
+    held in a min-heap of (due, lead id); the loop sleeps until the top is due.
+    """
+    heap = []
+    horizon = 0.0
+    while not stop():
+        now_ts = clock()
+        if now_ts >= horizon or not heap:
+            # Refill from the index; catches leads added or edited elsewhere
+            horizon = now_ts + max_sleep
+            heap = [(row["next_due"], row["id"]) for row in store.due(horizon)]
+            heapq.heapify(heap)
+
+        while heap and heap[0][0] <= now_ts:
+            due_ts, lead_id = heapq.heappop(heap)
+            lead = store.get(lead_id)
+            # Skip stale heap entries (lead rescheduled or deactivated since the refill)
+            if not lead or lead["status"] != "active" or lead["next_due"] != due_ts:
+                continue
+            next_ts = process_lead(store, lead, datetime.fromtimestamp(now_ts, timezone.utc))
+            if next_ts is not None and next_ts < horizon:
+                heapq.heappush(heap, (next_ts, lead_id))
+
+        wake = min(heap[0][0] if heap else horizon, horizon)
+        sleep(max(0.0, wake - clock()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send due follow-ups for the leads in leads_state.csv.")
+    parser.add_argument("--db", default=LEADS_DB_FILE, help="SQLite state file")
+    parser.add_argument("--csv", default=LEADS_STATE_FILE, help="leads_state.csv to import from / export to")
+    parser.add_argument("--import", dest="import_csv", action="store_true",
+                        help="Merge the CSV into the store even if it looks unchanged (progress is kept)")
+    parser.add_argument("--export", action="store_true", help="Write the store back to the CSV after running")
+    parser.add_argument("--watch", action="store_true", help="Keep running, sleeping until the next follow-up is due")
+    parser.add_argument("--max-sleep", type=float, default=300.0, help="Longest sleep in --watch mode (seconds)")
+    args = parser.parse_args()
+
+    store = open_store(args.db, args.csv)
+    if args.import_csv:
+        print(f"Merged {args.csv}: {store.import_csv(args.csv)} lead(s)")
+    try:
+        if args.watch:
+            run_forever(store, max_sleep=args.max_sleep)
+        else:
+            print(f"Processed {run_scheduler(store)} due lead(s)")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.export:
+            store.export_csv(args.csv)
+        store.close()
 
 
 if __name__ == "__main__":
-    run_scheduler()
+    main()
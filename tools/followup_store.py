@@ -0,0 +1,216 @@
+"""
+followup_store.py
+
+Date-indexed store for the legacy follow-up CSV (followups.csv written by
+build_followups.py, sent by send_followups.py). The CSV has to be read end
+to end to find one day's sends and rewritten end to end to change a status.
+This keeps the same rows in SQLite with a partial index on send_date over
+pending rows, so:
+
+- due(day): one index range read, O(k) in the day's pending sends
+- set_status(): an in-place one-row UPDATE (WAL journal), committed per send
+  so a crash mid-run never re-sends what already went out
+- import_csv(): streams the CSV in batches; open_store() re-imports only when
+  the CSV changed since the last import (new schedule from build_followups).
+  Statuses of rows already sent carry over by (phone, day_offset, send_date)
+- export_csv(): streams the store back to the CSV format on request
+
+The store sits next to the CSV as <csv>.sqlite3.
+
+Usage:
+    python tools/followup_store.py import followups.csv
+    python tools/followup_store.py export followups.csv
+    python tools/followup_store.py bench [--rows 1000000] [--days 90]
+"""
+
+import argparse
+import csv
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import date, timedelta
+from itertools import islice
+
+FIELDS = ["owner_name", "property_address", "phone", "day_offset", "send_date", "message_text", "status"]
+IMPORT_BATCH = 10_000
+
+
+def store_path_for(csv_path: str) -> str:
+    return csv_path + ".sqlite3"
+
+
+def _csv_signature(csv_path: str) -> str:
+    st = os.stat(csv_path)
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+class FollowupStore:
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS followups (
+                id INTEGER PRIMARY KEY,
+                owner_name TEXT, property_address TEXT, phone TEXT,
+                day_offset TEXT, send_date TEXT, message_text TEXT, status TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_followups_pending_date
+                ON followups (send_date) WHERE status = 'pending';
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        """)
+
+    def _meta(self, key: str):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value: str) -> None:
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def count(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM followups").fetchone()[0]
+
+    def import_csv(self, csv_path: str, batch_size: int = IMPORT_BATCH) -> int:
+        """
+        Replace the store's rows with csv_path, read in batches of batch_size.
+        Progress survives: a row already sent (any non-pending status) keeps
+        that status when the new CSV has the same (phone, day_offset,
+        send_date), so a rebuilt schedule never re-sends it.
+        """
+        with open(csv_path, newline="", encoding="utf-8") as f, self.conn:
+            done = {(row["phone"], row["day_offset"], row["send_date"]): row["status"]
+                    for row in self.conn.execute(
+                        "SELECT phone, day_offset, send_date, status FROM followups WHERE status != 'pending'")}
+            self.conn.execute("DELETE FROM followups")
+            rows = ((*(row.get(name, "") for name in FIELDS[:-1]),
+                     done.get((row.get("phone", ""), row.get("day_offset", ""), row.get("send_date", "")))
+                     or row.get("status") or "pending")
+                    for row in csv.DictReader(f))
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                self.conn.executemany(
+                    f"INSERT INTO followups ({', '.join(FIELDS)}) VALUES ({', '.join('?' * len(FIELDS))})", batch)
+            self._set_meta("source_signature", _csv_signature(csv_path))
+        return self.count()
+
+    def export_csv(self, csv_path: str) -> None:
+        """Write every row back out in followups.csv format."""
+        tmp = csv_path + ".tmp"
+        with open(tmp, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(FIELDS)
+            writer.writerows(self.conn.execute(f"SELECT {', '.join(FIELDS)} FROM followups ORDER BY id"))
+        os.replace(tmp, csv_path)
+        with self.conn:
+            self._set_meta("source_signature", _csv_signature(csv_path))
+
+    def due(self, send_date: str) -> list:
+        """Pending follow-ups scheduled for send_date (YYYY-MM-DD)."""
+        return self.conn.execute(
+            "SELECT * FROM followups WHERE status = 'pending' AND send_date = ? ORDER BY id", (send_date,)
+        ).fetchall()
+
+    def set_status(self, row_id: int, status: str) -> None:
+        with self.conn:
+            self.conn.execute("UPDATE followups SET status = ? WHERE id = ?", (status, row_id))
+
+    def is_current(self, csv_path: str) -> bool:
+        return self._meta("source_signature") == _csv_signature(csv_path)
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def open_store(path: str) -> FollowupStore:
+    """
+    Store for a followups CSV (or an existing .sqlite3 store). The CSV is
+    (re)imported only when it changed since it was last imported or exported.
+    """
+    if path.endswith(".sqlite3"):
+        return FollowupStore(path)
+    store = FollowupStore(store_path_for(path))
+    if not store.is_current(path):
+        count = store.import_csv(path)
+        print(f"Imported {count:,} follow-ups from {path}")
+    return store
+
+
+def _bench(rows: int, days: int) -> None:
+    rng = random.Random(7)
+    start = date(2026, 1, 1)
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "followups.csv")
+        with open(csv_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(FIELDS)
+            for i in range(rows):
+                offset = rng.choice((1, 3, 7, 14, 30))
+                send_date = (start + timedelta(days=rng.randrange(days))).isoformat()
+                writer.writerow([f"Owner {i}", f"{i} Main St", f"+1555{i:07d}", offset, send_date,
+                                 "Just checking in about your property.", "pending"])
+        print(f"csv: {rows:,} rows, {os.path.getsize(csv_path) / 1e6:.0f} MB")
+        day = (start + timedelta(days=days // 2)).isoformat()
+
+        started = time.perf_counter()
+        with open(csv_path, newline="", encoding="utf-8") as f:
+            all_rows = list(csv.DictReader(f))
+        hits = [r for r in all_rows if r["status"] == "pending" and r["send_date"] == day]
+        scan = time.perf_counter() - started
+        started = time.perf_counter()
+        with open(csv_path + ".rewrite", "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(all_rows)
+        rewrite = time.perf_counter() - started
+        del all_rows
+        print(f"csv baseline: day read {scan:.2f}s ({len(hits):,} due), full rewrite {rewrite:.2f}s")
+
+        store = FollowupStore(os.path.join(tmp, "followups.sqlite3"))
+        started = time.perf_counter()
+        store.import_csv(csv_path)
+        print(f"import: {time.perf_counter() - started:.1f}s")
+        started = time.perf_counter()
+        due = store.due(day)
+        read = time.perf_counter() - started
+        started = time.perf_counter()
+        for row in due:
+            store.set_status(row["id"], f"demo: whatsapp stub @ {day}")
+        update = time.perf_counter() - started
+        print(f"store: day read {read * 1000:.1f}ms ({len(due):,} due), "
+              f"{len(due):,} status updates {update:.2f}s ({len(due) / max(update, 1e-9):,.0f}/s)")
+        assert not store.due(day)
+        store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Date-indexed store for the legacy followups.csv.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    import_cmd = sub.add_parser("import", help="(Re)import a followups CSV into its store")
+    import_cmd.add_argument("csv_path")
+    export_cmd = sub.add_parser("export", help="Write the store back to its followups CSV")
+    export_cmd.add_argument("csv_path")
+    bench_cmd = sub.add_parser("bench", help="Time a day's read and status updates against the CSV")
+    bench_cmd.add_argument("--rows", type=int, default=1_000_000)
+    bench_cmd.add_argument("--days", type=int, default=90, help="Spread send dates over this many days")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        store = FollowupStore(store_path_for(args.csv_path))
+        print(f"Imported {store.import_csv(args.csv_path):,} follow-ups from {args.csv_path}")
+        store.close()
+    elif args.command == "export":
+        store = FollowupStore(store_path_for(args.csv_path))
+        store.export_csv(args.csv_path)
+        print(f"Exported {store.count():,} follow-ups to {args.csv_path}")
+        store.close()
+    else:
+        _bench(args.rows, args.days)
+
+
+if __name__ == "__main__":
+    main()
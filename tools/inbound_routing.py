@@ -0,0 +1,152 @@
+"""
+inbound_routing.py
+
+In-memory routing table: business number a message arrived on → owning tenant.
+
+Inbound messages used to be attributed by find_user_by_lead_phone, an
+unfiltered LIKE scan over every tenant's leads. With a route for the number
+the lead wrote to (WhatsApp phone_number_id, Twilio "To"), the tenant is a
+dict lookup and the lead lookup is scoped to that tenant. Numbers without a
+route (e.g. one platform number shared by several tenants) still fall back
+to the scan.
+
+- warmed in the background at startup (start()), then refreshed every
+  ROUTING_REFRESH_SECONDS with a delta query (rows updated since the last sync)
+- hard-deleted rows (including ON DELETE CASCADE from auth.users) never show
+  up in a delta; a full reload every ROUTING_FULL_RELOAD_SECONDS replaces
+  the table and drops them
+- a failed refresh keeps serving the last good table
+
+Env vars:
+- ROUTING_REFRESH_SECONDS (delta sync interval, default 300)
+- ROUTING_FULL_RELOAD_SECONDS (full reload interval, default 3600)
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    from tools.db import get_inbound_routes
+    SUPABASE_AVAILABLE = True
+except ImportError:
+    SUPABASE_AVAILABLE = False
+
+ROUTING_REFRESH_SECONDS = float(os.getenv("ROUTING_REFRESH_SECONDS", "300"))
+ROUTING_FULL_RELOAD_SECONDS = float(os.getenv("ROUTING_FULL_RELOAD_SECONDS", "3600"))
+
+
+def normalize_business_number(channel: str, number: str) -> str:
+    """phone_number_id is an opaque id; phone numbers compare on digits only."""
+    number = (number or "").strip()
+    if channel == "whatsapp":
+        return number
+    return "".join(c for c in number if c.isdigit())
+
+
+class RoutingTable:
+    def __init__(self, loader: Callable[[Optional[str]], Optional[list]],
+                 full_reload_seconds: float = ROUTING_FULL_RELOAD_SECONDS):
+        self._loader = loader
+        self._routes: dict[tuple[str, str], str] = {}
+        self._lock = threading.Lock()
+        self._synced_to: Optional[str] = None  # max updated_at seen
+        self._full_reload_seconds = full_reload_seconds
+        self._full_loaded_at: Optional[float] = None
+        self.loaded = False
+        self.last_refresh: Optional[float] = None
+        self.hits = 0
+        self.misses = 0
+        self.full_loads = 0
+
+    def refresh(self) -> bool:
+        """
+        Full load the first time and every full_reload_seconds, deltas in
+        between. Returns False if the load failed.
+        """
+        full = self._full_loaded_at is None or time.time() - self._full_loaded_at >= self._full_reload_seconds
+        rows = self._loader(None if full else self._synced_to)
+        if rows is None:
+            logger.warning("[Routing] Refresh failed — keeping the current routing table")
+            return False
+        with self._lock:
+            if full:
+                # Rebuild from scratch so rows deleted since the last load disappear
+                self._routes = {}
+                self._full_loaded_at = time.time()
+                self.full_loads += 1
+            for row in rows:
+                channel = row.get("channel") or ""
+                key = (channel, normalize_business_number(channel, row.get("business_number") or ""))
+                if row.get("active", True) and row.get("user_id"):
+                    self._routes[key] = row["user_id"]
+                else:
+                    self._routes.pop(key, None)
+                updated = row.get("updated_at")
+                if updated and (self._synced_to is None or updated > self._synced_to):
+                    self._synced_to = updated
+            self.loaded = True
+            self.last_refresh = time.time()
+            size = len(self._routes)
+        if full:
+            logger.info(f"[Routing] Full load: {size} route(s)")
+        elif rows:
+            logger.info(f"[Routing] Applied {len(rows)} route change(s), {size} route(s) loaded")
+        return True
+
+    def lookup(self, channel: str, business_number: str) -> Optional[str]:
+        """Tenant user_id for this business number, or None (caller falls back to the scan)."""
+        key = (channel, normalize_business_number(channel, business_number))
+        with self._lock:
+            user_id = self._routes.get(key)
+            if user_id:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return user_id
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "loaded": self.loaded,
+                "routes": len(self._routes),
+                "full_loads": self.full_loads,
+                "hits": self.hits,
+                "fallback_scans": self.misses,
+                "last_refresh_age_s": round(time.time() - self.last_refresh, 1) if self.last_refresh else None,
+            }
+
+
+ROUTES = RoutingTable(get_inbound_routes if SUPABASE_AVAILABLE else (lambda since: []))
+
+_started = False
+_start_lock = threading.Lock()
+
+
+def _refresh_loop() -> None:
+    while True:
+        try:
+            ROUTES.refresh()
+        except Exception as e:
+            logger.error(f"[Routing] Refresh error: {e}")
+        time.sleep(ROUTING_REFRESH_SECONDS)
+
+
+def start() -> None:
+    """Warm the table and keep it fresh on a daemon thread (idempotent)."""
+    global _started
+    with _start_lock:
+        if _started:
+            return
+        _started = True
+    threading.Thread(target=_refresh_loop, name="routing-refresh", daemon=True).start()
+
+
+def tenant_for(channel: str, business_number: str) -> Optional[str]:
+    if not business_number:
+        return None
+    return ROUTES.lookup(channel, business_number)
@@ -0,0 +1,284 @@
+"""
+lanes.py
+
+Priority lanes for webhook work. The webhook request only parses, dedups
+and classifies; the work itself runs on one of three worker pools so a
+backlog of AI replies can never delay an opt-out:
+
+- compliance: STOP / opt-out messages (DNC write, debounce cancel, confirmation)
+- status: delivery status callbacks (sent → delivered → read → failed)
+- ai: everything else — inbound logging, debounced AI replies, post-processing.
+  Shared fairly between tenants (FairLane): weighted by plan, capped per tenant
+
+Each lane tracks queue depth, active workers and queue wait (p50/p95/max over
+the last LANE_WAIT_SAMPLES tasks). A lane with an SLO also counts tasks that
+waited longer than it; the AI lane also breaks queue wait down per tenant.
+/health reports all of it.
+
+Env vars:
+- COMPLIANCE_LANE_WORKERS (default 4)
+- STATUS_LANE_WORKERS (default 2)
+- AI_LANE_WORKERS (default 16)
+- AI_TENANT_MAX_CONCURRENCY (AI-lane tasks one tenant may run at once, default AI_LANE_WORKERS / 4)
+- LANE_PLAN_WEIGHTS (fair-share weight per plan slug, default "agency:4,pro:2,starter:1")
+- COMPLIANCE_SLO_MS (max queue wait for an opt-out, default 250)
+- LANE_WAIT_SAMPLES (wait samples kept per lane, default 1000)
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from tools.stop_matcher import is_stop
+
+logger = logging.getLogger(__name__)
+
+COMPLIANCE_LANE_WORKERS = int(os.getenv("COMPLIANCE_LANE_WORKERS", "4"))
+STATUS_LANE_WORKERS = int(os.getenv("STATUS_LANE_WORKERS", "2"))
+AI_LANE_WORKERS = int(os.getenv("AI_LANE_WORKERS", "16"))
+COMPLIANCE_SLO_MS = float(os.getenv("COMPLIANCE_SLO_MS", "250"))
+LANE_WAIT_SAMPLES = int(os.getenv("LANE_WAIT_SAMPLES", "1000"))
+AI_TENANT_MAX_CONCURRENCY = int(os.getenv("AI_TENANT_MAX_CONCURRENCY", str(max(1, AI_LANE_WORKERS // 4))))
+TENANT_WAIT_SAMPLES = 200
+
+# Flow for AI-lane work whose tenant isn't known yet (ingest)
+UNASSIGNED = "unassigned"
+
+
+def _percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def _wait_summary(samples) -> dict:
+    waits = sorted(samples)
+    return {
+        "p50": round(_percentile(waits, 50), 1),
+        "p95": round(_percentile(waits, 95), 1),
+        "max": round(waits[-1], 1) if waits else 0.0,
+    }
+
+
+class Lane:
+    """A named worker pool that measures how long its tasks wait to start."""
+
+    def __init__(self, name: str, workers: int, slo_ms: Optional[float] = None):
+        self.name = name
+        self.workers = workers
+        self.slo_ms = slo_ms
+        self._lock = threading.Lock()
+        self._waits: deque = deque(maxlen=LANE_WAIT_SAMPLES)
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.max_depth = 0
+        self.slo_breaches = 0
+        self._start_workers()
+
+    def _start_workers(self) -> None:
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"lane-{self.name}")
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        enqueued = self._enqueued()
+        return self._pool.submit(lambda: self._run_task(fn, args, kwargs, (time.monotonic() - enqueued) * 1000))
+
+    def _enqueued(self) -> float:
+        with self._lock:
+            self.queued += 1
+            self.max_depth = max(self.max_depth, self.queued)
+        return time.monotonic()
+
+    def _run_task(self, fn: Callable, args: tuple, kwargs: dict, wait_ms: float):
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+            self._waits.append(wait_ms)
+            breached = self.slo_ms is not None and wait_ms > self.slo_ms
+            self.slo_breaches += int(breached)
+        if breached:
+            logger.warning(f"[Lanes] {self.name} task waited {wait_ms:.0f}ms (SLO {self.slo_ms:.0f}ms)")
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            logger.error(f"[Lanes] {self.name} task {getattr(fn, '__name__', fn)} failed: {e}")
+            raise
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.completed += 1
+
+    def depth(self) -> int:
+        with self._lock:
+            return self.queued
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = {
+                "workers": self.workers,
+                "queued": self.queued,
+                "active": self.active,
+                "max_depth": self.max_depth,
+                "completed": self.completed,
+                "failed": self.failed,
+                "wait_ms": _wait_summary(self._waits),
+            }
+            if self.slo_ms is not None:
+                out["slo_ms"] = self.slo_ms
+                out["slo_breaches"] = self.slo_breaches
+            return out
+
+
+class FairLane(Lane):
+    """
+    A lane shared by tenants. Tasks are picked by start-time fair queuing:
+    a task's virtual start is max(lane clock, its tenant's last finish) and
+    its finish is start + 1/weight, so a tenant with weight 4 gets four turns
+    for every one a weight-1 tenant gets while both are backlogged, and an
+    idle tenant's first message goes straight to the front.
+
+    Each tenant also has at most tenant_cap tasks running at once (bulkhead).
+    Tasks submitted without a tenant (ingest work done before the tenant is
+    known) share one uncapped flow at the top weight.
+    """
+
+    def __init__(self, name: str, workers: int, tenant_cap: int, slo_ms: Optional[float] = None):
+        self.tenant_cap = tenant_cap
+        self._tenants: dict[str, dict] = {}
+        self._clock = 0.0
+        super().__init__(name, workers, slo_ms)
+
+    def _start_workers(self) -> None:
+        self._ready = threading.Condition(self._lock)
+        for i in range(self.workers):
+            threading.Thread(target=self._worker, name=f"lane-{self.name}_{i}", daemon=True).start()
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        return self.submit_for(None, max(PLAN_WEIGHTS.values()), fn, *args, **kwargs)
+
+    def submit_for(self, tenant: Optional[str], weight: float, fn: Callable, *args, **kwargs) -> Future:
+        """Queue fn under `tenant`'s flow with the given weight."""
+        future: Future = Future()
+        key = tenant or UNASSIGNED
+        enqueued = self._enqueued()
+        with self._ready:
+            flow = self._tenants.get(key)
+            if flow is None:
+                flow = self._tenants[key] = {
+                    "queue": deque(), "finish": 0.0, "active": 0, "weight": weight,
+                    "completed": 0, "waits": deque(maxlen=TENANT_WAIT_SAMPLES),
+                }
+            flow["weight"] = weight
+            start = max(self._clock, flow["finish"])
+            flow["finish"] = start + 1.0 / max(weight, 0.01)
+            flow["queue"].append((start, enqueued, fn, args, kwargs, future))
+            self._ready.notify()
+        return future
+
+    def _pick(self):
+        """Head task with the smallest virtual start among flows under their cap (lock held)."""
+        best_key, best_start = None, None
+        for key, flow in self._tenants.items():
+            if not flow["queue"]:
+                continue
+            if key != UNASSIGNED and flow["active"] >= self.tenant_cap:
+                continue
+            start = flow["queue"][0][0]
+            if best_start is None or start < best_start:
+                best_key, best_start = key, start
+        if best_key is None:
+            return None
+        flow = self._tenants[best_key]
+        flow["active"] += 1
+        self._clock = max(self._clock, best_start)
+        return flow, flow["queue"].popleft()
+
+    def _worker(self) -> None:
+        while True:
+            with self._ready:
+                picked = self._pick()
+                while picked is None:
+                    self._ready.wait()
+                    picked = self._pick()
+            flow, (_start, enqueued, fn, args, kwargs, future) = picked
+            wait_ms = (time.monotonic() - enqueued) * 1000
+            with self._lock:
+                flow["waits"].append(wait_ms)
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(self._run_task(fn, args, kwargs, wait_ms))
+                    except BaseException as e:
+                        future.set_exception(e)
+                else:
+                    with self._lock:
+                        self.queued -= 1
+            finally:
+                with self._ready:
+                    flow["active"] -= 1
+                    flow["completed"] += 1
+                    # A capped tenant may be eligible again
+                    self._ready.notify_all()
+
+    def tenant_stats(self) -> dict:
+        """Per-tenant queue depth, running tasks and queue wait."""
+        with self._lock:
+            return {
+                key: {
+                    "weight": flow["weight"],
+                    "queued": len(flow["queue"]),
+                    "active": flow["active"],
+                    "completed": flow["completed"],
+                    "wait_ms": _wait_summary(flow["waits"]),
+                }
+                for key, flow in self._tenants.items()
+            }
+
+    def stats(self) -> dict:
+        out = super().stats()
+        out["tenant_cap"] = self.tenant_cap
+        out["tenants"] = self.tenant_stats()
+        return out
+
+
+def _parse_weights(raw: str) -> dict:
+    weights = {}
+    for part in raw.split(","):
+        slug, _, value = part.partition(":")
+        if slug.strip() and value.strip():
+            weights[slug.strip()] = float(value)
+    return weights
+
+
+PLAN_WEIGHTS = _parse_weights(os.getenv("LANE_PLAN_WEIGHTS", "agency:4,pro:2,starter:1"))
+
+
+def plan_weight(plan_slug: Optional[str]) -> float:
+    """Scheduling weight for a tenant's plan (get_user_plan_slug); unknown plans get 1."""
+    return PLAN_WEIGHTS.get(plan_slug or "", 1.0)
+
+
+COMPLIANCE = Lane("compliance", COMPLIANCE_LANE_WORKERS, slo_ms=COMPLIANCE_SLO_MS)
+STATUS = Lane("status", STATUS_LANE_WORKERS)
+AI = FairLane("ai", AI_LANE_WORKERS, tenant_cap=AI_TENANT_MAX_CONCURRENCY)
+
+LANES = {lane.name: lane for lane in (COMPLIANCE, STATUS, AI)}
+
+
+def classify(body: str, msg_type: str = "text") -> Lane:
+    """Pick the lane for an inbound message. Opt-outs always jump the AI queue."""
+    if msg_type == "text" and is_stop(body):
+        return COMPLIANCE
+    return AI
+
+
+def lane_stats() -> dict:
+    return {name: lane.stats() for name, lane in LANES.items()}
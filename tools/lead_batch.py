@@ -0,0 +1,210 @@
+"""
+lead_batch.py
+
+Shared plumbing for the per-lead batch CLIs (build_followups.py and
+friends), which otherwise make one blocking LLM round trip per lead and
+write their output in a single pass at the end.
+
+- run_concurrent(): runs a function over leads on a thread pool with a
+  bounded number in flight (nothing is queued ahead beyond the window), and
+  yields each (lead, result, error) as it finishes, or in input order.
+  Stages chain: feeding one stage's output into the next gives a pipeline
+  with back-pressure all the way to the input reader. Rate limiting stays
+  in llm_gateway: workers simply wait there for a slot / token budget.
+- ResumableCsvWriter: streams each finished lead's rows to the output CSV
+  and then records the lead in a checkpoint file (lead key + output offset).
+  Re-running with the same output skips checkpointed leads and truncates any
+  rows written after the last checkpoint, so a crash never duplicates rows.
+  The checkpoint records the input file and its hash and is ignored when
+  the input changed; finish() deletes it once every lead succeeded
+- Progress: periodic "done/total, leads/min, ETA" line; line() for the summary
+- lead_key(): stable key for a lead row (last 10 phone digits plus a hash of
+  the property address, else owner + address + email), so one owner's
+  several properties stay separate leads
+"""
+
+import csv
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Iterable, Iterator, Optional
+
+
+_END = object()
+
+
+def lead_key(lead: dict) -> str:
+    digits = "".join(ch for ch in (lead.get("phone") or "") if ch.isdigit())
+    address = " ".join((lead.get("property_address") or "").lower().split())
+    if len(digits) >= 10:
+        if not address:
+            return digits[-10:]
+        return f"{digits[-10:]}:{hashlib.sha1(address.encode('utf-8')).hexdigest()[:8]}"
+    ident = "|".join((lead.get(name) or "").strip().lower() for name in ("owner_name", "property_address", "email"))
+    return hashlib.sha1(ident.encode("utf-8")).hexdigest()[:16]
+
+
+def run_concurrent(items: Iterable, fn: Callable, concurrency: int, window: Optional[int] = None,
+                   ordered: bool = False) -> Iterator[tuple]:
+    """
+    Yield (item, result, error) for fn(item) over items, in completion order
+    (ordered=True: input order). At most `window` (default 2 x concurrency)
+    items are submitted and not yet yielded, so items are pulled from the
+    source only as fast as the caller consumes results (back-pressure).
+    Closing the generator early cancels anything not yet started.
+    """
+    window = window or concurrency * 2
+    source = iter(items)
+    pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="lead-batch")
+    pending = {}
+    finished = {}  # ordered mode: seq -> outcome, waiting for earlier items
+    submitted = next_seq = 0
+    try:
+        while True:
+            while len(pending) + len(finished) < window:
+                item = next(source, _END)
+                if item is _END:
+                    break
+                pending[pool.submit(fn, item)] = (submitted, item)
+                submitted += 1
+            if not pending and not finished:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                seq, item = pending.pop(future)
+                error = future.exception()
+                outcome = (item, (None if error else future.result()), error)
+                if ordered:
+                    finished[seq] = outcome
+                else:
+                    yield outcome
+            while next_seq in finished:
+                yield finished.pop(next_seq)
+                next_seq += 1
+    finally:
+        for future in pending:
+            future.cancel()
+        pool.shutdown(wait=True)
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResumableCsvWriter:
+    """
+    Append-as-you-go CSV output with a JSONL checkpoint alongside it
+    (<out>.checkpoint.jsonl). restart=True ignores any previous progress.
+    With source=<input path>, a checkpoint written for another input (or a
+    since-edited one) is ignored too; `stale` says that happened.
+    """
+
+    def __init__(self, out_path: str, fieldnames: list, checkpoint_path: Optional[str] = None, restart: bool = False,
+                 source: Optional[str] = None):
+        self.out_path = out_path
+        self.checkpoint_path = checkpoint_path or out_path + ".checkpoint.jsonl"
+        self._lock = threading.Lock()
+        self.completed = {}
+        self.stale = False
+        identity = {"source": os.path.abspath(source), "sha256": _file_sha256(source)} if source else {}
+        end = 0
+        if not restart and os.path.exists(self.checkpoint_path) and os.path.exists(out_path):
+            header = {}
+            with open(self.checkpoint_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        break  # torn last line from a crash
+                    if "key" not in entry:
+                        header = entry
+                        continue
+                    self.completed[entry["key"]] = entry["rows"]
+                    end = max(end, entry["end"])
+            if header != identity:
+                self.stale = True
+                end = 0
+
+        if end:
+            # Drop rows written after the last checkpointed lead
+            self._out = open(out_path, "r+", newline="", encoding="utf-8")
+            self._out.truncate(end)
+            self._out.seek(end)
+            self._checkpoint = open(self.checkpoint_path, "a", encoding="utf-8")
+        else:
+            self.completed = {}
+            self._out = open(out_path, "w", newline="", encoding="utf-8")
+            self._checkpoint = open(self.checkpoint_path, "w", encoding="utf-8")
+            if identity:
+                self._checkpoint.write(json.dumps(identity) + "\n")
+                self._checkpoint.flush()
+        self._writer = csv.DictWriter(self._out, fieldnames=fieldnames, extrasaction="ignore")
+        if not end:
+            self._writer.writeheader()
+            self._out.flush()
+
+    @property
+    def resumed(self) -> int:
+        return len(self.completed)
+
+    def done(self, key: str) -> bool:
+        return key in self.completed
+
+    def write(self, key: str, rows: list) -> None:
+        """Append one lead's rows, then checkpoint it."""
+        with self._lock:
+            self._writer.writerows(rows)
+            self._out.flush()
+            os.fsync(self._out.fileno())
+            self._checkpoint.write(json.dumps({"key": key, "rows": len(rows), "end": self._out.tell()}) + "\n")
+            self._checkpoint.flush()
+            self.completed[key] = len(rows)
+
+    def close(self) -> None:
+        self._out.close()
+        self._checkpoint.close()
+
+    def finish(self) -> None:
+        """Close after a clean run: the output is complete, so drop the checkpoint."""
+        self.close()
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+
+class Progress:
+    """Throughput reporter: prints at most every `every` seconds."""
+
+    def __init__(self, total: int, label: str = "leads", every: float = 10.0, extra: Optional[Callable[[], str]] = None):
+        self.total = total
+        self.label = label
+        self.every = every
+        self.extra = extra
+        self.done = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self._last = self.started
+
+    def tick(self, ok: bool = True) -> None:
+        self.done += 1
+        if not ok:
+            self.failed += 1
+        now = time.monotonic()
+        if now - self._last >= self.every:
+            self._last = now
+            print(self.line())
+
+    def line(self) -> str:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        rate = self.done / elapsed
+        left = self.total - self.done
+        eta = f", ETA {left / rate:.0f}s" if rate and left else ""
+        extra = f", {self.extra()}" if self.extra else ""
+        return (f"[{self.done}/{self.total}] {rate * 60:.1f} {self.label}/min, "
+                f"{self.failed} failed, {elapsed:.0f}s elapsed{eta}{extra}")
@@ -0,0 +1,355 @@
+"""
+lead_updates.py
+
+Lead-side effects of an AI reply, shared by every channel's reply pipeline
+(see reply_stages.py):
+
+- update_lead_from_qualification: copy extracted property/price/brief data onto the lead
+- handle_meeting_booking: conflict check, create the meeting + day-before reminder
+- handle_auto_follow_up: schedule the "checking back" message the lead asked for
+- FOLLOW_UP_CANCELS: "lead replied, cancel their pending follow-ups" writes,
+  skipped when leads.pending_follow_ups says there are none and otherwise
+  collected for FOLLOW_UP_CANCEL_FLUSH_MS so a reply wave becomes a few
+  UPDATE ... WHERE lead_id IN (...) statements instead of one per reply
+
+Env vars:
+- FOLLOW_UP_CANCEL_FLUSH_MS (how long a cancellation may wait for others, default 500)
+- FOLLOW_UP_CANCEL_BATCH (flush early at this many leads, default 100)
+"""
+
+import logging
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+
+from tools.message_pipeline import MessageContext
+
+logger = logging.getLogger(__name__)
+
+try:
+    from tools.db import (
+        log_activity,
+        find_lead_by_phone,
+        check_meeting_availability,
+        create_meeting,
+        get_supabase_client,
+        create_follow_up,
+        cancel_follow_ups_for_leads,
+        FOLLOW_UP_CREATED,
+    )
+    SUPABASE_AVAILABLE = True
+except ImportError:
+    SUPABASE_AVAILABLE = False
+
+FOLLOW_UP_CANCEL_FLUSH_MS = float(os.getenv("FOLLOW_UP_CANCEL_FLUSH_MS", "500"))
+FOLLOW_UP_CANCEL_BATCH = int(os.getenv("FOLLOW_UP_CANCEL_BATCH", "100"))
+
+
+def log_lead_activity(mctx: MessageContext, action: str, description: str, status: str, metadata: dict) -> None:
+    """log_activity with the phone/channel every entry carries filled in."""
+    if SUPABASE_AVAILABLE and mctx.user_id:
+        log_activity(mctx.user_id, action, description, status,
+                     {"phone": mctx.phone, "channel": mctx.channel.name, **metadata})
+
+
+def has_pending_follow_ups(lead: Optional[dict]) -> bool:
+    """
+    leads.pending_follow_ups (pending or claimed rows), kept by a trigger on
+    follow_ups. A lead row without the column (migration not applied) counts
+    as having some.
+    """
+    if not lead:
+        return False
+    return lead.get("pending_follow_ups") != 0
+
+
+class FollowUpCanceller:
+    """Collects leads whose pending follow-ups should be cancelled; writes them in batches."""
+
+    def __init__(self, writer: Callable[[list], bool], flush_ms: float, max_batch: int):
+        self._writer = writer
+        self.flush_ms = flush_ms
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._pending: dict[str, str] = {}  # lead_id -> reason
+        self._timer: Optional[threading.Timer] = None
+        self.skipped = 0
+        self.batches = 0
+        self.cancelled = 0
+        self.failed = 0
+
+    def skip(self) -> None:
+        """Count a cancellation the pending-follow-up index made unnecessary."""
+        with self._lock:
+            self.skipped += 1
+
+    def submit(self, lead_id: str, reason: str) -> None:
+        with self._lock:
+            self._pending[str(lead_id)] = reason
+            full = len(self._pending) >= self.max_batch
+            if not full and self._timer is None:
+                self._timer = threading.Timer(self.flush_ms / 1000, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            batch, self._pending = self._pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not batch:
+            return
+        try:
+            ok = self._writer(list(batch))
+        except Exception as e:
+            logger.error(f"[Follow-up] Cancel write raised: {e}")
+            ok = False
+        with self._lock:
+            self.batches += 1
+            if ok:
+                self.cancelled += len(batch)
+            else:
+                self.failed += len(batch)
+        if not ok:
+            # Not requeued: cancel_follow_ups_for_leads journals a failed write and
+            # db.replay_journal() re-applies it once Supabase recovers
+            logger.error(f"[Follow-up] Could not cancel pending follow-ups for {len(batch)} lead(s): "
+                         f"{', '.join(sorted(batch))}")
+            return
+        logger.info(f"[Follow-up] Cancelled pending follow-ups for {len(batch)} lead(s) — "
+                    f"{', '.join(sorted(set(batch.values())))}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queued": len(self._pending),
+                "batches": self.batches,
+                "cancelled_leads": self.cancelled,
+                "failed_leads": self.failed,
+                "skipped_no_pending": self.skipped,
+            }
+
+
+FOLLOW_UP_CANCELS = FollowUpCanceller(
+    cancel_follow_ups_for_leads if SUPABASE_AVAILABLE else (lambda lead_ids: False),
+    FOLLOW_UP_CANCEL_FLUSH_MS,
+    FOLLOW_UP_CANCEL_BATCH,
+)
+
+
+def update_lead_from_qualification(
+    user_id: str,
+    phone: str,
+    qualification: dict,
+    ai_result: dict,
+) -> None:
+    """Update the lead record with information extracted by AI during qualification."""
+    if not SUPABASE_AVAILABLE:
+        return
+
+    lead = find_lead_by_phone(user_id, phone)
+    if not lead:
+        return
+
+    updates = {}
+    # Always update qualification fields when AI extracts new data
+    # (leads can discuss multiple properties or change their mind)
+    if qualification.get("property_address"):
+        updates["property_address"] = qualification["property_address"]
+    if qualification.get("property_type"):
+        updates["property_type"] = qualification["property_type"]
+    if qualification.get("owner_goal"):
+        updates["property_interest"] = qualification["owner_goal"]
+    if qualification.get("price_expectation"):
+        # Try to parse a number from the price expectation (handles $300K, $1.5M, etc.)
+        try:
+            price_str = qualification["price_expectation"].replace("$", "").replace(",", "").strip()
+            multiplier = 1
+            if price_str.upper().endswith("K"):
+                multiplier = 1_000
+                price_str = price_str[:-1]
+            elif price_str.upper().endswith("M"):
+                multiplier = 1_000_000
+                price_str = price_str[:-1]
+            elif price_str.upper().endswith("B"):
+                multiplier = 1_000_000_000
+                price_str = price_str[:-1]
+            price_val = int(float(price_str) * multiplier)
+            updates["budget_max"] = price_val
+        except (ValueError, AttributeError):
+            pass
+    if qualification.get("sqft"):
+        notes = lead.get("notes") or ""
+        sqft_note = f"Sqft: {qualification['sqft']}"
+        if sqft_note not in notes:
+            updates["notes"] = f"{notes}\n{sqft_note}".strip() if notes else sqft_note
+    if qualification.get("bedrooms"):
+        notes = updates.get("notes") or lead.get("notes") or ""
+        bed_note = f"Beds: {qualification['bedrooms']}"
+        if bed_note not in notes:
+            updates["notes"] = f"{notes}\n{bed_note}".strip() if notes else bed_note
+
+    # Save agent brief to lead notes when qualified
+    agent_brief = ai_result.get("agent_brief")
+    if agent_brief:
+        notes = updates.get("notes") or lead.get("notes") or ""
+        brief_header = "--- AI QUALIFICATION BRIEF ---"
+        if brief_header not in notes:
+            updates["notes"] = f"{notes}\n\n{brief_header}\n{agent_brief}".strip()
+
+    if updates:
+        try:
+            client = get_supabase_client()
+            if client:
+                user_id_val = lead.get("user_id")
+                q = client.table("leads").update(updates).eq("id", lead["id"])
+                if user_id_val:
+                    q = q.eq("user_id", user_id_val)
+                q.execute()
+        except Exception as e:
+            logger.error(f"Error updating lead from qualification: {e}")
+
+
+def handle_meeting_booking(mctx: MessageContext, meeting_data: dict, qualification: dict) -> None:
+    """Handle meeting creation when AI determines ready_to_book."""
+    user_id = mctx.user_id
+    phone = mctx.phone
+    ai_result = mctx.ai_result
+    date_suggestion = meeting_data.get("date_suggestion", "")
+    proposed_date = date_suggestion[:10] if len(date_suggestion) >= 10 else ""
+    proposed_time = date_suggestion[11:16] if len(date_suggestion) >= 16 else ""
+
+    availability = {"available": True, "conflicts": []}
+    if proposed_date and proposed_time:
+        availability = check_meeting_availability(user_id, proposed_date, proposed_time)
+
+    if not availability["available"]:
+        conflict_info = availability["conflicts"]
+        conflict_desc = ", ".join(
+            f"{c.get('title', 'Meeting')} at {c.get('time', '?')}" for c in conflict_info
+        )
+        conflict_reply = (
+            f"I just checked the calendar and there's a conflict — "
+            f"you already have: {conflict_desc}. "
+            f"Would another time work? What about later that day or the next day?"
+        )
+        # Imported here to avoid a circular import (reply_stages imports this module)
+        from tools.reply_stages import log_message
+        mctx.channel.send(phone, conflict_reply)
+        log_message(mctx, "outbound", reply_text=conflict_reply, send_status="sent")
+        log_lead_activity(mctx, "meeting_conflict", f"AI detected scheduling conflict for {phone}: {conflict_desc}",
+                          "warning", {"conflicts": conflict_info, "proposed": date_suggestion})
+        return
+
+    lead = find_lead_by_phone(user_id, phone) if user_id else None
+    create_meeting(
+        user_id=user_id,
+        title=meeting_data.get("title", f"Meeting with {phone}"),
+        lead_phone=phone,
+        lead_name=lead.get("owner_name") if lead else None,
+        lead_id=lead.get("id") if lead else None,
+        description=meeting_data.get("description"),
+        meeting_date=meeting_data.get("date_suggestion"),
+        property_address=meeting_data.get("property_address") or qualification.get("property_address"),
+        notes=ai_result.get("agent_brief") or ai_result.get("notes", ""),
+        source="ai_bot",
+    )
+    log_lead_activity(mctx, "meeting_created", f"AI bot created meeting: {meeting_data.get('title', 'Meeting')}",
+                      "success", {"meeting": meeting_data, "qualification": qualification})
+
+    # Auto-create day-before confirmation follow-up (one pending reminder per lead and meeting date)
+    if meeting_data.get("date_suggestion") and lead:
+        try:
+            meeting_dt = datetime.fromisoformat(
+                meeting_data["date_suggestion"].replace("Z", "+00:00")
+            )
+            confirm_dt = meeting_dt - timedelta(days=1)
+
+            lead_name = lead.get("owner_name", "there")
+            confirm_msg = (
+                f"Hi {lead_name}, just a reminder about our meeting tomorrow "
+                f"at {meeting_dt.strftime('%I:%M %p')} regarding your property "
+                f"at {meeting_data.get('property_address', 'your property')}. "
+                f"Looking forward to speaking with you! - {mctx.user.get('agent_name')}"
+            )
+            if create_follow_up(
+                user_id=user_id,
+                lead_id=lead.get("id"),
+                message_text=confirm_msg,
+                scheduled_at=confirm_dt.isoformat(),
+                channel=mctx.channel.name,
+                kind="meeting_reminder",
+                dedup_key=f"meeting_reminder:{lead.get('id')}:{confirm_dt.date().isoformat()}",
+            ) == FOLLOW_UP_CREATED:
+                mctx.follow_ups_created += 1
+                log_lead_activity(mctx, "followup", f"Auto-created meeting confirmation for day before: {confirm_dt.date()}",
+                                  "success", {"meeting_date": meeting_data["date_suggestion"]})
+        except Exception as e:
+            logger.error(f"Error creating confirmation follow-up: {e}")
+
+
+def handle_auto_follow_up(mctx: MessageContext, follow_up_days: int) -> None:
+    """Auto-create follow-up when AI sets schedule_follow_up_days."""
+    user_id = mctx.user_id
+    ai_result = mctx.ai_result
+    agent_name = mctx.user.get("agent_name")
+    agent_brokerage = mctx.user.get("agent_brokerage")
+    try:
+        lead = find_lead_by_phone(user_id, mctx.phone)
+        if not lead:
+            return
+
+        follow_up_dt = datetime.now(timezone.utc) + timedelta(days=int(follow_up_days))
+        lead_name = lead.get("owner_name", "there").split(" ")[0]
+
+        ai_notes = ai_result.get("notes", "")
+        qualification = ai_result.get("qualification", {})
+        property_addr = qualification.get("property_address") or lead.get("property_address") or ""
+        owner_goal = qualification.get("owner_goal") or ""
+
+        if ai_notes and any(kw in ai_notes.lower() for kw in ("interest", "looking", "buy", "invest")):
+            follow_up_msg = (
+                f"Hi {lead_name}, it's {agent_name} from {agent_brokerage}. "
+                f"We spoke a few months back and you mentioned you'd be ready around now. "
+                f"I've been keeping an eye on the market for you — "
+                f"I have some opportunities that might match what you're looking for. "
+                f"Would you have time for a quick call this week?"
+            )
+        elif property_addr:
+            follow_up_msg = (
+                f"Hi {lead_name}, it's {agent_name}. "
+                f"We chatted a while back about your property at {property_addr}. "
+                f"The market has had some interesting movement since then — "
+                f"happy to share an updated analysis if you're curious. "
+                f"Are you still thinking about {owner_goal or 'your options'}?"
+            )
+        else:
+            follow_up_msg = (
+                f"Hi {lead_name}, it's {agent_name} from {agent_brokerage}. "
+                f"We connected a few months ago and you mentioned checking back around now. "
+                f"I'd love to catch up and see if I can help. "
+                f"Would you have a few minutes this week?"
+            )
+
+        created = create_follow_up(
+            user_id=user_id,
+            lead_id=lead.get("id"),
+            message_text=follow_up_msg,
+            scheduled_at=follow_up_dt.isoformat(),
+            channel=mctx.channel.name,
+            kind="auto_follow_up",
+        )
+        if created != FOLLOW_UP_CREATED:
+            # Already scheduled for that day (duplicate delivery or retry), or the write failed
+            return
+        mctx.follow_ups_created += 1
+        log_lead_activity(mctx, "followup",
+                          f"Auto-scheduled {mctx.channel.label} follow-up in {follow_up_days} days for {mctx.phone} (notes: {ai_notes[:100]})",
+                          "success",
+                          {"follow_up_days": follow_up_days, "scheduled_at": follow_up_dt.isoformat(), "ai_notes": ai_notes})
+    except Exception as e:
+        logger.error(f"Error creating scheduled follow-up: {e}")
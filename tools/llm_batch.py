@@ -0,0 +1,316 @@
+"""
+llm_batch.py
+
+OpenAI Batch API mode for the bulk generation CLIs (ai_listing_agent_full.py
+outreach, build_followups.py follow-ups). Nobody waits on those jobs in real
+time, so instead of one chat completion per lead through llm_gateway they
+can write every prompt to a JSONL request file, submit it as one batch
+(half price, separate rate limits), and merge the answers back by lead key.
+
+- request_line(): one chat completion request in Batch JSONL format
+- run_batch(): write requests -> submit -> poll -> download, returning
+  {custom_id: content or Exception}. Progress is kept in a work directory
+  (requests.jsonl, batch.json, results.jsonl), so re-running the same job
+  resumes polling the batch already submitted instead of paying twice.
+  Downloaded results accumulate in results.jsonl; a request whose identical
+  body already has a successful result there is answered from it and never
+  resubmitted, whatever subset of the job the caller asks for next time
+- OpenAIBatchBackend: Files + Batches API
+- LocalBatchBackend: file-based stand-in with the same request/result
+  formats, answered by a Python callable (default: placeholder JSON), for
+  tests and dry runs without an API key
+- custom_ids(): unique, stable custom_id per lead (lead_key, with #n
+  suffixes for repeated leads)
+
+Usage:
+    python tools/ai_listing_agent_full.py ... --batch [--batch-backend local]
+    python tools/build_followups.py leads.csv followups.csv --batch
+
+Env vars:
+- OPENAI_API_KEY (openai backend)
+- LLM_BATCH_POLL_SECONDS (default 30)
+"""
+
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+from typing import Callable, Optional
+
+from tools.lead_batch import lead_key
+
+try:
+    from openai import OpenAI
+    OPENAI_AVAILABLE = True
+except ImportError:
+    OPENAI_AVAILABLE = False
+
+LLM_BATCH_POLL_SECONDS = float(os.getenv("LLM_BATCH_POLL_SECONDS", "30"))
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+# Batch states after which polling stops
+_FINAL_STATES = {"completed", "failed", "expired", "cancelled"}
+
+
+class BatchError(Exception):
+    """The batch as a whole failed, expired or was cancelled."""
+
+
+def request_line(custom_id: str, messages: list, model: str, temperature: float, **kwargs) -> dict:
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": {"model": model, "temperature": temperature, "messages": messages, **kwargs},
+    }
+
+
+def custom_ids(leads: list) -> list:
+    """One custom_id per lead, in order; repeated leads get #2, #3, ..."""
+    seen = {}
+    ids = []
+    for lead in leads:
+        key = lead_key(lead)
+        seen[key] = seen.get(key, 0) + 1
+        ids.append(key if seen[key] == 1 else f"{key}#{seen[key]}")
+    return ids
+
+
+def parse_results(lines) -> dict:
+    """Batch output/error JSONL lines -> {custom_id: content or Exception}."""
+    results = {}
+    for line in lines:
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        response = entry.get("response") or {}
+        error = entry.get("error")
+        if error or response.get("status_code") != 200:
+            message = (error or {}).get("message") or (response.get("body") or {}).get("error", {}).get("message")
+            results[entry["custom_id"]] = RuntimeError(message or f"status {response.get('status_code')}")
+            continue
+        results[entry["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+    return results
+
+
+class OpenAIBatchBackend:
+    name = "openai"
+
+    def __init__(self, client=None):
+        if client is None and not OPENAI_AVAILABLE:
+            raise RuntimeError("openai package not installed")
+        self.client = client or OpenAI()
+
+    def submit(self, requests_path: str, metadata: Optional[dict] = None) -> str:
+        with open(requests_path, "rb") as f:
+            uploaded = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window="24h",
+            metadata=metadata or None,
+        )
+        return batch.id
+
+    def poll(self, batch_id: str) -> dict:
+        batch = self.client.batches.retrieve(batch_id)
+        counts = getattr(batch, "request_counts", None)
+        return {
+            "status": batch.status,
+            "completed": getattr(counts, "completed", 0) if counts else 0,
+            "failed": getattr(counts, "failed", 0) if counts else 0,
+            "total": getattr(counts, "total", 0) if counts else 0,
+            "output_file_id": batch.output_file_id,
+            "error_file_id": batch.error_file_id,
+        }
+
+    def download(self, state: dict) -> str:
+        text = ""
+        for file_id in (state.get("output_file_id"), state.get("error_file_id")):
+            if file_id:
+                text += self.client.files.content(file_id).text.rstrip("\n") + "\n"
+        return text
+
+
+def placeholder_response(body: dict) -> str:
+    """Default local answer: JSON with the keys the prompt asks for ("- key" bullets)."""
+    prompt = "\n".join(m.get("content") or "" for m in body.get("messages", []))
+    keys = re.findall(r"^- ([a-z][a-z0-9_]*)\s*$", prompt, re.MULTILINE)
+    return json.dumps({key: f"[local batch] {key}" for key in keys})
+
+
+class LocalBatchBackend:
+    """
+    Batch stand-in backed by a directory: submit() copies the request file
+    in, and the batch completes on the first poll at least `delay` seconds
+    later, with each request answered by respond(body) -> content.
+    """
+
+    name = "local"
+
+    def __init__(self, root: str, respond: Callable[[dict], str] = placeholder_response, delay: float = 0.0):
+        self.root = root
+        self.respond = respond
+        self.delay = delay
+
+    def _dir(self, batch_id: str) -> str:
+        return os.path.join(self.root, batch_id)
+
+    def submit(self, requests_path: str, metadata: Optional[dict] = None) -> str:
+        batch_id = f"batch_local_{uuid.uuid4().hex[:12]}"
+        os.makedirs(self._dir(batch_id))
+        with open(requests_path, encoding="utf-8") as src, \
+             open(os.path.join(self._dir(batch_id), "input.jsonl"), "w", encoding="utf-8") as dst:
+            dst.write(src.read())
+        with open(os.path.join(self._dir(batch_id), "submitted"), "w") as f:
+            f.write(str(time.time()))
+        return batch_id
+
+    def poll(self, batch_id: str) -> dict:
+        folder = self._dir(batch_id)
+        output = os.path.join(folder, "output.jsonl")
+        if not os.path.exists(output):
+            with open(os.path.join(folder, "submitted")) as f:
+                if time.time() - float(f.read()) < self.delay:
+                    return {"status": "in_progress"}
+            self._process(folder, output)
+        with open(output, encoding="utf-8") as f:
+            total = sum(1 for _ in f)
+        return {"status": "completed", "completed": total, "total": total, "output_file_id": output}
+
+    def _process(self, folder: str, output: str) -> None:
+        tmp = output + ".tmp"
+        with open(os.path.join(folder, "input.jsonl"), encoding="utf-8") as src, open(tmp, "w", encoding="utf-8") as dst:
+            for line in src:
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                entry = {"id": f"batch_req_{uuid.uuid4().hex[:12]}", "custom_id": request["custom_id"]}
+                try:
+                    content = self.respond(request["body"])
+                    entry["response"] = {"status_code": 200, "body": {
+                        "object": "chat.completion", "model": request["body"].get("model"),
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                                     "finish_reason": "stop"}]}}
+                    entry["error"] = None
+                except Exception as e:
+                    entry["response"] = None
+                    entry["error"] = {"code": "local_error", "message": str(e)}
+                dst.write(json.dumps(entry) + "\n")
+        os.replace(tmp, output)
+
+    def download(self, state: dict) -> str:
+        with open(state["output_file_id"], encoding="utf-8") as f:
+            return f.read()
+
+
+def get_backend(name: str, work_dir: str):
+    if name == "local":
+        return LocalBatchBackend(os.path.join(work_dir, "local"))
+    return OpenAIBatchBackend()
+
+
+def run_batch(
+    lines: list,
+    backend,
+    work_dir: str,
+    poll_interval: float = LLM_BATCH_POLL_SECONDS,
+    timeout: Optional[float] = None,
+    sleep: Callable[[float], None] = time.sleep,
+) -> dict:
+    """
+    Submit `lines` (request_line() dicts) as one batch and wait for it.
+    Returns {custom_id: content or Exception}; requests missing from the
+    output come back as errors. Raises BatchError if the batch itself fails
+    and TimeoutError if `timeout` passes first (re-run to keep waiting).
+    Requests already answered successfully in work_dir are not resubmitted;
+    failed ones are.
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    requests_path = os.path.join(work_dir, "requests.jsonl")
+    state_path = os.path.join(work_dir, "batch.json")
+    results_path = os.path.join(work_dir, "results.jsonl")
+
+    state = {}
+    if os.path.exists(state_path):
+        with open(state_path, encoding="utf-8") as f:
+            state = json.load(f)
+
+    # Answer what earlier batches already answered for the identical request
+    answered = state.get("answered", {})  # custom_id -> request hash of the result on file
+    reused = {}
+    if answered and os.path.exists(results_path):
+        with open(results_path, encoding="utf-8") as f:
+            previous = parse_results(f)
+        for line in lines:
+            cid = line["custom_id"]
+            if answered.get(cid) == _request_hash(line) and isinstance(previous.get(cid), str):
+                reused[cid] = previous[cid]
+    lines = [line for line in lines if line["custom_id"] not in reused]
+    if reused:
+        print(f"[Batch] Reusing {len(reused)} result(s) from earlier batches")
+    if not lines:
+        return reused
+
+    payload = "".join(json.dumps(line, sort_keys=True) + "\n" for line in lines)
+    digest = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    if state.get("requests_sha256") != digest or state.get("backend") != backend.name:
+        # New or changed job: submit a fresh batch
+        with open(requests_path, "w", encoding="utf-8") as f:
+            f.write(payload)
+        state = {"backend": backend.name, "requests_sha256": digest, "requests": len(lines),
+                 "batch_id": backend.submit(requests_path, {"source": os.path.basename(work_dir)}),
+                 "answered": answered}
+        _save_state(state_path, state)
+        print(f"[Batch] Submitted {len(lines)} request(s) as {state['batch_id']}")
+    else:
+        print(f"[Batch] Resuming {state['batch_id']}")
+
+    started = time.monotonic()
+    while True:
+        status = backend.poll(state["batch_id"])
+        state.update(status)
+        _save_state(state_path, state)
+        if status["status"] in _FINAL_STATES:
+            break
+        if timeout is not None and time.monotonic() - started >= timeout:
+            raise TimeoutError(f"batch {state['batch_id']} still {status['status']}; re-run to keep waiting")
+        print(f"[Batch] {state['batch_id']} {status['status']}: "
+              f"{status.get('completed', 0)}/{status.get('total') or len(lines)} done")
+        sleep(poll_interval)
+
+    if status["status"] != "completed":
+        raise BatchError(f"batch {state['batch_id']} {status['status']}")
+    text = backend.download(state)
+    with open(results_path, "a", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    answered.update((line["custom_id"], _request_hash(line)) for line in lines)
+    state["answered"] = answered
+    _save_state(state_path, state)
+    results = _with_missing(parse_results(text.splitlines()), lines)
+    failed = sum(isinstance(r, Exception) for r in results.values())
+    print(f"[Batch] {state['batch_id']} completed: {len(results) - failed} ok, {failed} failed")
+    results.update(reused)
+    return results
+
+
+def _request_hash(line: dict) -> str:
+    return hashlib.sha256(json.dumps(line, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def _with_missing(results: dict, lines: list) -> dict:
+    for line in lines:
+        results.setdefault(line["custom_id"], RuntimeError("no result in batch output"))
+    return results
+
+
+def _save_state(path: str, state: dict) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, path)
@@ -0,0 +1,183 @@
+"""
+llm_cache.py
+
+Content-addressed cache for chat completions, stored in SQLite.
+
+Identical requests — retries, duplicate deliveries that slip past dedup, and
+the offline test scripts replaying the same scenarios — are answered from disk
+instead of OpenAI. The key is a SHA-256 of (model, temperature, every message's
+role + content, response options), so any prompt change is a miss.
+
+- Size-bounded: least-recently-used rows are evicted past LLM_CACHE_MAX_ENTRIES
+- TTL: rows older than LLM_CACHE_TTL_SECONDS are ignored and pruned
+- On by default when APP_ENV is "test" or "benchmark"; opt-in in production
+  (LLM_CACHE_ENABLED=1) with a short default TTL
+
+Env vars:
+- APP_ENV (production | test | benchmark, default production)
+- LLM_CACHE_ENABLED (1/0 — overrides the APP_ENV default)
+- LLM_CACHE_TTL_SECONDS (default 7 days in test/benchmark, 5 minutes in production)
+- LLM_CACHE_MAX_ENTRIES (default 5000)
+- LLM_CACHE_PATH (default tools/logs/llm_cache.sqlite3)
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+APP_ENV = os.getenv("APP_ENV", "production").lower()
+_OFFLINE_MODE = APP_ENV in ("test", "benchmark")
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1" if _OFFLINE_MODE else "0") == "1"
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 86400 if _OFFLINE_MODE else 300)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+LLM_CACHE_PATH = os.getenv(
+    "LLM_CACHE_PATH",
+    os.path.join(os.path.dirname(__file__), "logs", "llm_cache.sqlite3"),
+)
+
+
+def cache_key(model: str, temperature: float, messages: list, **options) -> str:
+    """Stable hash of everything that determines the completion."""
+    material = {
+        "model": model,
+        "temperature": round(float(temperature), 4),
+        "messages": [(m.get("role"), m.get("content")) for m in messages],
+        "options": options,
+    }
+    blob = json.dumps(material, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """SQLite-backed LRU with TTL. Safe to share across threads."""
+
+    def __init__(
+        self,
+        path: str = LLM_CACHE_PATH,
+        ttl_seconds: float = LLM_CACHE_TTL_SECONDS,
+        max_entries: int = LLM_CACHE_MAX_ENTRIES,
+    ):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._puts_since_evict = 0
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn().executescript(
+            """
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                content TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache(last_used);
+            """
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        try:
+            row = self._conn().execute(
+                "SELECT content FROM llm_cache WHERE key = ? AND created_at > ?",
+                (key, now - self.ttl_seconds),
+            ).fetchone()
+            if row is None:
+                self._count(hit=False)
+                return None
+            self._conn().execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key))
+            self._count(hit=True)
+            return row[0]
+        except sqlite3.Error as e:
+            logger.warning(f"[LLM cache] read failed: {e}")
+            self._count(hit=False)
+            return None
+
+    def _count(self, hit: bool) -> None:
+        with self._write_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def put(self, key: str, content: str, model: str = "") -> None:
+        now = time.time()
+        try:
+            with self._write_lock:
+                self._conn().execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, model, content, created_at, last_used) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, model, content, now, now),
+                )
+                self._puts_since_evict += 1
+                # Evicting on every put would turn each miss into a table scan
+                if self._puts_since_evict >= 50:
+                    self._puts_since_evict = 0
+                    self._evict(now)
+        except sqlite3.Error as e:
+            logger.warning(f"[LLM cache] write failed: {e}")
+
+    def _evict(self, now: float) -> None:
+        conn = self._conn()
+        conn.execute("DELETE FROM llm_cache WHERE created_at <= ?", (now - self.ttl_seconds,))
+        conn.execute(
+            "DELETE FROM llm_cache WHERE key IN ("
+            "  SELECT key FROM llm_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?"
+            ")",
+            (self.max_entries,),
+        )
+
+    def stats(self) -> dict:
+        with self._write_lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            "enabled": True,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+            "ttl_seconds": self.ttl_seconds,
+        }
+
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> Optional[ResponseCache]:
+    """Process-wide cache, or None when caching is disabled."""
+    global _cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+            logger.info(f"[LLM cache] enabled ({APP_ENV}, ttl={LLM_CACHE_TTL_SECONDS:.0f}s) at {LLM_CACHE_PATH}")
+        return _cache
+
+
+def cache_stats() -> dict:
+    cache = _cache if LLM_CACHE_ENABLED else None
+    return cache.stats() if cache else {"enabled": False}
@@ -0,0 +1,428 @@
+"""
+llm_gateway.py
+
+Single entry point for every OpenAI chat completion made by the Python tools.
+
+- chat(): synchronous call used by the webhook threads and the batch CLIs
+- chat_stream(): same as chat() but yields content deltas as they arrive
+- achat(): asyncio path backed by AsyncOpenAI, sharing the same limits
+- Bounded concurrency: at most LLM_MAX_CONCURRENCY requests in flight
+- Priority queue: when slots are scarce, escalations and booking turns go
+  first, regular replies next, bulk outreach and follow-up generation last
+- Token-per-minute limiter so a reply spike queues here instead of
+  turning into a wall of 429s
+- 429 handling: honours Retry-After and retries within the caller's timeout
+- Circuit breaker: when OpenAI keeps failing, calls are rejected instantly
+  with CircuitOpenError so callers can send their canned fallback. Only
+  timeouts, connection errors, 5xx and exhausted 429 retries count as
+  failures; 4xx errors (bad request, auth, context length) don't
+- Response cache: identical requests are served from llm_cache.py when it is
+  enabled (default in test/benchmark mode), skipping the queue entirely
+
+Env vars:
+- OPENAI_API_KEY
+- LLM_MAX_CONCURRENCY (default 8)
+- LLM_TOKENS_PER_MINUTE (default 200000, 0 disables the limiter)
+- LLM_MAX_RETRIES (429 retries per request, default 3)
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import re
+import threading
+import time
+from types import SimpleNamespace
+from typing import Optional
+
+from openai import APIConnectionError, AsyncOpenAI, OpenAI, RateLimitError
+
+from tools.circuit_breaker import OPEN, CircuitOpenError, get_breaker
+from tools.deadline import DeadlineExceeded, mark_admitted
+from tools.llm_cache import cache_key, cache_stats, get_cache
+
+logger = logging.getLogger(__name__)
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "200000"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+
+# Lower number = served first
+PRIORITY_ESCALATION = 0
+PRIORITY_BOOKING = 1
+PRIORITY_REPLY = 2
+PRIORITY_BATCH = 3
+PRIORITY_FOLLOWUP = 4
+
+# Assumed completion size when the caller doesn't cap max_tokens
+_DEFAULT_COMPLETION_TOKENS = 600
+
+client = OpenAI()  # uses OPENAI_API_KEY env variable
+_async_client: Optional[AsyncOpenAI] = None
+
+
+class _PrioritySlots:
+    """Counting semaphore that hands free slots to the highest-priority waiter."""
+
+    def __init__(self, size: int):
+        self._free = size
+        self._cond = threading.Condition()
+        self._waiters: list[tuple[int, int]] = []  # heap of (priority, seq)
+        self._seq = itertools.count()
+
+    def acquire(self, priority: int, timeout: float) -> bool:
+        end = time.monotonic() + timeout
+        with self._cond:
+            ticket = (priority, next(self._seq))
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while not (self._free > 0 and self._waiters[0] == ticket):
+                    remaining = end - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+                self._free -= 1
+                return True
+            finally:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+    def release(self) -> None:
+        with self._cond:
+            self._free += 1
+            self._cond.notify_all()
+
+    def queue_depth(self) -> int:
+        with self._cond:
+            return len(self._waiters)
+
+
+class _TokenBucket:
+    """Tokens-per-minute limiter; refills continuously."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = per_minute
+        self._tokens = float(per_minute)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.capacity / 60.0)
+        self._updated = now
+
+    def take(self, tokens: int, timeout: float) -> bool:
+        if self.capacity <= 0:
+            return True
+        tokens = min(tokens, self.capacity)
+        end = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                wait_for = (tokens - self._tokens) * 60.0 / self.capacity
+            if time.monotonic() + wait_for > end:
+                return False
+            time.sleep(min(wait_for, 1.0))
+
+    def pause(self, seconds: float) -> None:
+        """Drain the bucket after a 429 so other callers back off too."""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, 0) - seconds * self.capacity / 60.0
+
+
+_slots = _PrioritySlots(LLM_MAX_CONCURRENCY)
+_bucket = _TokenBucket(LLM_TOKENS_PER_MINUTE)
+_breaker = get_breaker("openai")
+
+_stats_lock = threading.Lock()
+_stats = {"requests": 0, "rate_limited": 0, "queue_timeouts": 0}
+
+
+def _incr(key: str) -> None:
+    with _stats_lock:
+        _stats[key] += 1
+
+
+def gateway_stats() -> dict:
+    with _stats_lock:
+        snapshot = dict(_stats)
+    snapshot["queue_depth"] = _slots.queue_depth()
+    snapshot["max_concurrency"] = LLM_MAX_CONCURRENCY
+    snapshot["cache"] = cache_stats()
+    return snapshot
+
+
+def _cached_response(content: str) -> SimpleNamespace:
+    """Minimal stand-in for a ChatCompletion built from a cached body."""
+    message = SimpleNamespace(content=content, role="assistant")
+    return SimpleNamespace(choices=[SimpleNamespace(message=message, index=0)], cached=True)
+
+
+def _cache_lookup(use_cache: bool, model: str, temperature: float, messages: list, kwargs: dict):
+    """Returns (cache, key, cached_response_or_None)."""
+    cache = get_cache() if use_cache else None
+    if cache is None:
+        return None, None, None
+    key = cache_key(model, temperature, messages, **kwargs)
+    hit = cache.get(key)
+    return cache, key, (_cached_response(hit) if hit is not None else None)
+
+
+def _cache_store(cache, key: Optional[str], model: str, response) -> None:
+    if cache is None or key is None:
+        return
+    content = response.choices[0].message.content
+    if content:
+        cache.put(key, content, model)
+
+
+def estimate_tokens(messages: list, max_tokens: Optional[int] = None) -> int:
+    """Rough prompt+completion estimate (~4 chars per token)."""
+    prompt_chars = sum(len(m.get("content") or "") for m in messages)
+    return prompt_chars // 4 + (max_tokens or _DEFAULT_COMPLETION_TOKENS)
+
+
+def _retry_after(err: RateLimitError) -> float:
+    headers = getattr(getattr(err, "response", None), "headers", None) or {}
+    for key in ("retry-after-ms", "retry-after"):
+        value = headers.get(key)
+        if value:
+            try:
+                seconds = float(value)
+                return seconds / 1000.0 if key.endswith("-ms") else seconds
+            except ValueError:
+                pass
+    return 2.0
+
+
+def _record_error(err: Exception) -> None:
+    """
+    Count an error against the breaker only if it says OpenAI is unhealthy:
+    timeouts, connection errors and 5xx. A 4xx (bad request, auth, context
+    length) means OpenAI answered, so it closes a half-open trial instead.
+    """
+    status = getattr(err, "status_code", None)
+    if isinstance(err, (APIConnectionError, TimeoutError, ConnectionError)) or (status is not None and status >= 500):
+        _breaker.record_failure()
+    else:
+        _breaker.record_success()
+
+
+def _admit(messages: list, priority: int, max_tokens: Optional[int], timeout: float) -> float:
+    """
+    Wait for a concurrency slot and token budget, then pass the breaker.
+    Returns the time left; the caller owns the slot and must release it.
+    """
+    # Don't queue at all for a dependency we already know is down
+    if _breaker.state == OPEN:
+        raise CircuitOpenError("openai circuit is open — failing fast")
+    end = time.monotonic() + timeout
+    if not _slots.acquire(priority, timeout):
+        _incr("queue_timeouts")
+        raise DeadlineExceeded(f"LLM queue wait exceeded {timeout:.1f}s (priority {priority})")
+    if not _bucket.take(estimate_tokens(messages, max_tokens), max(end - time.monotonic(), 0)):
+        _slots.release()
+        _incr("queue_timeouts")
+        raise DeadlineExceeded(f"LLM token budget unavailable within {timeout:.1f}s")
+    if not _breaker.allow():
+        _slots.release()
+        raise CircuitOpenError("openai circuit is open — failing fast")
+    return max(end - time.monotonic(), 0.1)
+
+
+def chat(
+    messages: list,
+    model: str,
+    temperature: float = 0.3,
+    priority: int = PRIORITY_REPLY,
+    timeout: float = 30,
+    use_cache: bool = True,
+    **kwargs,
+):
+    """
+    Queue, rate-limit and send one chat completion. Returns the raw response.
+    Raises DeadlineExceeded if it can't be admitted and answered within timeout,
+    CircuitOpenError if OpenAI is currently marked unhealthy.
+    use_cache=False skips the response cache for this call.
+    """
+    end = time.monotonic() + timeout
+    cache, key, cached = _cache_lookup(use_cache, model, temperature, messages, kwargs)
+    if cached is not None:
+        return cached
+
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        remaining = _admit(messages, priority, kwargs.get("max_tokens"), max(end - time.monotonic(), 0))
+        mark_admitted()
+        _incr("requests")
+        try:
+            response = client.chat.completions.create(
+                model=model,
+                temperature=temperature,
+                messages=messages,
+                timeout=remaining,
+                **kwargs,
+            )
+            _breaker.record_success()
+            _cache_store(cache, key, model, response)
+            return response
+        except RateLimitError as e:
+            _incr("rate_limited")
+            wait_for = _retry_after(e)
+            _bucket.pause(wait_for)
+            if attempt == LLM_MAX_RETRIES or time.monotonic() + wait_for >= end:
+                # Still throttled after every retry: count it as an outage
+                _breaker.record_failure()
+                raise
+            # Throttled, but reachable — retry without tripping the breaker
+            _breaker.record_success()
+            logger.warning(f"[LLM] 429 from OpenAI — retrying in {wait_for:.1f}s (attempt {attempt + 1})")
+        except Exception as e:
+            _record_error(e)
+            raise
+        finally:
+            _slots.release()
+        time.sleep(wait_for)
+
+
+def chat_stream(
+    messages: list,
+    model: str,
+    temperature: float = 0.3,
+    priority: int = PRIORITY_REPLY,
+    timeout: float = 30,
+    use_cache: bool = True,
+    **kwargs,
+):
+    """
+    Streaming variant of chat(): yields content deltas as they arrive.
+    Same queueing, limits, breaker and cache (a hit is yielded as one chunk).
+    A 429 is only retried before the first delta; after that it is raised.
+    """
+    end = time.monotonic() + timeout
+    cache, key, cached = _cache_lookup(use_cache, model, temperature, messages, kwargs)
+    if cached is not None:
+        yield cached.choices[0].message.content
+        return
+
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        remaining = _admit(messages, priority, kwargs.get("max_tokens"), max(end - time.monotonic(), 0))
+        mark_admitted()
+        _incr("requests")
+        parts = []
+        try:
+            stream = client.chat.completions.create(
+                model=model,
+                temperature=temperature,
+                messages=messages,
+                timeout=remaining,
+                stream=True,
+                **kwargs,
+            )
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    yield delta
+            _breaker.record_success()
+            if cache is not None and parts:
+                cache.put(key, "".join(parts), model)
+            return
+        except RateLimitError as e:
+            _incr("rate_limited")
+            wait_for = _retry_after(e)
+            _bucket.pause(wait_for)
+            if parts or attempt == LLM_MAX_RETRIES or time.monotonic() + wait_for >= end:
+                _breaker.record_failure()
+                raise
+            _breaker.record_success()
+            logger.warning(f"[LLM] 429 from OpenAI — retrying stream in {wait_for:.1f}s (attempt {attempt + 1})")
+        except Exception as e:
+            _record_error(e)
+            raise
+        finally:
+            _slots.release()
+        time.sleep(wait_for)
+
+
+async def achat(
+    messages: list,
+    model: str,
+    temperature: float = 0.3,
+    priority: int = PRIORITY_REPLY,
+    timeout: float = 30,
+    use_cache: bool = True,
+    **kwargs,
+):
+    """Async twin of chat() for asyncio callers; shares slots and token budget."""
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncOpenAI()
+
+    end = time.monotonic() + timeout
+    cache, key, cached = _cache_lookup(use_cache, model, temperature, messages, kwargs)
+    if cached is not None:
+        return cached
+
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        remaining = await asyncio.to_thread(
+            _admit, messages, priority, kwargs.get("max_tokens"), max(end - time.monotonic(), 0)
+        )
+        _incr("requests")
+        try:
+            response = await _async_client.chat.completions.create(
+                model=model,
+                temperature=temperature,
+                messages=messages,
+                timeout=remaining,
+                **kwargs,
+            )
+            _breaker.record_success()
+            _cache_store(cache, key, model, response)
+            return response
+        except RateLimitError as e:
+            _incr("rate_limited")
+            wait_for = _retry_after(e)
+            _bucket.pause(wait_for)
+            if attempt == LLM_MAX_RETRIES or time.monotonic() + wait_for >= end:
+                # Still throttled after every retry: count it as an outage
+                _breaker.record_failure()
+                raise
+            # Throttled, but reachable — retry without tripping the breaker
+            _breaker.record_success()
+            logger.warning(f"[LLM] 429 from OpenAI — retrying in {wait_for:.1f}s (attempt {attempt + 1})")
+        except Exception as e:
+            _record_error(e)
+            raise
+        finally:
+            _slots.release()
+        await asyncio.sleep(wait_for)
+
+
+_ESCALATION_HINTS = re.compile(
+    r"\b(lawyer|attorney|sue|lawsuit|legal action|harass\w*|report you|complain\w*|scam\w*|fraud)\b",
+    re.IGNORECASE,
+)
+_BOOKING_HINTS = re.compile(
+    r"\b(meet(ing)?|appointment|schedule|reschedule|call me|tomorrow|tonight|"
+    r"monday|tuesday|wednesday|thursday|friday|saturday|sunday|\d{1,2}\s*(am|pm)|\d{1,2}:\d{2})\b",
+    re.IGNORECASE,
+)
+
+
+def priority_for_inbound(body: str, lead_details: Optional[dict] = None) -> int:
+    """
+    Pick a queue priority for an inbound reply before the model has classified it.
+    Likely escalations first, then turns that look like scheduling.
+    """
+    if _ESCALATION_HINTS.search(body or ""):
+        return PRIORITY_ESCALATION
+    if _BOOKING_HINTS.search(body or "") or (lead_details or {}).get("status") == "meeting_scheduled":
+        return PRIORITY_BOOKING
+    return PRIORITY_REPLY
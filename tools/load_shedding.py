@@ -0,0 +1,76 @@
+"""
+load_shedding.py
+
+Progressive degradation for AI replies when the AI lane backs up, so reply
+latency stays bounded during a spike instead of every turn timing out.
+
+Each reply turn is graded when it starts, from the AI lane's queue depth and
+how long the turn itself waited in the queue. Each step switches on when
+either reading reaches its threshold (a threshold of 0 disables that trigger),
+and every step below the one reached stays on:
+
+1. cheap_model: answer with SHED_MODEL instead of AI_MODEL
+2. skip_optional: skip the optional post-steps (OPTIONAL_STAGES)
+3. template_ack: send the Starter-plan templated acknowledgement, no AI call
+
+Env vars:
+- SHED_MODEL (model for step 1, default gpt-4o-mini)
+- SHED_CHEAP_MODEL_DEPTH / SHED_CHEAP_MODEL_WAIT_MS (default 32 / 5000)
+- SHED_SKIP_OPTIONAL_DEPTH / SHED_SKIP_OPTIONAL_WAIT_MS (default 64 / 10000)
+- SHED_TEMPLATE_ACK_DEPTH / SHED_TEMPLATE_ACK_WAIT_MS (default 128 / 20000)
+"""
+
+import os
+import threading
+
+SHED_MODEL = os.getenv("SHED_MODEL", "gpt-4o-mini")
+
+NONE = 0
+CHEAP_MODEL = 1
+SKIP_OPTIONAL = 2
+TEMPLATE_ACK = 3
+
+STEP_NAMES = {CHEAP_MODEL: "cheap_model", SKIP_OPTIONAL: "skip_optional", TEMPLATE_ACK: "template_ack"}
+
+# Reply stages a degraded turn may drop without affecting what the lead receives
+OPTIONAL_STAGES = frozenset({"qualification", "valuation", "agent_brief"})
+
+
+def _threshold(name: str, default: str) -> float:
+    return float(os.getenv(name, default))
+
+
+# level -> (queue depth threshold, queue wait threshold in ms)
+THRESHOLDS = {
+    CHEAP_MODEL: (_threshold("SHED_CHEAP_MODEL_DEPTH", "32"), _threshold("SHED_CHEAP_MODEL_WAIT_MS", "5000")),
+    SKIP_OPTIONAL: (_threshold("SHED_SKIP_OPTIONAL_DEPTH", "64"), _threshold("SHED_SKIP_OPTIONAL_WAIT_MS", "10000")),
+    TEMPLATE_ACK: (_threshold("SHED_TEMPLATE_ACK_DEPTH", "128"), _threshold("SHED_TEMPLATE_ACK_WAIT_MS", "20000")),
+}
+
+_counts_lock = threading.Lock()
+_counts = {level: 0 for level in (NONE, *STEP_NAMES)}
+
+
+def shed_level(queue_depth: int, queue_wait_ms: float, thresholds: dict = THRESHOLDS) -> int:
+    """Highest step whose depth or wait threshold has been reached (NONE if none)."""
+    level = NONE
+    for step, (depth_at, wait_at) in thresholds.items():
+        if (depth_at and queue_depth >= depth_at) or (wait_at and queue_wait_ms >= wait_at):
+            level = max(level, step)
+    return level
+
+
+def steps_for(level: int) -> list[str]:
+    """Names of every step in effect at `level`, mildest first."""
+    return [STEP_NAMES[step] for step in sorted(STEP_NAMES) if step <= level]
+
+
+def record(level: int) -> None:
+    with _counts_lock:
+        _counts[level] += 1
+
+
+def shed_stats() -> dict:
+    """Reply turns graded at each level since start."""
+    with _counts_lock:
+        return {STEP_NAMES.get(level, "none"): count for level, count in _counts.items()}
@@ -0,0 +1,208 @@
+"""
+message_pipeline.py
+
+Channel-agnostic engine for inbound lead messages.
+
+A Pipeline is an ordered list of named stages. Each stage takes the
+MessageContext, may fill in fields on it, and returns HALT to end the run
+early (opt-out handled, plan gate hit, DNC-blocked, ...). Stages named in
+mctx.skip are passed over (load shedding drops optional post-steps this way). Every stage is
+timed individually and the totals are exposed via pipeline_stats() for /health.
+
+Channels plug in through a ChannelAdapter (how to send, what the business
+number is, how long to debounce). The stages themselves live in
+reply_stages.py and are shared by WhatsApp, SMS and any future channel.
+
+- Debouncer: per-sender batching of rapid multi-texts into one AI turn
+"""
+
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Returned by a stage to stop the pipeline after it
+HALT = object()
+
+
+class ChannelAdapter(ABC):
+    """Receive/send hooks for one messaging channel. Subclasses must implement send()."""
+
+    name = "base"           # stored in messages.channel / follow_ups.channel
+    label = "Base"          # used in log lines and activity descriptions
+    debounce_seconds = 0.0  # 0 = queue the reply pipeline immediately
+
+    def business_number(self) -> str:
+        """Our number on this channel (passed to the model as the `to` number)."""
+        return ""
+
+    @abstractmethod
+    def send(self, to_number: str, body: str) -> dict:
+        """Send one message. Returns at least {"ok": bool}."""
+
+
+class MessageContext:
+    """Everything one inbound message accumulates on its way through the stages."""
+
+    def __init__(
+        self,
+        channel: ChannelAdapter,
+        phone: str,
+        body: str,
+        msg_id: str = "",
+        ts: str = "",
+        now: str = "",
+        msg_type: str = "text",
+        business_number: str = "",
+    ):
+        self.channel = channel
+        self.phone = phone
+        self.body = body
+        self.msg_id = msg_id
+        self.ts = ts
+        self.now = now
+        self.msg_type = msg_type
+        # Our number the lead wrote to (WhatsApp phone_number_id / Twilio "To")
+        self.business_number = business_number
+        # When the webhook accepted it — lanes may run messages out of arrival order
+        self.received = time.monotonic()
+        # When the reply turn was queued on the AI lane
+        self.enqueued: Optional[float] = None
+
+        # Filled in by stages
+        self.user: dict = {}
+        self.stop_requested = False
+        self.deadline = None
+        self.lookups = None
+        self.conversation_history: list = []
+        self.lead_details: Optional[dict] = None
+        self.campaign_context: Optional[str] = None
+        self.early_send = None
+        self.ai_result: dict = {}
+        self.reply_text: Optional[str] = None
+        self.quota: Optional[dict] = None
+        self.send_result: Optional[dict] = None
+        # Follow-ups this turn scheduled (lead_details predates them)
+        self.follow_ups_created = 0
+        self.timings: dict[str, float] = {}
+        self.halted_at: Optional[str] = None
+        # Set by load shedding
+        self.shed_level = 0
+        self.model: Optional[str] = None
+        self.skip: set[str] = set()
+
+    @property
+    def user_id(self) -> Optional[str]:
+        return self.user.get("user_id")
+
+
+_stats_lock = threading.Lock()
+_stats: dict[str, dict[str, dict]] = {}
+
+
+def _record(pipeline: str, stage: str, seconds: float, halted: bool, failed: bool) -> None:
+    with _stats_lock:
+        entry = _stats.setdefault(pipeline, {}).setdefault(
+            stage, {"runs": 0, "total_ms": 0.0, "max_ms": 0.0, "halts": 0, "errors": 0}
+        )
+        entry["runs"] += 1
+        entry["total_ms"] += seconds * 1000
+        entry["max_ms"] = max(entry["max_ms"], seconds * 1000)
+        entry["halts"] += int(halted)
+        entry["errors"] += int(failed)
+
+
+def pipeline_stats() -> dict:
+    """Per-pipeline, per-stage run counts and latency (avg/max ms)."""
+    with _stats_lock:
+        return {
+            pipeline: {
+                stage: {
+                    "runs": e["runs"],
+                    "avg_ms": round(e["total_ms"] / e["runs"], 1) if e["runs"] else 0.0,
+                    "max_ms": round(e["max_ms"], 1),
+                    "halts": e["halts"],
+                    "errors": e["errors"],
+                }
+                for stage, e in stages.items()
+            }
+            for pipeline, stages in _stats.items()
+        }
+
+
+class Pipeline:
+    def __init__(self, name: str, stages: Sequence[tuple[str, Callable[[MessageContext], object]]]):
+        self.name = name
+        self.stages = list(stages)
+
+    def run(self, mctx: MessageContext) -> MessageContext:
+        for stage_name, stage in self.stages:
+            if stage_name in mctx.skip:
+                continue
+            started = time.monotonic()
+            outcome = None
+            try:
+                outcome = stage(mctx)
+            except Exception:
+                _record(self.name, stage_name, time.monotonic() - started, False, True)
+                logger.exception(f"[Pipeline] {self.name}/{stage_name} failed for {mctx.channel.label} {mctx.phone}")
+                raise
+            elapsed = time.monotonic() - started
+            mctx.timings[stage_name] = elapsed
+            halted = outcome is HALT
+            _record(self.name, stage_name, elapsed, halted, False)
+            if halted:
+                mctx.halted_at = stage_name
+                break
+
+        parts = ", ".join(f"{k}={v * 1000:.0f}ms" for k, v in mctx.timings.items())
+        logger.debug(f"[Pipeline] {self.name} {mctx.channel.label} {mctx.phone}: {parts}"
+                     + (f" (halted at {mctx.halted_at})" if mctx.halted_at else ""))
+        return mctx
+
+
+class Debouncer:
+    """
+    Batches rapid messages from the same sender. Each new message restarts the
+    quiet-period timer; when it fires, flush_fn gets every buffered entry.
+    """
+
+    def __init__(self, seconds: float, flush_fn: Callable[[str, list], None]):
+        self.seconds = seconds
+        self._flush_fn = flush_fn
+        self._buffers: dict[str, list] = {}
+        self._timers: dict[str, threading.Timer] = {}
+        self._lock = threading.Lock()
+
+    def add(self, key: str, entry) -> None:
+        with self._lock:
+            existing_timer = self._timers.get(key)
+            if existing_timer:
+                existing_timer.cancel()
+            self._buffers.setdefault(key, []).append(entry)
+            timer = threading.Timer(self.seconds, self._flush, args=[key])
+            timer.daemon = True
+            timer.start()
+            self._timers[key] = timer
+
+    def cancel(self, key: str) -> None:
+        """Drop anything buffered for this sender (e.g. they just opted out)."""
+        with self._lock:
+            existing_timer = self._timers.pop(key, None)
+            if existing_timer:
+                existing_timer.cancel()
+            self._buffers.pop(key, None)
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._buffers)
+
+    def _flush(self, key: str) -> None:
+        with self._lock:
+            buffered = self._buffers.pop(key, [])
+            self._timers.pop(key, None)
+        if buffered:
+            self._flush_fn(key, buffered)
@@ -0,0 +1,274 @@
+"""
+national_dnc.py
+
+On-disk, memory-mapped copy of the FTC National Do Not Call Registry for
+scrubbing campaign lists from Python. The national_dnc table is far too big
+to query number by number; this file answers a lookup with two array reads
+and a binary search, without loading anything into the process heap.
+
+File layout (little-endian):
+- header: 8-byte magic, uint64 number count
+- index: 1001 uint64 offsets, one per area code 000-999 plus the end,
+  into the suffix array
+- suffixes: uint32 last-7-digits, sorted within each area code
+
+Four bytes per number (the full registry is roughly 1 GB). The file is
+opened read-only with mmap, so every worker process maps the same page-cache
+pages instead of holding its own copy.
+
+- build(): convert an FTC data file (one number per line; "201,5550123"
+  area-code/number pairs and formatted numbers are accepted) into the
+  registry file. Holds 4 bytes per number while reading; each large area
+  code is then sorted and deduplicated through a 1.25 MB bitmap rather than
+  a set of Python ints (small ones are sorted directly).
+- registry(): the shared read-only instance (None if no file is installed;
+  opening is retried every NATIONAL_DNC_RETRY_SECONDS until it succeeds)
+- is_on_national_dnc() / scrub(): same contract as app/lib/messaging/dnc-registry.ts,
+  including failing closed: without a registry every US number is blocked
+
+Usage:
+    python tools/national_dnc.py build ftc_dnc.txt [--out PATH]
+    python tools/national_dnc.py check +15551234567
+    python tools/national_dnc.py bench [--size 5000000] [--lookups 1000000]
+
+Env vars:
+- NATIONAL_DNC_PATH (registry file, default tools/data/national_dnc.bin)
+- NATIONAL_DNC_RETRY_SECONDS (wait before reopening a missing/bad file, default 60)
+"""
+
+import argparse
+import bisect
+import logging
+import mmap
+import os
+import random
+import re
+import struct
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+NATIONAL_DNC_PATH = os.getenv(
+    "NATIONAL_DNC_PATH", os.path.join(os.path.dirname(__file__), "data", "national_dnc.bin")
+)
+NATIONAL_DNC_RETRY_SECONDS = float(os.getenv("NATIONAL_DNC_RETRY_SECONDS", "60"))
+
+MAGIC = b"NDNCv1\x00\x00"
+AREA_CODES = 1000
+_HEADER = struct.Struct("<8sQ")
+_INDEX_OFFSET = _HEADER.size
+_DATA_OFFSET = _INDEX_OFFSET + 8 * (AREA_CODES + 1)
+_NON_DIGITS = re.compile(r"\D+")
+_SUFFIXES = 10 ** 7                 # 7-digit numbers per area code
+_SMALL_BUCKET = 1 << 16             # below this, sorting directly beats scanning the bitmap
+_BYTE_BITS = [tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256)]
+
+
+def normalize(phone: str) -> Optional[str]:
+    """10-digit US number (country code stripped), or None for anything else."""
+    digits = _NON_DIGITS.sub("", phone or "")
+    if len(digits) == 11 and digits.startswith("1"):
+        digits = digits[1:]
+    return digits if len(digits) == 10 else None
+
+
+def _sorted_unique(bucket: array) -> array:
+    """One area code's suffixes, sorted and deduplicated."""
+    if len(bucket) < _SMALL_BUCKET:
+        return array("I", sorted(set(bucket)))
+    bitmap = bytearray(_SUFFIXES // 8 + 1)
+    for suffix in bucket:
+        bitmap[suffix >> 3] |= 1 << (suffix & 7)
+    suffixes = array("I")
+    for pos, byte in enumerate(bitmap):
+        if byte:
+            base = pos << 3
+            suffixes.extend(base + bit for bit in _BYTE_BITS[byte])
+    return suffixes
+
+
+def build(source_path: str, out_path: str = NATIONAL_DNC_PATH) -> int:
+    """Build the registry file from an FTC data file. Returns the number of distinct numbers."""
+    buckets: dict[int, array] = {}
+    skipped = 0
+    with open(source_path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            number = normalize(line)
+            if number is None:
+                skipped += int(bool(line.strip()))
+                continue
+            area = int(number[:3])
+            bucket = buckets.get(area)
+            if bucket is None:
+                bucket = buckets[area] = array("I")
+            bucket.append(int(number[3:]))
+
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    tmp_path = f"{out_path}.tmp"
+    index = array("Q", [0] * (AREA_CODES + 1))
+    count = 0
+    with open(tmp_path, "wb") as out:
+        out.seek(_DATA_OFFSET)
+        for area in range(AREA_CODES):
+            index[area] = count
+            bucket = buckets.pop(area, None)
+            if bucket:
+                suffixes = _sorted_unique(bucket)
+                del bucket
+                if sys.byteorder != "little":
+                    suffixes.byteswap()
+                suffixes.tofile(out)
+                count += len(suffixes)
+        index[AREA_CODES] = count
+        if sys.byteorder != "little":
+            index.byteswap()
+        out.seek(0)
+        out.write(_HEADER.pack(MAGIC, count))
+        index.tofile(out)
+    os.replace(tmp_path, out_path)
+    if skipped:
+        logger.warning(f"[National DNC] Skipped {skipped} line(s) that aren't 10-digit US numbers")
+    logger.info(f"[National DNC] Built {out_path} with {count} numbers")
+    return count
+
+
+class NationalDnc:
+    """Read-only view over a registry file. Safe to share between threads."""
+
+    def __init__(self, path: str):
+        if sys.byteorder != "little":
+            raise RuntimeError("national DNC registry files are little-endian")
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # Truncated files (e.g. a copy still in progress) must not reach unpack_from
+        magic, self.count = _HEADER.unpack_from(self._mm, 0) if len(self._mm) >= _DATA_OFFSET else (None, 0)
+        if magic != MAGIC or len(self._mm) != _DATA_OFFSET + 4 * self.count:
+            self._mm.close()
+            raise ValueError(f"{path} is not a national DNC registry file")
+        view = memoryview(self._mm)
+        self._index = view[_INDEX_OFFSET:_DATA_OFFSET].cast("Q")
+        self._suffixes = view[_DATA_OFFSET:].cast("I")
+
+    def _contains(self, number: str) -> bool:
+        area = int(number[:3])
+        start, end = self._index[area], self._index[area + 1]
+        suffix = int(number[3:])
+        pos = bisect.bisect_left(self._suffixes, suffix, start, end)
+        return pos < end and self._suffixes[pos] == suffix
+
+    def __contains__(self, phone: str) -> bool:
+        number = normalize(phone)
+        return number is not None and self._contains(number)
+
+    def scrub(self, phones: Iterable[str]) -> set:
+        """The subset of `phones` on the registry. Non-US numbers are never on it."""
+        blocked = set()
+        for phone in phones:
+            number = normalize(phone)
+            if number is not None and self._contains(number):
+                blocked.add(phone)
+        return blocked
+
+    def close(self) -> None:
+        self._index.release()
+        self._suffixes.release()
+        self._mm.close()
+
+
+_registry: Optional[NationalDnc] = None
+_registry_lock = threading.Lock()
+_registry_retry_at = 0.0  # monotonic time of the next open attempt while unavailable
+
+
+def registry() -> Optional[NationalDnc]:
+    """
+    The shared registry for NATIONAL_DNC_PATH, opened on first use. None if
+    it's unavailable; the open is retried after NATIONAL_DNC_RETRY_SECONDS,
+    so installing the file later doesn't need a restart.
+    """
+    global _registry, _registry_retry_at
+    with _registry_lock:
+        if _registry is None and time.monotonic() >= _registry_retry_at:
+            try:
+                _registry = NationalDnc(NATIONAL_DNC_PATH)
+                logger.info(f"[National DNC] Mapped {_registry.count} numbers from {NATIONAL_DNC_PATH}")
+            except (OSError, ValueError, RuntimeError, struct.error) as e:
+                _registry_retry_at = time.monotonic() + NATIONAL_DNC_RETRY_SECONDS
+                logger.error(f"[National DNC] Registry unavailable ({e}) — blocking all US numbers, "
+                             f"retrying in {NATIONAL_DNC_RETRY_SECONDS:.0f}s")
+        return _registry
+
+
+def is_on_national_dnc(phone: str) -> bool:
+    """True if the number must not be called or texted. Fails closed without a registry."""
+    if normalize(phone) is None:
+        return False
+    reg = registry()
+    return True if reg is None else phone in reg
+
+
+def scrub(phones: Iterable[str]) -> set:
+    """Numbers in `phones` that are on the registry (every US number if there is no registry)."""
+    phones = list(phones)
+    reg = registry()
+    if reg is None:
+        return {phone for phone in phones if normalize(phone) is not None}
+    return reg.scrub(phones)
+
+
+def _bench(size: int, lookups: int) -> None:
+    rng = random.Random(42)
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "ftc.txt")
+        with open(source, "w") as f:
+            for _ in range(size):
+                f.write(f"{rng.randint(201, 989)},{rng.randint(2000000, 9999999)}\n")
+        started = time.perf_counter()
+        count = build(source, os.path.join(tmp, "national_dnc.bin"))
+        print(f"build: {count:,} numbers in {time.perf_counter() - started:.1f}s "
+              f"({os.path.getsize(os.path.join(tmp, 'national_dnc.bin')) / 1e6:.1f} MB)")
+
+        reg = NationalDnc(os.path.join(tmp, "national_dnc.bin"))
+        phones = [f"+1{rng.randint(201, 989)}{rng.randint(2000000, 9999999)}" for _ in range(lookups)]
+        started = time.perf_counter()
+        hits = sum(phone in reg for phone in phones)
+        elapsed = time.perf_counter() - started
+        print(f"lookup: {lookups:,} in {elapsed:.2f}s ({lookups / elapsed:,.0f}/s, {hits:,} on the registry)")
+        started = time.perf_counter()
+        blocked = reg.scrub(phones)
+        elapsed = time.perf_counter() - started
+        print(f"scrub:  {lookups:,} in {elapsed:.2f}s ({lookups / elapsed:,.0f}/s, {len(blocked):,} blocked)")
+        reg.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query the memory-mapped National DNC registry.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build_cmd = sub.add_parser("build", help="Build the registry file from an FTC data file")
+    build_cmd.add_argument("source", help="FTC data file, one number per line")
+    build_cmd.add_argument("--out", default=NATIONAL_DNC_PATH, help="Registry file to write")
+    check_cmd = sub.add_parser("check", help="Check numbers against the registry")
+    check_cmd.add_argument("phones", nargs="+")
+    bench_cmd = sub.add_parser("bench", help="Build a synthetic registry and time lookups")
+    bench_cmd.add_argument("--size", type=int, default=5_000_000, help="Numbers in the synthetic registry")
+    bench_cmd.add_argument("--lookups", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.command == "build":
+        build(args.source, args.out)
+    elif args.command == "check":
+        for phone in args.phones:
+            print(f"{phone}: {'on the registry' if is_on_national_dnc(phone) else 'clear'}")
+    else:
+        _bench(args.size, args.lookups)
+
+
+if __name__ == "__main__":
+    main()
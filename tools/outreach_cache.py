@@ -0,0 +1,94 @@
+"""
+outreach_cache.py
+
+On-disk cache for generated outreach copy (sms_text, email_subject,
+email_body, call_opener, voicemail_script) in ai_listing_agent_full.py.
+Re-running a campaign with the same template and lead fields builds the
+same prompt, so the copy is served from disk instead of OpenAI.
+
+- Content-addressed: the key is llm_cache.cache_key() over model,
+  temperature and the messages built from build_prompt(), so editing the
+  template, agent details or lead fields is a miss
+- Stored with llm_cache.ResponseCache in its own file, with a campaign-sized
+  TTL and entry limit (independent of the gateway's short-lived cache)
+- Modes: "use" (read, then write misses), "refresh" (skip reads, overwrite
+  with fresh copy), "cache_only" (never call OpenAI; a miss raises CacheMiss)
+- stats() / summary(): hits, misses, refreshed and stored counts
+
+Env vars:
+- OUTREACH_CACHE_PATH (default tools/logs/outreach_cache.sqlite3)
+- OUTREACH_CACHE_TTL_SECONDS (default 30 days)
+- OUTREACH_CACHE_MAX_ENTRIES (default 100000)
+"""
+
+import os
+import threading
+from typing import Optional
+
+from tools.llm_cache import ResponseCache, cache_key
+
+OUTREACH_CACHE_PATH = os.getenv(
+    "OUTREACH_CACHE_PATH",
+    os.path.join(os.path.dirname(__file__), "logs", "outreach_cache.sqlite3"),
+)
+OUTREACH_CACHE_TTL_SECONDS = float(os.getenv("OUTREACH_CACHE_TTL_SECONDS", str(30 * 86400)))
+OUTREACH_CACHE_MAX_ENTRIES = int(os.getenv("OUTREACH_CACHE_MAX_ENTRIES", "100000"))
+
+MODES = ("use", "refresh", "cache_only")
+
+
+class CacheMiss(Exception):
+    """cache_only mode and the copy for this prompt was never generated."""
+
+
+class OutreachCache:
+    def __init__(self, mode: str = "use", path: str = OUTREACH_CACHE_PATH,
+                 ttl_seconds: float = OUTREACH_CACHE_TTL_SECONDS, max_entries: int = OUTREACH_CACHE_MAX_ENTRIES):
+        if mode not in MODES:
+            raise ValueError(f"unknown cache mode {mode!r}")
+        self.mode = mode
+        self._store = ResponseCache(path, ttl_seconds=ttl_seconds, max_entries=max_entries)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "refreshed": 0, "stored": 0}
+
+    def _incr(self, key: str) -> None:
+        with self._lock:
+            self._stats[key] += 1
+
+    @staticmethod
+    def key(model: str, temperature: float, messages: list, **options) -> str:
+        return cache_key(model, temperature, messages, **options)
+
+    def lookup(self, key: str) -> Optional[str]:
+        """Cached copy, or None if it should be generated (raises CacheMiss in cache_only mode)."""
+        if self.mode == "refresh":
+            self._incr("refreshed")
+            return None
+        content = self._store.get(key)
+        if content is not None:
+            self._incr("hits")
+            return content
+        self._incr("misses")
+        if self.mode == "cache_only":
+            raise CacheMiss("outreach copy not cached (--cache-only)")
+        return None
+
+    def store(self, key: str, content: Optional[str], model: str = "") -> None:
+        if content:
+            self._store.put(key, content, model)
+            self._incr("stored")
+
+    def stats(self) -> dict:
+        with self._lock:
+            snapshot = dict(self._stats)
+        looked_up = snapshot["hits"] + snapshot["misses"]
+        snapshot["hit_rate"] = round(snapshot["hits"] / looked_up, 4) if looked_up else 0.0
+        snapshot["mode"] = self.mode
+        return snapshot
+
+    def summary(self) -> str:
+        s = self.stats()
+        line = f"Outreach cache ({s['mode']}): {s['hits']} hits, {s['misses']} misses ({s['hit_rate']:.0%} hit rate)"
+        if s["refreshed"]:
+            line += f", {s['refreshed']} refreshed"
+        return line + f", {s['stored']} stored"
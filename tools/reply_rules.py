@@ -0,0 +1,189 @@
+"""
+reply_rules.py
+
+Table-driven post-processor for AI replies.
+
+GPT-4o has habits the prompt can't fully prevent ("Got it, Ahmad.", the same
+opener three turns in a row, "Let me know if there's anything else!"). Each
+fix is a rule; rules are compiled once at import and applied in order.
+
+- DEFAULT_RULES: the built-in rule set used for every tenant
+- rules_for_config(ai_config): defaults + the tenant's own "reply_rules"
+  (compiled once per distinct rule list and cached)
+- RuleSet.apply(): returns the cleaned reply and the names of rules that fired
+
+Tenant rules live in ai_config.reply_rules as a list of
+{"name": ..., "pattern": ..., "replacement": ..., "ignore_case": bool}.
+"""
+
+import json
+import logging
+import re
+import threading
+from typing import Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+
+class RegexRule:
+    """Substitute every (or the first `count`) match of a precompiled pattern."""
+
+    def __init__(self, name: str, pattern: str, replacement: str, flags: int = 0, count: int = 0):
+        self.name = name
+        self.pattern = re.compile(pattern, flags)
+        self.replacement = replacement
+        self.count = count
+
+    def apply(self, reply: str, ctx: "ReplyContext") -> str:
+        return self.pattern.sub(self.replacement, reply, count=self.count)
+
+
+class OpenerDedupRule:
+    """Swap the reply's opener when one of the last few agent replies used it."""
+
+    def __init__(self, name: str, alternatives: dict, default_swaps: Sequence[str], opener_pattern: str):
+        self.name = name
+        self.alternatives = alternatives
+        self.default_swaps = list(default_swaps)
+        self.opener_pattern = re.compile(opener_pattern)
+        # Precompute each swap's opener word once instead of per call
+        self._swap_openers = {
+            swap: swap.split()[0].rstrip(".,!—").lower()
+            for swaps in list(alternatives.values()) + [self.default_swaps]
+            for swap in swaps
+        }
+
+    def apply(self, reply: str, ctx: "ReplyContext") -> str:
+        current = _opener(reply)
+        if not current:
+            return reply
+        recent = ctx.recent_openers
+        if current not in recent:
+            return reply
+        for swap in self.alternatives.get(current, self.default_swaps):
+            if self._swap_openers[swap] not in recent:
+                return self.opener_pattern.sub(swap + " ", reply, count=1)
+        return reply
+
+
+def _opener(text: str) -> str:
+    words = text.split(None, 1)
+    return words[0].rstrip(".,!").lower() if words else ""
+
+
+class ReplyContext:
+    """Per-reply inputs, derived lazily so rules that don't need history don't pay for it."""
+
+    def __init__(self, conversation_history: Optional[list] = None, window: int = 3):
+        self._history = conversation_history or []
+        self._window = window
+        self._recent_openers: Optional[set] = None
+
+    @property
+    def recent_openers(self) -> set:
+        if self._recent_openers is None:
+            recent = [
+                m.get("body", "") for m in self._history
+                if m.get("direction") == "outbound"
+            ][-self._window:]
+            self._recent_openers = {_opener(body) for body in recent if body.strip()}
+        return self._recent_openers
+
+
+class RuleSet:
+    def __init__(self, rules: Sequence):
+        self.rules = list(rules)
+
+    def extend(self, extra: Sequence) -> "RuleSet":
+        return RuleSet(self.rules + list(extra))
+
+    def apply(self, reply: str, conversation_history: Optional[list] = None) -> tuple[str, list[str]]:
+        """Run every rule in order. Returns (cleaned_reply, names_of_rules_that_changed_it)."""
+        ctx = ReplyContext(conversation_history)
+        fired = []
+        for rule in self.rules:
+            updated = rule.apply(reply, ctx)
+            if updated != reply:
+                fired.append(rule.name)
+                reply = updated
+        return reply.strip(), fired
+
+
+DEFAULT_RULES = RuleSet([
+    # Strip name from "Got it, [Name]" openers — GPT-4o ignores the ban
+    RegexRule(
+        "strip_name_opener",
+        r"^(Got it|Perfect|Great|Sounds good),?\s+[A-Z][a-z]+[.!]?\s*",
+        r"\1. ",
+    ),
+    # De-duplicate openers — don't start 2+ replies in a row with the same word
+    OpenerDedupRule(
+        "dedupe_opener",
+        alternatives={
+            "got": ["Right —", "Makes sense.", "Okay,"],
+            "great": ["Nice.", "Love it —", "Perfect."],
+            "perfect": ["Great.", "Sounds good.", "Nice —"],
+            "sounds": ["Right.", "Makes sense.", "Perfect."],
+            "right": ["Got it.", "Makes sense.", "So,"],
+            "makes": ["Right.", "Got it.", "Okay,"],
+            "nice": ["Great.", "Love it.", "Perfect."],
+        },
+        default_swaps=["So,", "Right —", "Okay,"],
+        opener_pattern=r"^(Got it|Perfect|Great|Sounds good|Right|Makes sense|Nice|Okay)[.,!—\s]*",
+    ),
+    # Strip conversation killers that slip through
+    RegexRule(
+        "kill_let_me_know",
+        r"[.!]\s*Let me know if there'?s anything( else)?( you need| I can help with)?[.!]?\s*$",
+        ".",
+        re.IGNORECASE,
+    ),
+    RegexRule(
+        "kill_anything_you_need",
+        r"[.!]\s*If there'?s anything( specific)? you need( from me)?,?\s*(just )?let me know[.!]?\s*$",
+        ".",
+        re.IGNORECASE,
+    ),
+    RegexRule(
+        "kill_dont_hesitate",
+        r"[.!]\s*Don'?t hesitate to reach out[.!]?\s*$",
+        ".",
+        re.IGNORECASE,
+    ),
+])
+
+_TENANT_CACHE: dict[str, RuleSet] = {}
+_TENANT_CACHE_LOCK = threading.Lock()
+_TENANT_CACHE_MAX = 256
+
+
+def rules_for_config(ai_config: Optional[dict]) -> RuleSet:
+    """DEFAULT_RULES plus the tenant's custom rules, compiled once per distinct rule list."""
+    custom = (ai_config or {}).get("reply_rules") or []
+    if not custom:
+        return DEFAULT_RULES
+
+    cache_key = json.dumps(custom, sort_keys=True)
+    with _TENANT_CACHE_LOCK:
+        cached = _TENANT_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+
+    extra = []
+    for i, spec in enumerate(custom):
+        try:
+            extra.append(RegexRule(
+                f"tenant:{spec.get('name') or i}",
+                spec["pattern"],
+                spec.get("replacement", ""),
+                re.IGNORECASE if spec.get("ignore_case", True) else 0,
+            ))
+        except (KeyError, TypeError, re.error) as e:
+            logger.warning(f"Skipping invalid tenant reply rule {spec!r}: {e}")
+
+    ruleset = DEFAULT_RULES.extend(extra)
+    with _TENANT_CACHE_LOCK:
+        if len(_TENANT_CACHE) >= _TENANT_CACHE_MAX:
+            _TENANT_CACHE.clear()
+        _TENANT_CACHE[cache_key] = ruleset
+    return ruleset
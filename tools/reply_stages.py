@@ -0,0 +1,727 @@
+"""
+reply_stages.py
+
+The stages every inbound lead message goes through, for any channel.
+Assembled into two pipelines (see message_pipeline.py):
+
+- INGEST_PIPELINE: runs on a priority lane (lanes.py) for each raw message —
+  resolve tenant, non-text ack, inbound logging, STOP/re-opt-in compliance,
+  then hand off to the channel's debouncer (or queue the reply right away)
+- REPLY_PIPELINE: one AI turn — plan gate, load shedding, context lookups,
+  analyze_with_ai, stop/escalation handling, DNC/quota + send, qualification,
+  meetings, follow-ups, valuation tasks, outbound logging, follow-up
+  cancellation; queued on the AI lane under the tenant's plan-weighted
+  fair share
+
+Also home to the helpers both channels share (tenant resolution, CSV logs,
+message logging, follow-up cancellation).
+"""
+
+import csv
+import fcntl
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional
+
+from tools.ai_inbound_agent import EarlyReplyDispatcher, analyze_with_ai, is_stop_message
+from tools.deadline import Deadline
+from tools import dnc_cache, inbound_routing, lanes, load_shedding
+from tools.lead_updates import (
+    FOLLOW_UP_CANCELS,
+    handle_auto_follow_up,
+    has_pending_follow_ups,
+    handle_meeting_booking,
+    log_lead_activity,
+    update_lead_from_qualification,
+)
+from tools.message_pipeline import HALT, ChannelAdapter, Debouncer, MessageContext, Pipeline
+from tools.task_graph import TaskGraph
+
+logger = logging.getLogger(__name__)
+
+try:
+    from tools.db import (
+        log_inbound_message,
+        log_outbound_message,
+        find_lead_by_phone,
+        find_user_by_lead_phone,
+        cancel_follow_ups_for_leads,
+        create_follow_up,
+        FOLLOW_UP_CREATED,
+        get_user_profile,
+        get_user_ai_config,
+        update_lead_last_response,
+        get_default_user_id,
+        get_conversation_history,
+        tag_campaign_context,
+        get_lead_details,
+        check_messaging_quota,
+        get_user_plan_slug,
+        record_overage,
+    )
+    SUPABASE_AVAILABLE = True
+except ImportError:
+    SUPABASE_AVAILABLE = False
+
+LOG_DIR = os.path.join(os.path.dirname(__file__), "logs")
+INBOUND_LOG = os.path.join(LOG_DIR, "inbound.csv")
+OUTBOUND_LOG = os.path.join(LOG_DIR, "outbound.csv")
+STOPPED_LOG = os.path.join(LOG_DIR, "stopped.csv")
+
+os.makedirs(LOG_DIR, exist_ok=True)
+
+UNSUBSCRIBED_REPLY = (
+    "You're unsubscribed. You won't receive any further messages. "
+    "Thank you for letting us know."
+)
+
+_NON_TEXT_LABELS = {
+    "image": "photo",
+    "video": "video",
+    "audio": "voice note",
+    "voice": "voice note",
+    "document": "document",
+    "sticker": "sticker",
+    "location": "location",
+    "contacts": "contact card",
+}
+
+
+# ---------- Shared helpers ----------
+
+def write_csv_row(path: str, headers: Iterable[str], row: dict) -> None:
+    os.makedirs(LOG_DIR, exist_ok=True)
+    file_exists = os.path.exists(path)
+    with open(path, "a", newline="", encoding="utf-8") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        writer = csv.DictWriter(f, fieldnames=list(headers))
+        if not file_exists:
+            writer.writeheader()
+        writer.writerow(row)
+        f.flush()
+        os.fsync(f.fileno())
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _get_user_id() -> Optional[str]:
+    """Get the user ID to associate with messages (legacy fallback)"""
+    if SUPABASE_AVAILABLE:
+        return get_default_user_id()
+    return None
+
+
+def resolve_user_context(phone: str, channel: str = "", business_number: str = "") -> dict:
+    """
+    Resolve which agent owns a lead.
+    The business number the lead wrote to is looked up in the routing table
+    first; only unrouted numbers search leads across all users.
+    Returns {user_id, agent_name, agent_brokerage, agent_phone, agent_email, ai_config, plan_slug}.
+    Falls back to env vars + first user if lead not found.
+    """
+    default_name = os.getenv("AGENT_NAME", "Your Agent")
+    default_brokerage = os.getenv("AGENT_BROKERAGE", "Estate AI")
+    default_phone = os.getenv("AGENT_PHONE")
+    default_email = os.getenv("AGENT_EMAIL")
+
+    fallback = {
+        "user_id": None,
+        "agent_name": default_name,
+        "agent_brokerage": default_brokerage,
+        "agent_phone": default_phone,
+        "agent_email": default_email,
+        "ai_config": None,
+        "plan_slug": None,
+    }
+
+    if not SUPABASE_AVAILABLE:
+        return fallback
+
+    owner_id = inbound_routing.tenant_for(channel, business_number)
+    if not owner_id:
+        match = find_user_by_lead_phone(phone)
+        owner_id = match.get("user_id") if match else None
+    if not owner_id:
+        return {**fallback, "user_id": _get_user_id()}
+
+    profile = get_user_profile(owner_id)
+    plan_slug = get_user_plan_slug(owner_id)
+    if not profile:
+        return {**fallback, "user_id": owner_id, "plan_slug": plan_slug}
+
+    return {
+        "user_id": owner_id,
+        "agent_name": profile.get("full_name") or default_name,
+        "agent_brokerage": profile.get("company") or default_brokerage,
+        "agent_phone": profile.get("phone") or default_phone,
+        "agent_email": profile.get("email") or default_email,
+        "ai_config": get_user_ai_config(owner_id),
+        "plan_slug": plan_slug,
+    }
+
+
+def log_message(
+    mctx: MessageContext,
+    direction: str = "inbound",
+    body: Optional[str] = None,
+    reply_text: Optional[str] = None,
+    send_status: Optional[str] = None,
+) -> None:
+    """Log a message to the Supabase messages table (and bump the lead's last response on inbound)."""
+    user_id = mctx.user_id
+    if not SUPABASE_AVAILABLE or not user_id:
+        return
+
+    lead = find_lead_by_phone(user_id, mctx.phone)
+    lead_id = lead["id"] if lead else None
+
+    if direction == "inbound":
+        log_inbound_message(
+            user_id=user_id,
+            from_number=mctx.phone,
+            body=body if body is not None else mctx.body,
+            external_id=mctx.msg_id or None,
+            lead_id=lead_id,
+            channel=mctx.channel.name,
+        )
+        if lead_id:
+            update_lead_last_response(lead_id)
+    elif direction == "outbound" and reply_text:
+        log_outbound_message(
+            user_id=user_id,
+            to_number=mctx.phone,
+            body=reply_text,
+            status=send_status or "sent",
+            lead_id=lead_id,
+            channel=mctx.channel.name,
+        )
+
+
+def cancel_pending_follow_ups(user_id: str, phone: str, reason: str,
+                              lead: Optional[dict] = None, batched: bool = False) -> None:
+    """
+    Cancel the lead's pending follow-ups (they replied or opted out).
+    `lead` may be a row fetched earlier in the turn; when its pending_follow_ups
+    count is 0 there is nothing to cancel and no write is made. `batched`
+    queues the write with other leads' cancellations (FOLLOW_UP_CANCELS).
+    """
+    if lead is None:
+        lead = find_lead_by_phone(user_id, phone)
+    lead_id = lead.get("id") if lead else None
+    if not lead_id:
+        return
+    if not has_pending_follow_ups(lead):
+        FOLLOW_UP_CANCELS.skip()
+        return
+    if batched:
+        FOLLOW_UP_CANCELS.submit(lead_id, reason)
+    elif cancel_follow_ups_for_leads([lead_id]):
+        logger.info(f"[Follow-up] Cancelled pending follow-ups for lead {lead_id} ({phone}) — {reason}")
+
+
+def check_and_send(mctx: MessageContext, reply_text: str) -> tuple:
+    """
+    DNC check, quota check, then send. Returns (blocked, quota, send_result).
+    Runs either inline or on an early-send worker while the model is still streaming.
+    Uses the "dnc"/"quota" results prefetched in mctx.lookups when available.
+    """
+    user_id = mctx.user_id
+    lookups = mctx.lookups
+
+    # DNC send-side check: never send to numbers on the DNC list
+    on_dnc = False
+    if SUPABASE_AVAILABLE and user_id:
+        on_dnc = lookups.result("dnc") if lookups and "dnc" in lookups else dnc_cache.is_blocked(user_id, mctx.phone)
+    if on_dnc:
+        logger.warning(f"Blocked {mctx.channel.label} outbound to DNC number {mctx.phone}")
+        log_lead_activity(mctx, "dnc_blocked", f"Blocked outbound message to DNC number {mctx.phone}",
+                          "blocked", {"reason": "on_dnc_list"})
+        return True, None, None
+
+    # Check messaging quota — record overage if over limit
+    quota = None
+    if SUPABASE_AVAILABLE and user_id:
+        quota = lookups.result("quota") if lookups and "quota" in lookups else check_messaging_quota(user_id)
+        if quota.get("current", 0) >= quota.get("limit", 0) and quota.get("limit", 0) > 0:
+            logger.warning(f"[Overage] User {user_id} over quota ({quota.get('current')}/{quota.get('limit')}), will record overage")
+
+    return False, quota, mctx.channel.send(mctx.phone, reply_text)
+
+
+# ---------- Ingest stages (per raw message, in the webhook request) ----------
+
+def stage_resolve_context(mctx: MessageContext):
+    # Resolve which agent owns this lead (multi-tenant routing)
+    mctx.user = resolve_user_context(mctx.phone, mctx.channel.name, mctx.business_number)
+
+
+def stage_non_text_ack(mctx: MessageContext):
+    """Voice notes, photos etc. get an immediate ack — the model only reads text."""
+    if mctx.msg_type == "text":
+        return None
+    label = _NON_TEXT_LABELS.get(mctx.msg_type, "message")
+    ack_reply = (
+        f"Thanks for sending that {label}! I'm currently only able to read text messages. "
+        f"Could you describe what you'd like to share in a text message? "
+        f"I'm here to help! - {mctx.user.get('agent_name')}"
+    )
+    mctx.channel.send(mctx.phone, ack_reply)
+    log_message(mctx, "inbound", body=f"[{mctx.msg_type} message]")
+    log_message(mctx, "outbound", reply_text=ack_reply, send_status="sent")
+    log_lead_activity(mctx, "message_reply", f"Acknowledged {mctx.msg_type} message from {mctx.phone}",
+                      "sent", {"type": mctx.msg_type, "direction": "inbound"})
+    return HALT
+
+
+def stage_log_inbound(mctx: MessageContext):
+    # Log to CSV (always, for backup), then Supabase — each message gets its own record
+    write_csv_row(
+        INBOUND_LOG,
+        ["timestamp_utc", "wa_id", "message_id", "message_ts", "body"],
+        {
+            "timestamp_utc": mctx.now,
+            "wa_id": mctx.phone,
+            "message_id": mctx.msg_id,
+            "message_ts": mctx.ts,
+            "body": mctx.body,
+        },
+    )
+    log_message(mctx, "inbound")
+    log_lead_activity(mctx, "message_reply", f"Inbound {mctx.channel.label} from {mctx.phone}: {mctx.body[:100]}",
+                      "received", {"message": mctx.body, "direction": "inbound"})
+
+
+_opt_outs: dict[str, float] = {}  # phone -> received time of its latest STOP
+_opt_outs_lock = threading.Lock()
+_OPT_OUT_MEMORY_SECONDS = 3600  # far longer than any lane queue wait
+
+
+def _record_opt_out(phone: str, received: float) -> None:
+    with _opt_outs_lock:
+        _opt_outs[phone] = max(received, _opt_outs.get(phone, received))
+        if len(_opt_outs) > 10_000:
+            cutoff = time.monotonic() - _OPT_OUT_MEMORY_SECONDS
+            for stale in [k for k, v in _opt_outs.items() if v < cutoff]:
+                del _opt_outs[stale]
+
+
+def stage_compliance(mctx: MessageContext):
+    """Re-opt-in and STOP handling. STOP is never debounced or queued behind AI work."""
+    user_id = mctx.user_id
+    phone = mctx.phone
+
+    # Evaluate STOP once per message; every branch below reuses it
+    mctx.stop_requested = is_stop_message(mctx.body)
+
+    # Re-engagement: if a DNC-listed number sends a non-STOP message, re-opt-in.
+    # STOP jumps the AI lane, so a message that arrived before it must not undo it.
+    opted_out_after = _opt_outs.get(phone, float("-inf")) > mctx.received
+    if (SUPABASE_AVAILABLE and user_id and not mctx.stop_requested and not opted_out_after
+            and dnc_cache.is_blocked(user_id, phone)):
+        dnc_cache.remove(user_id, phone)
+        log_lead_activity(mctx, "re_opt_in",
+                          f"User {phone} re-engaged via {mctx.channel.label} after previous opt-out — removed from DNC",
+                          "success", {"message": mctx.body})
+
+    if not mctx.stop_requested:
+        return None
+
+    _record_opt_out(phone, mctx.received)
+
+    # Drop anything still waiting in the debounce buffer for this sender
+    debouncer = _debouncers.get(mctx.channel.name)
+    if debouncer:
+        debouncer.cancel(phone)
+
+    write_csv_row(
+        STOPPED_LOG,
+        ["timestamp_utc", "wa_id", "message_id", "message_ts", "body"],
+        {
+            "timestamp_utc": mctx.now,
+            "wa_id": phone,
+            "message_id": mctx.msg_id,
+            "message_ts": mctx.ts,
+            "body": mctx.body,
+        },
+    )
+
+    if SUPABASE_AVAILABLE and user_id:
+        dnc_cache.add(user_id, phone, f"STOP keyword via {mctx.channel.label} webhook")
+        log_lead_activity(mctx, "opt_out", f"User {phone} opted out via {mctx.channel.label} STOP keyword",
+                          "success", {"message": mctx.body})
+        # Cancel pending follow-ups — lead has unsubscribed
+        cancel_pending_follow_ups(user_id, phone, f"STOP received via {mctx.channel.label}")
+
+    mctx.channel.send(phone, UNSUBSCRIBED_REPLY)
+    return HALT
+
+
+_debouncers: dict[str, Debouncer] = {}
+
+
+def _flush_debounced(channel: ChannelAdapter, phone: str, buffered: list) -> None:
+    """Combine a sender's buffered messages into one AI turn."""
+    first, last = buffered[0], buffered[-1]
+    combined = MessageContext(
+        channel,
+        phone,
+        "\n".join(m.body for m in buffered if m.body),
+        msg_id=first.msg_id,
+        ts=first.ts,
+        now=first.now,
+        business_number=first.business_number,
+    )
+    # Tenant was resolved at ingest moments ago — no second cross-tenant scan
+    combined.user = last.user
+    combined.received = first.received
+    logger.info(f"[Debounce] Flushing {len(buffered)} {channel.label} messages from {phone}: {combined.body[:100]}")
+    # Timer threads only hand off; the AI turn runs (and queues) on the AI lane
+    _submit_reply(combined)
+
+
+def _submit_reply(mctx: MessageContext) -> None:
+    """Queue the AI turn under its tenant's fair share of the AI lane."""
+    mctx.enqueued = time.monotonic()
+    lanes.AI.submit_for(mctx.user_id, lanes.plan_weight(mctx.user.get("plan_slug")), REPLY_PIPELINE.run, mctx)
+
+
+def stage_dispatch(mctx: MessageContext):
+    """Buffer for the channel's quiet period, or queue the reply now when it doesn't debounce."""
+    channel = mctx.channel
+    if channel.debounce_seconds <= 0:
+        _submit_reply(mctx)
+        return None
+    debouncer = _debouncers.get(channel.name)
+    if debouncer is None:
+        debouncer = _debouncers.setdefault(
+            channel.name,
+            Debouncer(channel.debounce_seconds, lambda phone, buf: _flush_debounced(channel, phone, buf)),
+        )
+    debouncer.add(mctx.phone, mctx)
+    return None
+
+
+# ---------- Reply stages (one AI turn) ----------
+
+def stage_start_budget(mctx: MessageContext):
+    # The reply budget starts after debounce and is shared by every stage below
+    mctx.deadline = Deadline()
+
+
+def stage_agent_self(mctx: MessageContext):
+    """The sender IS the agent (admin testing or texting themselves) — no AI reply."""
+    sender_digits = "".join(c for c in mctx.phone if c.isdigit())
+    agent_digits = "".join(c for c in (mctx.user.get("agent_phone") or "") if c.isdigit())
+    if not (sender_digits and agent_digits and sender_digits == agent_digits):
+        return None
+    logger.info(f"[Agent-self] Detected agent {mctx.user.get('agent_name')} texting from {mctx.phone} — skipping AI reply")
+    log_lead_activity(mctx, "agent_self_message", f"Agent texted from their own number {mctx.phone} — no AI reply sent",
+                      "info", {"message": mctx.body[:100]})
+    return HALT
+
+
+def _send_template_ack(mctx: MessageContext) -> None:
+    """The no-AI "agent will get back to you" reply (Starter plan, or shedding load)."""
+    agent_name = mctx.user.get("agent_name")
+    ack_text = (
+        f"Thanks for reaching out! {agent_name} will get back to you shortly. "
+        f"(Automated reply — {agent_name}'s AI assistant)"
+    )
+    mctx.channel.send(mctx.phone, ack_text)
+    log_message(mctx, "outbound", reply_text=ack_text, send_status="sent")
+
+
+def stage_plan_gate(mctx: MessageContext):
+    """AI auto-reply requires Pro plan or above; Starter gets a templated ack."""
+    if mctx.user.get("plan_slug") != "starter":
+        return None
+    log_lead_activity(mctx, "feature_blocked",
+                      f"AI auto-reply skipped for {mctx.channel.label} {mctx.phone} — Starter plan. Upgrade to Pro for AI replies.",
+                      "info", {"feature": "ai_auto_reply", "plan": "starter"})
+    _send_template_ack(mctx)
+    return HALT
+
+
+def stage_load_shed(mctx: MessageContext):
+    """Degrade this turn step by step when the AI lane is backed up (see load_shedding.py)."""
+    depth = lanes.AI.depth()
+    wait_ms = (time.monotonic() - mctx.enqueued) * 1000 if mctx.enqueued else 0.0
+    mctx.shed_level = load_shedding.shed_level(depth, wait_ms)
+    load_shedding.record(mctx.shed_level)
+    if mctx.shed_level == load_shedding.NONE:
+        return None
+
+    steps = load_shedding.steps_for(mctx.shed_level)
+    logger.warning(f"[Shed] {mctx.channel.label} {mctx.phone}: {', '.join(steps)} (AI queue {depth}, waited {wait_ms:.0f}ms)")
+    log_lead_activity(mctx, "load_shed",
+                      f"Degraded {mctx.channel.label} reply to {mctx.phone} under load: {', '.join(steps)}",
+                      "info", {"level": mctx.shed_level, "steps": steps,
+                               "queue_depth": depth, "queue_wait_ms": round(wait_ms)})
+    if mctx.shed_level >= load_shedding.TEMPLATE_ACK:
+        _send_template_ack(mctx)
+        return HALT
+    if mctx.shed_level >= load_shedding.SKIP_OPTIONAL:
+        mctx.skip |= load_shedding.OPTIONAL_STAGES
+    mctx.model = load_shedding.SHED_MODEL
+    return None
+
+
+def stage_lookups(mctx: MessageContext):
+    """
+    Fetch context for the model and the send-side checks concurrently.
+    DNC and quota don't depend on the reply, so they run alongside the LLM call.
+    """
+    user_id = mctx.user_id
+    if not (SUPABASE_AVAILABLE and user_id):
+        return None
+    lookups = TaskGraph()
+    lookups.add("history", get_conversation_history, user_id, mctx.phone)
+    lookups.add("lead_details", get_lead_details, user_id, mctx.phone)
+    lookups.add("campaign_context", tag_campaign_context, user_id, needs=("history",))
+    lookups.add("dnc", dnc_cache.is_blocked, user_id, mctx.phone)
+    lookups.add("quota", check_messaging_quota, user_id)
+    mctx.lookups = lookups
+
+    # campaign_context tags history messages in place, so wait for it first
+    mctx.campaign_context = lookups.result("campaign_context")
+    mctx.conversation_history = lookups.result("history")
+    mctx.lead_details = lookups.result("lead_details")
+    return None
+
+
+def stage_analyze(mctx: MessageContext):
+    # The send starts as soon as intent + reply have streamed in
+    mctx.early_send = EarlyReplyDispatcher(lambda text: check_and_send(mctx, text))
+    mctx.ai_result = analyze_with_ai(
+        mctx.body, mctx.phone, mctx.business_number or mctx.channel.business_number(),
+        conversation_history=mctx.conversation_history,
+        lead_details=mctx.lead_details,
+        agent_name=mctx.user.get("agent_name"),
+        agent_brokerage=mctx.user.get("agent_brokerage"),
+        ai_config=mctx.user.get("ai_config"),
+        campaign_context=mctx.campaign_context,
+        deadline=mctx.deadline,
+        on_reply_ready=mctx.early_send,
+        model=mctx.model,
+    )
+
+
+def stage_stop_intent(mctx: MessageContext):
+    """
+    If AI detects stop intent, verify with keyword checker before opt-out.
+    AI alone is unreliable — it once classified "Thanks" as stop intent.
+    """
+    if mctx.ai_result.get("intent") != "stop":
+        return None
+    if is_stop_message(mctx.body):
+        log_lead_activity(mctx, "opt_out", f"User {mctx.phone} opted out via {mctx.channel.label} (AI + keyword confirmed)",
+                          "success", {"message": mctx.body})
+        if SUPABASE_AVAILABLE and mctx.user_id:
+            dnc_cache.add(mctx.user_id, mctx.phone, f"AI-detected stop intent via {mctx.channel.label} (confirmed)")
+        mctx.channel.send(mctx.phone, UNSUBSCRIBED_REPLY)
+        return HALT
+    # AI said stop but keywords don't confirm — override to "other" and continue
+    logger.warning(f"[Stop override] AI classified {mctx.channel.label} '{mctx.body[:50]}' as stop but keyword check disagreed — continuing")
+    mctx.ai_result["intent"] = "other"
+    return None
+
+
+def stage_escalation(mctx: MessageContext):
+    """Angry/legal turns: send the holding reply and alert the agent directly."""
+    ai_result = mctx.ai_result
+    if ai_result.get("intent") != "escalate":
+        return None
+    escalation_reply = ai_result.get(
+        "reply",
+        "I hear you, and I want to make sure this is handled properly. "
+        "Let me review the details and get back to you directly."
+    )
+    mctx.channel.send(mctx.phone, escalation_reply)
+
+    agent_phone = mctx.user.get("agent_phone")
+    if agent_phone:
+        agent_msg = (
+            f"ESCALATION NEEDED ({mctx.channel.label})\n"
+            f"Lead: {mctx.phone}\n"
+            f"Message: {mctx.body[:200]}\n"
+            f"AI Notes: {ai_result.get('notes', 'N/A')}\n"
+            f"Please follow up directly."
+        )
+        mctx.channel.send(agent_phone, agent_msg)
+
+    log_lead_activity(mctx, "escalation", f"Lead {mctx.phone} escalated to agent via {mctx.channel.label}: {mctx.body[:100]}",
+                      "pending", {"message": mctx.body, "notes": ai_result.get("notes")})
+    log_message(mctx, "outbound", reply_text=escalation_reply, send_status="sent")
+    return HALT
+
+
+def stage_send(mctx: MessageContext):
+    mctx.reply_text = mctx.ai_result.get("reply", "Thanks for your message! I'll follow up shortly.")
+
+    # The streamed reply may already have gone out while the model was still writing
+    if mctx.early_send is not None and mctx.early_send.started:
+        blocked, mctx.quota, mctx.send_result = mctx.early_send.result()
+    else:
+        blocked, mctx.quota, mctx.send_result = check_and_send(mctx, mctx.reply_text)
+    if mctx.lookups:
+        mctx.lookups.log_timings(f"{mctx.channel.label} {mctx.phone}")
+    return HALT if blocked else None
+
+
+def stage_overage(mctx: MessageContext):
+    # Record overage after successful send
+    quota = mctx.quota
+    if mctx.send_result and SUPABASE_AVAILABLE and mctx.user_id and quota:
+        if quota.get("current", 0) >= quota.get("limit", 0) and quota.get("limit", 0) > 0:
+            period_start = quota.get("period_start") or datetime.utcnow().replace(day=1).isoformat()
+            record_overage(mctx.user_id, mctx.channel.name, period_start)
+
+
+def stage_qualification(mctx: MessageContext):
+    # Update lead with qualification data extracted by AI
+    qualification = mctx.ai_result.get("qualification", {})
+    if qualification and SUPABASE_AVAILABLE and mctx.user_id:
+        update_lead_from_qualification(mctx.user_id, mctx.phone, qualification, mctx.ai_result)
+
+
+def stage_meeting(mctx: MessageContext):
+    # Create meeting ONLY when ready_to_book (has both date and time)
+    meeting_data = mctx.ai_result.get("meeting") or {}
+    # Validate date_suggestion is in the future — AI sometimes returns today's date by mistake
+    if meeting_data.get("date_suggestion"):
+        try:
+            suggested_dt = datetime.fromisoformat(meeting_data["date_suggestion"].replace("Z", "+00:00"))
+            if suggested_dt < datetime.now(timezone.utc):
+                logger.warning(f"[Meeting] AI suggested past date {meeting_data['date_suggestion']} — ignoring meeting booking")
+                meeting_data["ready_to_book"] = False
+        except (ValueError, TypeError):
+            logger.warning(f"[Meeting] Invalid date_suggestion: {meeting_data.get('date_suggestion')}")
+            meeting_data["ready_to_book"] = False
+
+    if meeting_data.get("ready_to_book") and meeting_data.get("date_suggestion") and SUPABASE_AVAILABLE and mctx.user_id:
+        handle_meeting_booking(mctx, meeting_data, mctx.ai_result.get("qualification", {}))
+
+
+def stage_follow_up(mctx: MessageContext):
+    # Auto-create follow-up when AI sets schedule_follow_up_days
+    follow_up_days = mctx.ai_result.get("schedule_follow_up_days")
+    if follow_up_days and isinstance(follow_up_days, (int, float)) and follow_up_days > 0 and SUPABASE_AVAILABLE and mctx.user_id:
+        handle_auto_follow_up(mctx, follow_up_days)
+
+
+def stage_valuation(mctx: MessageContext):
+    # Auto-create CMA task when AI detects valuation request
+    if not (mctx.ai_result.get("valuation_requested") and SUPABASE_AVAILABLE and mctx.user_id):
+        return
+    user_id = mctx.user_id
+    phone = mctx.phone
+    lead = find_lead_by_phone(user_id, phone)
+    lead_name = (lead or {}).get("owner_name", phone)
+    prop_addr = (lead or {}).get("property_address", "unknown property")
+    # One pending CMA task per lead number
+    digits = "".join(c for c in phone if c.isdigit())
+    if create_follow_up(
+        user_id=user_id,
+        lead_id=(lead or {}).get("id"),
+        message_text=f"Send full CMA to {lead_name} ({phone}) for {prop_addr}. Lead requested valuation via {mctx.channel.label}.",
+        scheduled_at=(datetime.now(timezone.utc) + timedelta(hours=24)).isoformat(),
+        kind="valuation_task",
+        dedup_key=f"valuation_task:{digits}",
+    ) == FOLLOW_UP_CREATED:
+        mctx.follow_ups_created += 1
+        log_lead_activity(mctx, "valuation_request", f"CMA follow-up task created for {lead_name} at {prop_addr}",
+                          "success", {"property": prop_addr})
+
+
+def stage_agent_brief(mctx: MessageContext):
+    # Log agent brief when lead is fully qualified
+    agent_brief = mctx.ai_result.get("agent_brief")
+    if agent_brief:
+        log_lead_activity(mctx, "lead_qualified", f"Lead {mctx.phone} fully qualified by AI bot", "success",
+                          {"agent_brief": agent_brief, "qualification": mctx.ai_result.get("qualification", {})})
+
+
+def stage_outbound_log(mctx: MessageContext):
+    send_result = mctx.send_result or {}
+    write_csv_row(
+        OUTBOUND_LOG,
+        ["timestamp_utc", "wa_id", "message_id", "reply", "send_status", "send_body"],
+        {
+            "timestamp_utc": mctx.now,
+            "wa_id": mctx.phone,
+            "message_id": mctx.msg_id,
+            "reply": mctx.reply_text,
+            "send_status": send_result.get("status")
+            or ("demo" if send_result.get("demo") else ""),
+            "send_body": send_result.get("body") or "",
+        },
+    )
+
+    send_status = "sent" if send_result.get("ok") else "failed"
+    log_message(mctx, "outbound", reply_text=mctx.reply_text, send_status=send_status)
+
+    # Log AI bot reply to activity_logs
+    intent = mctx.ai_result.get("intent", "other")
+    log_lead_activity(
+        mctx, "message_reply",
+        f"AI bot replied via {mctx.channel.label} to {mctx.phone} (intent: {intent}): {mctx.reply_text[:100]}",
+        send_status,
+        {
+            "reply": mctx.reply_text,
+            "intent": intent,
+            "direction": "outbound",
+            "follow_up_days": mctx.ai_result.get("schedule_follow_up_days"),
+            "post_processing_rules": mctx.ai_result.get("post_processing_rules", []),
+            "stage_ms": {k: round(v * 1000) for k, v in mctx.timings.items()},
+        },
+    )
+
+
+def stage_cancel_follow_ups(mctx: MessageContext):
+    # Cancel pending follow-ups — lead has replied, sequence should pause
+    if SUPABASE_AVAILABLE and mctx.user_id:
+        # The lead row from the lookups is current unless this turn scheduled follow-ups itself
+        lead = mctx.lead_details if not mctx.follow_ups_created else None
+        cancel_pending_follow_ups(mctx.user_id, mctx.phone, f"lead replied via {mctx.channel.label}",
+                                  lead=lead, batched=True)
+
+
+INGEST_PIPELINE = Pipeline("ingest", [
+    ("resolve_context", stage_resolve_context),
+    ("non_text_ack", stage_non_text_ack),
+    ("log_inbound", stage_log_inbound),
+    ("compliance", stage_compliance),
+    ("dispatch", stage_dispatch),
+])
+
+REPLY_PIPELINE = Pipeline("reply", [
+    ("start_budget", stage_start_budget),
+    ("agent_self", stage_agent_self),
+    ("plan_gate", stage_plan_gate),
+    ("load_shed", stage_load_shed),
+    ("lookups", stage_lookups),
+    ("analyze", stage_analyze),
+    ("escalation", stage_escalation),
+    ("stop_intent", stage_stop_intent),
+    ("send", stage_send),
+    ("overage", stage_overage),
+    ("qualification", stage_qualification),
+    ("meeting", stage_meeting),
+    ("follow_up", stage_follow_up),
+    ("valuation", stage_valuation),
+    ("agent_brief", stage_agent_brief),
+    ("outbound_log", stage_outbound_log),
+    ("cancel_follow_ups", stage_cancel_follow_ups),
+])
+
+
+def submit_inbound(mctx: MessageContext):
+    """Queue an accepted webhook message on its lane (STOP → compliance, else AI)."""
+    return lanes.classify(mctx.body, mctx.msg_type).submit(INGEST_PIPELINE.run, mctx)
+
+
+def debounce_pending() -> dict:
+    """Senders currently waiting out a debounce window, per channel."""
+    return {name: d.pending() for name, d in _debouncers.items()}
@@ -4,12 +4,17 @@ Replaced by /api/calendar/ routes with Google Calendar export + ICS download.
 Owner: engineering-ops agent
 """
 import os
-import smtplib
+import sys
 from datetime import datetime, timedelta, timezone
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 import uuid
 
+# Run as a script from anywhere: make the tools.* package importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.smtp_pool import get_pool  # noqa: E402
+
 
 def build_ics(
     organizer_name: str,
@@ -77,10 +82,8 @@ def send_invite(
     ical_part.add_header("Content-Disposition", "attachment", filename="invite.ics")
     msg.attach(ical_part)
 
-    with smtplib.SMTP(smtp_host, smtp_port) as server:
-        server.starttls()
-        server.login(smtp_user, smtp_password)
-        server.send_message(msg)
+    # Pooled session: repeated invites reuse one login (see smtp_pool.py)
+    get_pool(smtp_host, smtp_port, smtp_user, smtp_password).send(msg)
 
     print(f"\n✅ Invite sent to {lead_email}")
 
@@ -3,11 +3,24 @@ LEGACY: CSV-based follow-up sender (demo mode).
 Replaced by /api/cron/send-followups which reads from Supabase follow_ups table.
 Still referenced by /api/followups/send route (protected by CRON_SECRET).
 Owner: engineering-ops agent
+
+Reads the day's sends from the date-indexed store next to the CSV
+(tools/followup_store.py) and updates each status in place; the CSV is
+re-imported only when build_followups.py writes a new one. Updated statuses
+are written back to the CSV (other tools, e.g. the Supabase migration, read
+them from there) unless --no-export is given; a run that sent nothing leaves
+the CSV untouched.
 """
-import csv
 import argparse
+import os
+import sys
 from datetime import date
 
+# Run as a script from anywhere: make the tools.* package importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.followup_store import open_store  # noqa: E402
+
 def send_sms(to_number: str, body: str) -> str:
     """
     Send an outbound message in demo mode.
@@ -32,57 +45,45 @@ def main():
         "--test-to-phone",
         help="If set, ALL follow-ups go to this number instead of the lead phones (safe test mode).",
     )
+    parser.add_argument(
+        "--no-export",
+        action="store_true",
+        help="Keep updated statuses in the store only; don't rewrite the CSV.",
+    )
     args = parser.parse_args()
 
     today_str = args.today or date.today().isoformat()
 
-    # Load all rows
-    with open(args.followups_csv, newline="", encoding="utf-8") as f:
-        rows = list(csv.DictReader(f))
-
-    if not rows:
+    store = open_store(args.followups_csv)
+    if not store.count():
         print("No rows found in followups CSV.")
+        store.close()
         return
 
-    changed = False
-    for row in rows:
-        status = row.get("status", "")
-        send_date = row.get("send_date", "")
-        phone = (row.get("phone") or "").strip()
-        msg = (row.get("message_text") or "").strip()
-
-        # Only send:
-        # - status pending
-        # - send_date == today
-        if status != "pending":
-            continue
-        if send_date != today_str:
-            continue
+    # Only pending rows with send_date == today (index read)
+    due = store.due(today_str)
+    for row in due:
+        phone = (row["phone"] or "").strip()
+        msg = (row["message_text"] or "").strip()
 
         if not msg:
-            row["status"] = "skipped: empty message"
-            changed = True
+            store.set_status(row["id"], "skipped: empty message")
             continue
 
         if not phone and not args.test_to_phone:
-            row["status"] = "skipped: no phone"
-            changed = True
+            store.set_status(row["id"], "skipped: no phone")
             continue
 
         actual_to = args.test_to_phone or phone
-        print(f"Sending follow-up to {actual_to} for {row.get('property_address','')} (day_offset={row.get('day_offset','')})")
+        print(f"Sending follow-up to {actual_to} for {row['property_address'] or ''} (day_offset={row['day_offset'] or ''})")
 
         send_status = send_sms(actual_to, msg)
-        row["status"] = f"{send_status} @ {today_str}"
-        changed = True
-
-    # Write back updates
-    if changed:
-        fieldnames = rows[0].keys()
-        with open(args.followups_csv, "w", newline="", encoding="utf-8") as f_out:
-            writer = csv.DictWriter(f_out, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(rows)
+        store.set_status(row["id"], f"{send_status} @ {today_str}")
+
+    if due and not args.no_export:
+        # Full rewrite; skipped when no status changed
+        store.export_csv(args.followups_csv)
+    store.close()
 
     print(f"Done processing follow-ups for {today_str}")
 
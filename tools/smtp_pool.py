@@ -0,0 +1,288 @@
+"""
+smtp_pool.py
+
+Pooled SMTP sessions for the legacy email senders (ai_listing_agent_full.py
+send_email, send_calendar_invite.py send_invite). Each send used to connect,
+STARTTLS and log in from scratch; a 1,000-lead run meant 1,000 handshakes
+and logins, which is also what gets an account throttled by the provider.
+
+- SmtpPool: up to `size` authenticated connections, checked out by one
+  sender at a time and reused for later messages
+- Per-connection cap: a connection is QUIT and replaced after
+  max_per_connection messages (providers cap messages per session)
+- Rate limit: sends are spaced to stay under rate_per_minute
+- Reconnect: a connection that fails before DATA (server closed it, 421,
+  network error during connect/EHLO/STARTTLS/MAIL/RCPT) is replaced and the
+  message retried once; connections idle longer than idle_seconds are checked with
+  NOOP before reuse. Once DATA has been sent a drop is ambiguous (the server
+  may already have queued the message), so it's raised without a retry
+  rather than risking a duplicate. Message-level refusals (bad recipient,
+  5xx on DATA) are raised without a retry.
+- get_pool(): one shared pool per (host, port, user, starttls); replaced
+  (and the old one closed) when the password changes; closed at exit
+
+Local stand-in (no TLS/auth): python -m aiosmtpd -n -l localhost:1025 and
+EMAIL_HOST=localhost EMAIL_PORT=1025 EMAIL_STARTTLS=0.
+
+Env vars:
+- EMAIL_STARTTLS (default 1)
+- EMAIL_POOL_SIZE (default 4)
+- EMAIL_MAX_PER_CONNECTION (default 100)
+- EMAIL_RATE_PER_MINUTE (default 0 = unlimited)
+- EMAIL_IDLE_SECONDS (default 60)
+"""
+
+import atexit
+import logging
+import os
+import smtplib
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+EMAIL_STARTTLS = os.getenv("EMAIL_STARTTLS", "1").lower() not in ("0", "false", "no")
+EMAIL_POOL_SIZE = int(os.getenv("EMAIL_POOL_SIZE", "4"))
+EMAIL_MAX_PER_CONNECTION = int(os.getenv("EMAIL_MAX_PER_CONNECTION", "100"))
+EMAIL_RATE_PER_MINUTE = float(os.getenv("EMAIL_RATE_PER_MINUTE", "0"))
+EMAIL_IDLE_SECONDS = float(os.getenv("EMAIL_IDLE_SECONDS", "60"))
+
+# Errors that mean the connection (not the message) is bad
+_CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, smtplib.SMTPHeloError, OSError)
+
+
+class _TrackedSMTP(smtplib.SMTP):
+    """smtplib.SMTP that notes when DATA has been sent for the current message."""
+
+    in_data = False
+
+    def data(self, msg):
+        self.in_data = True
+        return super().data(msg)
+
+
+class _Conn:
+    __slots__ = ("smtp", "sent", "last_used")
+
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.sent = 0
+        self.last_used = time.monotonic()
+
+
+class SmtpPool:
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        user: Optional[str] = None,
+        password: Optional[str] = None,
+        starttls: bool = EMAIL_STARTTLS,
+        size: int = EMAIL_POOL_SIZE,
+        max_per_connection: int = EMAIL_MAX_PER_CONNECTION,
+        rate_per_minute: float = EMAIL_RATE_PER_MINUTE,
+        idle_seconds: float = EMAIL_IDLE_SECONDS,
+        timeout: float = 30,
+    ):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.starttls = starttls
+        self.max_per_connection = max_per_connection
+        self.interval = 60.0 / rate_per_minute if rate_per_minute > 0 else 0.0
+        self.idle_seconds = idle_seconds
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle = []
+        self._closed = False
+        self._next_send = 0.0
+        self._stats = {"connections_opened": 0, "messages_sent": 0, "reconnects": 0, "recycled": 0, "failed": 0}
+
+    def _incr(self, key: str) -> None:
+        with self._lock:
+            self._stats[key] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["idle_connections"] = len(self._idle)
+        return snapshot
+
+    # ---- connections ----
+
+    def _connect(self) -> _Conn:
+        smtp = _TrackedSMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            smtp.ehlo()
+            if self.starttls:
+                smtp.starttls()
+                smtp.ehlo()
+            # Without STARTTLS (local debug server) only log in if AUTH is offered
+            if self.user and self.password and (self.starttls or smtp.has_extn("auth")):
+                smtp.login(self.user, self.password)
+        except Exception:
+            _quit(smtp)
+            raise
+        self._incr("connections_opened")
+        return _Conn(smtp)
+
+    def _checkout(self) -> _Conn:
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                return self._connect()
+            if time.monotonic() - conn.last_used < self.idle_seconds:
+                return conn
+            # Long idle: the server may have dropped it
+            try:
+                if conn.smtp.noop()[0] == 250:
+                    return conn
+            except _CONNECTION_ERRORS:
+                pass
+            _quit(conn.smtp)
+
+    def _checkin(self, conn: _Conn) -> None:
+        conn.last_used = time.monotonic()
+        if conn.sent >= self.max_per_connection:
+            self._incr("recycled")
+            _quit(conn.smtp)
+            return
+        with self._lock:
+            if not self._closed:
+                self._idle.append(conn)
+                return
+        # Pool was closed while this connection was out
+        _quit(conn.smtp)
+
+    def _wait_for_rate(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_send)
+            self._next_send = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    # ---- sending ----
+
+    def send(self, msg) -> None:
+        """
+        Send one email.message.Message. Raises the smtplib error if the
+        message is refused, the server is unreachable after a reconnect, or
+        the connection failed after DATA (delivery unknown; not retried).
+        """
+        self._wait_for_rate()
+        with self._slots:
+            for attempt in (1, 2):
+                try:
+                    conn = self._checkout()
+                except _CONNECTION_ERRORS as e:
+                    # Connect/EHLO/STARTTLS failed: nothing was sent yet
+                    if attempt == 1:
+                        logger.warning(f"[SMTP] Connecting to {self.host} failed ({e}) — retrying")
+                        self._incr("reconnects")
+                        continue
+                    self._incr("failed")
+                    raise
+                conn.smtp.in_data = False
+                try:
+                    conn.smtp.send_message(msg)
+                except smtplib.SMTPResponseException as e:
+                    if e.smtp_code == 421 and conn.smtp.in_data:
+                        self._fail_ambiguous(conn, e)
+                        raise
+                    if e.smtp_code == 421 and attempt == 1:
+                        # Service closing the channel: reconnect and retry
+                        _quit(conn.smtp)
+                        self._incr("reconnects")
+                        continue
+                    self._incr("failed")
+                    self._release_after_error(conn, e)
+                    raise
+                except smtplib.SMTPRecipientsRefused:
+                    self._incr("failed")
+                    self._checkin(conn)
+                    raise
+                except _CONNECTION_ERRORS as e:
+                    if conn.smtp.in_data:
+                        self._fail_ambiguous(conn, e)
+                        raise
+                    _quit(conn.smtp)
+                    if attempt == 1:
+                        logger.warning(f"[SMTP] Connection to {self.host} lost ({e}) — reconnecting")
+                        self._incr("reconnects")
+                        continue
+                    self._incr("failed")
+                    raise
+                conn.sent += 1
+                self._incr("messages_sent")
+                self._checkin(conn)
+                return
+
+    def _fail_ambiguous(self, conn: _Conn, err: Exception) -> None:
+        logger.warning(f"[SMTP] Connection to {self.host} lost after DATA ({err}) — "
+                       f"delivery unknown, not retrying")
+        _quit(conn.smtp)
+        self._incr("failed")
+
+    def _release_after_error(self, conn: _Conn, err: smtplib.SMTPResponseException) -> None:
+        # A 4xx/5xx reply to one message leaves the session usable unless it's a 421
+        if err.smtp_code == 421:
+            _quit(conn.smtp)
+        else:
+            self._checkin(conn)
+
+    def close(self) -> None:
+        """QUIT idle sessions; sessions still sending are QUIT when they come back."""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            _quit(conn.smtp)
+
+
+def _quit(smtp) -> None:
+    try:
+        smtp.quit()
+    except Exception:
+        try:
+            smtp.close()
+        except Exception:
+            pass
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(host: str, port: int, user: Optional[str] = None, password: Optional[str] = None,
+             starttls: bool = EMAIL_STARTTLS) -> SmtpPool:
+    """Shared pool for this server/account (created on first use)."""
+    key = (host, port, user, starttls)
+    with _pools_lock:
+        stale = _pools.get(key)
+        if stale is not None and stale.password == password:
+            return stale
+        pool = _pools[key] = SmtpPool(host, port, user, password, starttls=starttls)
+    if stale is not None:
+        # Password changed: its sessions are logged in with the old one
+        stale.close()
+    return pool
+
+
+def pool_stats() -> dict:
+    with _pools_lock:
+        return {f"{user or ''}@{host}:{port}": pool.stats() for (host, port, user, _), pool in _pools.items()}
+
+
+@atexit.register
+def close_all() -> None:
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close()
@@ -0,0 +1,198 @@
+"""
+stream_json.py
+
+Incremental parser for the JSON object analyze_with_ai asks the model for.
+
+Completions are fed in as they stream. Each top-level field is decoded as
+soon as its value closes, so callers can act on "intent" and "reply" while
+the model is still writing "qualification", "meeting" and "agent_brief".
+
+- IncrementalJSONParser.feed(): consume a chunk, return newly completed fields
+- IncrementalJSONParser.partial(): best-effort object from a cut-off stream
+  (completed fields plus whatever of the in-progress value can be closed)
+- repair_json(): parse a full completion, salvaging truncated or malformed
+  output instead of discarding it
+"""
+
+import json
+import re
+from typing import Optional
+
+_CLOSERS = {"{": "}", "[": "]"}
+
+# "\u20" cut mid-escape; keeps any escaped backslashes in front of it
+_PARTIAL_UNICODE_ESCAPE = re.compile(r"(?<!\\)((?:\\\\)*)\\u[0-9a-fA-F]{0,3}$")
+
+# Trailing fragments that stop a cut-off value from closing cleanly, tried in order
+_TRIMS = [
+    re.compile(r"[,:]\s*$"),                                          # dangling separator
+    re.compile(r'(?:,|(?<=[{\[]))\s*"(?:[^"\\]|\\.)*"\s*:?\s*$'),     # key without a value
+    re.compile(r"(?<=[:\[,])\s*[-+\w.]+$"),                           # half-written literal (tru, 12.)
+]
+
+
+class IncrementalJSONParser:
+    """Streaming decoder for one top-level JSON object. Not thread-safe; one per stream."""
+
+    def __init__(self):
+        self.text = ""
+        self.fields: dict = {}
+        self.invalid: list[str] = []
+        self.complete = False
+        self._pos = 0
+        self._stack: list[str] = []
+        self._in_string = False
+        self._escape = False
+        self._key_start: Optional[int] = None
+        self._key: Optional[str] = None
+        self._value_start: Optional[int] = None
+
+    def feed(self, chunk: str) -> list[str]:
+        """Consume the next piece of the completion. Returns keys completed by it."""
+        self.text += chunk
+        completed = []
+        text = self.text
+        for i in range(self._pos, len(text)):
+            if self.complete:
+                break
+            ch = text[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if len(self._stack) == 1 and self._key is None and self._key_start is not None:
+                        try:
+                            self._key = json.loads(text[self._key_start:i + 1])
+                        except json.JSONDecodeError:
+                            self._key = text[self._key_start + 1:i]
+                continue
+
+            if not self._stack:
+                # Skip anything before the object (code fences, stray prose)
+                if ch == "{":
+                    self._stack.append(ch)
+                continue
+
+            top_level = len(self._stack) == 1
+            if ch == '"':
+                self._in_string = True
+                if top_level:
+                    if self._key is None:
+                        self._key_start = i
+                    elif self._value_start is None:
+                        self._value_start = i
+            elif ch in "{[":
+                if top_level and self._key is not None and self._value_start is None:
+                    self._value_start = i
+                self._stack.append(ch)
+            elif ch in "}]":
+                if top_level:
+                    self._finish_value(i, completed)
+                    self.complete = True
+                self._stack.pop()
+            elif ch == "," and top_level:
+                self._finish_value(i, completed)
+            elif top_level and not ch.isspace() and ch != ":" and self._key is not None and self._value_start is None:
+                self._value_start = i
+
+        self._pos = len(text)
+        return completed
+
+    def _finish_value(self, end: int, completed: list) -> None:
+        if self._key is not None and self._value_start is not None:
+            raw = self.text[self._value_start:end].strip()
+            try:
+                self.fields[self._key] = json.loads(raw)
+                completed.append(self._key)
+            except json.JSONDecodeError:
+                self.invalid.append(self._key)
+        self._key_start = self._key = self._value_start = None
+
+    def partial(self) -> dict:
+        """Completed fields plus the in-progress value, closed as well as possible."""
+        result = dict(self.fields)
+        if self.complete or self._key is None or self._value_start is None:
+            return result
+
+        fragment = self.text[self._value_start:]
+        if self._in_string:
+            if self._escape:
+                fragment = fragment[:-1]
+            fragment = _PARTIAL_UNICODE_ESCAPE.sub(r"\1", fragment) + '"'
+        value = _close(fragment)
+        if value is not _UNPARSEABLE:
+            result[self._key] = value
+        return result
+
+
+_UNPARSEABLE = object()
+
+
+def _open_brackets(fragment: str) -> list[str]:
+    stack: list[str] = []
+    in_string = escape = False
+    for ch in fragment:
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append(ch)
+        elif ch in "}]" and stack:
+            stack.pop()
+    return stack
+
+
+def _close(fragment: str):
+    """Close every open bracket in a truncated value, trimming dangling tails until it parses."""
+    candidate = fragment.rstrip()
+    while candidate:
+        closers = "".join(_CLOSERS[b] for b in reversed(_open_brackets(candidate)))
+        try:
+            return json.loads(candidate + closers)
+        except json.JSONDecodeError:
+            pass
+        for trim in _TRIMS:
+            trimmed = trim.sub("", candidate).rstrip()
+            if trimmed != candidate:
+                candidate = trimmed
+                break
+        else:
+            break
+    return _UNPARSEABLE
+
+
+def strip_code_fences(raw: str) -> str:
+    raw = raw.strip()
+    if raw.startswith("```"):
+        raw = raw.split("\n", 1)[1] if "\n" in raw else raw[3:]
+    if raw.endswith("```"):
+        raw = raw[:-3]
+    return raw.strip()
+
+
+def repair_json(raw: str) -> tuple[dict, bool]:
+    """
+    Decode a model completion into a dict.
+    Returns (data, repaired) — repaired is True when the text wasn't valid JSON
+    and the result was salvaged field by field ({} if nothing was usable).
+    """
+    raw = strip_code_fences(raw)
+    try:
+        data = json.loads(raw)
+        if isinstance(data, dict):
+            return data, False
+    except json.JSONDecodeError:
+        pass
+    parser = IncrementalJSONParser()
+    parser.feed(raw)
+    return parser.partial(), True
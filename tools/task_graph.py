@@ -0,0 +1,102 @@
+"""
+task_graph.py
+
+Small dependency-graph executor for the per-message lookups the reply
+handlers make (conversation history, lead details, campaign names, DNC,
+quota). Independent tasks run concurrently on a shared thread pool; a task
+with `needs` starts the moment its dependencies finish and receives their
+results as keyword arguments.
+
+    graph = TaskGraph()
+    graph.add("history", get_conversation_history, user_id, phone)
+    graph.add("campaign", tag_campaign_context, user_id, needs=("history",))
+    graph.add("dnc", is_on_dnc_list, user_id, phone)
+    history = graph.result("history")
+
+Tasks are scheduled as they are added, so dependencies must be added first
+(which also rules out cycles). A failed task re-raises from result() and
+fails every task that needs it.
+
+Env vars:
+- LOOKUP_POOL_SIZE (worker threads shared by all graphs, default 32)
+"""
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+LOOKUP_POOL_SIZE = int(os.getenv("LOOKUP_POOL_SIZE", "32"))
+
+_pool = ThreadPoolExecutor(max_workers=LOOKUP_POOL_SIZE, thread_name_prefix="lookup")
+
+
+def submit(fn: Callable, *args, **kwargs) -> Future:
+    """Run a one-off callable on the shared lookup pool."""
+    return _pool.submit(fn, *args, **kwargs)
+
+
+class TaskGraph:
+    def __init__(self, executor: Optional[ThreadPoolExecutor] = None):
+        self._executor = executor or _pool
+        self._futures: dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.timings: dict[str, float] = {}
+
+    def add(self, name: str, fn: Callable, *args, needs: Sequence[str] = (), **kwargs) -> "TaskGraph":
+        """Schedule fn(*args, **kwargs, **{dep: dep_result}) once every task in `needs` is done."""
+        if name in self._futures:
+            raise ValueError(f"Task {name!r} already added")
+        missing = [dep for dep in needs if dep not in self._futures]
+        if missing:
+            raise ValueError(f"Task {name!r} needs unknown task(s) {missing} — add dependencies first")
+
+        future: Future = Future()
+        self._futures[name] = future
+        deps = [self._futures[dep] for dep in needs]
+
+        def _run() -> None:
+            started = time.monotonic()
+            try:
+                dep_results = {dep: self._futures[dep].result() for dep in needs}
+                future.set_result(fn(*args, **dep_results, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                self.timings[name] = time.monotonic() - started
+
+        if not deps:
+            self._executor.submit(_run)
+            return self
+
+        remaining = [len(deps)]
+
+        def _dep_done(_f: Future) -> None:
+            with self._lock:
+                remaining[0] -= 1
+                ready = remaining[0] == 0
+            if ready:
+                self._executor.submit(_run)
+
+        for dep in deps:
+            dep.add_done_callback(_dep_done)
+        return self
+
+    def result(self, name: str, timeout: Optional[float] = None):
+        return self._futures[name].result(timeout=timeout)
+
+    def future(self, name: str) -> Future:
+        return self._futures[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._futures
+
+    def log_timings(self, label: str) -> None:
+        """One debug line: each task's own duration and the wall time of the slowest."""
+        if self.timings:
+            parts = ", ".join(f"{k}={v * 1000:.0f}ms" for k, v in self.timings.items())
+            logger.debug(f"[Lookups] {label}: {parts} (serial would be {sum(self.timings.values()) * 1000:.0f}ms)")
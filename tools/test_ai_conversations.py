@@ -14,6 +14,9 @@ import json
 from dotenv import load_dotenv
 load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
 
+# Replay identical prompts from the local LLM cache (set APP_ENV=production to force live calls)
+os.environ.setdefault("APP_ENV", "test")
+
 # Import the AI function
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 from tools.ai_inbound_agent import analyze_with_ai
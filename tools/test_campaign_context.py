@@ -13,10 +13,13 @@ import os
 import sys
 import json
 
-# Ensure tools/ is importable
-sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# Replay identical prompts from the local LLM cache (set APP_ENV=production to force live calls)
+os.environ.setdefault("APP_ENV", "test")
 
-from ai_inbound_agent import analyze_with_ai
+# Ensure the repo root is importable (tools.* package imports)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.ai_inbound_agent import analyze_with_ai
 
 # ── Campaign templates (mirrors campaign-templates.ts) ──
 CAMPAIGNS = [
@@ -0,0 +1,98 @@
+"""
+Circuit Breaker Test — state transitions of circuit_breaker.CircuitBreaker.
+
+- CLOSED -> OPEN after failure_threshold consecutive failures; a success resets the count
+- OPEN rejects calls until reset_seconds pass, then turns HALF_OPEN
+- HALF_OPEN lets exactly one trial through: success closes (and runs the
+  on_close callbacks), failure re-opens it
+- call() records the outcome and raises CircuitOpenError while open
+
+Usage: python tools/test_circuit_breaker.py
+       (also collected by pytest)
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError  # noqa: E402
+
+
+def test_opens_after_threshold():
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_seconds=60)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()  # not consecutive any more
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CLOSED and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.snapshot()["consecutive_failures"] == 3
+
+
+def test_half_open_single_trial():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_seconds=0.05)
+    breaker.record_failure()
+    assert breaker.state == OPEN and not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()  # trial already in flight
+    # Failed trial: straight back to OPEN for another reset period
+    breaker.record_failure()
+    assert breaker.state == OPEN and not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED and breaker.allow() and breaker.allow()
+
+
+def test_on_close_callbacks():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_seconds=0.01)
+    calls = []
+    breaker.on_close(lambda: calls.append("replay"))
+    breaker.on_close(lambda: 1 / 0)  # a failing callback doesn't stop the others
+    breaker.on_close(lambda: calls.append("after"))
+    breaker.record_success()
+    assert calls == []  # already closed: nothing recovered
+    breaker.record_failure()
+    time.sleep(0.02)
+    assert breaker.allow()
+    breaker.record_success()
+    assert calls == ["replay", "after"], calls
+
+
+def test_call_wraps_outcome():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_seconds=60)
+    assert breaker.call(lambda x: x * 2, 21) == 42
+
+    def boom():
+        raise ConnectionError("down")
+
+    for _ in range(2):
+        try:
+            breaker.call(boom)
+            raise AssertionError("expected ConnectionError")
+        except ConnectionError:
+            pass
+    try:
+        breaker.call(lambda: "never runs")
+        raise AssertionError("expected CircuitOpenError")
+    except CircuitOpenError:
+        pass
+
+
+if __name__ == "__main__":
+    failed = 0
+    for test in (test_opens_after_threshold, test_half_open_single_trial, test_on_close_callbacks,
+                 test_call_wraps_outcome):
+        try:
+            test()
+            print(f"  PASS  {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"  FAIL  {test.__name__}: {e}")
+    sys.exit(1 if failed else 0)
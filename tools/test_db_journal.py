@@ -0,0 +1,176 @@
+"""
+DB Journal Test — the local write-ahead journal for deferred Supabase writes.
+
+- append() / drain(): entries come back oldest first and the journal is emptied
+- Corrupt lines are skipped instead of failing the whole drain
+- replay(): applied writes are counted, failing ones re-appended with their
+  attempt count and dropped after max_attempts, unknown ones dropped
+- A writer returning DROPPED is dropped at once, not retried
+- db._guarded: outages (timeouts, 5xx) are journaled and count against the
+  breaker; rejected writes (constraint violations, 4xx) are neither
+- Appends racing a drain (other threads, other processes) are never lost:
+  every entry is drained exactly once
+
+Usage: python tools/test_db_journal.py
+       (also collected by pytest)
+"""
+
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools import db_journal  # noqa: E402
+from tools.circuit_breaker import CLOSED, CircuitBreaker  # noqa: E402
+
+try:
+    from tools import db  # needs the supabase client package
+    DB_AVAILABLE = True
+except ImportError:
+    DB_AVAILABLE = False
+
+
+class _TempJournal:
+    def __enter__(self):
+        self.dir = tempfile.mkdtemp()
+        self.saved = db_journal.DB_JOURNAL_PATH
+        db_journal.DB_JOURNAL_PATH = os.path.join(self.dir, "db_journal.jsonl")
+        return db_journal.DB_JOURNAL_PATH
+
+    def __exit__(self, *exc):
+        db_journal.DB_JOURNAL_PATH = self.saved
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+def test_append_and_drain():
+    with _TempJournal() as path:
+        assert db_journal.drain() == [] and db_journal.pending_count() == 0
+        for i in range(3):
+            db_journal.append("log_activity", (f"lead-{i}",), {"kind": "sms"})
+        with open(path, "a", encoding="utf-8") as f:
+            f.write("{not json\n")
+        assert db_journal.pending_count() == 4
+        entries = db_journal.drain()
+        assert [e["args"] for e in entries] == [["lead-0"], ["lead-1"], ["lead-2"]]
+        assert entries[0]["fn"] == "log_activity" and entries[0]["kwargs"] == {"kind": "sms"}
+        assert db_journal.pending_count() == 0 and db_journal.drain() == []
+        assert not [name for name in os.listdir(os.path.dirname(path)) if name.endswith(".replay")]
+
+
+def test_replay():
+    with _TempJournal():
+        applied = []
+        writers = {
+            "good": lambda lead_id: applied.append(lead_id) or True,
+            "flaky": lambda lead_id: False,
+        }
+        db_journal.append("good", ("lead-1",), {})
+        db_journal.append("flaky", ("lead-2",), {})
+        db_journal.append("removed_fn", ("lead-3",), {})
+        db_journal.append("good", ("lead-4",), {})
+
+        assert db_journal.replay(writers, max_attempts=2) == 2
+        assert applied == ["lead-1", "lead-4"]
+        # Only the failing write is left, with its attempt recorded
+        left = db_journal.drain()
+        assert [(e["fn"], e["attempts"]) for e in left] == [("flaky", 1)]
+        db_journal.append("flaky", ("lead-2",), {}, attempts=1)
+        assert db_journal.replay(writers, max_attempts=2) == 0
+        assert db_journal.pending_count() == 0  # given up after 2 attempts
+
+
+def test_replay_drops_rejected():
+    with _TempJournal():
+        calls = []
+        writers = {"rejected": lambda lead_id: calls.append(lead_id) or db_journal.DROPPED}
+        db_journal.append("rejected", ("lead-1",), {})
+        assert db_journal.replay(writers, max_attempts=3) == 0
+        assert calls == ["lead-1"] and db_journal.pending_count() == 0
+
+
+class _ApiError(Exception):
+    """Shaped like postgrest-py's APIError."""
+
+    def __init__(self, code):
+        super().__init__(f"error {code}")
+        self.code = code
+
+
+def _write(error):
+    try:
+        raise error
+    except Exception as e:
+        db._note_db_failure(e)
+        return False
+
+
+def test_rejections_not_journaled():
+    if not DB_AVAILABLE:
+        print("  SKIP  test_rejections_not_journaled: supabase not installed")
+        return
+    write = db._guarded(False, journal=True)(_write)
+    breaker = CircuitBreaker("supabase-test", failure_threshold=2, reset_seconds=60)
+    saved, db._breaker = db._breaker, breaker
+    try:
+        with _TempJournal():
+            for error in (_ApiError("23505"), _ApiError("23503"), _ApiError("22P02"), _ApiError("PGRST204"),
+                          _ApiError("400"), _ApiError("404"), KeyError("id")):
+                write(error)
+                write(error)
+                assert breaker.state == CLOSED, error
+            assert db_journal.pending_count() == 0
+
+            for error in (TimeoutError("read timed out"), _ApiError("503"), _ApiError("57014")):
+                breaker.record_success()
+                write(error)
+                assert breaker.snapshot()["consecutive_failures"] == 1, error
+            assert [e["fn"] for e in db_journal.drain()] == ["_write"] * 3
+    finally:
+        db._breaker = saved
+
+
+def _append_many(path, prefix, count):
+    db_journal.DB_JOURNAL_PATH = path
+    for i in range(count):
+        db_journal.append("log_activity", (f"{prefix}-{i}",), {})
+
+
+def test_concurrent_append_during_drain():
+    with _TempJournal() as path:
+        writers = [threading.Thread(target=_append_many, args=(path, f"t{k}", 150)) for k in range(2)]
+        ctx = multiprocessing.get_context("fork")
+        procs = [ctx.Process(target=_append_many, args=(path, f"p{k}", 150)) for k in range(2)]
+        for w in writers + procs:
+            w.start()
+
+        drained = []
+        while any(w.is_alive() for w in writers + procs):
+            drained.extend(db_journal.drain())
+        for w in writers + procs:
+            w.join()
+        drained.extend(db_journal.drain())
+
+        ids = [e["args"][0] for e in drained]
+        expected = {f"{prefix}-{i}" for prefix in ("t0", "t1", "p0", "p1") for i in range(150)}
+        assert len(ids) == len(expected), f"{len(ids)} drained, {len(expected)} appended"
+        assert set(ids) == expected
+        # Each writer's own entries stay in order
+        for prefix in ("t0", "p1"):
+            mine = [int(i.split("-")[1]) for i in ids if i.startswith(prefix + "-")]
+            assert mine == sorted(mine)
+
+
+if __name__ == "__main__":
+    failed = 0
+    for test in (test_append_and_drain, test_replay, test_replay_drops_rejected, test_rejections_not_journaled,
+                 test_concurrent_append_during_drain):
+        try:
+            test()
+            print(f"  PASS  {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"  FAIL  {test.__name__}: {e}")
+    sys.exit(1 if failed else 0)
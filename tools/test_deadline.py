@@ -0,0 +1,152 @@
+"""
+Deadline Test — per-message budgets and hedged calls.
+
+- Deadline.remaining() counts down to zero and check() raises once spent
+- A call slower than p95 gets a backup request; the faster one wins
+- A fast call is never hedged
+- A call that outlives the budget raises DeadlineExceeded
+- An error from the only attempt is raised as-is
+- gated=True: time spent queued before mark_admitted() neither triggers a
+  hedge nor counts as latency; a call slow after admission is still hedged
+
+Usage: python tools/test_deadline.py
+       (also collected by pytest)
+"""
+
+import itertools
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools import deadline as dl  # noqa: E402
+
+_names = itertools.count()
+
+
+def _fresh_dependency(p95: float) -> str:
+    """New tracker name with a warmed-up window, so p95 is known."""
+    name = f"test-dep-{next(_names)}"
+    tracker = dl._get_tracker(name)
+    for _ in range(20):
+        tracker.record(p95)
+    return name
+
+
+def test_deadline_expiry():
+    deadline = dl.Deadline(0.1)
+    assert 0 < deadline.remaining() <= 0.1
+    deadline.check("start")
+    time.sleep(0.12)
+    assert deadline.expired() and deadline.remaining() == 0.0
+    try:
+        deadline.check("analyze")
+        raise AssertionError("expected DeadlineExceeded")
+    except dl.DeadlineExceeded as e:
+        assert "analyze" in str(e)
+
+
+def test_hedge_wins_over_slow_primary():
+    saved_min_delay = dl.HEDGE_MIN_DELAY_SECONDS
+    dl.HEDGE_MIN_DELAY_SECONDS = 0.05
+    try:
+        name = _fresh_dependency(0.05)
+        calls = itertools.count(1)
+        primary_done = threading.Event()
+
+        def fn(timeout):
+            attempt = next(calls)
+            if attempt == 1:
+                time.sleep(0.5)
+                primary_done.set()
+            return attempt
+
+        assert dl.hedged_call(fn, dl.Deadline(3), name=name) == 2
+        stats = dl._STATS[name].snapshot()
+        assert stats["hedged"] == 1 and stats["hedge_wins"] == 1, stats
+        # The losing primary still finishes and credits the time saved
+        assert primary_done.wait(2)
+        time.sleep(0.05)
+        assert dl._STATS[name].saved_seconds_total > 0
+    finally:
+        dl.HEDGE_MIN_DELAY_SECONDS = saved_min_delay
+
+
+def test_fast_call_not_hedged():
+    name = _fresh_dependency(0.05)
+    assert dl.hedged_call(lambda timeout: "ok", dl.Deadline(3), name=name) == "ok"
+    stats = dl._STATS[name].snapshot()
+    assert stats["calls"] == 1 and stats["hedged"] == 0, stats
+
+
+def test_deadline_miss():
+    name = _fresh_dependency(0.05)
+    started = time.monotonic()
+    try:
+        dl.hedged_call(lambda timeout: time.sleep(1.0), dl.Deadline(0.2), name=name)
+        raise AssertionError("expected DeadlineExceeded")
+    except dl.DeadlineExceeded:
+        pass
+    assert time.monotonic() - started < 0.6
+    # Too little budget left to be worth a backup request
+    stats = dl._STATS[name].snapshot()
+    assert stats["deadline_misses"] == 1 and stats["hedged"] == 0, stats
+
+
+def test_error_propagates():
+    name = _fresh_dependency(0.05)
+
+    def fn(timeout):
+        raise ValueError("boom")
+
+    try:
+        dl.hedged_call(fn, dl.Deadline(3), name=name)
+        raise AssertionError("expected ValueError")
+    except ValueError as e:
+        assert str(e) == "boom"
+
+
+def test_gated_hedge_times_from_admission():
+    saved_min_delay = dl.HEDGE_MIN_DELAY_SECONDS
+    dl.HEDGE_MIN_DELAY_SECONDS = 0.05
+    try:
+        name = _fresh_dependency(0.05)
+
+        def queued_then_fast(timeout):
+            time.sleep(0.3)  # waiting for a gateway slot
+            dl.mark_admitted()
+            time.sleep(0.01)
+            return "ok"
+
+        assert dl.hedged_call(queued_then_fast, dl.Deadline(3), name=name, gated=True) == "ok"
+        assert dl._STATS[name].snapshot()["hedged"] == 0
+        assert dl._TRACKERS[name]._samples[-1] < 0.2  # the queue wait isn't in the sample
+
+        calls = itertools.count(1)
+
+        def admitted_then_slow(timeout):
+            dl.mark_admitted()
+            if next(calls) == 1:
+                time.sleep(0.5)
+            return "done"
+
+        name = _fresh_dependency(0.05)
+        assert dl.hedged_call(admitted_then_slow, dl.Deadline(3), name=name, gated=True) == "done"
+        assert dl._STATS[name].snapshot()["hedged"] == 1
+        dl.mark_admitted()  # outside a hedged call: no-op
+    finally:
+        dl.HEDGE_MIN_DELAY_SECONDS = saved_min_delay
+
+
+if __name__ == "__main__":
+    failed = 0
+    for test in (test_deadline_expiry, test_hedge_wins_over_slow_primary, test_fast_call_not_hedged,
+                 test_deadline_miss, test_error_propagates, test_gated_hedge_times_from_admission):
+        try:
+            test()
+            print(f"  PASS  {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"  FAIL  {test.__name__}: {e}")
+    sys.exit(1 if failed else 0)
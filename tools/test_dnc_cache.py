@@ -0,0 +1,186 @@
+"""
+DNC Cache Test — per-tenant in-memory DNC membership used in place of a
+LIKE query per message.
+
+- A tenant is loaded on first lookup; later lookups are answered from memory
+  until DNC_SYNC_SECONDS passes, then only rows created since the last sync are pulled
+- The delta window overlaps the last sync, so a row committed late with an
+  older created_at is still picked up
+- Numbers match on their last 10 digits; shorter numbers go to the direct query
+- Write-through: an add blocks immediately, a remove unblocks
+- A slow sync doesn't hold up lookups or write-through updates for the
+  tenant, and its (older) rows don't undo a remove made meanwhile
+- A failed load or sync falls back to the direct query (which blocks when unsure)
+- Bloom mode never lets a listed number through
+
+Usage: python tools/test_dnc_cache.py
+       (also collected by pytest)
+"""
+
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools import dnc_cache  # noqa: E402
+from tools.dnc_cache import BloomFilter, DncCache  # noqa: E402
+
+
+class FakeDnc:
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = []
+        self.fail = False
+        self.direct = []
+
+    def load(self, user_id, since=None):
+        self.calls.append((user_id, since))
+        if self.fail:
+            return None
+        if user_id != "tenant-a":
+            return []
+        return [r for r in self.rows if since is None or r["created_at"] >= since]
+
+    def is_on_dnc_list(self, user_id, phone):
+        self.direct.append(phone)
+        return True
+
+
+def _row(phone, created):
+    return {"phone": phone, "created_at": f"2026-04-16T10:00:{created:02d}+00:00"}
+
+
+def test_lazy_load_and_delta_sync():
+    fake = FakeDnc([_row("+15551230001", 1), _row("15551230002", 2)])
+    cache = DncCache(fake.load, fake.is_on_dnc_list)
+    dnc_cache.DNC_SYNC_SECONDS = 3600
+    assert cache.is_blocked("tenant-a", "+1 (555) 123-0001")
+    assert cache.is_blocked("tenant-a", "5551230002")
+    assert not cache.is_blocked("tenant-a", "+15551239999")
+    assert fake.calls == [("tenant-a", None)]
+
+    fake.rows.append(_row("+15551239999", 3))
+    dnc_cache.DNC_SYNC_SECONDS = 0
+    assert cache.is_blocked("tenant-a", "+15551239999")
+    # The delta window overlaps the newest row seen by DNC_SYNC_OVERLAP_SECONDS
+    assert fake.calls[-1] == ("tenant-a", "2026-04-16T09:58:02+00:00")
+    assert not cache.is_blocked("tenant-b", "+15551230001")
+    assert fake.direct == []
+    stats = cache.stats()
+    assert stats["tenants"] == 2 and stats["numbers"] == 3, stats
+    dnc_cache.DNC_SYNC_SECONDS = 30
+
+
+def test_late_commit_in_overlap():
+    fake = FakeDnc([_row("+15551230001", 30)])
+    cache = DncCache(fake.load, fake.is_on_dnc_list)
+    dnc_cache.DNC_SYNC_SECONDS = 0
+    try:
+        assert not cache.is_blocked("tenant-a", "+15551230002")
+        # Inserted before the row already seen, but committed after the load
+        fake.rows.append(_row("+15551230002", 10))
+        assert cache.is_blocked("tenant-a", "+15551230002")
+        assert cache.stats()["numbers"] == 2
+    finally:
+        dnc_cache.DNC_SYNC_SECONDS = 30
+
+
+def test_write_through():
+    fake = FakeDnc([_row("+15551230001", 1)])
+    cache = DncCache(fake.load, fake.is_on_dnc_list)
+    assert not cache.is_blocked("tenant-a", "+15551230005")
+    cache.note_added("tenant-a", "+15551230005")
+    assert cache.is_blocked("tenant-a", "15551230005")
+    cache.note_removed("tenant-a", "15551230001")
+    assert not cache.is_blocked("tenant-a", "+15551230001")
+
+
+def test_sync_runs_outside_lock():
+    fake = FakeDnc([_row("+15551230001", 1)])
+    in_query, release = threading.Event(), threading.Event()
+
+    def slow_load(user_id, since=None):
+        rows = fake.load(user_id, since)  # snapshot taken before the remove below
+        if since is not None:
+            in_query.set()
+            release.wait(5)
+        return rows
+
+    cache = DncCache(slow_load, fake.is_on_dnc_list)
+    assert cache.is_blocked("tenant-a", "+15551230001")
+    dnc_cache.DNC_SYNC_SECONDS = 0
+    try:
+        syncing = threading.Thread(target=cache.is_blocked, args=("tenant-a", "+15551230002"))
+        syncing.start()
+        assert in_query.wait(2)
+
+        started = time.monotonic()
+        assert cache.is_blocked("tenant-a", "+15551230001")
+        cache.note_added("tenant-a", "+15551230003")
+        fake.rows = []  # remove_from_dnc_list committed, then the cache is told
+        cache.note_removed("tenant-a", "+15551230001")
+        assert time.monotonic() - started < 1
+
+        release.set()
+        syncing.join(5)
+        assert not cache.is_blocked("tenant-a", "+15551230001")
+        assert cache.is_blocked("tenant-a", "+15551230003")
+        assert fake.direct == []
+    finally:
+        release.set()
+        dnc_cache.DNC_SYNC_SECONDS = 30
+
+
+def test_blocks_when_unsure():
+    fake = FakeDnc([])
+    cache = DncCache(fake.load, fake.is_on_dnc_list)
+    fake.fail = True
+    assert cache.is_blocked("tenant-a", "+15551230001")
+    assert cache.is_blocked("tenant-a", "12345")
+    assert fake.direct == ["+15551230001", "12345"]
+    assert cache.stats()["sync_failures"] == 1
+
+    fake.fail = False
+    assert not cache.is_blocked("tenant-a", "+15551230001")
+    dnc_cache.DNC_SYNC_SECONDS = 0
+    fake.fail = True
+    assert cache.is_blocked("tenant-a", "+15551230001")
+    dnc_cache.DNC_SYNC_SECONDS = 30
+
+
+def test_bloom_mode():
+    bloom = BloomFilter(10_000, 0.001)
+    keys = [f"555{i:07d}" for i in range(10_000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    false_positives = sum(f"777{i:07d}" in bloom for i in range(10_000))
+    assert false_positives < 50, false_positives
+
+    threshold = dnc_cache.DNC_BLOOM_THRESHOLD
+    dnc_cache.DNC_BLOOM_THRESHOLD = 100
+    try:
+        fake = FakeDnc([_row(f"+1555{i:07d}", i % 60) for i in range(500)])
+        cache = DncCache(fake.load, fake.is_on_dnc_list)
+        assert cache.is_blocked("tenant-a", "+15550000042")
+        assert cache.stats()["bloom_tenants"] == 1
+        cache.note_removed("tenant-a", "+15550000042")
+        assert not cache.is_blocked("tenant-a", "+15550000042")
+        cache.note_added("tenant-a", "+15550000042")
+        assert cache.is_blocked("tenant-a", "+15550000042")
+    finally:
+        dnc_cache.DNC_BLOOM_THRESHOLD = threshold
+
+
+if __name__ == "__main__":
+    failed = 0
+    for test in (test_lazy_load_and_delta_sync, test_late_commit_in_overlap, test_write_through,
+                 test_sync_runs_outside_lock, test_blocks_when_unsure, test_bloom_mode):
+        try:
+            test()
+            print(f"  PASS  {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"  FAIL  {test.__name__}: {e}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,99 @@
+"""
+Follow-up Cancels Test — "lead replied, cancel their pending follow-ups"
+without an UPDATE per reply.
+
+- has_pending_follow_ups(): a lead whose trigger-kept count is 0 needs no
+  write; a lead row without the column (migration not applied) still does
+- FollowUpCanceller: a burst of replies becomes one write after the flush
+  window, a full batch flushes immediately, and duplicate leads collapse
+- A failed (or raising) write is counted as failed, not as cancelled
+
+Usage: python tools/test_follow_up_cancels.py
+       (also collected by pytest)
+"""
+
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools.lead_updates import FollowUpCanceller, has_pending_follow_ups  # noqa: E402
+
+
+class FakeWriter:
+    def __init__(self, result=True):
+        self.calls = []
+        self.written = threading.Event()
+        self.result = result
+
+    def __call__(self, lead_ids):
+        self.calls.append(sorted(lead_ids))
+        self.written.set()
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+def test_pending_index():
+    assert not has_pending_follow_ups(None)
+    assert not has_pending_follow_ups({"id": "lead-1", "pending_follow_ups": 0})
+    assert has_pending_follow_ups({"id": "lead-1", "pending_follow_ups": 2})
+    assert has_pending_follow_ups({"id": "lead-1"})
+
+
+def test_burst_is_one_write():
+    writer = FakeWriter()
+    canceller = FollowUpCanceller(writer, flush_ms=100, max_batch=100)
+    for i in range(20):
+        canceller.submit(f"lead-{i % 10}", "lead replied via WhatsApp")
+    assert writer.calls == []
+    assert canceller.stats()["queued"] == 10
+    assert writer.written.wait(2)
+    time.sleep(0.05)
+    assert writer.calls == [sorted(f"lead-{i}" for i in range(10))]
+    stats = canceller.stats()
+    assert stats["batches"] == 1 and stats["cancelled_leads"] == 10 and stats["queued"] == 0, stats
+
+
+def test_full_batch_flushes_early():
+    writer = FakeWriter()
+    canceller = FollowUpCanceller(writer, flush_ms=10_000, max_batch=5)
+    for i in range(12):
+        canceller.submit(f"lead-{i}", "lead replied via SMS")
+    assert [len(call) for call in writer.calls] == [5, 5]
+    canceller.flush()
+    assert [len(call) for call in writer.calls] == [5, 5, 2]
+    canceller.skip()
+    assert canceller.stats()["skipped_no_pending"] == 1
+
+
+
+def test_failed_write_not_counted():
+    writer = FakeWriter(result=False)
+    canceller = FollowUpCanceller(writer, flush_ms=10_000, max_batch=100)
+    for i in range(3):
+        canceller.submit(f"lead-{i}", "lead replied via SMS")
+    canceller.flush()
+    writer.result = RuntimeError("connection reset")
+    canceller.submit("lead-9", "lead replied via SMS")
+    canceller.flush()
+    writer.result = True
+    canceller.submit("lead-10", "lead replied via SMS")
+    canceller.flush()
+    stats = canceller.stats()
+    assert stats["cancelled_leads"] == 1 and stats["failed_leads"] == 4 and stats["batches"] == 3, stats
+    assert stats["queued"] == 0
+
+
+if __name__ == "__main__":
+    failed = 0
+    for test in (test_pending_index, test_burst_is_one_write, test_full_batch_flushes_early,
+                 test_failed_write_not_counted):
+        try:
+            test()
+            print(f"  PASS  {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"  FAIL  {test.__name__}: {e}")
+    sys.exit(1 if failed else 0)
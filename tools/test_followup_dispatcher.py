@@ -0,0 +1,211 @@
+"""
+Follow-up Dispatcher Test — several workers draining one follow_ups table.
+
+- FakeStore mimics the claim/complete RPCs: claims skip rows another worker
+  holds (SKIP LOCKED), completions only apply to rows the worker still holds
+- Two dispatchers with parallel senders drain the queue: every row is sent
+  exactly once and ends up sent/cancelled, DNC numbers are never sent to
+- Results come back as one completion + one log write per batch
+- A claim whose lease has already run out is not sent
+- A row cancelled after the claim (reply/STOP cancels 'sending' rows too) is
+  not sent, and the completion doesn't overwrite the cancel; if the claim
+  can't be checked the row is left to the lease
+- A row whose send raises anything is marked failed; the rest of the batch
+  is sent and recorded
+- run() survives a batch that raises; a failed completion is retried
+
+Usage: python tools/test_followup_dispatcher.py
+       (also collected by pytest)
+"""
+
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools.followup_dispatcher import Dispatcher  # noqa: E402
+
+DNC_PHONE = "+15550000013"
+
+
+class FakeStore:
+    def __init__(self, count):
+        self.lock = threading.Lock()
+        self.rows = {
+            f"fu-{i}": {"id": f"fu-{i}", "user_id": f"tenant-{i % 3}", "lead_id": f"lead-{i}",
+                        "message_text": f"Checking in #{i}", "kind": "follow_up",
+                        "channel": "sms" if i % 4 == 0 else "whatsapp",
+                        "lead_phone": DNC_PHONE if i == 13 else f"+1555000{i:04d}", "agent_name": "Nadine",
+                        "status": "pending", "claimed_by": None}
+            for i in range(count)
+        }
+        self.completions = []
+        self.log_writes = []
+
+    def claim(self, worker, limit, lease_seconds, channels):
+        with self.lock:
+            due = [r for r in self.rows.values() if r["status"] == "pending" and r["channel"] in channels][:limit]
+            for r in due:
+                r["status"], r["claimed_by"] = "sending", worker
+            return [dict(r) for r in due]
+
+    def complete(self, worker, results):
+        with self.lock:
+            self.completions.append(len(results))
+            for result in results:
+                row = self.rows[result["id"]]
+                if row["claimed_by"] == worker and row["status"] == "sending":
+                    row["status"], row["claimed_by"] = result["status"], None
+        return True
+
+    def claim_held(self, follow_up_id, worker):
+        with self.lock:
+            row = self.rows[follow_up_id]
+            return row["claimed_by"] == worker and row["status"] == "sending"
+
+    def cancel(self, lead_ids):
+        """cancel_follow_ups_for_leads: pending and claimed rows."""
+        with self.lock:
+            for row in self.rows.values():
+                if row["lead_id"] in lead_ids and row["status"] in ("pending", "sending"):
+                    row["status"] = "cancelled"
+
+    def log_sends(self, messages, activities):
+        self.log_writes.append((len(messages), len(activities)))
+        return True
+
+
+class FakeTransports:
+    def __init__(self, broken=()):
+        self.lock = threading.Lock()
+        self.sent = []
+        self.broken = set(broken)
+
+    def _send(self, to_number):
+        time.sleep(0.002)
+        if to_number in self.broken:
+            raise ValueError("unexpected response shape")
+        with self.lock:
+            self.sent.append(to_number)
+        return {"ok": True, "external_id": f"ext-{to_number}"}
+
+    def whatsapp(self, to_number, body, agent_name):
+        return self._send(to_number)
+
+    def sms(self, to_number, body):
+        return self._send(to_number)
+
+
+def _dispatcher(store, transports, **kwargs):
+    kwargs.setdefault("claim_held", store.claim_held)
+    return Dispatcher(claim=store.claim, complete=store.complete, log_sends=store.log_sends,
+                      transports=transports, is_blocked=lambda user_id, phone: phone == DNC_PHONE,
+                      on_national_dnc=lambda phone: False, **kwargs)
+
+
+def test_workers_never_double_send():
+    store, transports = FakeStore(200), FakeTransports()
+    workers = [_dispatcher(store, transports, worker_id=f"w{i}", batch_size=25, workers=4) for i in range(2)]
+    threads = [threading.Thread(target=w.run, kwargs={"once": True}) for w in workers]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=30)
+
+    assert len(transports.sent) == len(set(transports.sent)) == 199, len(transports.sent)
+    assert DNC_PHONE not in transports.sent
+    statuses = [r["status"] for r in store.rows.values()]
+    assert statuses.count("sent") == 199 and statuses.count("cancelled") == 1, set(statuses)
+    assert sum(w.stats()["claimed"] for w in workers) == 200
+    # One completion and one log write per batch
+    batches = sum(w.stats()["batches"] for w in workers)
+    assert len(store.completions) == len(store.log_writes) == batches == 8, batches
+
+
+def test_expired_lease_is_not_sent():
+    store, transports = FakeStore(5), FakeTransports()
+    dispatcher = _dispatcher(store, transports, worker_id="slow", batch_size=5, workers=2, lease_seconds=0)
+    assert dispatcher.run_batch() == 5
+    assert transports.sent == []
+    assert dispatcher.stats()["lease_expired"] == 5
+    assert all(r["status"] == "sending" for r in store.rows.values())
+
+
+def test_cancel_during_claim_is_not_sent():
+    store, transports = FakeStore(4), FakeTransports()
+
+    def claim_then_reply(*args):
+        rows = store.claim(*args)
+        store.cancel({"lead-1"})  # the lead replies while the batch is claimed
+        return rows
+
+    dispatcher = Dispatcher(claim=claim_then_reply, complete=store.complete, log_sends=store.log_sends,
+                            claim_held=store.claim_held, transports=transports,
+                            is_blocked=lambda user_id, phone: False, on_national_dnc=lambda phone: False,
+                            worker_id="w", batch_size=4, workers=2)
+    assert dispatcher.run_batch() == 4
+    assert "+15550000001" not in transports.sent and len(transports.sent) == 3
+    assert store.rows["fu-1"]["status"] == "cancelled"
+    assert dispatcher.stats()["withdrawn"] == 1 and dispatcher.stats()["sent"] == 3
+
+    # Claim can't be checked (Supabase blip): not sent, left to the lease
+    store, transports = FakeStore(2), FakeTransports()
+    dispatcher = _dispatcher(store, transports, worker_id="w", batch_size=2, claim_held=lambda *a: None)
+    assert dispatcher.run_batch() == 2
+    assert transports.sent == [] and dispatcher.stats()["lease_expired"] == 2
+
+
+
+def test_row_error_marks_row_failed():
+    store = FakeStore(6)
+    transports = FakeTransports(broken={"+15550000002"})
+    dispatcher = _dispatcher(store, transports, worker_id="w", batch_size=10, workers=3)
+    assert dispatcher.run_batch() == 6
+    statuses = {r["id"]: r["status"] for r in store.rows.values()}
+    assert statuses.pop("fu-2") == "failed"
+    assert set(statuses.values()) == {"sent"}, statuses
+    assert dispatcher.stats()["failed"] == 1 and dispatcher.stats()["sent"] == 5
+
+
+def test_run_survives_errors_and_retries_completion():
+    store, transports = FakeStore(4), FakeTransports()
+    claim_calls, complete_calls = [], []
+
+    def claim(*args):
+        claim_calls.append(args)
+        if len(claim_calls) == 1:
+            raise RuntimeError("claim RPC blew up")
+        return store.claim(*args)
+
+    def complete(worker, results):
+        complete_calls.append(len(results))
+        return len(complete_calls) > 1 and store.complete(worker, results)
+
+    dispatcher = Dispatcher(claim=claim, complete=complete, log_sends=store.log_sends, transports=transports,
+                            is_blocked=lambda user_id, phone: False, on_national_dnc=lambda phone: False,
+                            worker_id="w", batch_size=10, workers=2)
+    runner = threading.Thread(target=dispatcher.run, kwargs={"poll_seconds": 0.01})
+    runner.start()
+    end = time.monotonic() + 10
+    while any(r["status"] != "sent" for r in store.rows.values()) and time.monotonic() < end:
+        time.sleep(0.01)
+    dispatcher.stop()
+    runner.join(timeout=5)
+    assert not runner.is_alive()
+    assert all(r["status"] == "sent" for r in store.rows.values())
+    assert len(transports.sent) == 4 and complete_calls[:2] == [4, 4], complete_calls
+    assert dispatcher.stats()["unrecorded"] == 0
+
+
+if __name__ == "__main__":
+    failed = 0
+    for test in (test_workers_never_double_send, test_expired_lease_is_not_sent, test_cancel_during_claim_is_not_sent,
+                 test_row_error_marks_row_failed, test_run_survives_errors_and_retries_completion):
+        try:
+            test()
+            print(f"  PASS  {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"  FAIL  {test.__name__}: {e}")
+    sys.exit(1 if failed else 0)
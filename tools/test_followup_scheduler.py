@@ -0,0 +1,146 @@
+"""
+Follow-up Scheduler Test — legacy leads_state.csv scheduler on SQLite.
+
+- Import: a new lead without a date is due now, later stages without a
+  date are never due, inactive leads are skipped
+- run_scheduler(): only due leads are sent; each send advances the stage
+  and next follow-up on that one row; a second pass sends nothing
+- run_forever(): the heap loop wakes for each follow-up in due order and
+  sleeps until the next one (simulated clock)
+- open_store(): an edited CSV is merged by phone, keeping stage, next due
+  time and last_outbound_at; an unchanged CSV (or our own export) isn't
+
+Usage: python tools/test_followup_scheduler.py
+       (also collected by pytest)
+"""
+
+import csv
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools import followup_scheduler as fs  # noqa: E402
+
+NOW = datetime(2026, 5, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def _store(rows):
+    tmp = tempfile.mkdtemp()
+    csv_path = os.path.join(tmp, "leads_state.csv")
+    fs.save_leads(rows, csv_path)
+    store = fs.LeadStore(os.path.join(tmp, "leads_state.sqlite3"))
+    store.import_csv(csv_path, now=NOW)
+    return store
+
+
+def _lead(phone, stage="new", status="active", next_at=""):
+    return {"phone": phone, "name": f"Owner {phone}", "stage": stage, "status": status, "next_followup_at": next_at}
+
+
+def test_single_pass_sends_only_due():
+    sent = []
+    original, fs.send_sms = fs.send_sms, lambda to, body: sent.append(to)
+    try:
+        store = _store([
+            _lead("+1001"),
+            _lead("+1002", stage="followup1", next_at=fs.format_iso(NOW - timedelta(hours=1))),
+            _lead("+1003", stage="followup1", next_at=fs.format_iso(NOW + timedelta(days=1))),
+            _lead("+1004", stage="followup2"),
+            _lead("+1005", status="paused"),
+        ])
+        assert fs.run_scheduler(store, now=NOW) == 2
+        assert sent == ["+1002", "+1001"], sent  # earliest due first
+        first = store.get(1)
+        assert first["stage"] == "outbound_sent"
+        assert first["next_due"] == (NOW + timedelta(days=1)).timestamp()
+        assert store.get(2)["stage"] == "followup2"
+        assert store.get(3)["stage"] == "followup1"
+        assert fs.run_scheduler(store, now=NOW) == 0
+    finally:
+        fs.send_sms = original
+
+
+def test_watch_sleeps_until_next_due():
+    sent, sleeps = [], []
+    clock = [NOW.timestamp()]
+    original, fs.send_sms = fs.send_sms, lambda to, body: sent.append((to, clock[0]))
+    try:
+        store = _store([
+            _lead("+2001", stage="followup3", next_at=fs.format_iso(NOW + timedelta(seconds=90))),
+            _lead("+2002", stage="followup3", next_at=fs.format_iso(NOW + timedelta(seconds=30))),
+        ])
+
+        def sleep(seconds):
+            sleeps.append(round(seconds))
+            clock[0] += seconds
+
+        fs.run_forever(store, max_sleep=300, clock=lambda: clock[0], sleep=sleep, stop=lambda: len(sleeps) >= 3)
+        assert [to for to, _ in sent] == ["+2002", "+2001"], sent
+        assert sleeps[:2] == [30, 60], sleeps
+        # followup3 -> done: nothing left scheduled
+        assert store.get(1)["stage"] == store.get(2)["stage"] == "done"
+        assert store.get(1)["next_due"] is None
+    finally:
+        fs.send_sms = original
+
+
+def test_export_round_trip():
+    store = _store([_lead("+3001", stage="followup1", next_at=fs.format_iso(NOW))])
+    out = os.path.join(tempfile.mkdtemp(), "out.csv")
+    store.export_csv(out)
+    with open(out, newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    assert rows[0]["phone"] == "+3001" and fs.parse_iso(rows[0]["next_followup_at"]) == NOW
+
+
+
+def test_csv_edits_merge_and_keep_progress():
+    tmp = tempfile.mkdtemp()
+    csv_path, db_path = os.path.join(tmp, "leads_state.csv"), os.path.join(tmp, "leads_state.sqlite3")
+    fs.save_leads([_lead("+4001"), _lead("+4002"), _lead("+4003", stage="followup2")], csv_path)
+    original, fs.send_sms = fs.send_sms, lambda to, body: None
+    try:
+        store = fs.open_store(db_path, csv_path)
+        assert store.count() == 3
+        assert fs.run_scheduler(store) == 2  # new leads were imported as due "now"
+        progressed = store.get(1)
+        store.close()
+
+        # Edited by hand: rename +4001, drop +4003, add +4004 (the CSV still says stage "new")
+        fs.save_leads([dict(_lead("+4001"), name="Renamed Owner"), _lead("+4002"), _lead("+4004")], csv_path)
+        mtime = os.stat(csv_path).st_mtime_ns + 10 ** 9
+        os.utime(csv_path, ns=(mtime, mtime))
+        store = fs.open_store(db_path, csv_path)
+        leads = {row["phone"]: row for row in store.conn.execute("SELECT * FROM leads")}
+        assert sorted(leads) == ["+4001", "+4002", "+4004"]
+        first = leads["+4001"]
+        assert first["id"] == 1 and first["name"] == "Renamed Owner"
+        assert (first["stage"], first["next_due"], first["last_outbound_at"]) == \
+            ("outbound_sent", progressed["next_due"], progressed["last_outbound_at"])
+        assert leads["+4004"]["stage"] == "new" and leads["+4004"]["next_due"] is not None
+        # A forced re-import is a no-op for progress, never a reset
+        store.import_csv(csv_path, now=NOW)
+        assert store.get(1)["stage"] == "outbound_sent"
+        store.export_csv(csv_path)
+        store.close()
+
+        store = fs.open_store(db_path, csv_path)
+        assert store.is_current(csv_path) and store.get(1)["stage"] == "outbound_sent"
+        store.close()
+    finally:
+        fs.send_sms = original
+
+
+if __name__ == "__main__":
+    failed = 0
+    for test in (test_single_pass_sends_only_due, test_watch_sleeps_until_next_due, test_export_round_trip,
+                 test_csv_edits_merge_and_keep_progress):
+        try:
+            test()
+            print(f"  PASS  {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"  FAIL  {test.__name__}: {e}")
+    sys.exit(1 if failed else 0)
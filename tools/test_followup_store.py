@@ -0,0 +1,109 @@
+"""
+Follow-up Store Test — date-indexed store behind send_followups.py.
+
+- open_store() imports the CSV once, and again only after it changes;
+  rows already sent keep their status across the re-import
+- due(day) returns just that day's pending rows; set_status() takes a row
+  out of the pending index in place
+- send_followups.py end to end: only today's rows are sent, statuses stick
+  across runs and are written back in the CSV format (not with --no-export)
+
+Usage: python tools/test_followup_store.py
+       (also collected by pytest)
+"""
+
+import csv
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools.followup_store import FIELDS, open_store  # noqa: E402
+
+SEND_FOLLOWUPS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "send_followups.py")
+
+
+def _write_csv(path, rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def _row(phone, send_date, status="pending", message="Checking in"):
+    return {"owner_name": "Dana", "property_address": "1 Main St", "phone": phone, "day_offset": "1",
+            "send_date": send_date, "message_text": message, "status": status}
+
+
+def test_indexed_day_and_reimport():
+    path = os.path.join(tempfile.mkdtemp(), "followups.csv")
+    _write_csv(path, [_row("+1001", "2026-05-01"), _row("+1002", "2026-05-02"),
+                      _row("+1003", "2026-05-01", status="sent"), _row("+1004", "2026-05-01")])
+    store = open_store(path)
+    due = store.due("2026-05-01")
+    assert [r["phone"] for r in due] == ["+1001", "+1004"]
+    store.set_status(due[0]["id"], "demo: whatsapp stub @ 2026-05-01")
+    store.close()
+
+    # Unchanged CSV: statuses in the store survive
+    store = open_store(path)
+    assert [r["phone"] for r in store.due("2026-05-01")] == ["+1004"]
+    store.close()
+
+    # A rebuilt schedule keeps what was already sent and drops what's gone
+    time.sleep(0.01)
+    _write_csv(path, [_row("+1001", "2026-05-01"), _row("+1004", "2026-05-01"), _row("+2001", "2026-05-01")])
+    store = open_store(path)
+    assert store.count() == 3 and [r["phone"] for r in store.due("2026-05-01")] == ["+1004", "+2001"]
+    store.close()
+
+    # A new schedule replaces the store
+    time.sleep(0.01)
+    _write_csv(path, [_row("+2001", "2026-05-02")])
+    store = open_store(path)
+    assert store.count() == 1 and [r["phone"] for r in store.due("2026-05-02")] == ["+2001"]
+    store.close()
+
+
+def test_send_followups_script():
+    path = os.path.join(tempfile.mkdtemp(), "followups.csv")
+    _write_csv(path, [_row("+3001", "2026-05-01"), _row("", "2026-05-01"),
+                      _row("+3003", "2026-05-01", message=""), _row("+3004", "2026-05-09")])
+    run = [sys.executable, SEND_FOLLOWUPS, path, "--today", "2026-05-01"]
+    out = subprocess.run(run, capture_output=True, text=True, check=True).stdout
+    assert out.count("[demo] WhatsApp send") == 1 and "+3001" in out, out
+
+    with open(path, newline="", encoding="utf-8") as f:
+        statuses = [r["status"] for r in csv.DictReader(f)]
+    assert statuses == ["demo: whatsapp stub @ 2026-05-01", "skipped: no phone",
+                        "skipped: empty message", "pending"], statuses
+
+    # Second run the same day sends nothing again and leaves the CSV alone
+    mtime = os.stat(path).st_mtime_ns
+    out = subprocess.run(run, capture_output=True, text=True, check=True).stdout
+    assert "[demo] WhatsApp send" not in out, out
+    assert os.stat(path).st_mtime_ns == mtime
+
+    # --no-export keeps statuses in the store only
+    time.sleep(0.01)
+    _write_csv(path, [_row("+3005", "2026-05-01")])
+    out = subprocess.run(run + ["--no-export"], capture_output=True, text=True, check=True).stdout
+    assert "+3005" in out, out
+    with open(path, newline="", encoding="utf-8") as f:
+        assert [r["status"] for r in csv.DictReader(f)] == ["pending"]
+    out = subprocess.run(run, capture_output=True, text=True, check=True).stdout
+    assert "[demo] WhatsApp send" not in out, out
+
+
+if __name__ == "__main__":
+    failed = 0
+    for test in (test_indexed_day_and_reimport, test_send_followups_script):
+        try:
+            test()
+            print(f"  PASS  {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"  FAIL  {test.__name__}: {e}")
+    sys.exit(1 if failed else 0)
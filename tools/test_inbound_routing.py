@@ -0,0 +1,101 @@
+"""
+Inbound Routing Test — business number → tenant table used to attribute
+inbound messages without scanning every tenant's leads.
+
+- First refresh is a full load, later ones only apply deltas (updated_at > last sync)
+- Deactivated routes are dropped; a failed refresh keeps the last good table
+- A periodic full reload drops hard-deleted routes a delta never reports
+- SMS numbers match on digits only; WhatsApp phone_number_id matches exactly
+
+Usage: python tools/test_inbound_routing.py
+       (also collected by pytest)
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools.inbound_routing import RoutingTable  # noqa: E402
+
+
+class FakeRoutes:
+    def __init__(self):
+        self.calls = []
+        self.responses = []
+
+    def __call__(self, since):
+        self.calls.append(since)
+        return self.responses.pop(0)
+
+
+def test_full_then_delta():
+    loader = FakeRoutes()
+    table = RoutingTable(loader)
+    loader.responses.append([
+        {"channel": "whatsapp", "business_number": "1049912345", "user_id": "tenant-a", "active": True,
+         "updated_at": "2026-04-15T10:00:00+00:00"},
+        {"channel": "sms", "business_number": "+1 (555) 010-2000", "user_id": "tenant-b", "active": True,
+         "updated_at": "2026-04-15T11:00:00+00:00"},
+    ])
+    assert table.refresh()
+    assert loader.calls == [None]
+    assert table.lookup("whatsapp", "1049912345") == "tenant-a"
+    assert table.lookup("sms", "+15550102000") == "tenant-b"
+    assert table.lookup("sms", "15550109999") is None
+    assert table.lookup("whatsapp", "15550102000") is None
+
+    loader.responses.append([
+        {"channel": "sms", "business_number": "15550102000", "user_id": "tenant-b", "active": False,
+         "updated_at": "2026-04-16T09:00:00+00:00"},
+        {"channel": "sms", "business_number": "15550103000", "user_id": "tenant-c", "active": True,
+         "updated_at": "2026-04-16T09:30:00+00:00"},
+    ])
+    assert table.refresh()
+    assert loader.calls[-1] == "2026-04-15T11:00:00+00:00"
+    assert table.lookup("sms", "+15550102000") is None
+    assert table.lookup("sms", "+1 555 010 3000") == "tenant-c"
+    assert table.lookup("whatsapp", "1049912345") == "tenant-a"
+
+    stats = table.stats()
+    assert stats["routes"] == 2 and stats["hits"] == 4 and stats["fallback_scans"] == 3, stats
+
+
+def test_failed_refresh_keeps_table():
+    loader = FakeRoutes()
+    table = RoutingTable(loader)
+    loader.responses += [
+        [{"channel": "whatsapp", "business_number": "77", "user_id": "tenant-a", "updated_at": "2026-04-15"}],
+        None,
+    ]
+    assert table.refresh()
+    assert not table.refresh()
+    assert table.lookup("whatsapp", "77") == "tenant-a"
+    assert loader.calls == [None, "2026-04-15"]
+
+
+def test_full_reload_drops_deleted_routes():
+    loader = FakeRoutes()
+    table = RoutingTable(loader, full_reload_seconds=0)
+    loader.responses += [
+        [{"channel": "sms", "business_number": "15550102000", "user_id": "tenant-a", "updated_at": "2026-04-15"},
+         {"channel": "sms", "business_number": "15550103000", "user_id": "tenant-b", "updated_at": "2026-04-16"}],
+        # tenant-b's account (and its route, via ON DELETE CASCADE) was deleted
+        [{"channel": "sms", "business_number": "15550102000", "user_id": "tenant-a", "updated_at": "2026-04-15"}],
+    ]
+    assert table.refresh() and table.refresh()
+    assert loader.calls == [None, None]
+    assert table.lookup("sms", "15550102000") == "tenant-a"
+    assert table.lookup("sms", "15550103000") is None
+    assert table.stats()["full_loads"] == 2
+
+
+if __name__ == "__main__":
+    failed = 0
+    for test in (test_full_then_delta, test_failed_refresh_keeps_table, test_full_reload_drops_deleted_routes):
+        try:
+            test()
+            print(f"  PASS  {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"  FAIL  {test.__name__}: {e}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,146 @@
+"""
+Lead Batch Test — concurrent, resumable per-lead generation (lead_batch.py).
+
+- run_concurrent(): runs leads in parallel, never more than the window in
+  flight, and yields failures instead of raising; ordered=True yields in
+  input order, and a slow consumer stops the source being read ahead
+- ResumableCsvWriter: a second run skips checkpointed leads, and rows
+  written after the last checkpoint (crash mid-write) are dropped, so the
+  final CSV has every lead exactly once; a checkpoint for a different input
+  file is ignored, and finish() removes it after a clean run
+- lead_key(): one phone with two properties is two leads
+
+Usage: python tools/test_lead_batch.py
+       (also collected by pytest)
+"""
+
+import csv
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools.lead_batch import ResumableCsvWriter, lead_key, run_concurrent  # noqa: E402
+
+FIELDS = ["phone", "message_text"]
+LEADS = [{"phone": f"+1555000{i:04d}", "owner_name": f"Owner {i}"} for i in range(20)]
+
+
+def test_bounded_concurrency():
+    lock = threading.Lock()
+    state = {"in_flight": 0, "peak": 0}
+
+    def work(lead):
+        with lock:
+            state["in_flight"] += 1
+            state["peak"] = max(state["peak"], state["in_flight"])
+        time.sleep(0.01)
+        with lock:
+            state["in_flight"] -= 1
+        if lead["owner_name"] == "Owner 3":
+            raise RuntimeError("boom")
+        return lead["owner_name"]
+
+    started = time.monotonic()
+    results = list(run_concurrent(LEADS, work, concurrency=4))
+    assert time.monotonic() - started < 0.15  # 20 x 10ms sequentially would be 0.2s
+    assert len(results) == 20 and state["peak"] <= 4, state
+    failed = [lead for lead, _, error in results if error is not None]
+    assert [lead["owner_name"] for lead in failed] == ["Owner 3"]
+
+
+def test_ordered_with_back_pressure():
+    pulled = []
+
+    def source():
+        for i in range(30):
+            pulled.append(i)
+            yield i
+
+    def work(i):
+        time.sleep(0.001 * ((i * 7) % 5))
+        return i * i
+
+    seen = []
+    for i, result, error in run_concurrent(source(), work, concurrency=3, window=5, ordered=True):
+        # Never more than the window read past what the consumer has taken
+        assert len(pulled) - len(seen) <= 5, (len(pulled), len(seen))
+        seen.append(i)
+        assert result == i * i and error is None
+        time.sleep(0.002)
+    assert seen == list(range(30))
+
+
+def test_resume_skips_done_and_drops_torn_rows():
+    out_path = os.path.join(tempfile.mkdtemp(), "followups.csv")
+    out = ResumableCsvWriter(out_path, FIELDS)
+    for lead in LEADS[:5]:
+        out.write(lead_key(lead), [{"phone": lead["phone"], "message_text": "hi"}])
+    out.close()
+    # Crash after rows hit the file but before their checkpoint line
+    with open(out_path, "a", encoding="utf-8") as f:
+        f.write(f"{LEADS[5]['phone']},hi\n")
+
+    out = ResumableCsvWriter(out_path, FIELDS)
+    assert out.resumed == 5
+    todo = [lead for lead in LEADS if not out.done(lead_key(lead))]
+    assert len(todo) == 15
+    for lead in todo:
+        out.write(lead_key(lead), [{"phone": lead["phone"], "message_text": "hi"}])
+    out.close()
+
+    with open(out_path, newline="", encoding="utf-8") as f:
+        phones = [row["phone"] for row in csv.DictReader(f)]
+    assert sorted(phones) == sorted(lead["phone"] for lead in LEADS), phones
+
+    # --restart starts a fresh file
+    out = ResumableCsvWriter(out_path, FIELDS, restart=True)
+    assert out.resumed == 0
+    out.close()
+
+
+def test_checkpoint_tied_to_input():
+    folder = tempfile.mkdtemp()
+    leads_path, out_path = os.path.join(folder, "leads.csv"), os.path.join(folder, "followups.csv")
+    with open(leads_path, "w", encoding="utf-8") as f:
+        f.write("phone\n+15550000001\n")
+    out = ResumableCsvWriter(out_path, FIELDS, source=leads_path)
+    out.write("a", [{"phone": "+15550000001", "message_text": "hi"}])
+    out.close()
+
+    out = ResumableCsvWriter(out_path, FIELDS, source=leads_path)
+    assert out.resumed == 1 and not out.stale
+    out.close()
+    # Edited leads file: the old progress doesn't apply
+    with open(leads_path, "a", encoding="utf-8") as f:
+        f.write("+15550000002\n")
+    out = ResumableCsvWriter(out_path, FIELDS, source=leads_path)
+    assert out.resumed == 0 and out.stale
+    out.write("a", [{"phone": "+15550000001", "message_text": "hi"}])
+    out.finish()
+    assert not os.path.exists(out.checkpoint_path)
+    with open(out_path, newline="", encoding="utf-8") as f:
+        assert [row["phone"] for row in csv.DictReader(f)] == ["+15550000001"]
+
+
+def test_lead_key_per_property():
+    a = {"phone": "+1 555 000 0001", "property_address": "1 Main St"}
+    b = {"phone": "555-000-0001", "property_address": "9 Elm Ave"}
+    assert lead_key(a) != lead_key(b)
+    assert lead_key(a) == lead_key({"phone": "5550000001", "property_address": " 1  MAIN st "})
+    assert lead_key({"phone": "+15550000001"}) == "5550000001"
+
+
+if __name__ == "__main__":
+    failed = 0
+    for test in (test_bounded_concurrency, test_ordered_with_back_pressure, test_resume_skips_done_and_drops_torn_rows,
+                 test_checkpoint_tied_to_input, test_lead_key_per_property):
+        try:
+            test()
+            print(f"  PASS  {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"  FAIL  {test.__name__}: {e}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,99 @@
+"""
+LLM Batch Test — Batch API mode against the local file-based backend.
+
+- run_batch(): requests go out in Batch JSONL format, results come back
+  keyed by custom_id; a failed request is an Exception for that lead only
+- Polling waits while the batch is in progress
+- Re-running the same job reuses the submitted batch / downloaded results
+  instead of submitting again; only failed or changed requests go out in a
+  new batch, and a subset of an answered job (caller crashed while merging)
+  submits nothing
+- custom_ids(): repeated leads get distinct ids
+
+Usage: python tools/test_llm_batch.py
+       (also collected by pytest)
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools.llm_batch import LocalBatchBackend, custom_ids, placeholder_response, request_line, run_batch  # noqa: E402
+
+PROMPT = "Return a JSON object with EXACTLY these keys:\n- day1\n- day3\n"
+
+
+class CountingBackend(LocalBatchBackend):
+    submits = 0
+
+    def submit(self, requests_path, metadata=None):
+        self.submits += 1
+        return super().submit(requests_path, metadata)
+
+
+def _respond(body):
+    content = body["messages"][-1]["content"]
+    if "FAIL" in content:
+        raise ValueError("content_filter")
+    return json.dumps({"echo": content})
+
+
+def _lines(contents):
+    return [request_line(f"lead-{i}", [{"role": "user", "content": c}], "gpt-4.1-mini", 0.4,
+                         response_format={"type": "json_object"}) for i, c in enumerate(contents)]
+
+
+def test_round_trip_and_resume():
+    work_dir = tempfile.mkdtemp()
+    backend = CountingBackend(os.path.join(work_dir, "local"), respond=_respond, delay=0.05)
+    naps = []
+
+    def sleep(seconds):
+        naps.append(seconds)
+        time.sleep(seconds)
+
+    lines = _lines(["hello", "FAIL please", "bye"])
+    results = run_batch(lines, backend, work_dir, poll_interval=0.02, sleep=sleep)
+    assert naps, "should have polled while in progress"
+    assert json.loads(results["lead-0"]) == {"echo": "hello"}
+    assert isinstance(results["lead-1"], Exception) and "content_filter" in str(results["lead-1"])
+    assert json.loads(results["lead-2"]) == {"echo": "bye"}
+
+    with open(os.path.join(work_dir, "requests.jsonl")) as f:
+        first = json.loads(f.readline())
+    assert first["url"] == "/v1/chat/completions" and first["body"]["model"] == "gpt-4.1-mini"
+
+    # The caller crashed while merging and now asks for what it hadn't merged
+    again = run_batch(lines[::2], backend, work_dir, poll_interval=0.02)
+    assert backend.submits == 1 and again == {"lead-0": results["lead-0"], "lead-2": results["lead-2"]}
+    # Same job again: only the failed request is retried
+    again = run_batch(lines, backend, work_dir, poll_interval=0.02)
+    assert backend.submits == 2 and again["lead-0"] == results["lead-0"]
+    with open(os.path.join(work_dir, "requests.jsonl")) as f:
+        assert [json.loads(line)["custom_id"] for line in f] == ["lead-1"]
+    # Changed request under a known id: new batch
+    changed = run_batch(_lines(["hello again"]), backend, work_dir, poll_interval=0.02)
+    assert backend.submits == 3 and json.loads(changed["lead-0"]) == {"echo": "hello again"}
+
+
+def test_ids_and_placeholder():
+    leads = [{"phone": "+1 555 000 0001"}, {"phone": "555-000-0001"}, {"owner_name": "Ann"}]
+    ids = custom_ids(leads)
+    assert len(set(ids)) == 3 and ids[1] == ids[0] + "#2", ids
+    body = {"messages": [{"role": "user", "content": PROMPT}]}
+    assert set(json.loads(placeholder_response(body))) == {"day1", "day3"}
+
+
+if __name__ == "__main__":
+    failed = 0
+    for test in (test_round_trip_and_resume, test_ids_and_placeholder):
+        try:
+            test()
+            print(f"  PASS  {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"  FAIL  {test.__name__}: {e}")
+    sys.exit(1 if failed else 0)
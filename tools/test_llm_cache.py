@@ -0,0 +1,109 @@
+"""
+LLM Cache Test — content-addressed response cache (llm_cache.py).
+
+- cache_key() is stable and changes with model, temperature, any message's
+  role or content, and response options
+- Rows past the TTL are misses
+- Every 50th put evicts least-recently-used rows past max_entries; a get
+  counts as a use
+- Hit/miss counters stay exact under concurrent readers
+
+Usage: python tools/test_llm_cache.py
+       (also collected by pytest)
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools.llm_cache import ResponseCache, cache_key  # noqa: E402
+
+MESSAGES = [{"role": "system", "content": "You are helpful."}, {"role": "user", "content": "Is it sold?"}]
+
+
+def _temp_cache(**kwargs):
+    folder = tempfile.mkdtemp()
+    return folder, ResponseCache(os.path.join(folder, "cache.sqlite3"), **kwargs)
+
+
+def test_cache_key():
+    base = cache_key("gpt-4o-mini", 0.3, MESSAGES)
+    assert base == cache_key("gpt-4o-mini", 0.3, [dict(m) for m in MESSAGES])
+    assert base == cache_key("gpt-4o-mini", 0.30000001, MESSAGES)  # rounded to 4 places
+    changed = [
+        cache_key("gpt-4o", 0.3, MESSAGES),
+        cache_key("gpt-4o-mini", 0.7, MESSAGES),
+        cache_key("gpt-4o-mini", 0.3, MESSAGES[:1] + [{"role": "user", "content": "Is it sold??"}]),
+        cache_key("gpt-4o-mini", 0.3, MESSAGES[:1] + [{"role": "assistant", "content": "Is it sold?"}]),
+        cache_key("gpt-4o-mini", 0.3, MESSAGES, max_tokens=200),
+        cache_key("gpt-4o-mini", 0.3, MESSAGES, response_format={"type": "json_object"}),
+    ]
+    assert base not in changed and len(set(changed)) == len(changed)
+    # Option order doesn't matter
+    assert cache_key("m", 0, MESSAGES, a=1, b=2) == cache_key("m", 0, MESSAGES, b=2, a=1)
+
+
+def test_ttl_expiry():
+    folder, cache = _temp_cache(ttl_seconds=0.2, max_entries=100)
+    try:
+        cache.put("k", "cached reply", "gpt-4o-mini")
+        assert cache.get("k") == "cached reply"
+        time.sleep(0.25)
+        assert cache.get("k") is None
+        assert cache.get("never-stored") is None
+        stats = cache.stats()
+        assert stats["hits"] == 1 and stats["misses"] == 2 and stats["hit_rate"] == round(1 / 3, 4), stats
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def test_lru_eviction():
+    folder, cache = _temp_cache(ttl_seconds=3600, max_entries=10)
+    try:
+        for i in range(49):
+            cache.put(f"k{i}", f"reply {i}")
+            time.sleep(0.001)  # distinct last_used values
+        assert cache.get("k0") == "reply 0"  # touched: now recently used
+        time.sleep(0.001)
+        cache.put("k49", "reply 49")  # 50th put runs the eviction
+        rows = cache._conn().execute("SELECT key FROM llm_cache").fetchall()
+        assert sorted(key for (key,) in rows) == sorted(["k0"] + [f"k{i}" for i in range(41, 50)]), rows
+        assert cache.get("k1") is None and cache.get("k40") is None
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def test_counters_thread_safe():
+    folder, cache = _temp_cache(ttl_seconds=3600, max_entries=100)
+    try:
+        cache.put("hit", "cached")
+
+        def reader():
+            for i in range(200):
+                cache.get("hit" if i % 2 else "miss")
+
+        threads = [threading.Thread(target=reader) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        stats = cache.stats()
+        assert stats["hits"] == 800 and stats["misses"] == 800, stats
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    failed = 0
+    for test in (test_cache_key, test_ttl_expiry, test_lru_eviction, test_counters_thread_safe):
+        try:
+            test()
+            print(f"  PASS  {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"  FAIL  {test.__name__}: {e}")
+    sys.exit(1 if failed else 0)
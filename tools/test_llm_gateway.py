@@ -0,0 +1,125 @@
+"""
+LLM Gateway Test — concurrency slots and the token-per-minute limiter.
+
+No API calls: only the admission primitives are exercised.
+
+- A freed slot goes to the highest-priority waiter, FIFO within a priority
+- acquire() gives up after its timeout and leaves the queue
+- The token bucket refills continuously and take() waits for the refill
+- pause() after a 429 drains the bucket so other callers back off too
+- Only timeouts, connection errors and 5xx count against the breaker
+
+Usage: python tools/test_llm_gateway.py
+       (also collected by pytest)
+"""
+
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")  # the client is built at import; nothing is sent
+from tools import llm_gateway as gw  # noqa: E402
+from tools.circuit_breaker import CLOSED, OPEN, CircuitBreaker  # noqa: E402
+
+
+def _wait_for_depth(slots, depth, timeout=2.0):
+    end = time.monotonic() + timeout
+    while slots.queue_depth() < depth:
+        assert time.monotonic() < end, f"queue depth stuck at {slots.queue_depth()}"
+        time.sleep(0.005)
+
+
+def test_priority_ordering():
+    slots = gw._PrioritySlots(1)
+    assert slots.acquire(gw.PRIORITY_REPLY, timeout=1)
+    served = []
+    threads = []
+    waiters = [("followup", gw.PRIORITY_FOLLOWUP), ("reply-1", gw.PRIORITY_REPLY),
+               ("escalation", gw.PRIORITY_ESCALATION), ("reply-2", gw.PRIORITY_REPLY),
+               ("booking", gw.PRIORITY_BOOKING)]
+
+    def waiter(label, priority):
+        assert slots.acquire(priority, timeout=5)
+        served.append(label)
+        slots.release()
+
+    # Queue them one at a time so the FIFO order within a priority is fixed
+    for depth, (label, priority) in enumerate(waiters, start=1):
+        t = threading.Thread(target=waiter, args=(label, priority))
+        t.start()
+        threads.append(t)
+        _wait_for_depth(slots, depth)
+
+    slots.release()
+    for t in threads:
+        t.join(timeout=5)
+    assert served == ["escalation", "booking", "reply-1", "reply-2", "followup"], served
+    assert slots.queue_depth() == 0
+
+
+def test_acquire_times_out():
+    slots = gw._PrioritySlots(1)
+    assert slots.acquire(gw.PRIORITY_REPLY, timeout=1)
+    started = time.monotonic()
+    assert not slots.acquire(gw.PRIORITY_ESCALATION, timeout=0.1)
+    assert 0.09 <= time.monotonic() - started < 1.0
+    assert slots.queue_depth() == 0
+    slots.release()
+    assert slots.acquire(gw.PRIORITY_FOLLOWUP, timeout=0.1)
+
+
+def test_token_bucket_refill():
+    bucket = gw._TokenBucket(600)  # 10 tokens per second
+    assert bucket.take(600, timeout=0)
+    # Empty: 5 tokens are 0.5s away, so a zero timeout fails without sleeping
+    started = time.monotonic()
+    assert not bucket.take(5, timeout=0)
+    assert time.monotonic() - started < 0.05
+    assert bucket.take(5, timeout=2)
+    assert 0.4 <= time.monotonic() - started < 1.5
+    # Requests larger than the bucket are capped, not refused forever
+    assert gw._TokenBucket(60).take(1000, timeout=0)
+
+
+def test_pause_drains_bucket():
+    bucket = gw._TokenBucket(600)
+    bucket.pause(1.0)  # one second of budget owed
+    assert not bucket.take(1, timeout=0.5)
+    assert bucket.take(1, timeout=2)
+    assert gw._TokenBucket(0).take(10 ** 6, timeout=0)  # 0 disables the limiter
+
+
+class _StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def test_breaker_counts_only_outages():
+    breaker = CircuitBreaker("openai-test", failure_threshold=1, reset_seconds=60)
+    saved, gw._breaker = gw._breaker, breaker
+    try:
+        for err in (_StatusError(400), _StatusError(401), _StatusError(404), ValueError("context length")):
+            gw._record_error(err)
+            assert breaker.state == CLOSED, err
+        for err in (TimeoutError("read timed out"), ConnectionError("reset"), _StatusError(503)):
+            breaker.record_success()
+            gw._record_error(err)
+            assert breaker.state == OPEN, err
+    finally:
+        gw._breaker = saved
+
+
+if __name__ == "__main__":
+    failed = 0
+    for test in (test_priority_ordering, test_acquire_times_out, test_token_bucket_refill, test_pause_drains_bucket,
+                 test_breaker_counts_only_outages):
+        try:
+            test()
+            print(f"  PASS  {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"  FAIL  {test.__name__}: {e}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,67 @@
+"""
+Load Shedding Test — the degradation ladder used when the AI lane backs up.
+
+- shed_level() picks the highest step whose depth OR wait threshold is reached
+- A zero threshold disables that trigger
+- Stages listed in mctx.skip (OPTIONAL_STAGES at skip_optional) never run
+
+Usage: python tools/test_load_shedding.py
+       (also collected by pytest)
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools import load_shedding as ls  # noqa: E402
+from tools.message_pipeline import ChannelAdapter, MessageContext, Pipeline  # noqa: E402
+
+THRESHOLDS = {
+    ls.CHEAP_MODEL: (10, 1000),
+    ls.SKIP_OPTIONAL: (20, 2000),
+    ls.TEMPLATE_ACK: (40, 0),
+}
+
+
+class _Channel(ChannelAdapter):
+    def send(self, to_number, body):
+        return {"ok": True}
+
+
+def test_shed_level():
+    cases = [
+        ((0, 0), ls.NONE),
+        ((9, 999), ls.NONE),
+        ((10, 0), ls.CHEAP_MODEL),
+        ((0, 1500), ls.CHEAP_MODEL),
+        ((25, 0), ls.SKIP_OPTIONAL),
+        ((5, 2500), ls.SKIP_OPTIONAL),
+        ((40, 0), ls.TEMPLATE_ACK),
+        ((0, 10 ** 9), ls.SKIP_OPTIONAL),  # wait trigger disabled for template_ack
+    ]
+    for (depth, wait), expected in cases:
+        assert ls.shed_level(depth, wait, THRESHOLDS) == expected, (depth, wait)
+    assert ls.steps_for(ls.SKIP_OPTIONAL) == ["cheap_model", "skip_optional"]
+    assert ls.steps_for(ls.NONE) == []
+
+
+def test_optional_stages_skipped():
+    ran = []
+    stages = [(name, lambda m, n=name: ran.append(n))
+              for name in ("analyze", "send", "qualification", "meeting", "valuation", "agent_brief", "outbound_log")]
+    mctx = MessageContext(_Channel(), "15550001111", "hi")
+    mctx.skip |= ls.OPTIONAL_STAGES
+    Pipeline("shed-test", stages).run(mctx)
+    assert ran == ["analyze", "send", "meeting", "outbound_log"], ran
+
+
+if __name__ == "__main__":
+    failed = 0
+    for test in (test_shed_level, test_optional_stages_skipped):
+        try:
+            test()
+            print(f"  PASS  {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"  FAIL  {test.__name__}: {e}")
+    sys.exit(1 if failed else 0)
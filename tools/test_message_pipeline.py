@@ -0,0 +1,129 @@
+"""
+Message Pipeline Test — the stage engine behind both inbound channels
+(message_pipeline.py).
+
+- Stages run in order; HALT stops the run after that stage and is recorded
+  in halted_at and the per-stage stats
+- Stages named in mctx.skip are passed over
+- A stage that raises is counted as an error and the exception propagates
+- Debouncer: rapid messages from one sender flush as one batch; cancel()
+  drops a sender's buffer (STOP)
+- A channel adapter without send() can't be instantiated
+
+Usage: python tools/test_message_pipeline.py
+       (also collected by pytest)
+"""
+
+import itertools
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools.message_pipeline import HALT, ChannelAdapter, Debouncer, MessageContext, Pipeline, pipeline_stats  # noqa: E402
+
+_names = itertools.count()
+
+
+class _Channel(ChannelAdapter):
+    name = "test"
+    label = "Test"
+
+    def send(self, to_number, body):
+        return {"ok": True}
+
+
+def _mctx(body="hello"):
+    return MessageContext(_Channel(), "+15550000001", body)
+
+
+def _pipeline(*stages):
+    return Pipeline(f"test-{next(_names)}", list(stages))
+
+
+def test_halt_short_circuits():
+    ran = []
+
+    def stage(label, outcome=None):
+        def run(mctx):
+            ran.append(label)
+            return outcome
+        return label, run
+
+    pipeline = _pipeline(stage("resolve"), stage("compliance", HALT), stage("dispatch"))
+    mctx = pipeline.run(_mctx("STOP"))
+    assert ran == ["resolve", "compliance"], ran
+    assert mctx.halted_at == "compliance" and set(mctx.timings) == {"resolve", "compliance"}
+    stats = pipeline_stats()[pipeline.name]
+    assert stats["compliance"]["halts"] == 1 and "dispatch" not in stats, stats
+
+    # Without the halt every stage runs
+    ran.clear()
+    mctx = _pipeline(stage("resolve"), stage("compliance"), stage("dispatch")).run(_mctx())
+    assert ran == ["resolve", "compliance", "dispatch"] and mctx.halted_at is None
+
+
+def test_skip_and_errors():
+    ran = []
+    pipeline = _pipeline(("send", lambda m: ran.append("send")),
+                         ("valuation", lambda m: ran.append("valuation")),
+                         ("outbound_log", lambda m: ran.append("outbound_log")))
+    mctx = _mctx()
+    mctx.skip = {"valuation"}
+    pipeline.run(mctx)
+    assert ran == ["send", "outbound_log"]
+
+    def broken(mctx):
+        raise RuntimeError("db down")
+
+    pipeline = _pipeline(("lookups", broken), ("send", lambda m: ran.append("late")))
+    try:
+        pipeline.run(_mctx())
+        raise AssertionError("expected RuntimeError")
+    except RuntimeError:
+        pass
+    assert "late" not in ran
+    assert pipeline_stats()[pipeline.name]["lookups"]["errors"] == 1
+
+
+def test_debouncer_batches_and_cancels():
+    flushed = []
+    done = threading.Event()
+
+    def flush(key, entries):
+        flushed.append((key, entries))
+        done.set()
+
+    debouncer = Debouncer(0.05, flush)
+    for body in ("hi", "are you there", "about the house"):
+        debouncer.add("+1555", body)
+    debouncer.add("+1666", "STOP soon")
+    debouncer.cancel("+1666")
+    assert done.wait(2)
+    assert flushed == [("+1555", ["hi", "are you there", "about the house"])], flushed
+    assert debouncer.pending() == 0
+
+
+def test_adapter_requires_send():
+    class NoSend(ChannelAdapter):
+        name = "nosend"
+
+    try:
+        NoSend()
+        raise AssertionError("adapter without send() was instantiated")
+    except TypeError:
+        pass
+    assert _Channel().send("+15550000001", "hi") == {"ok": True}
+
+
+if __name__ == "__main__":
+    failed = 0
+    for test in (test_halt_short_circuits, test_skip_and_errors, test_debouncer_batches_and_cancels,
+                 test_adapter_requires_send):
+        try:
+            test()
+            print(f"  PASS  {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"  FAIL  {test.__name__}: {e}")
+    sys.exit(1 if failed else 0)
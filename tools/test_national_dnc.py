@@ -0,0 +1,149 @@
+"""
+National DNC Test — memory-mapped FTC registry used to scrub campaign lists.
+
+- build() accepts area-code/number pairs and formatted numbers, drops
+  duplicates and anything that isn't a 10-digit US number; the bitmap sort
+  used for large area codes gives the same file as the direct sort
+- Lookups match with or without the +1 country code, across area-code boundaries
+- scrub() returns the registered subset; non-US numbers are never on it
+- Without a registry file, every US number is blocked (fails closed)
+- A truncated or foreign file is rejected with ValueError, and a failed open
+  is retried after the back-off
+
+Usage: python tools/test_national_dnc.py
+       (also collected by pytest)
+"""
+
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools import national_dnc  # noqa: E402
+from tools.national_dnc import NationalDnc, build  # noqa: E402
+
+FTC_LINES = [
+    "201,5550123",
+    "201,5550123",        # duplicate
+    "(212) 555-0000",
+    "+1 999 999 9999",
+    "000,0000001",
+    "212,5559999",
+    "not a number",
+    "44 20 7946 0958",    # non-US
+    "",
+]
+
+
+def _registry(tmp: str) -> NationalDnc:
+    source = os.path.join(tmp, "ftc.txt")
+    with open(source, "w") as f:
+        f.write("\n".join(FTC_LINES))
+    assert build(source, os.path.join(tmp, "national_dnc.bin")) == 5
+    return NationalDnc(os.path.join(tmp, "national_dnc.bin"))
+
+
+def test_build_and_lookup():
+    with tempfile.TemporaryDirectory() as tmp:
+        reg = _registry(tmp)
+        assert reg.count == 5
+        for phone in ("2015550123", "+12015550123", "212-555-0000", "19999999999", "0000000001", "2125559999"):
+            assert phone in reg, phone
+        for phone in ("2015550124", "2125550001", "2135550000", "9999999998", "12345", ""):
+            assert phone not in reg, phone
+        reg.close()
+
+
+def test_bitmap_sort_matches_direct_sort():
+    rng = random.Random(7)
+    lines = [f"201,{rng.choice((0, 9999999, rng.randrange(10 ** 7))):07d}" for _ in range(5000)]
+    lines += [f"2125{rng.randrange(10 ** 6):06d}" for _ in range(500)]
+    small_bucket = national_dnc._SMALL_BUCKET
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, "ftc.txt")
+            with open(source, "w") as f:
+                f.write("\n".join(lines))
+            files = []
+            for threshold in (small_bucket, 0):  # direct sort, then bitmap for every area code
+                national_dnc._SMALL_BUCKET = threshold
+                out = os.path.join(tmp, f"national_dnc_{threshold}.bin")
+                build(source, out)
+                with open(out, "rb") as f:
+                    files.append(f.read())
+        assert files[0] == files[1]
+    finally:
+        national_dnc._SMALL_BUCKET = small_bucket
+
+
+def test_scrub():
+    with tempfile.TemporaryDirectory() as tmp:
+        reg = _registry(tmp)
+        phones = ["+12015550123", "+12015550999", "+442079460958", "(212) 555-9999"]
+        assert reg.scrub(phones) == {"+12015550123", "(212) 555-9999"}
+        reg.close()
+
+
+def _swap_registry(path, reg=None, retry_at=0.0):
+    saved = national_dnc.NATIONAL_DNC_PATH, national_dnc._registry, national_dnc._registry_retry_at
+    national_dnc.NATIONAL_DNC_PATH, national_dnc._registry, national_dnc._registry_retry_at = path, reg, retry_at
+    return saved
+
+
+def test_fails_closed_without_registry():
+    saved = _swap_registry(os.path.join(tempfile.gettempdir(), "missing-national-dnc.bin"))
+    try:
+        assert national_dnc.is_on_national_dnc("+12015550123")
+        assert not national_dnc.is_on_national_dnc("+442079460958")
+        assert national_dnc.scrub(["2015550123", "+442079460958"]) == {"2015550123"}
+    finally:
+        _swap_registry(*saved)
+
+
+def test_rejects_bad_files():
+    with tempfile.TemporaryDirectory() as tmp:
+        for content in (b"", b"NDNCv1", national_dnc.MAGIC + b"\x05" + b"\x00" * 20, b"x" * 10_000):
+            path = os.path.join(tmp, "bad.bin")
+            with open(path, "wb") as f:
+                f.write(content)
+            try:
+                NationalDnc(path).close()
+                raise AssertionError(f"accepted {len(content)}-byte file")
+            except ValueError:
+                pass
+
+
+def test_retries_after_backoff():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "national_dnc.bin")
+        with open(path, "wb") as f:
+            f.write(b"partial")
+        saved = _swap_registry(path)
+        retry = national_dnc.NATIONAL_DNC_RETRY_SECONDS
+        try:
+            national_dnc.NATIONAL_DNC_RETRY_SECONDS = 3600
+            assert national_dnc.registry() is None
+            _registry(tmp)  # the real file is installed
+            assert national_dnc.registry() is None  # still backing off
+            national_dnc._registry_retry_at = 0.0  # back-off elapsed
+            reg = national_dnc.registry()
+            assert reg is not None and "+12015550123" in reg
+            assert not national_dnc.is_on_national_dnc("+12015550124")
+            reg.close()
+        finally:
+            national_dnc.NATIONAL_DNC_RETRY_SECONDS = retry
+            _swap_registry(*saved)
+
+
+if __name__ == "__main__":
+    failed = 0
+    for test in (test_build_and_lookup, test_bitmap_sort_matches_direct_sort, test_scrub, test_fails_closed_without_registry, test_rejects_bad_files,
+                 test_retries_after_backoff):
+        try:
+            test()
+            print(f"  PASS  {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"  FAIL  {test.__name__}: {e}")
+    sys.exit(1 if failed else 0)
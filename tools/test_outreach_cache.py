@@ -0,0 +1,67 @@
+"""
+Outreach Cache Test — generated outreach copy served from disk on re-runs.
+
+- Same model/temperature/prompt is a hit; any prompt change is a miss
+- refresh mode skips reads but overwrites the stored copy
+- cache_only mode raises CacheMiss instead of letting a call through
+- Stats count hits, misses, refreshes and stores
+
+Usage: python tools/test_outreach_cache.py
+       (also collected by pytest)
+"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools.outreach_cache import CacheMiss, OutreachCache  # noqa: E402
+
+FORMAT = {"type": "json_object"}
+
+
+def _messages(address):
+    return [{"role": "system", "content": "You are a helpful real estate ISA assistant."},
+            {"role": "user", "content": f"Write outreach for the owner of {address}"}]
+
+
+def test_modes():
+    path = os.path.join(tempfile.mkdtemp(), "outreach_cache.sqlite3")
+    cache = OutreachCache("use", path=path)
+    key = cache.key("gpt-4.1-mini", 0.4, _messages("1 Main St"), response_format=FORMAT)
+    assert key == cache.key("gpt-4.1-mini", 0.4, _messages("1 Main St"), response_format=FORMAT)
+    assert key != cache.key("gpt-4.1-mini", 0.4, _messages("2 Main St"), response_format=FORMAT)
+    assert key != cache.key("gpt-4.1", 0.4, _messages("1 Main St"), response_format=FORMAT)
+
+    assert cache.lookup(key) is None
+    cache.store(key, '{"sms_text": "v1"}', "gpt-4.1-mini")
+    assert cache.lookup(key) == '{"sms_text": "v1"}'
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["stored"]) == (1, 1, 1), stats
+
+    refresh = OutreachCache("refresh", path=path)
+    assert refresh.lookup(key) is None
+    refresh.store(key, '{"sms_text": "v2"}')
+    assert refresh.stats()["refreshed"] == 1
+
+    cache_only = OutreachCache("cache_only", path=path)
+    assert cache_only.lookup(key) == '{"sms_text": "v2"}'
+    other = cache_only.key("gpt-4.1-mini", 0.4, _messages("9 Elm St"), response_format=FORMAT)
+    try:
+        cache_only.lookup(other)
+        raise AssertionError("expected CacheMiss")
+    except CacheMiss:
+        pass
+    assert "1 hits, 1 misses" in cache_only.summary(), cache_only.summary()
+
+
+if __name__ == "__main__":
+    failed = 0
+    for test in (test_modes,):
+        try:
+            test()
+            print(f"  PASS  {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"  FAIL  {test.__name__}: {e}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,277 @@
+"""
+Reply Stages Test — the shared inbound stages run by both the WhatsApp and
+the SMS webhook (reply_stages.py).
+
+- STOP: the number is written to the DNC list, the unsubscribe reply goes
+  out, the ingest pipeline halts at compliance and no AI turn is queued
+- A reply turn for a message that arrived before the STOP is blocked at
+  send, and that message does not re-opt the number in
+- Messages still waiting out the debounce window are dropped by a STOP
+- WhatsApp and SMS run the same stages for the same turn: same sends, same
+  meeting / follow-up / qualification side effects, same activity log
+
+The database, model and channel sends are replaced by in-memory fakes.
+
+Usage: python tools/test_reply_stages.py
+       (also collected by pytest)
+"""
+
+import contextlib
+import os
+import sys
+import tempfile
+import threading
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools import dnc_cache, reply_stages  # noqa: E402
+from tools.dnc_cache import DncCache  # noqa: E402
+from tools.message_pipeline import MessageContext  # noqa: E402
+from tools.reply_stages import INGEST_PIPELINE, REPLY_PIPELINE, UNSUBSCRIBED_REPLY  # noqa: E402
+from tools.sms_handler import SmsChannel  # noqa: E402
+from tools.webhook_app import WhatsAppChannel  # noqa: E402
+
+USER_ID = "tenant-1"
+LEAD = {"id": "lead-1", "owner_name": "Sam", "property_address": "12 Palm St", "pending_follow_ups": 0}
+
+_MISSING = object()
+
+
+class RecordingSms(SmsChannel):
+    def __init__(self):
+        self.sent = []
+
+    def send(self, to_number, body):
+        self.sent.append((to_number, body))
+        return {"ok": True, "status": "queued"}
+
+
+class RecordingWhatsApp(WhatsAppChannel):
+    def __init__(self, debounce_seconds=None):
+        self.sent = []
+        if debounce_seconds is not None:
+            self.debounce_seconds = debounce_seconds
+
+    def send(self, to_number, body):
+        self.sent.append((to_number, body))
+        return {"ok": True, "status": "queued"}
+
+
+class FakeStore:
+    """Stands in for db.py, lead_updates.py and the model."""
+
+    def __init__(self, ai_result=None):
+        self.dnc_rows = []
+        self.messages = []
+        self.activity = []
+        self.meetings = []
+        self.follow_ups = []
+        self.qualifications = []
+        self.queued = []
+        self.ai_result = ai_result or {"intent": "other", "reply": "Happy to help!"}
+
+    # dnc_cache
+    def load_dnc(self, user_id, since=None):
+        return [r for r in self.dnc_rows if since is None or r["created_at"] >= since]
+
+    def is_on_dnc_list(self, user_id, phone):
+        return True
+
+    def add_to_dnc_list(self, user_id, phone, reason="STOP keyword"):
+        self.dnc_rows.append({"phone": phone, "created_at": "2026-10-19T10:00:00+00:00"})
+        return True
+
+    def remove_from_dnc_list(self, user_id, phone):
+        self.dnc_rows = [r for r in self.dnc_rows if r["phone"] != phone]
+        return True
+
+    # reply_stages
+    def resolve_user_context(self, phone, channel="", business_number=""):
+        return {"user_id": USER_ID, "agent_name": "Dana", "agent_brokerage": "Estate AI",
+                "agent_phone": "+15559990000", "agent_email": None, "ai_config": None, "plan_slug": "pro"}
+
+    def analyze_with_ai(self, body, phone, to_number, **kwargs):
+        return {**self.ai_result, "meeting": dict(self.ai_result.get("meeting") or {})}
+
+    def log_inbound_message(self, **kwargs):
+        self.messages.append(("inbound", kwargs["channel"], kwargs["body"]))
+
+    def log_outbound_message(self, **kwargs):
+        self.messages.append(("outbound", kwargs["channel"], kwargs["body"]))
+
+    def log_lead_activity(self, mctx, action, description, status, metadata=None):
+        self.activity.append(action)
+
+    def handle_meeting_booking(self, mctx, meeting_data, qualification):
+        self.meetings.append(meeting_data["date_suggestion"])
+
+    def handle_auto_follow_up(self, mctx, days):
+        self.follow_ups.append(days)
+
+    def update_lead_from_qualification(self, user_id, phone, qualification, ai_result):
+        self.qualifications.append(qualification)
+
+    def installed(self, tmpdir):
+        return _patched(
+            (reply_stages, {
+                "SUPABASE_AVAILABLE": True,
+                "INBOUND_LOG": os.path.join(tmpdir, "inbound.csv"),
+                "OUTBOUND_LOG": os.path.join(tmpdir, "outbound.csv"),
+                "STOPPED_LOG": os.path.join(tmpdir, "stopped.csv"),
+                "_debouncers": {},
+                "_opt_outs": {},
+                "_submit_reply": self.queued.append,
+                "resolve_user_context": self.resolve_user_context,
+                "analyze_with_ai": self.analyze_with_ai,
+                "log_inbound_message": self.log_inbound_message,
+                "log_outbound_message": self.log_outbound_message,
+                "log_lead_activity": self.log_lead_activity,
+                "handle_meeting_booking": self.handle_meeting_booking,
+                "handle_auto_follow_up": self.handle_auto_follow_up,
+                "update_lead_from_qualification": self.update_lead_from_qualification,
+                "find_lead_by_phone": lambda user_id, phone: dict(LEAD),
+                "get_lead_details": lambda user_id, phone: dict(LEAD),
+                "update_lead_last_response": lambda lead_id: True,
+                "get_conversation_history": lambda user_id, phone: [],
+                "tag_campaign_context": lambda user_id, history: None,
+                "check_messaging_quota": lambda user_id: {"current": 1, "limit": 100},
+                "record_overage": lambda *args: True,
+            }),
+            (dnc_cache, {
+                "CACHE": DncCache(self.load_dnc, self.is_on_dnc_list),
+                "add_to_dnc_list": self.add_to_dnc_list,
+                "remove_from_dnc_list": self.remove_from_dnc_list,
+            }),
+        )
+
+
+@contextlib.contextmanager
+def _patched(*targets):
+    saved = []
+    try:
+        for module, attrs in targets:
+            for name, value in attrs.items():
+                saved.append((module, name, getattr(module, name, _MISSING)))
+                setattr(module, name, value)
+        yield
+    finally:
+        for module, name, old in reversed(saved):
+            if old is _MISSING:
+                delattr(module, name)
+            else:
+                setattr(module, name, old)
+
+
+def _inbound(channel, phone, body):
+    return MessageContext(channel, phone, body, msg_id=f"m-{time.monotonic_ns()}",
+                          now="2026-10-19T10:00:00+00:00")
+
+
+def _blocked(phone):
+    return dnc_cache.is_blocked(USER_ID, phone)
+
+
+def test_stop_adds_dnc_and_halts():
+    for channel in (RecordingSms(), RecordingWhatsApp()):
+        store = FakeStore()
+        with tempfile.TemporaryDirectory() as tmpdir, store.installed(tmpdir):
+            phone = "+15551230001"
+            mctx = INGEST_PIPELINE.run(_inbound(channel, phone, "STOP"))
+            assert mctx.halted_at == "compliance", (channel.name, mctx.halted_at)
+            assert _blocked(phone) and [r["phone"] for r in store.dnc_rows] == [phone]
+            assert channel.sent == [(phone, UNSUBSCRIBED_REPLY)], channel.sent
+            assert store.queued == []
+            assert store.messages == [("inbound", channel.name, "STOP")]
+            assert "opt_out" in store.activity
+            assert os.path.exists(reply_stages.STOPPED_LOG)
+
+
+def test_reply_after_stop_is_not_sent():
+    channel = RecordingSms()
+    store = FakeStore({"intent": "meeting", "reply": "Does Tuesday work?",
+                       "meeting": {"ready_to_book": True, "date_suggestion": "2099-01-06T10:00:00Z"}})
+    with tempfile.TemporaryDirectory() as tmpdir, store.installed(tmpdir):
+        phone = "+15551230002"
+        earlier = _inbound(channel, phone, "is it still for sale?")
+        INGEST_PIPELINE.run(_inbound(channel, phone, "stop texting me"))
+        assert _blocked(phone)
+
+        # The earlier message's turn runs after the STOP: no re-opt-in, no reply
+        INGEST_PIPELINE.run(earlier)
+        assert _blocked(phone) and "re_opt_in" not in store.activity
+        mctx = REPLY_PIPELINE.run(store.queued[-1])
+        assert mctx.halted_at == "send", mctx.halted_at
+        assert channel.sent == [(phone, UNSUBSCRIBED_REPLY)], channel.sent
+        assert "dnc_blocked" in store.activity
+        assert store.meetings == [] and not [m for m in store.messages if m[0] == "outbound"]
+
+
+def test_stop_drops_debounced_messages():
+    channel = RecordingWhatsApp(debounce_seconds=0.1)
+    store = FakeStore()
+    flushed = threading.Event()
+    with tempfile.TemporaryDirectory() as tmpdir, store.installed(tmpdir):
+        reply_stages._submit_reply = lambda mctx: (store.queued.append(mctx), flushed.set())
+        phone = "+15551230003"
+        INGEST_PIPELINE.run(_inbound(channel, phone, "hello"))
+        INGEST_PIPELINE.run(_inbound(channel, phone, "unsubscribe"))
+        assert not flushed.wait(0.3), "buffered message flushed after STOP"
+        assert reply_stages.debounce_pending() == {"whatsapp": 0}
+
+        # Another sender on the same channel is still batched and queued
+        INGEST_PIPELINE.run(_inbound(channel, "+15551230004", "hi"))
+        INGEST_PIPELINE.run(_inbound(channel, "+15551230004", "about the house"))
+        assert flushed.wait(2)
+        assert [m.body for m in store.queued] == ["hi\nabout the house"]
+
+
+def test_channels_run_the_same_reply():
+    ai_result = {
+        "intent": "meeting",
+        "reply": "Tuesday at 10 works — see you then!",
+        "schedule_follow_up_days": 3,
+        "qualification": {"timeline": "3 months"},
+        "meeting": {"ready_to_book": True, "date_suggestion": "2099-01-06T10:00:00Z"},
+        "agent_brief": "Motivated seller, wants a valuation walk-through.",
+    }
+    outcomes = []
+    for channel in (RecordingSms(), RecordingWhatsApp()):
+        store = FakeStore(ai_result)
+        with tempfile.TemporaryDirectory() as tmpdir, store.installed(tmpdir):
+            mctx = _inbound(channel, "+15551230005", "Tuesday at 10?")
+            mctx.user = store.resolve_user_context(mctx.phone)
+            REPLY_PIPELINE.run(mctx)
+        outcomes.append({
+            "stages": list(mctx.timings),
+            "halted_at": mctx.halted_at,
+            "sent": channel.sent,
+            "messages": [(direction, body) for direction, _, body in store.messages],
+            "channels": {name for _, name, _ in store.messages},
+            "meetings": store.meetings,
+            "follow_ups": store.follow_ups,
+            "qualifications": store.qualifications,
+            "activity": store.activity,
+        })
+
+    sms, whatsapp = outcomes
+    assert sms["channels"] == {"sms"} and whatsapp["channels"] == {"whatsapp"}
+    del sms["channels"], whatsapp["channels"]
+    assert sms == whatsapp, (sms, whatsapp)
+    assert sms["stages"] == [name for name, _ in REPLY_PIPELINE.stages] and sms["halted_at"] is None
+    assert sms["sent"] == [("+15551230005", ai_result["reply"])]
+    assert sms["meetings"] == ["2099-01-06T10:00:00Z"] and sms["follow_ups"] == [3]
+    assert "lead_qualified" in sms["activity"]
+
+
+if __name__ == "__main__":
+    failed = 0
+    for test in (test_stop_adds_dnc_and_halts, test_reply_after_stop_is_not_sent,
+                 test_stop_drops_debounced_messages, test_channels_run_the_same_reply):
+        try:
+            test()
+            print(f"  PASS  {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"  FAIL  {test.__name__}: {e}")
+    sys.exit(1 if failed else 0)
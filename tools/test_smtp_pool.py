@@ -0,0 +1,260 @@
+"""
+SMTP Pool Test — pooled sessions against a local debug SMTP server.
+
+A small in-process SMTP server (plain text, no TLS/auth, like
+`python -m aiosmtpd -n`) stands in for the provider and counts connections.
+
+- Many messages from several threads share a few connections, each QUIT
+  after max_per_connection messages
+- A server that drops the connection mid-run: the pool reconnects and the
+  message still goes out once
+- A refused connection (421 greeting) is retried once, then raised
+- A drop after the message data was sent raises instead of retrying, so
+  the server never gets the message twice
+- A refused recipient raises but the session is kept for the next message
+- rate_per_minute spaces sends out
+- get_pool() closes the pool it replaces when the password changes, and a
+  closed pool doesn't keep sessions that come back to it
+
+Usage: python tools/test_smtp_pool.py
+       (also collected by pytest)
+"""
+
+import os
+import smtplib
+import socketserver
+import sys
+import threading
+import time
+from email.mime.text import MIMEText
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools import smtp_pool  # noqa: E402
+from tools.smtp_pool import SmtpPool, get_pool  # noqa: E402
+
+
+class DebugSmtpServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, drop_after=None, drop_in_data=False, busy_greetings=0):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.busy_greetings = busy_greetings  # greet this many connections with 421 and hang up
+        self.drop_after = drop_after  # hang up after this many messages on one connection
+        self.drop_in_data = drop_in_data  # take the first message's data, then hang up before replying
+        self.connections = 0
+        self.messages = []
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write((line + "\r\n").encode())
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+            busy = server.busy_greetings > 0
+            server.busy_greetings -= int(busy)
+        if busy:
+            self.reply("421 debug busy, try again later")
+            return
+        sent_here = 0
+        self.reply("220 debug ESMTP")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip()
+            verb = command[:4].upper()
+            if verb in ("EHLO", "HELO"):
+                self.reply("250 debug")
+            elif verb == "MAIL":
+                if server.drop_after is not None and sent_here >= server.drop_after:
+                    return  # hang up without a reply
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                self.reply("550 No such user" if "bad@" in command else "250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                body = []
+                while True:
+                    data = self.rfile.readline()
+                    if data in (b".\r\n", b""):
+                        break
+                    body.append(data)
+                with server.lock:
+                    server.messages.append(b"".join(body))
+                    if server.drop_in_data:
+                        server.drop_in_data = False
+                        return
+                sent_here += 1
+                self.reply("250 OK queued")
+            elif verb in ("RSET", "NOOP"):
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+def _msg(i, to="lead@example.com"):
+    msg = MIMEText(f"Message {i}", "plain", "utf-8")
+    msg["Subject"] = f"Hello {i}"
+    msg["From"] = "Agent <agent@example.com>"
+    msg["To"] = to
+    return msg
+
+
+def test_sessions_are_reused_and_capped():
+    server = DebugSmtpServer()
+    pool = SmtpPool("127.0.0.1", server.port, starttls=False, size=2, max_per_connection=10)
+    try:
+        threads = [threading.Thread(target=lambda k=k: [pool.send(_msg(k * 10 + i)) for i in range(10)])
+                   for k in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(timeout=10)
+        stats = pool.stats()
+        assert len(server.messages) == 30 and stats["messages_sent"] == 30
+        # 30 messages at 10 per session: a handful of logins instead of 30
+        assert 3 <= server.connections <= 5, server.connections
+        assert stats["recycled"] >= 2, stats
+    finally:
+        pool.close()
+        server.stop()
+
+
+def test_reconnects_after_drop():
+    server = DebugSmtpServer(drop_after=3)
+    pool = SmtpPool("127.0.0.1", server.port, starttls=False, size=1)
+    try:
+        for i in range(7):
+            pool.send(_msg(i))
+        assert len(server.messages) == 7
+        assert pool.stats()["reconnects"] == 2 and server.connections == 3, (pool.stats(), server.connections)
+    finally:
+        pool.close()
+        server.stop()
+
+
+def test_refused_connection_retried_once():
+    server = DebugSmtpServer(busy_greetings=1)
+    pool = SmtpPool("127.0.0.1", server.port, starttls=False, size=1)
+    try:
+        pool.send(_msg(0))
+        assert len(server.messages) == 1 and server.connections == 2
+        assert pool.stats()["reconnects"] == 1
+
+        pool.close()
+        server.busy_greetings = 2
+        pool = SmtpPool("127.0.0.1", server.port, starttls=False, size=1)
+        try:
+            pool.send(_msg(1))
+            raise AssertionError("expected SMTPConnectError")
+        except smtplib.SMTPConnectError:
+            pass
+        assert len(server.messages) == 1 and server.connections == 4
+        assert pool.stats()["failed"] == 1
+    finally:
+        pool.close()
+        server.stop()
+
+
+def test_drop_after_data_not_retried():
+    server = DebugSmtpServer(drop_in_data=True)
+    pool = SmtpPool("127.0.0.1", server.port, starttls=False, size=1)
+    try:
+        try:
+            pool.send(_msg(0))
+            raise AssertionError("expected SMTPServerDisconnected")
+        except smtplib.SMTPServerDisconnected:
+            pass
+        assert len(server.messages) == 1 and server.connections == 1
+        stats = pool.stats()
+        assert stats["failed"] == 1 and stats["reconnects"] == 0, stats
+        # The next message gets a fresh connection
+        pool.send(_msg(1))
+        assert len(server.messages) == 2 and server.connections == 2
+    finally:
+        pool.close()
+        server.stop()
+
+
+def test_refused_recipient_keeps_session():
+    server = DebugSmtpServer()
+    pool = SmtpPool("127.0.0.1", server.port, starttls=False, size=1)
+    try:
+        try:
+            pool.send(_msg(0, to="bad@example.com"))
+            raise AssertionError("expected SMTPRecipientsRefused")
+        except smtplib.SMTPRecipientsRefused:
+            pass
+        pool.send(_msg(1))
+        assert len(server.messages) == 1 and server.connections == 1
+        assert pool.stats()["failed"] == 1
+    finally:
+        pool.close()
+        server.stop()
+
+
+def test_rate_limit_spaces_sends():
+    server = DebugSmtpServer()
+    pool = SmtpPool("127.0.0.1", server.port, starttls=False, size=2, rate_per_minute=1200)
+    try:
+        started = time.monotonic()
+        for i in range(5):
+            pool.send(_msg(i))
+        assert time.monotonic() - started >= 0.19  # 4 gaps of 50ms
+    finally:
+        pool.close()
+        server.stop()
+
+
+def test_get_pool_closes_replaced_pool():
+    server = DebugSmtpServer()
+    key = ("127.0.0.1", server.port, "agent", False)
+    try:
+        old = get_pool("127.0.0.1", server.port, "agent", "old-secret", starttls=False)
+        assert get_pool("127.0.0.1", server.port, "agent", "old-secret", starttls=False) is old
+        old.send(_msg(0))
+        assert old.stats()["idle_connections"] == 1
+
+        new = get_pool("127.0.0.1", server.port, "agent", "new-secret", starttls=False)
+        assert new is not old and old.stats()["idle_connections"] == 0
+
+        # A session that finishes after close() isn't kept
+        old.send(_msg(1))
+        assert old.stats()["idle_connections"] == 0 and len(server.messages) == 2
+    finally:
+        with smtp_pool._pools_lock:
+            pool = smtp_pool._pools.pop(key, None)
+        if pool:
+            pool.close()
+        server.stop()
+
+
+if __name__ == "__main__":
+    failed = 0
+    for test in (test_sessions_are_reused_and_capped, test_reconnects_after_drop, test_refused_connection_retried_once,
+                 test_drop_after_data_not_retried, test_refused_recipient_keeps_session, test_rate_limit_spaces_sends,
+                 test_get_pool_closes_replaced_pool):
+        try:
+            test()
+            print(f"  PASS  {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"  FAIL  {test.__name__}: {e}")
+    sys.exit(1 if failed else 0)
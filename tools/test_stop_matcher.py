@@ -0,0 +1,157 @@
+"""
+STOP Matcher Test — labeled corpus + micro-benchmark for stop_matcher.is_stop().
+
+Every corpus entry is (message, expected). False negatives are TCPA exposure;
+false positives unsubscribe leads who were just being polite, so both fail.
+The benchmark compares the compiled matcher against the old lowercase +
+alternation-regex implementation on the same corpus.
+
+Usage: python tools/test_stop_matcher.py
+       (also collected by pytest: test_corpus)
+"""
+
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools.stop_matcher import is_stop  # noqa: E402
+
+CORPUS = [
+    # --- English: opt-outs ---
+    ("STOP", True),
+    ("Stop", True),
+    ("stop.", True),
+    ("  unsubscribe  ", True),
+    ("Opt-out", True),
+    ("opt out", True),
+    ("remove me", True),
+    ("Please stop", True),
+    ("please stop texting me", True),
+    ("Stop texting me you idiot", True),
+    ("stop messaging me!!!", True),
+    ("Remove me from your list", True),
+    ("take me off this list", True),
+    ("Don't contact me again", True),
+    ("don’t text me", True),
+    ("do not call me", True),
+    ("leave me alone", True),
+    ("No more texts please", True),
+    ("I don't want any more messages", True),
+    ("i dont want to hear from you", True),
+    ("off your list", True),
+    # --- English: NOT opt-outs ---
+    ("Thanks", False),
+    ("ok", False),
+    ("sure", False),
+    ("no thanks", False),
+    ("not interested", False),
+    ("Can you stop by tomorrow?", False),
+    ("Don't cancel my meeting", False),
+    ("What's the end date on the lease?", False),
+    ("I want to remove the tenant first", False),
+    ("Is there a bus stop nearby?", False),
+    ("", False),
+    # --- Arabic: opt-outs (plain, diacritics, tatweel, letter variants) ---
+    ("توقف", True),
+    ("تَوَقَّفْ", True),
+    ("الغاء", True),
+    ("إلغاء", True),
+    ("الغـــاء", True),
+    ("إلغاء الاشتراك", True),
+    ("لا تراسلني", True),
+    ("لا تراسلني مرة اخرى", True),
+    ("أوقف", True),
+    ("كفاية", True),
+    ("کفایة", True),
+    ("توقف عن مراسلتي", True),
+    # --- Arabic: NOT opt-outs ---
+    ("شكرا", False),
+    ("مرحبا، عندي عقار للبيع", False),
+    # --- Spanish: opt-outs ---
+    ("no más", True),
+    ("no mas", True),
+    ("NO MAS", True),
+    ("Basta", True),
+    ("cancelar", True),
+    ("no más mensajes por favor", True),
+    ("no me escriban", True),
+    ("dejen de escribirme", True),
+    # --- Spanish: NOT opt-outs ---
+    ("gracias", False),
+    ("quiero vender mi casa", False),
+    ("no más de 500 mil", False),
+]
+
+
+def test_corpus():
+    failures = [(text, expected) for text, expected in CORPUS if is_stop(text) != expected]
+    assert not failures, f"Misclassified: {failures}"
+
+
+# ── Pre-compiled-matcher implementation, kept only as the benchmark baseline ──
+_LEGACY_KEYWORDS = {
+    "stop", "unsubscribe", "cancel", "end", "quit", "stop all",
+    "opt out", "optout", "opt-out", "remove me", "remove", "leave me alone",
+    "do not contact", "don't contact", "no more", "stop texting",
+    "stop messaging", "take me off", "off the list", "off your list",
+    "توقف", "الغاء", "إلغاء", "الغاء الاشتراك", "إلغاء الاشتراك",
+    "لا تراسلني", "أوقف", "وقف", "كفاية",
+    "parar", "cancelar", "detener", "no más", "basta",
+}
+_LEGACY_PATTERNS = re.compile(
+    r'\b(stop\s*(texting|messaging|contacting|calling|emailing)\s*me'
+    r'|remove\s*me\s*(from|off)'
+    r'|take\s*me\s*off'
+    r'|don\'?t\s*(text|message|contact|call|email)\s*me'
+    r'|leave\s*me\s*alone'
+    r'|no\s*more\s*(texts?|messages?|emails?|calls?)'
+    r'|i\s*don\'?t\s*want\s*(any\s*more|to\s*(hear|receive))'
+    r'|please\s*stop'
+    r')\b',
+    re.IGNORECASE,
+)
+
+
+def _legacy_is_stop(text: str) -> bool:
+    if not text:
+        return False
+    normalized = text.strip().lower()
+    return normalized in _LEGACY_KEYWORDS or bool(_LEGACY_PATTERNS.search(normalized))
+
+
+def benchmark(rounds: int = 2000) -> None:
+    texts = [t for t, _ in CORPUS]
+    # Defeat the memo so we time real evaluations, then time the cached path
+    uncached = is_stop.__wrapped__
+
+    def _time(fn) -> float:
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for t in texts:
+                fn(t)
+        return (time.perf_counter() - start) / (rounds * len(texts)) * 1e6
+
+    legacy_us = _time(_legacy_is_stop)
+    compiled_us = _time(uncached)
+    cached_us = _time(is_stop)
+    legacy_misses = sum(1 for t, expected in CORPUS if _legacy_is_stop(t) != expected)
+
+    print(f"  legacy regex      : {legacy_us:6.2f} µs/msg  ({legacy_misses} misclassified)")
+    print(f"  compiled matcher  : {compiled_us:6.2f} µs/msg")
+    print(f"  memoised matcher  : {cached_us:6.2f} µs/msg")
+
+
+if __name__ == "__main__":
+    print(f"\n{'='*70}\n  STOP MATCHER — {len(CORPUS)} labeled messages\n{'='*70}")
+    bad = 0
+    for text, expected in CORPUS:
+        got = is_stop(text)
+        if got != expected:
+            bad += 1
+            print(f"  FAIL  expected={expected!s:5}  got={got!s:5}  {text!r}")
+    print(f"  {len(CORPUS) - bad}/{len(CORPUS)} correct")
+    print("\n  MICRO-BENCHMARK")
+    benchmark()
+    sys.exit(1 if bad else 0)
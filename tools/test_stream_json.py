@@ -0,0 +1,92 @@
+"""
+Streaming JSON Test — incremental parsing, truncation repair and schema coercion
+for the analyze_with_ai output format.
+
+- Every chunk size must yield the same fields, with intent/reply completing first
+- Every truncation point must keep each field already closed (no regressions)
+- validate_analysis() must coerce wrong types instead of dropping the result
+
+Usage: python tools/test_stream_json.py
+       (also collected by pytest)
+"""
+
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools.analysis_schema import validate_analysis  # noqa: E402
+from tools.stream_json import IncrementalJSONParser, repair_json  # noqa: E402
+
+SAMPLE = {
+    "intent": "interested",
+    "reply": "Got it. He said \"maybe\" — does Tuesday at 4 work?\nThanks \\ see you",
+    "schedule_follow_up_days": None,
+    "notes": "wants CMA first, {braces} and [brackets] in text",
+    "qualification": {
+        "property_address": "12 Palm St",
+        "bedrooms": 3,
+        "missing_fields": ["timeline", "price_expectation"],
+        "qualified": False,
+    },
+    "meeting": {"requested": True, "ready_to_book": False, "date_suggestion": None},
+    "valuation_requested": True,
+    "agent_brief": None,
+}
+
+
+def test_chunked_parsing():
+    text = "```json\n" + json.dumps(SAMPLE, ensure_ascii=False, indent=2) + "\n```"
+    for size in (1, 2, 5, 17, len(text)):
+        parser = IncrementalJSONParser()
+        order = []
+        for i in range(0, len(text), size):
+            order += parser.feed(text[i:i + size])
+        assert parser.complete and parser.fields == SAMPLE, size
+        assert order[:2] == ["intent", "reply"], order
+
+
+def test_truncation_never_loses_closed_fields():
+    text = json.dumps(SAMPLE)
+    parser = IncrementalJSONParser()
+    for cut in range(len(text) + 1):
+        data, _ = repair_json(text[:cut])
+        parser.feed(text[cut - 1:cut] if cut else "")
+        for key, value in parser.fields.items():
+            assert data.get(key) == value, (cut, key)
+    assert repair_json(text) == (SAMPLE, False)
+
+
+def test_schema_repairs():
+    data, repairs = validate_analysis({
+        "intent": "Interested ",
+        "reply": "",
+        "schedule_follow_up_days": "3",
+        "qualification": {"bedrooms": "4", "sqft": "2,100", "qualified": "true", "missing_fields": "timeline"},
+        "meeting": "tomorrow",
+        "valuation_requested": "yes",
+        "agent_brief": "null",
+    }, default_reply="ACK")
+    assert data["intent"] == "interested"
+    assert data["reply"] == "ACK"
+    assert data["schedule_follow_up_days"] == 3
+    assert data["qualification"] == {"bedrooms": 4, "sqft": 2100, "qualified": True, "missing_fields": ["timeline"]}
+    assert data["meeting"] == {}
+    assert data["valuation_requested"] is True
+    assert data["agent_brief"] is None and data["notes"] == ""
+    assert set(repairs) >= {"reply", "schedule_follow_up_days", "qualification.bedrooms", "meeting"}, repairs
+
+    clean, repairs = validate_analysis(SAMPLE, default_reply="ACK")
+    assert clean == SAMPLE and not repairs, repairs
+
+
+if __name__ == "__main__":
+    failed = 0
+    for test in (test_chunked_parsing, test_truncation_never_loses_closed_fields, test_schema_repairs):
+        try:
+            test()
+            print(f"  PASS  {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"  FAIL  {test.__name__}: {e}")
+    sys.exit(1 if failed else 0)
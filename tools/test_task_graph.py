@@ -0,0 +1,97 @@
+"""
+Task Graph Test — the per-message lookup executor (task_graph.py).
+
+- Independent tasks run concurrently
+- A task with `needs` starts once its dependencies finish and gets their
+  results as keyword arguments (extra args/kwargs still passed through)
+- A failed task re-raises from result() and fails every task downstream of
+  it; unrelated tasks are unaffected
+- Unknown dependencies and duplicate names are refused when added
+
+Usage: python tools/test_task_graph.py
+       (also collected by pytest)
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tools.task_graph import TaskGraph  # noqa: E402
+
+
+def _slow(value, seconds=0.1):
+    time.sleep(seconds)
+    return value
+
+
+def test_independent_tasks_run_concurrently():
+    graph = TaskGraph()
+    started = time.monotonic()
+    for name in ("history", "lead_details", "dnc", "quota"):
+        graph.add(name, _slow, name)
+    assert [graph.result(name, timeout=2) for name in ("history", "lead_details", "dnc", "quota")] == [
+        "history", "lead_details", "dnc", "quota"]
+    assert time.monotonic() - started < 0.3  # serially this would be 0.4s
+    assert set(graph.timings) == {"history", "lead_details", "dnc", "quota"}
+
+
+def test_dependencies_receive_results():
+    def step(label, **deps):
+        return (label, deps)
+
+    graph = TaskGraph()
+    graph.add("history", lambda: _slow(["hi"], 0.05))
+    graph.add("lead", lambda: "lead-1")
+    graph.add("campaign", step, "campaign", needs=("history", "lead"), source="sms")
+    label, deps = graph.result("campaign", timeout=2)
+    assert label == "campaign" and deps == {"history": ["hi"], "lead": "lead-1", "source": "sms"}, deps
+    assert "campaign" in graph and "missing" not in graph
+
+
+def test_failure_fans_out_downstream():
+    ran = []
+
+    def boom():
+        raise LookupError("history unavailable")
+
+    graph = TaskGraph()
+    graph.add("history", boom)
+    graph.add("campaign", lambda history: ran.append("campaign"), needs=("history",))
+    graph.add("tags", lambda campaign: ran.append("tags"), needs=("campaign",))
+    graph.add("dnc", lambda: "ok")
+
+    for name in ("history", "campaign", "tags"):
+        try:
+            graph.result(name, timeout=2)
+            raise AssertionError(f"{name} should have failed")
+        except LookupError as e:
+            assert str(e) == "history unavailable"
+    assert ran == []  # dependents never ran
+    assert graph.result("dnc", timeout=2) == "ok"
+
+
+def test_add_validates_names():
+    graph = TaskGraph()
+    graph.add("history", lambda: 1)
+    for call in (lambda: graph.add("history", lambda: 2),
+                 lambda: graph.add("campaign", lambda history: 3, needs=("histroy",))):
+        try:
+            call()
+            raise AssertionError("expected ValueError")
+        except ValueError:
+            pass
+    assert graph.result("history", timeout=2) == 1
+
+
+if __name__ == "__main__":
+    failed = 0
+    for test in (test_independent_tasks_run_concurrently, test_dependencies_receive_results,
+                 test_failure_fans_out_downstream, test_add_validates_names):
+        try:
+            test()
+            print(f"  PASS  {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"  FAIL  {test.__name__}: {e}")
+    sys.exit(1 if failed else 0)